@@ -11,10 +11,18 @@ from ..services.firebase_utils import (
     update_chatbot_general_settings
 )
 
+# Gemini model ของแต่ละระดับที่ model_router เลือกใช้ตามความยากของคำถาม (override ได้ด้วย env)
+GEMINI_MODEL_TIERS = {
+    "lite": os.getenv("GEMINI_MODEL_LITE", "gemini-1.5-flash-8b"),
+    "standard": os.getenv("GEMINI_MODEL_STANDARD", "gemini-1.5-flash"),
+    "strong": os.getenv("GEMINI_MODEL_STRONG", "gemini-1.5-pro"),
+}
+
 # Private global variables to store initialized models
 _end_user_model_instance = None
 _wizard_model_instance = None
 _openai_client_instance = None
+_tier_model_instances = {}
 
 def get_gemini_end_user_model():
     """Returns the initialized Gemini end-user model instance."""
@@ -24,7 +32,7 @@ def get_gemini_end_user_model():
         if GEMINI_API_KEY:
             try:
                 genai.configure(api_key=GEMINI_API_KEY)
-                _end_user_model_instance = genai.GenerativeModel('gemini-1.5-flash')
+                _end_user_model_instance = genai.GenerativeModel(GEMINI_MODEL_TIERS["standard"])
                 print("✅ Gemini end-user model initialized on first access.")
             except Exception as e:
                 print(f"❌ CRITICAL: Could not configure Gemini API for end-user model: {e}")
@@ -32,6 +40,24 @@ def get_gemini_end_user_model():
             print("⚠️ GEMINI_API_KEY not found. Gemini end-user model will not be available.")
     return _end_user_model_instance
 
+def get_gemini_tier_model(tier: str):
+    """
+    Returns the Gemini model for a routing tier ('lite', 'standard', 'strong').
+    'standard' is the end-user model; other tiers fall back to it when unavailable.
+    """
+    if tier == "standard" or tier not in GEMINI_MODEL_TIERS:
+        return get_gemini_end_user_model()
+    if _tier_model_instances.get(tier) is None:
+        GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+        if GEMINI_API_KEY:
+            try:
+                genai.configure(api_key=GEMINI_API_KEY)
+                _tier_model_instances[tier] = genai.GenerativeModel(GEMINI_MODEL_TIERS[tier])
+                print(f"✅ Gemini '{tier}' model ({GEMINI_MODEL_TIERS[tier]}) initialized on first access.")
+            except Exception as e:
+                print(f"❌ Could not initialize Gemini '{tier}' model: {e}")
+    return _tier_model_instances.get(tier) or get_gemini_end_user_model()
+
 def get_gemini_wizard_model():
     """Returns the initialized Gemini wizard model instance."""
     global _wizard_model_instance
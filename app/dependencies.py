@@ -1,7 +1,9 @@
 # app/dependencies.py
 from fastapi import Depends, HTTPException, status, Security
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import APIKeyHeader
-from .services.firebase_utils import db, firebase_auth
+from .services.firebase_utils import firebase_auth
+from .services.storage import get_async_storage
 
 # สมมติว่า Token ถูกส่งมาใน Header ชื่อ 'Authorization'
 api_key_header = APIKeyHeader(name="Authorization", auto_error=False)
@@ -16,7 +18,8 @@ async def get_current_user(token: str = Security(api_key_header)):
         # โดยปกติ Token จะมี "Bearer " นำหน้า
         if "Bearer " in token:
             token = token.split("Bearer ")[1]
-        decoded_token = firebase_auth.verify_id_token(token)
+        # verify_id_token อาจต้องดึง public key ผ่าน network จึงรันใน threadpool
+        decoded_token = await run_in_threadpool(firebase_auth.verify_id_token, token)
         return decoded_token
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Invalid authentication credentials: {e}")
@@ -27,11 +30,10 @@ async def get_user_tenant_role(tenant_id: str, current_user: dict = Depends(get_
     """
     try:
         uid = current_user["uid"]
-        user_doc = db.collection('users').document(uid).get()
-        if not user_doc.exists:
+        user_data = await get_async_storage().get_user(uid)
+        if user_data is None:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User profile not found.")
         
-        user_data = user_doc.to_dict()
         tenant_roles = user_data.get("tenants", {})
         
         role = tenant_roles.get(tenant_id)
@@ -1,21 +1,47 @@
 # Force update
 # app/main.py
      
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+import anyio
+import asyncio
 import os
 
 # 1. Import Routers ทั้งหมดที่คุณมี
 # ตรวจสอบให้แน่ใจว่าชื่อตรงกับไฟล์ในโฟลเดอร์ /routers
-from .routers import auth, tenant, webhook, assistant, inbox, inbox_api, user
+from .routers import auth, tenant, webhook, assistant, inbox, inbox_api, inbox_tools, user, metrics, broadcast
+from .services import analytics, delivery, usage
+
+# งาน I/O แบบ sync (storage, LLM, LINE/Facebook API) ถูกรันใน threadpool จาก async handler
+# จำนวน thread จึงเป็นตัวกำหนดจำนวน request ที่รอ I/O พร้อมกันได้ต่อ instance (ค่าเริ่มต้นของ anyio คือ 40)
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "200"))
+
+# --- Background Workers ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    # เริ่มงานเบื้องหลังเมื่อ app start และยกเลิกเมื่อ shutdown
+    background_tasks = [
+        asyncio.create_task(delivery.run_retry_worker()),
+        asyncio.create_task(usage.run_flush_worker()),
+        asyncio.create_task(analytics.run_flush_worker()),
+    ]
+    yield
+    for task in background_tasks:
+        task.cancel()
+    # เขียนยอดการใช้งานและสถิติที่ยังค้างในหน่วยความจำก่อนปิด instance
+    usage.flush()
+    analytics.flush()
 
 # --- App Initialization ---
 app = FastAPI(
     title="AllChat API",
     description="Backend services for the AllChat Platform.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # --- CORS Middleware ---
@@ -36,7 +62,10 @@ app.include_router(webhook.router)
 app.include_router(assistant.router)
 app.include_router(inbox.router)
 app.include_router(inbox_api.router)
+app.include_router(inbox_tools.router)
 app.include_router(user.router)
+app.include_router(metrics.router)
+app.include_router(broadcast.router)
 
 
 # --- Static Files and HTML Page Serving ---
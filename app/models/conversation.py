@@ -0,0 +1,136 @@
+# app/models/conversation.py
+"""
+โมเดลข้อความ/บทสนทนาแบบกะทัดรัดสำหรับ pipeline ของ get_bot_response
+
+* `Message` ห่อ dict ของข้อความจาก storage โดยไม่คัดลอก และถอดข้อความ (parts) เฉพาะเมื่อถูกใช้
+* `Conversation.window()` / `recent()` คืน view ของช่วง history (ไม่คัดลอก list) และสร้าง `Message`
+  เฉพาะข้อความที่ถูกอ่านจริง ข้อความเก่าในเอกสารจึงไม่ถูกแปลงเลย
+* ข้อความใหม่ของ request ถูกต่อท้าย history เดิม (`append`) แล้ว `new_messages()` คืนเฉพาะส่วนที่เพิ่ม
+* การแปลงเป็น Content ของ Gemini ถูก memoize ตาม (role, ข้อความ) ข้าม request เพราะข้อความล่าสุด
+  และ summary ของแชทเดียวกันถูกส่งซ้ำในทุกข้อความถัดไป
+"""
+from collections.abc import Sequence
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from google.generativeai.types import content_types
+
+# จำนวน Content ที่แปลงแล้วที่เก็บไว้ (ต่อ process)
+PROVIDER_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=PROVIDER_CACHE_SIZE)
+def gemini_content(role: str, texts: Tuple[str, ...]):
+    """Content ของ Gemini สำหรับข้อความตัวอักษรล้วน (ใช้ร่วมกันได้เพราะไม่ถูกแก้หลังสร้าง)"""
+    return content_types.to_content({'role': role, 'parts': [{'text': text} for text in texts]})
+
+
+class Message:
+    __slots__ = ('raw', '_texts', '_openai')
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.raw = raw
+        self._texts: Optional[Tuple[str, ...]] = None
+        self._openai: Optional[Dict[str, str]] = None
+
+    @property
+    def role(self) -> str:
+        return self.raw['role']
+
+    @property
+    def status(self) -> Optional[str]:
+        return self.raw.get('status')
+
+    @property
+    def texts(self) -> Tuple[str, ...]:
+        if self._texts is None:
+            self._texts = tuple(part['text'] for part in self.raw.get('parts', []) if 'text' in part)
+        return self._texts
+
+    @property
+    def text(self) -> str:
+        return ' '.join(self.texts)
+
+    def to_gemini(self):
+        parts = self.raw.get('parts', [])
+        if len(self.texts) != len(parts):
+            # มีส่วนที่ไม่ใช่ข้อความ (เช่น รูปภาพ) จึงแปลงตรงๆ โดยไม่ cache
+            return content_types.to_content({'role': self.role, 'parts': parts})
+        return gemini_content(self.role, self.texts)
+
+    def to_openai(self) -> Dict[str, str]:
+        if self._openai is None:
+            self._openai = {"role": "assistant" if self.role == 'model' else self.role, "content": self.text}
+        return self._openai
+
+    def summary_line(self) -> str:
+        return f"{self.role}: {self.text}\n"
+
+
+class HistoryView(Sequence):
+    """ช่วงหนึ่งของ history แบบไม่คัดลอก ให้ `Message` ทีละรายการ"""
+
+    __slots__ = ('_conversation', '_start', '_stop')
+
+    def __init__(self, conversation: "Conversation", start: int, stop: int):
+        self._conversation = conversation
+        self._start = start
+        self._stop = stop
+
+    def __len__(self) -> int:
+        return max(0, self._stop - self._start)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return HistoryView(self._conversation, self._start + start, self._start + stop)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history view index out of range")
+        return self._conversation.message(self._start + index)
+
+    def __iter__(self) -> Iterator[Message]:
+        message = self._conversation.message
+        for position in range(self._start, self._stop):
+            yield message(position)
+
+    def clean(self) -> Iterator[Message]:
+        """ข้อความปกติ (ไม่รวมรายการที่มี status เช่น error log) สำหรับส่งให้ model"""
+        return (message for message in self if message.status is None)
+
+
+class Conversation:
+    __slots__ = ('data', 'history', 'stored_length', '_messages')
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        # ใช้ list เดิมจาก storage โดยตรง (ไม่คัดลอก) ข้อความใหม่ถูกต่อท้ายหลัง stored_length
+        self.history: List[Dict[str, Any]] = data.setdefault('history', [])
+        self.stored_length = len(self.history)
+        self._messages: Dict[int, Message] = {}
+
+    def __len__(self) -> int:
+        return len(self.history)
+
+    def message(self, position: int) -> Message:
+        message = self._messages.get(position)
+        if message is None:
+            message = self._messages[position] = Message(self.history[position])
+        return message
+
+    def window(self, start: int = 0, stop: Optional[int] = None) -> HistoryView:
+        length = len(self.history)
+        stop = length if stop is None else min(stop, length)
+        return HistoryView(self, min(max(0, start), stop), stop)
+
+    def recent(self, count: int) -> HistoryView:
+        return self.window(len(self.history) - count)
+
+    def append(self, raw: Dict[str, Any]) -> None:
+        self.history.append(raw)
+
+    def new_messages(self) -> List[Dict[str, Any]]:
+        return self.history[self.stored_length:]
@@ -13,7 +13,9 @@ class TenantUpdateRequest(BaseModel):
     botPersona: Optional[str] = None
     knowledgeBase: Optional[str] = None
     lineAccessToken: Optional[str] = None
+    lineChannelSecret: Optional[str] = None
     facebookPageToken: Optional[str] = None
+    facebookAppSecret: Optional[str] = None
     facebookVerifyToken: Optional[str] = None
     businessType: Optional[str] = None
     productRecommendationEnabled: Optional[bool] = None
@@ -22,6 +24,11 @@ class TenantUpdateRequest(BaseModel):
     projectStatusUpdateEnabled: Optional[bool] = None
     chatbotName: Optional[str] = None
     welcomeMessage: Optional[str] = None
+    # Model routing: ปิด routing, บังคับระดับ model ('lite' | 'standard' | 'strong') หรือปิดข้อความสำเร็จรูป
+    modelRoutingEnabled: Optional[bool] = None
+    modelTierOverride: Optional[str] = None
+    cannedRepliesEnabled: Optional[bool] = None
+    cannedReplies: Optional[Dict[str, str]] = None
     owner_uid: Optional[str] = None
 
     # --- ✨ NEW: Add the missing behavioral toggle fields ---
@@ -43,4 +50,12 @@ class SocialLoginRequest(BaseModel):
     uid: str
     email: str
     displayName: Optional[str] = None
-    providerId: str
\ No newline at end of file
+    providerId: str
+# Schema for broadcast campaigns
+class BroadcastRequest(BaseModel):
+    message: str
+    platform: str  # 'line' or 'facebook'
+    user_ids: Optional[List[str]] = None  # None = ส่งถึงทุกคนของ tenant บน platform นี้
+# Schema for inbox tools (draft reply)
+class DraftReplyRequest(BaseModel):
+    keywords: str
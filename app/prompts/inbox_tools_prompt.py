@@ -0,0 +1,31 @@
+# app/prompts/inbox_tools_prompt.py
+
+# สรุปสำหรับแอดมินที่เพิ่งเปิดแชท (ต่อยอดจาก summary ที่บอทสรุปเก็บไว้แล้ว)
+INBOX_SUMMARY_PROMPT = """
+You are helping a shop admin who just opened this chat. Using the 'PREVIOUS SUMMARY' and the 'RECENT MESSAGES', write a short summary in Thai for the admin: what the customer wants, what has already been answered or agreed, and what is still pending. Use at most 5 short bullet points.
+
+PREVIOUS SUMMARY:
+{summary}
+
+RECENT MESSAGES:
+{recent_messages}
+---
+Summary for admin (Thai):
+"""
+
+# ร่างคำตอบจากคีย์เวิร์ดที่แอดมินพิมพ์ (ใช้ persona และ knowledge base เดียวกับบอท)
+DRAFT_REPLY_PROMPT = """
+{prompt_template}
+
+--- ข้อมูลอ้างอิง ---
+{retrieved_info}
+
+--- สรุปบทสนทนาก่อนหน้า ---
+{summary}
+
+--- ข้อความล่าสุด ---
+{recent_messages}
+---
+คุณกำลังร่างข้อความตอบลูกค้าให้แอดมินตรวจก่อนส่ง เขียนคำตอบถัดไปถึงลูกค้าหนึ่งข้อความให้ครอบคลุมประเด็นต่อไปนี้: {keywords}
+ตอบเฉพาะข้อความที่จะส่งให้ลูกค้าเท่านั้น:
+"""
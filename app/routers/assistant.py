@@ -1,10 +1,12 @@
 # app/routers/assistant.py
 import os
 from fastapi import APIRouter, Request, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from google.generativeai.types import content_types
 
 from ..config.settings import get_gemini_wizard_model # <--- CHANGED IMPORT
+from ..services import usage
 from ..prompts.settings_assistant_prompt import SETTINGS_ASSISTANT_PROMPT
 from ..prompts.wizard_prompt import WIZARD_PROMPT
 from ..services.firebase_utils import (
@@ -44,8 +46,9 @@ async def handle_settings_assistant(tenant_id: str, request: AssistantRequest):
     
     chat = settings_assistant_sessions[tenant_id]
     
-    # Send message to AI and handle Function Calling
-    response = chat.send_message(request.message)
+    # Send message to AI and handle Function Calling (ใช้ async client ของ Gemini จึงไม่บล็อก event loop)
+    response = await chat.send_message_async(request.message)
+    usage.record_gemini_usage(tenant_id, wizard_model, response, "settings_assistant")
     
     if response.candidates and response.candidates[0].content.parts and response.candidates[0].content.parts[0].function_call:
         function_call = response.candidates[0].content.parts[0].function_call
@@ -58,25 +61,27 @@ async def handle_settings_assistant(tenant_id: str, request: AssistantRequest):
 
         # Call the appropriate function based on AI's request
         if function_name == "update_bot_persona":
-            result = update_bot_persona(tenant_id, args['persona'])
+            result = await run_in_threadpool(update_bot_persona, tenant_id, args['persona'])
         elif function_name == "update_knowledge_base":
-            result = update_knowledge_base(tenant_id, args['knowledge'])
+            result = await run_in_threadpool(update_knowledge_base, tenant_id, args['knowledge'])
         elif function_name == "update_line_token":
-            result = update_line_token(tenant_id, args['token'])
+            result = await run_in_threadpool(update_line_token, tenant_id, args['token'])
         elif function_name == "update_business_type":
-            result = update_business_type(tenant_id, args['business_type'])
+            result = await run_in_threadpool(update_business_type, tenant_id, args['business_type'])
         elif function_name == "update_product_recommendation_setting":
-            result = update_product_recommendation_setting(tenant_id, args['enabled'])
+            result = await run_in_threadpool(update_product_recommendation_setting, tenant_id, args['enabled'])
         elif function_name == "update_booking_settings":
-            result = update_booking_settings(
+            result = await run_in_threadpool(
+                update_booking_settings,
                 tenant_id,
                 integration_url=args.get('integration_url'),
                 bot_enabled=args.get('bot_enabled')
             )
         elif function_name == "update_project_status_setting":
-            result = update_project_status_setting(tenant_id, args['enabled'])
+            result = await run_in_threadpool(update_project_status_setting, tenant_id, args['enabled'])
         elif function_name == "update_chatbot_general_settings":
-            result = update_chatbot_general_settings(
+            result = await run_in_threadpool(
+                update_chatbot_general_settings,
                 tenant_id,
                 name=args.get('name'),
                 welcome_message=args.get('welcome_message')
@@ -85,11 +90,12 @@ async def handle_settings_assistant(tenant_id: str, request: AssistantRequest):
             result = "Unknown function"
             
         # Send the function result back to AI to generate final response
-        response = chat.send_message(
+        response = await chat.send_message_async(
             content_types.to_content(
                 content_types.FunctionResponse(name=function_name, response={'result': result})
             )
         )
+        usage.record_gemini_usage(tenant_id, wizard_model, response, "settings_assistant")
 
     return {"reply": response.text}
 
@@ -113,7 +119,8 @@ async def wizard_chatbot(tenant_id: str, request: Request):
         ])
     
     chat = wizard_chat_sessions[tenant_id]
-    response = chat.send_message(user_input)
+    response = await chat.send_message_async(user_input)
+    usage.record_gemini_usage(tenant_id, wizard_model, response, "wizard")
     
     if response.candidates and response.candidates[0].content.parts and response.candidates[0].content.parts[0].function_call:
         function_call = response.candidates[0].content.parts[0].function_call
@@ -124,14 +131,15 @@ async def wizard_chatbot(tenant_id: str, request: Request):
         result = "Unknown function" # Default result
         # Call the appropriate function
         if function_name == "update_bot_persona":
-            result = update_bot_persona(tenant_id, args['persona'])
+            result = await run_in_threadpool(update_bot_persona, tenant_id, args['persona'])
         elif function_name == "update_knowledge_base":
-            result = update_knowledge_base(tenant_id, args['knowledge'])
+            result = await run_in_threadpool(update_knowledge_base, tenant_id, args['knowledge'])
         elif function_name == "update_line_token":
-            result = update_line_token(tenant_id, args['token'])
+            result = await run_in_threadpool(update_line_token, tenant_id, args['token'])
         # Add new function calls for wizard if needed, but for now, settings assistant handles specific settings
         else:
             result = "Unknown function"
             
-        response = chat.send_message(content_types.to_content(content_types.FunctionResponse(name=function_name, response={'result': result})))
+        response = await chat.send_message_async(content_types.to_content(content_types.FunctionResponse(name=function_name, response={'result': result})))
+        usage.record_gemini_usage(tenant_id, wizard_model, response, "wizard")
     return {"reply": response.text}
@@ -1,8 +1,11 @@
 # app/routers/auth.py
 from fastapi import APIRouter, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
+import datetime
 from ..models.schemas import AuthRequest, SocialLoginRequest
-from ..services.firebase_utils import db, firebase_auth, firestore
+from ..services.firebase_utils import firebase_auth
+from ..services.storage import get_async_storage
 
 # Create an API router specific for authentication
 router = APIRouter(
@@ -15,22 +18,22 @@ async def register_user(request: AuthRequest):
     """
     Registers a new user in Firebase Authentication and creates a linked tenant document.
     """
-    if not db:
+    storage = get_async_storage()
+    if not storage:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database is not available.")
     try:
         # 1. Create user in Firebase Authentication
-        user = firebase_auth.create_user(
+        user = await run_in_threadpool(
+            firebase_auth.create_user,
             email=request.email,
             password=request.password
         )
         print(f"✅ Firebase Auth User created: {user.uid}")
 
         # 2. Create a new tenant document and link it to the user
-        tenant_doc_ref = db.collection('tenants').document()
-        new_tenant_id = tenant_doc_ref.id
-        
+        created_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
         tenant_data = {
-            'createdAt': firestore.SERVER_TIMESTAMP,
+            'createdAt': created_at,
             'status': 'active',
             'owner_uid': user.uid,
             'email': request.email,
@@ -39,16 +42,15 @@ async def register_user(request: AuthRequest):
                 user.uid: 'owner'
             }
         }
-        tenant_doc_ref.set(tenant_data)
+        new_tenant_id = await storage.create_tenant(tenant_data)
         print(f"✅ New tenant '{new_tenant_id}' created and linked to user '{user.uid}'.")
 
         # 2.5 Create a user profile document in 'users' collection
-        user_doc_ref = db.collection('users').document(user.uid)
-        user_doc_ref.set({
+        await storage.set_user(user.uid, {
             'uid': user.uid,
             'email': request.email,
             'displayName': request.email,
-            'createdAt': firestore.SERVER_TIMESTAMP,
+            'createdAt': created_at,
             'tenants': {
                 new_tenant_id: 'owner'
             }
@@ -56,7 +58,7 @@ async def register_user(request: AuthRequest):
         print(f"✅ New user profile created for '{user.uid}'.")
 
         # 3. Generate a Custom Token for the user to login on the client-side
-        custom_token = firebase_auth.create_custom_token(user.uid)
+        custom_token = await run_in_threadpool(firebase_auth.create_custom_token, user.uid)
         return {"custom_token": custom_token.decode('utf-8'), "uid": user.uid, "tenant_id": new_tenant_id}
 
     except firebase_auth.EmailAlreadyExistsError:
@@ -73,15 +75,15 @@ async def login_user(request: AuthRequest):
     ฟังก์ชันนี้จะไม่ตรวจสอบรหัสผ่านโดยตรง แต่จะสร้าง Token ให้ Frontend
     ที่ทำการ signInWithEmailAndPassword สำเร็จแล้วนำไปใช้ต่อ
     """
-    if not db:
+    if not get_async_storage():
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database is not available.")
     try:
         # Backend จะไม่ตรวจสอบรหัสผ่าน
         # แต่จะหาผู้ใช้จาก Email เพื่อสร้าง Token ให้
-        user = firebase_auth.get_user_by_email(request.email)
+        user = await run_in_threadpool(firebase_auth.get_user_by_email, request.email)
         
         # สร้าง Custom Token เพื่อส่งกลับให้ Frontend
-        custom_token = firebase_auth.create_custom_token(user.uid)
+        custom_token = await run_in_threadpool(firebase_auth.create_custom_token, user.uid)
         
         # ไม่ต้องส่ง tenant_id กลับไปแล้ว เพราะจะไปเลือกที่หน้า tenant-selector
         return {"custom_token": custom_token.decode('utf-8'), "uid": user.uid}
@@ -104,32 +106,31 @@ async def social_login(request: SocialLoginRequest):
         email = request.email
         display_name = request.displayName
 
-        user_ref = db.collection('users').document(uid)
-        user_doc = user_ref.get()
+        storage = get_async_storage()
+        user_data = await storage.get_user(uid)
 
-        if user_doc.exists:
+        if user_data is not None:
             print(f"✅ Existing social user '{email}' logged in.")
             return {"message": "Existing user logged in.", "uid": uid, "is_new_user": False}
         else:
             print(f"✨ New social user '{email}'. Creating new user profile and tenant...")
             
-            tenant_doc_ref = db.collection('tenants').document()
-            new_tenant_id = tenant_doc_ref.id
+            created_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
             tenant_data = {
-                'createdAt': firestore.SERVER_TIMESTAMP,
+                'createdAt': created_at,
                 'status': 'active',
                 'owner_uid': uid,
                 'email': email,
                 'tenantName': f"{display_name}'s Shop",
                 'members': { uid: 'owner' }
             }
-            tenant_doc_ref.set(tenant_data)
+            new_tenant_id = await storage.create_tenant(tenant_data)
 
-            user_ref.set({
+            await storage.set_user(uid, {
                 'uid': uid,
                 'email': email,
                 'displayName': display_name,
-                'createdAt': firestore.SERVER_TIMESTAMP,
+                'createdAt': created_at,
                 'tenants': { new_tenant_id: 'owner' }
             })
 
@@ -0,0 +1,59 @@
+# app/routers/broadcast.py
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, status
+from fastapi.concurrency import run_in_threadpool
+
+from ..models.schemas import BroadcastRequest
+from ..services import broadcast
+from ..services.storage import get_async_storage
+from ..dependencies import get_current_user, get_user_tenant_role
+
+router = APIRouter(
+    prefix="/api/broadcast",
+    tags=["Broadcast"],
+)
+
+@router.post("/{tenant_id}/campaigns", status_code=status.HTTP_202_ACCEPTED)
+async def create_broadcast_campaign(
+    tenant_id: str,
+    request: BroadcastRequest,
+    background_tasks: BackgroundTasks,
+    role: str = Depends(get_user_tenant_role),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    สร้าง campaign สำหรับส่งข้อความถึงผู้ใช้จำนวนมาก และเริ่มส่งเบื้องหลัง
+    ติดตามความคืบหน้าได้ที่ GET /api/broadcast/{tenant_id}/campaigns/{campaign_id}
+    """
+    if request.platform not in ("line", "facebook"):
+        raise HTTPException(status_code=400, detail=f"Unsupported platform: {request.platform}")
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message must not be empty.")
+    if request.user_ids is not None and not request.user_ids:
+        raise HTTPException(status_code=400, detail="user_ids must not be empty.")
+
+    try:
+        campaign_id = await run_in_threadpool(broadcast.create_campaign, tenant_id, request.message, request.platform, request.user_ids, current_user)
+        background_tasks.add_task(broadcast.run_campaign, tenant_id, campaign_id)
+        return {"status": "ok", "campaign_id": campaign_id}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"❌ Error creating broadcast campaign for tenant {tenant_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{tenant_id}/campaigns/{campaign_id}")
+async def get_broadcast_campaign(
+    tenant_id: str,
+    campaign_id: str,
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    คืนสถานะและความคืบหน้า (total, sent, failed) ของ campaign
+    """
+    campaign = await get_async_storage().get_campaign(tenant_id, campaign_id)
+    if campaign is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    campaign.pop('user_ids', None)
+    campaign['campaign_id'] = campaign_id
+    return campaign
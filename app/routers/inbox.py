@@ -1,6 +1,6 @@
 # app/routers/inbox.py
 from fastapi import APIRouter, HTTPException
-from ..services.firebase_utils import db
+from ..services.storage import get_async_storage
 
 # สร้าง Router สำหรับจัดการ API ที่เกี่ยวกับ Inbox
 router = APIRouter(
@@ -15,17 +15,8 @@ async def get_chat_users(tenant_id: str):
     Endpoint นี้จะถูกเรียกใช้โดยหน้า inbox.html
     """
     try:
-        # เข้าถึง collection ของ user ภายใต้ tenant ที่ระบุ
-        users_ref = db.collection('chat_sessions').document(tenant_id).collection('users')
-        users_docs = users_ref.stream()
-        
-        users_list = []
-        for doc in users_docs:
-            user_data = doc.to_dict()
-            # เพิ่ม user_id (ซึ่งก็คือ document ID) เข้าไปในข้อมูลที่จะส่งกลับ
-            user_data['user_id'] = doc.id
-            users_list.append(user_data)
-            
+        # ดึง conversation ทั้งหมดของ tenant (แต่ละรายการมี user_id ซึ่งก็คือ document ID อยู่แล้ว)
+        users_list = await get_async_storage().list_conversations(tenant_id)
         return users_list
     except Exception as e:
         print(f"❌ Error fetching chat users for tenant {tenant_id}: {e}")
@@ -1,12 +1,17 @@
 # app/routers/inbox_api.py
 
 # ✨ 1. แก้ไขบรรทัดนี้: เพิ่ม Depends เข้าไปใน import
-from fastapi import APIRouter, HTTPException, Depends, Body 
-from firebase_admin import firestore
+from fastapi import APIRouter, HTTPException, Depends, Body, BackgroundTasks, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import asyncio
 import datetime
+import json
 
-from ..services.firebase_utils import db
+from ..services.storage import get_async_storage
 from ..services.line_api import push_line_message
+from ..services import analytics, archive, inbox_stream, search, work_queue
 # ✨ ตรวจสอบให้แน่ใจว่าได้ import dependencies ที่สร้างไว้ครบถ้วน
 from ..dependencies import get_current_user, get_user_tenant_role
 
@@ -15,6 +20,180 @@ router = APIRouter(
     tags=["Inbox API"],
 )
 
+@router.get("/{tenant_id}/unread")
+async def get_unread_total(
+    tenant_id: str,
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    คืนจำนวนข้อความที่แอดมินยังไม่ได้อ่านรวมทั้ง tenant (อ่านจากตัวนับ ไม่ต้องโหลด history)
+    """
+    try:
+        return {"total": await get_async_storage().get_unread_total(tenant_id)}
+    except Exception as e:
+        print(f"❌ Error fetching unread total for tenant {tenant_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ส่ง comment ว่างเป็นระยะ เพื่อไม่ให้ proxy ตัดการเชื่อมต่อที่ไม่มีความเคลื่อนไหว
+STREAM_HEARTBEAT_S = 15
+
+
+@router.get("/{tenant_id}/stream")
+async def stream_inbox(
+    tenant_id: str,
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    Server-Sent Events ของ inbox: เริ่มด้วย `snapshot` (รายชื่อแชทแบบสรุป) แล้วตามด้วย delta
+    (`conversation`, `message`, `unread`, `bot`, `work_queue`, `resync`) ทุก event เป็น JSON หนึ่งบรรทัดใน `data:`
+    """
+    hub = inbox_stream.get_inbox_hub()
+    # subscribe ก่อนอ่าน snapshot เพื่อไม่ให้พลาดการเปลี่ยนแปลงระหว่างนั้น
+    queue = await hub.subscribe(tenant_id)
+    try:
+        storage = get_async_storage()
+        conversations, work_open = await asyncio.gather(
+            storage.list_conversations(
+                tenant_id, limit=inbox_stream.INBOX_SNAPSHOT_LIMIT, include_history=False, fields=list(inbox_stream.SUMMARY_FIELDS)
+            ),
+            storage.get_open_work_count(tenant_id),
+        )
+    except Exception as e:
+        await hub.unsubscribe(tenant_id, queue)
+        print(f"❌ Error opening inbox stream for tenant {tenant_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    def encode(event: dict) -> str:
+        return f"data: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+    async def events():
+        try:
+            yield encode({
+                "type": "snapshot",
+                "conversations": [inbox_stream.conversation_summary(c) for c in conversations],
+                "work_queue_open": work_open,
+            })
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=STREAM_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield encode(event)
+        finally:
+            await hub.unsubscribe(tenant_id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/{tenant_id}/work-queue")
+async def list_work_queue(
+    tenant_id: str,
+    status: str = Query("open", pattern="^(open|resolved|expired)$"),
+    limit: int = Query(work_queue.WORK_QUEUE_PAGE_SIZE, ge=1, le=work_queue.WORK_QUEUE_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    งานที่ต้องให้แอดมินตอบเอง/ตรวจสอบ เรียงจากเก่าไปใหม่ ส่ง `next_cursor` กลับมาใน `cursor` เพื่อขอหน้าถัดไป
+    """
+    try:
+        return await run_in_threadpool(work_queue.list_items, tenant_id, status, limit, cursor)
+    except Exception as e:
+        print(f"❌ Error listing work queue for tenant {tenant_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{tenant_id}/work-queue/{item_id}/claim")
+async def claim_work_item(
+    tenant_id: str,
+    item_id: str,
+    role: str = Depends(get_user_tenant_role),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    รับงานนี้ไว้ (แอดมินคนอื่นรับซ้ำไม่ได้จนกว่าจะปิดงานหรือหมดเวลาถือครอง)
+    """
+    admin = {"uid": current_user["uid"], "name": current_user.get("name", "Admin")}
+    try:
+        item = await run_in_threadpool(work_queue.claim, tenant_id, item_id, admin)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"❌ Error claiming work item {item_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if item is None:
+        raise HTTPException(status_code=404, detail="Work item not found")
+    return item
+
+
+@router.post("/{tenant_id}/work-queue/{item_id}/resolve")
+async def resolve_work_item(
+    tenant_id: str,
+    item_id: str,
+    resolution: str = Body("resolved", embed=True, max_length=100),
+    role: str = Depends(get_user_tenant_role),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    ปิดงานนี้ (เช่น ตอบลูกค้าผ่านช่องทางอื่นแล้ว หรือไม่ต้องดำเนินการ)
+    """
+    admin = {"uid": current_user["uid"], "name": current_user.get("name", "Admin")}
+    try:
+        item = await run_in_threadpool(work_queue.resolve, tenant_id, item_id, admin, resolution)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        print(f"❌ Error resolving work item {item_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if item is None:
+        raise HTTPException(status_code=404, detail="Work item not found")
+    return item
+
+
+@router.get("/{tenant_id}/search")
+async def search_conversations(
+    tenant_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    user_id: Optional[str] = None,
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    ค้นหาข้อความในแชทของ tenant (เช่น เลขที่ order หรือชื่อสินค้า) เรียงตามความเกี่ยวข้อง
+    คืนค่าข้อความที่พบแบบแบ่งหน้า และรายชื่อแชทที่มีข้อความตรงกันมากที่สุด
+    """
+    index = search.get_search_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Search is only available with the SQLite storage backend.")
+    try:
+        results = await run_in_threadpool(index.search, tenant_id, q, limit=limit, offset=offset, user_id=user_id)
+        results["limit"], results["offset"] = limit, offset
+        return results
+    except Exception as e:
+        print(f"❌ Error searching conversations for tenant {tenant_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{tenant_id}/search/reindex")
+async def reindex_search(
+    tenant_id: str,
+    background_tasks: BackgroundTasks,
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    สร้าง search index ของ tenant ใหม่จากข้อมูลแชททั้งหมด (รวมข้อความใน archive) แบบเบื้องหลัง
+    """
+    if role != 'owner':
+        raise HTTPException(status_code=403, detail="Only the tenant owner can rebuild the search index.")
+    if search.get_search_index() is None:
+        raise HTTPException(status_code=503, detail="Search is only available with the SQLite storage backend.")
+    background_tasks.add_task(search.reindex_tenant, tenant_id)
+    return {"status": "ok", "message": f"Search reindex started for tenant {tenant_id}."}
+
+
 @router.post("/{tenant_id}/{user_id}/mark-as-read")
 async def mark_chat_as_read(
     tenant_id: str, 
@@ -26,20 +205,50 @@ async def mark_chat_as_read(
     อัปเดตเวลาล่าสุดที่แอดมินเปิดอ่านแชทของผู้ใช้คนนี้
     """
     try:
-        user_doc_ref = db.collection('chat_sessions').document(tenant_id).collection('users').document(user_id)
-        user_doc_ref.update({
+        # อัปเดตฟิลด์ admin_last_seen_timestamp เป็นเวลาปัจจุบัน และ reset ตัวนับข้อความที่ยังไม่ได้อ่าน
+        await get_async_storage().reset_unread(tenant_id, user_id, {
             'admin_last_seen_timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat()
         })
         return {"status": "ok", "message": f"Chat for {user_id} marked as read."}
-    
-        user_doc_ref = db.collection('chat_sessions').document(tenant_id).collection('users').document(user_id)
-        
-        # อัปเดตฟิลด์ admin_last_seen_timestamp เป็นเวลาปัจจุบัน
     except Exception as e:
         print(f"❌ Error marking chat as read for {user_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/{tenant_id}/{user_id}/conversation")
+async def get_conversation(
+    tenant_id: str,
+    user_id: str,
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    คืนเอกสารแชทของผู้ใช้ (history ปัจจุบัน, lead score, archive segments) สำหรับเปิดแชทในหน้า inbox
+    """
+    user_data = await get_async_storage().get_conversation(tenant_id, user_id)
+    if user_data is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    user_data['user_id'] = user_id
+    return user_data
+
+
+@router.post("/{tenant_id}/{user_id}/bot-status")
+async def set_bot_status(
+    tenant_id: str,
+    user_id: str,
+    active: bool = Body(..., embed=True),
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    เปิด/ปิดบอทของแชทนี้ (แอดมินคนอื่นจะได้รับ event `bot` ผ่าน stream)
+    """
+    try:
+        await get_async_storage().set_conversation(tenant_id, user_id, {'is_bot_active': active}, merge=True)
+        return {"status": "ok", "is_bot_active": active}
+    except Exception as e:
+        print(f"❌ Error updating bot status for {user_id}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/{tenant_id}/{user_id}/send-admin-message")
 async def send_admin_message(
     tenant_id: str, 
@@ -54,17 +263,12 @@ async def send_admin_message(
     """
     try:
         # 1. ดึงข้อมูลผู้ใช้เพื่อหา Platform และ Token
-        tenant_doc_ref = db.collection('tenants').document(tenant_id)
-        user_chat_doc_ref = db.collection('chat_sessions').document(tenant_id).collection('users').document(user_id) # ✨ แก้ไข: กำหนดตัวแปรนี้ไว้เลย
-        
-        tenant_doc = tenant_doc_ref.get()
-        user_doc = user_chat_doc_ref.get()
+        storage = get_async_storage()
+        tenant_data, user_data = await asyncio.gather(storage.get_tenant(tenant_id), storage.get_conversation(tenant_id, user_id))
 
-        if not tenant_doc.exists() or not user_doc.exists():
+        if tenant_data is None or user_data is None:
             raise HTTPException(status_code=404, detail="Tenant or User chat session not found")
 
-        tenant_data = tenant_doc.to_dict()
-        user_data = user_doc.to_dict()
         platform = user_data.get('platform')
 
         # ✨ 4. ดึงข้อมูลแอดมินจาก current_user ที่ได้จาก Dependency
@@ -79,7 +283,7 @@ async def send_admin_message(
             if not line_token:
                 raise HTTPException(status_code=500, detail="LINE Access Token not configured for this tenant.")
             
-            result = push_line_message(user_id, message, line_token)
+            result = await run_in_threadpool(push_line_message, user_id, message, line_token)
             if result.get("status") != "ok":
                 raise HTTPException(status_code=500, detail=f"Failed to send LINE message: {result.get('message')}")
         else:
@@ -95,10 +299,11 @@ async def send_admin_message(
             "sender_name": admin_display_name
         }
         
-        # ✨ 5. ใช้ `user_chat_doc_ref` ที่เรากำหนดไว้ตอนแรก
-        user_chat_doc_ref.update({
-            "history": firestore.ArrayUnion([admin_message_for_history])
-        })
+        await storage.append_messages(tenant_id, user_id, [admin_message_for_history])
+        await run_in_threadpool(search.index_messages, tenant_id, user_id, [admin_message_for_history])
+        analytics.record_messages(tenant_id, [admin_message_for_history])
+        # แอดมินตอบแล้ว งานที่ค้างของแชทนี้จึงถือว่าเสร็จ
+        await run_in_threadpool(work_queue.resolve_for_user, tenant_id, user_id, {"uid": admin_uid, "name": admin_display_name})
 
         return {"status": "ok", "message": f"Message sent to {user_id} via {platform}."}
 
@@ -108,4 +313,52 @@ async def send_admin_message(
         # แปลง HTTPException เป็น dict ก่อนส่งกลับ
         if isinstance(e, HTTPException):
             raise e
-        raise HTTPException(status_code=500, detail=str(e))        
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{tenant_id}/{user_id}/archive")
+async def get_archived_messages(
+    tenant_id: str,
+    user_id: str,
+    segment: Optional[int] = Query(None, ge=0),
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    อ่านข้อความเก่าที่ถูกย้ายไป archive ทีละ segment (ไม่ระบุ segment = segment ล่าสุด)
+    ใช้ `previous_segment` เพื่อโหลดหน้าที่เก่ากว่าต่อไป
+    """
+    user_data = await get_async_storage().get_conversation(tenant_id, user_id)
+    if user_data is None:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+
+    segments = user_data.get('archive_segments') or []
+    if not segments:
+        return {"messages": [], "segment": None, "previous_segment": None, "archived_message_count": 0}
+    index = segments[-1]['index'] if segment is None else segment
+    if not any(s['index'] == index for s in segments):
+        raise HTTPException(status_code=404, detail="Archive segment not found")
+
+    messages = await run_in_threadpool(archive.read_segment, tenant_id, user_id, index)
+    if messages is None:
+        raise HTTPException(status_code=500, detail="Archive segment could not be read")
+    return {
+        "messages": messages,
+        "segment": index,
+        "previous_segment": index - 1 if index > 0 else None,
+        "archived_message_count": user_data.get('archived_message_count', 0),
+    }
+
+
+@router.post("/{tenant_id}/archive")
+async def archive_tenant_history(
+    tenant_id: str,
+    background_tasks: BackgroundTasks,
+    role: str = Depends(get_user_tenant_role)
+):
+    """
+    สั่งย้ายข้อความเก่าที่สรุปแล้วของทุกแชทใน tenant ไป archive (ทำงานเบื้องหลัง)
+    """
+    if role != 'owner':
+        raise HTTPException(status_code=403, detail="Only the tenant owner can archive history.")
+    background_tasks.add_task(archive.archive_tenant, tenant_id)
+    return {"status": "ok", "message": f"Archival started for tenant {tenant_id}."}
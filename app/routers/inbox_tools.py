@@ -0,0 +1,84 @@
+# app/routers/inbox_tools.py
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, Iterator
+import json
+
+from ..models.schemas import DraftReplyRequest
+from ..services import inbox_tools
+from ..services.storage import get_async_storage
+from ..dependencies import get_user_tenant_role
+
+router = APIRouter(
+    prefix="/api/inbox-tools",
+    tags=["Inbox Tools"],
+)
+
+
+async def _load_conversation(tenant_id: str, user_id: str) -> Dict[str, Any]:
+    conversation = await get_async_storage().get_conversation(tenant_id, user_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="Conversation not found.")
+    return conversation
+
+
+async def _respond(events: Iterator[Dict[str, Any]], field: str, stream: bool):
+    """
+    stream=true: NDJSON ทีละบรรทัด `{"type": "delta", "text"}` ... แล้วปิดด้วย `{"type": "done", "<field>", "cached"}`
+    (หรือ `{"type": "error", "detail"}`) stream=false: JSON เดียว `{"<field>", "cached"}`
+    """
+    if not stream:
+        for event in await run_in_threadpool(list, events):
+            if event['type'] == 'error':
+                raise HTTPException(status_code=502, detail=event['detail'])
+            if event['type'] == 'done':
+                return {field: event['text'], "cached": event['cached']}
+        raise HTTPException(status_code=500, detail="No result.")
+
+    async def body() -> AsyncIterator[bytes]:
+        # model ของ Gemini เป็นแบบ sync จึงอ่านทีละ chunk ใน threadpool
+        async for event in iterate_in_threadpool(events):
+            if event['type'] == 'done':
+                event = {"type": "done", field: event['text'], "cached": event['cached']}
+            yield (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+    return StreamingResponse(body(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/{tenant_id}/{user_id}/summarize")
+async def summarize_conversation(
+    tenant_id: str,
+    user_id: str,
+    stream: bool = Query(True),
+    role: str = Depends(get_user_tenant_role),
+):
+    """
+    สรุปบทสนทนาให้แอดมิน จาก summary ที่เก็บไว้ + ข้อความหลัง summary checkpoint
+    (ผลถูก cache จนกว่าจะมีข้อความใหม่)
+    """
+    conversation = await _load_conversation(tenant_id, user_id)
+    return await _respond(inbox_tools.summarize_stream(tenant_id, user_id, conversation), "summary", stream)
+
+
+@router.post("/{tenant_id}/{user_id}/draft-reply")
+async def draft_reply(
+    tenant_id: str,
+    user_id: str,
+    request: DraftReplyRequest,
+    stream: bool = Query(True),
+    role: str = Depends(get_user_tenant_role),
+):
+    """
+    ร่างคำตอบถึงลูกค้าจากคีย์เวิร์ดของแอดมิน ด้วย persona และ knowledge base เดียวกับบอท
+    """
+    storage = get_async_storage()
+    config = await storage.get_tenant(tenant_id)
+    if config is None:
+        raise HTTPException(status_code=404, detail="Tenant not found.")
+    conversation = await _load_conversation(tenant_id, user_id)
+    try:
+        events = inbox_tools.draft_reply_stream(tenant_id, user_id, config, conversation, request.keywords)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await _respond(events, "draft", stream)
@@ -0,0 +1,21 @@
+# app/routers/metrics.py
+import os
+from fastapi import APIRouter, HTTPException, Header, status
+from typing import Optional
+from ..services import metrics
+
+router = APIRouter(
+    prefix="/api/metrics",
+    tags=["Metrics"],
+)
+
+@router.get("")
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """
+    คืนค่า metrics ของ instance นี้ (delivery latency/failures ฯลฯ)
+    หากตั้งค่า METRICS_TOKEN ไว้ ต้องส่ง Header `Authorization: Bearer <token>`
+    """
+    expected_token = os.getenv("METRICS_TOKEN")
+    if expected_token and authorization != f"Bearer {expected_token}":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid metrics token.")
+    return metrics.snapshot()
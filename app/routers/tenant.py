@@ -1,8 +1,15 @@
 # app/routers/tenant.py
-from fastapi import APIRouter, HTTPException, status, Depends
+import datetime
+import hashlib
+import json
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from ..models.schemas import TenantUpdateRequest # สมมติว่าคุณมี schema นี้
-from typing import Optional
-from ..services.firebase_utils import db
+from typing import Any, List, Optional
+from ..services.storage import get_async_storage
+from ..services import analytics, catalog, context_cache, export, kb_retrieval, usage, webhook_guard
 from ..dependencies import get_user_tenant_role # ✨ Import dependency
 
 # Create an API router specific for tenant management
@@ -11,33 +18,261 @@ router = APIRouter(
     tags=["Tenant Management"],
 )
 
+# ขนาดหน้า (จำนวนตัวอักษร) ของ knowledge base ที่ส่งให้หน้า settings
+KB_PAGE_CHARS = 20000
+KB_MAX_PAGE_CHARS = 100000
+
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """`fields=a,b,c` -> ['a', 'b', 'c'] (ฟิลด์ระดับบนสุดของเอกสาร tenant)"""
+    if not fields:
+        return None
+    names = sorted({name.strip() for name in fields.split(',') if name.strip()})
+    if not names:
+        return None
+    if any(not name.replace('_', '').isalnum() for name in names):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="fields must be a comma-separated list of top-level field names.")
+    return names
+
+
+def _tenant_etag(tenant_id: str, version: Any, *variant: Any) -> str:
+    """ETag จาก configVersion ของ tenant (เพิ่มทุกครั้งที่ update_tenant) และรูปแบบของ response"""
+    digest = hashlib.sha1(json.dumps([tenant_id, version, *variant], default=str).encode("utf-8")).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in {tag.strip() for tag in header.split(',')}
+
+
+async def _conditional_tenant_read(request: Request, tenant_id: str, fields: Optional[List[str]], *variant: Any):
+    """
+    อ่านเอกสาร tenant แบบมีเงื่อนไข: หาก client ส่ง If-None-Match มา อ่านแค่ `configVersion` ก่อน
+    คืนค่า (data, etag) หรือ (None, etag) เมื่อ client มีข้อมูลล่าสุดแล้ว (ตอบ 304)
+    """
+    storage = get_async_storage()
+    if request.headers.get("if-none-match"):
+        current = await storage.get_tenant(tenant_id, fields=['configVersion'])
+        if current is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tenant not found")
+        etag = _tenant_etag(tenant_id, current.get('configVersion', 0), fields, *variant)
+        if _etag_matches(request, etag):
+            return None, etag
+    tenant_data = await storage.get_tenant(tenant_id, fields=fields + ['configVersion'] if fields else None)
+    if tenant_data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tenant not found")
+    etag = _tenant_etag(tenant_id, tenant_data.get('configVersion', 0), fields, *variant)
+    if fields and 'configVersion' not in fields:
+        tenant_data.pop('configVersion', None)
+    # handle ของ context cache เปลี่ยนโดยไม่เพิ่ม configVersion จึงไม่อยู่ใน response ที่ cache ตาม ETag
+    tenant_data.pop('contextCaches', None)
+    return tenant_data, etag
+
+
+def _cacheable_json(content: Any, etag: str) -> Response:
+    # no-cache: browser เก็บ response ไว้แต่ต้องถามซ้ำทุกครั้ง (ได้ 304 หาก config ยังไม่เปลี่ยน)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if content is None:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(jsonable_encoder(content), headers=headers)
+
+
 @router.get("/{tenant_id}")
-async def get_tenant_data(tenant_id: str, role: str = Depends(get_user_tenant_role)):
+async def get_tenant_data(
+    tenant_id: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description="Comma-separated top-level fields to return (default: all)"),
+    role: str = Depends(get_user_tenant_role),
+):
 
     """
     Retrieves the configuration data for a specific tenant.
+    Supports `fields=` projection and ETag / If-None-Match (304 when the configuration is unchanged).
     """
     # if not db:
     #     raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database not available.")
+    field_names = _parse_fields(fields)
     try:
-        doc_ref = db.collection('tenants').document(tenant_id)
-        doc = doc_ref.get() # .get() is synchronous
-        if not doc.exists:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tenant not found")
-        return doc.to_dict()
+        tenant_data, etag = await _conditional_tenant_read(request, tenant_id, field_names)
+        return _cacheable_json(tenant_data, etag)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+@router.get("/{tenant_id}/knowledge-base")
+async def get_tenant_knowledge_base(
+    tenant_id: str,
+    request: Request,
+    offset: int = Query(0, ge=0, description="Character offset"),
+    limit: int = Query(KB_PAGE_CHARS, ge=1, le=KB_MAX_PAGE_CHARS, description="Characters per page"),
+    role: str = Depends(get_user_tenant_role),
+):
+    """
+    Returns the knowledge base text one page at a time. Follow `next_offset` until it is null
+    and concatenate `text` to rebuild the whole knowledge base.
+    """
+    try:
+        tenant_data, etag = await _conditional_tenant_read(request, tenant_id, ['knowledgeBase'], offset, limit)
+        if tenant_data is None:
+            return _cacheable_json(None, etag)
+        knowledge_base = tenant_data.get('knowledgeBase') or ""
+        end = min(offset + limit, len(knowledge_base))
+        return _cacheable_json({
+            "text": knowledge_base[offset:end],
+            "offset": offset,
+            "next_offset": end if end < len(knowledge_base) else None,
+            "total_length": len(knowledge_base),
+        }, etag)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 @router.put("/{tenant_id}")
-async def update_tenant_data(tenant_id: str, data: TenantUpdateRequest, role: str = Depends(get_user_tenant_role)):
+async def update_tenant_data(tenant_id: str, data: TenantUpdateRequest, background_tasks: BackgroundTasks, role: str = Depends(get_user_tenant_role)):
       
     if role != 'owner':
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the owner can update tenant settings.")
 
     try:
         update_data = data.dict(exclude_none=True)
-        doc_ref = db.collection('tenants').document(tenant_id)
-        doc_ref.update(update_data)
+        await get_async_storage().update_tenant(tenant_id, update_data)
+        webhook_guard.invalidate_config(tenant_id)
+        if 'botPersona' in update_data or 'knowledgeBase' in update_data:
+            await run_in_threadpool(context_cache.invalidate_tenant, tenant_id)
+        if 'knowledgeBase' in update_data:
+            # สร้าง embedding index ของ KB ใหม่ล่วงหน้า (ไม่ให้ข้อความแรกของลูกค้าต้องรอ)
+            background_tasks.add_task(kb_retrieval.warm, tenant_id, update_data['knowledgeBase'])
         return {"message": "Tenant data updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+@router.get("/{tenant_id}/usage")
+async def get_tenant_usage(tenant_id: str, days: int = Query(30, ge=1, le=366), role: str = Depends(get_user_tenant_role)):
+    """
+    Returns pre-aggregated LLM usage (calls, tokens, estimated cost) for the last `days` days.
+    """
+    try:
+        return await run_in_threadpool(usage.get_usage, tenant_id, days)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+@router.get("/{tenant_id}/analytics")
+async def get_tenant_analytics(
+    tenant_id: str,
+    start: Optional[str] = Query(None, description="YYYY-MM-DD (default: 29 days before end)"),
+    end: Optional[str] = Query(None, description="YYYY-MM-DD (default: today)"),
+    granularity: str = Query("day", pattern="^(day|hour)$"),
+    role: str = Depends(get_user_tenant_role),
+):
+    """
+    Returns conversation analytics (messages, bot/admin replies, fallback rate, failure types)
+    from pre-aggregated hourly/daily rollups, so any range costs only a few reads.
+    """
+    try:
+        end_day = datetime.date.fromisoformat(end) if end else datetime.datetime.now(analytics.ANALYTICS_TIMEZONE).date()
+        start_day = datetime.date.fromisoformat(start) if start else end_day - datetime.timedelta(days=29)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Dates must be in YYYY-MM-DD format.")
+    try:
+        return await run_in_threadpool(analytics.get_analytics, tenant_id, start_day, end_day, granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+def _parse_export_bound(value: Optional[str], name: str, end_of_day: bool = False) -> Optional[datetime.datetime]:
+    """แปลงวันที่ (YYYY-MM-DD) หรือ ISO datetime เป็น datetime แบบมี timezone; `end` แบบวันที่จะนับรวมทั้งวัน"""
+    if not value:
+        return None
+    try:
+        if len(value) == 10:
+            parsed = datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time(), datetime.timezone.utc)
+            return parsed + datetime.timedelta(days=1) if end_of_day else parsed
+        parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid '{name}' date: {value}")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+@router.get("/{tenant_id}/export")
+async def export_conversations(
+    tenant_id: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    start: Optional[str] = Query(None, description="YYYY-MM-DD or ISO datetime (inclusive)"),
+    end: Optional[str] = Query(None, description="YYYY-MM-DD (inclusive) or ISO datetime (exclusive)"),
+    gzip: bool = False,
+    role: str = Depends(get_user_tenant_role),
+):
+    """
+    Streams every message of the tenant as NDJSON or CSV (optionally gzip-compressed),
+    paging through conversations so memory stays flat regardless of tenant size.
+    """
+    if role != 'owner':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the owner can export conversations.")
+    start_at = _parse_export_bound(start, "start")
+    end_at = _parse_export_bound(end, "end", end_of_day=True)
+
+    filename = f"{tenant_id}-conversations.{format}"
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv; charset=utf-8"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        export.stream_export(tenant_id, format, start_at, end_at, compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.post("/{tenant_id}/catalog/import")
+async def import_product_catalog(
+    tenant_id: str,
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|json)$", description="Defaults to the request Content-Type"),
+    replace: bool = Query(False, description="Remove products that are not in this file"),
+    role: str = Depends(get_user_tenant_role),
+):
+    """
+    Bulk-imports products from a CSV or JSON request body. Columns: sku, name, category, price,
+    size(s), color(s), description, in_stock (Thai headers work too); other columns become attributes.
+    """
+    if role != 'owner':
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only the owner can import the product catalog.")
+    fmt = format or ("json" if "json" in request.headers.get("content-type", "") else "csv")
+    body = await request.body()
+    try:
+        products, errors = await run_in_threadpool(catalog.parse_catalog, body, fmt)
+    except ValueError as e:  # รวม JSONDecodeError และ UnicodeDecodeError
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {fmt} catalog: {e}")
+    if not products:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail={"message": "No valid products found.", "errors": errors[:50]})
+    try:
+        result = await run_in_threadpool(catalog.import_catalog, tenant_id, products, replace)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    result.update(error_count=len(errors), errors=errors[:50])
+    return result
+
+@router.get("/{tenant_id}/catalog/search")
+async def search_product_catalog(
+    tenant_id: str,
+    q: str = Query(..., min_length=1, max_length=500),
+    k: int = Query(catalog.CATALOG_TOP_K, ge=1, le=50),
+    role: str = Depends(get_user_tenant_role),
+):
+    """
+    Runs the same product retrieval the bot uses, so owners can check what a question would match.
+    """
+    config = await get_async_storage().get_tenant(tenant_id)
+    if config is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tenant not found")
+    if not config.get('catalogVersion'):
+        return {"products": [], "filtered": False, "product_count": 0}
+    index = await run_in_threadpool(catalog.get_product_index, tenant_id, config['catalogVersion'])
+    result = await run_in_threadpool(index.search, q, k)
+    result["product_count"] = len(index)
+    return result
+
@@ -1,7 +1,8 @@
 # app/routers/user.py
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
 from ..dependencies import get_current_user
-from ..services.firebase_utils import db
+from ..services.storage import get_async_storage
 
 router = APIRouter(
     prefix="/api/user",
@@ -17,24 +18,22 @@ async def get_my_tenants(current_user: dict = Depends(get_current_user)):
     """
     try:
         uid = current_user["uid"]
-        user_ref = db.collection('users').document(uid)
-        user_doc = user_ref.get()
+        storage = get_async_storage()
+        user_data = await storage.get_user(uid)
 
-        if not user_doc.exists:
+        if user_data is None:
             raise HTTPException(status_code=404, detail="User profile not found.")
 
-        user_data = user_doc.to_dict()
         tenant_roles = user_data.get("tenants", {})
 
         if not tenant_roles:
             return [] # Return an empty list if the user is not part of any tenant
 
-        # Fetch details for each tenant
+        # Fetch details for each tenant (อ่านพร้อมกันทุก tenant)
+        tenants_data = await asyncio.gather(*(storage.get_tenant(tenant_id) for tenant_id in tenant_roles))
         tenants_details = []
-        for tenant_id, role in tenant_roles.items():
-            tenant_doc = db.collection('tenants').document(tenant_id).get()
-            if tenant_doc.exists:
-                tenant_data = tenant_doc.to_dict()
+        for (tenant_id, role), tenant_data in zip(tenant_roles.items(), tenants_data):
+            if tenant_data is not None:
                 tenants_details.append({
                     "tenant_id": tenant_id,
                     "tenantName": tenant_data.get("tenantName", "Untitled Shop"),
@@ -1,107 +1,194 @@
 # app/routers/webhook.py
 # ✨ ลบ import requests ที่ไม่จำเป็นแล้ว
-from fastapi import APIRouter, Request, HTTPException, status
-from ..services.firebase_utils import db
+from fastapi import APIRouter, Request, HTTPException, Header, status
+from fastapi.concurrency import run_in_threadpool
+from ..services.storage import get_async_storage, get_storage
 from ..services.chatbot_logic import get_bot_response
 # ✨ 1. Import ฟังก์ชันที่จำเป็นทั้งหมด
-from ..services.facebook_api import send_facebook_message, get_facebook_user_profile
-from ..services.line_api import get_line_user_profile, send_line_message
+from ..services.facebook_api import get_facebook_user_profile
+from ..services.line_api import get_line_user_profile
+from ..services.delivery import deliver_message
+from ..services import load_shedder, metrics, webhook_guard
+import asyncio
 import datetime
+import json
+from collections import defaultdict
+from typing import Optional
 
 router = APIRouter(
     prefix="/webhook",
     tags=["Webhooks"],
 )
 
+async def _run_per_user(handler, events_by_user):
+    """
+    รัน handler (ฟังก์ชัน sync) ของแต่ละ event ใน threadpool: event ของผู้ใช้คนเดียวกันทำตามลำดับ
+    ส่วนผู้ใช้ต่างคนทำพร้อมกัน เพื่อไม่ให้การรอ LLM/platform ของคนหนึ่งบล็อกคนอื่นหรือ request อื่น
+    admission control รอคิวใน event loop ก่อนเข้า threadpool (handler รับ load_level ต่อท้าย args)
+    """
+    controller = load_shedder.get_admission_controller()
+
+    async def run_user(events):
+        for args in events:
+            async with controller.admit_async() as load_level:
+                await run_in_threadpool(handler, *args, load_level)
+    await asyncio.gather(*(run_user(events) for events in events_by_user.values()))
+
+
+def _handle_line_event(tenant_id: str, event: dict, line_token: str, load_level: int) -> None:
+    try:
+        storage = get_storage()
+        user_id = event["source"]["userId"]
+
+        # ดึงข้อมูลโปรไฟล์จาก LINE
+        profile_data = get_line_user_profile(user_id, line_token)
+        display_name = profile_data.get("displayName", "Unknown User")
+        picture_url = profile_data.get("pictureUrl", None)
+
+        # บันทึก/อัปเดตข้อมูลโปรไฟล์ลงฐานข้อมูล
+        storage.set_conversation(tenant_id, user_id, {
+            'displayName': display_name,
+            'pictureUrl': picture_url,
+            'platform': 'line'
+        }, merge=True)
+
+        user_msg = event["message"]["text"]
+        reply_token = event["replyToken"]
+        # timestamp ของ event (ms) ใช้คำนวณอายุของ replyToken
+        event_timestamp = event.get("timestamp", 0) / 1000 or None
+        current_time = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+        reply_msg = get_bot_response(tenant_id, user_id, user_msg, platform="line", display_name=display_name, last_message_time=current_time, load_level=load_level)
+
+        # ✨ 2. ส่งผ่าน delivery ซึ่งจะ fallback เป็น push หาก replyToken หมดอายุ และ retry ให้อัตโนมัติ
+        if reply_msg:
+            deliver_message(tenant_id, "line", user_id, reply_msg, line_token, reply_token=reply_token, event_timestamp=event_timestamp)
+
+    except Exception as e:
+        print(f"❌ Error processing a LINE event for tenant {tenant_id}: {e}")
+
+
+async def _verified_config(tenant_id: str, platform: str, body: bytes, signature: str) -> dict:
+    """
+    คืน config ของ tenant (token/secret จาก cache) หลังตรวจลายเซ็นของ body แล้ว
+    ลายเซ็นไม่ถูกต้อง -> 401 โดยไม่ทำงานต่อ
+    """
+    config = webhook_guard.cached_config(tenant_id)
+    if config is None:
+        config = await run_in_threadpool(webhook_guard.load_config, tenant_id)
+
+    if platform == "line":
+        secret, verify = config.get('lineChannelSecret'), webhook_guard.line_signature_valid
+    else:
+        secret, verify = config.get('facebookAppSecret'), webhook_guard.facebook_signature_valid
+    if secret:
+        if not verify(body, signature, secret):
+            metrics.increment("webhook.rejected", platform=platform, reason="bad_signature")
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid signature.")
+    elif webhook_guard.WEBHOOK_REQUIRE_SIGNATURE:
+        metrics.increment("webhook.rejected", platform=platform, reason="no_secret")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Webhook secret is not configured.")
+    else:
+        # tenant เดิมที่ยังไม่ได้ตั้ง secret ยังใช้งานได้ แต่ตรวจสอบไม่ได้
+        metrics.increment("webhook.unverified", platform=platform)
+    return config
+
+
+def _parse_body(body: bytes, platform: str) -> dict:
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = None
+    if not isinstance(payload, dict):
+        metrics.increment("webhook.rejected", platform=platform, reason="bad_body")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid JSON body.")
+    return payload
+
+
 @router.post("/line/{tenant_id}")
-async def line_webhook(tenant_id: str, request: Request):
-    body = await request.json()
-    events = body.get("events", [])
-    
-    tenant_ref = db.collection('tenants').document(tenant_id)
-    tenant_data = tenant_ref.get().to_dict()
-    line_token = tenant_data.get('lineAccessToken')
+async def line_webhook(tenant_id: str, request: Request, x_line_signature: Optional[str] = Header(None)):
+    # LINE ส่งลายเซ็นมาทุก request เสมอ ไม่มีแสดงว่าไม่ได้มาจาก LINE (ปฏิเสธก่อนอ่าน body)
+    if not x_line_signature:
+        metrics.increment("webhook.rejected", platform="line", reason="missing_signature")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing signature.")
+    body = await request.body()
+    events = webhook_guard.line_reply_events(_parse_body(body, "line"))
+    # sticker, follow/unfollow, การกด Verify ใน LINE console ฯลฯ ตอบ 200 ได้ทันทีโดยไม่ต้องแตะ storage
+    if not events:
+        metrics.increment("webhook.filtered", platform="line")
+        return {"status": "ok"}
+
+    config = await _verified_config(tenant_id, "line", body, x_line_signature)
+    line_token = config.get('lineAccessToken')
 
     if not line_token:
         print(f"❌ Missing LINE Access Token for tenant: {tenant_id}")
         return {"status": "error", "message": "Missing token"}
 
+    events_by_user = defaultdict(list)
     for event in events:
-        try:
-            if event.get("type") != "message" or event.get("message", {}).get("type") != "text":
-                continue
-
-            user_id = event["source"]["userId"]
-            
-            # ดึงข้อมูลโปรไฟล์จาก LINE
-            profile_data = get_line_user_profile(user_id, line_token)
-            display_name = profile_data.get("displayName", "Unknown User")
-            picture_url = profile_data.get("pictureUrl", None)
-
-            # บันทึก/อัปเดตข้อมูลโปรไฟล์ลง Firestore
-            user_doc_ref = db.collection('chat_sessions').document(tenant_id).collection('users').document(user_id)
-            user_doc_ref.set({
-                'displayName': display_name,
-                'pictureUrl': picture_url,
-                'platform': 'line'
-            }, merge=True)
-
-            user_msg = event["message"]["text"]
-            reply_token = event["replyToken"]
-            current_time = datetime.datetime.now(datetime.timezone.utc).isoformat()
-
-            reply_msg = get_bot_response(tenant_id, user_id, user_msg, platform="line", display_name=display_name, last_message_time=current_time)
-            
-            # ✨ 2. เปลี่ยนมาเรียกใช้ฟังก์ชัน send_line_message
-            # เพื่อให้โค้ดมีรูปแบบเดียวกับ Facebook
-            if reply_msg:
-                send_line_message(reply_token, reply_msg, line_token)
-
-        except Exception as e:
-            print(f"❌ Error processing a LINE event for tenant {tenant_id}: {e}")
+        if webhook_guard.is_duplicate(tenant_id, event.get("webhookEventId")):
+            metrics.increment("webhook.duplicates", platform="line")
             continue
-    
+        events_by_user[event["source"]["userId"]].append((tenant_id, event, line_token))
+    await _run_per_user(_handle_line_event, events_by_user)
+
     return {"status": "ok"}
 
 
+def _handle_facebook_event(tenant_id: str, messaging_event: dict, page_token: str, load_level: int) -> None:
+    try:
+        storage = get_storage()
+        sender_id = messaging_event["sender"]["id"]
+        message_text = messaging_event["message"].get("text")
+
+        # ดึงข้อมูลโปรไฟล์จาก Facebook
+        profile_data = get_facebook_user_profile(sender_id, page_token)
+        display_name = profile_data.get("name", "Unknown User")
+        picture_url = profile_data.get("profile_pic", None)
+
+        # บันทึก/อัปเดตข้อมูลโปรไฟล์ลงฐานข้อมูล
+        storage.set_conversation(tenant_id, sender_id, {
+            'displayName': display_name,
+            'pictureUrl': picture_url,
+            'platform': 'facebook'
+        }, merge=True)
+
+        current_time = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+        if message_text:
+            reply_text = get_bot_response(tenant_id, sender_id, message_text, platform="facebook", display_name=display_name, last_message_time=current_time, load_level=load_level)
+            if reply_text:
+                deliver_message(tenant_id, "facebook", sender_id, reply_text, page_token, event_timestamp=messaging_event.get("timestamp", 0) / 1000 or None)
+    except Exception as e:
+        print(f"❌ Error processing a Facebook event for tenant {tenant_id}: {e}")
+
+
 @router.post("/facebook/{tenant_id}")
-async def facebook_webhook_handler(tenant_id: str, request: Request):
-    data = await request.json()
-    
-    tenant_ref = db.collection('tenants').document(tenant_id)
-    config = tenant_ref.get().to_dict()
+async def facebook_webhook_handler(tenant_id: str, request: Request, x_hub_signature_256: Optional[str] = Header(None)):
+    if not x_hub_signature_256:
+        metrics.increment("webhook.rejected", platform="facebook", reason="missing_signature")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing signature.")
+    body = await request.body()
+    messaging_events = webhook_guard.facebook_message_events(_parse_body(body, "facebook"))
+    if not messaging_events:
+        metrics.increment("webhook.filtered", platform="facebook")
+        return "EVENT_RECEIVED"
+
+    config = await _verified_config(tenant_id, "facebook", body, x_hub_signature_256)
     page_token = config.get('facebookPageToken')
 
     if not page_token:
         print(f"❌ Missing Facebook Page Token for tenant: {tenant_id}")
         return "EVENT_RECEIVED"
 
-    if data.get("object") == "page":
-        for entry in data.get("entry", []):
-            for messaging_event in entry.get("messaging", []):
-                if messaging_event.get("message"):
-                    sender_id = messaging_event["sender"]["id"]
-                    message_text = messaging_event["message"].get("text")
-
-                    # ดึงข้อมูลโปรไฟล์จาก Facebook
-                    profile_data = get_facebook_user_profile(sender_id, page_token)
-                    display_name = profile_data.get("name", "Unknown User")
-                    picture_url = profile_data.get("profile_pic", None)
-
-                    # บันทึก/อัปเดตข้อมูลโปรไฟล์ลง Firestore
-                    user_doc_ref = db.collection('chat_sessions').document(tenant_id).collection('users').document(sender_id)
-                    user_doc_ref.set({
-                        'displayName': display_name,
-                        'pictureUrl': picture_url,
-                        'platform': 'facebook'
-                    }, merge=True)
-
-                    current_time = datetime.datetime.now(datetime.timezone.utc).isoformat()
-
-                    if message_text:
-                        reply_text = get_bot_response(tenant_id, sender_id, message_text, platform="facebook", display_name=display_name, last_message_time=current_time)
-                        if reply_text:
-                            send_facebook_message(sender_id, reply_text, page_token)
+    events_by_user = defaultdict(list)
+    for messaging_event in messaging_events:
+        if webhook_guard.is_duplicate(tenant_id, messaging_event["message"].get("mid")):
+            metrics.increment("webhook.duplicates", platform="facebook")
+            continue
+        events_by_user[messaging_event["sender"]["id"]].append((tenant_id, messaging_event, page_token))
+    await _run_per_user(_handle_facebook_event, events_by_user)
                         
     return "EVENT_RECEIVED"
 
@@ -112,11 +199,11 @@ async def facebook_webhook_verify(tenant_id: str, request: Request):
     Handles Facebook webhook verification (GET request).
     """
     if 'hub.mode' in request.query_params and 'hub.challenge' in request.query_params and 'hub.verify_token' in request.query_params:
-        if not db:
+        storage = get_async_storage()
+        if not storage:
             raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database not available.")
         
-        tenant_ref = db.collection('tenants').document(tenant_id)
-        config = tenant_ref.get().to_dict()
+        config = await storage.get_tenant(tenant_id) or {}
         verify_token_from_db = config.get('facebookVerifyToken')
         
         if request.query_params.get('hub.mode') == 'subscribe' and request.query_params.get('hub.verify_token') == verify_token_from_db:
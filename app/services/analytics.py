@@ -0,0 +1,165 @@
+# app/services/analytics.py
+"""
+สถิติของบทสนทนาต่อ tenant ที่นับเพิ่มทีละข้อความตอนเขียน history (ไม่ต้องไล่อ่าน history ทั้งหมด)
+
+* ทุกจุดที่เขียนข้อความลง history เรียก `record_messages` ซึ่งนับลงตัวนับในหน่วยความจำ
+* `flush()` (เรียกเป็นระยะจาก background worker) เขียนยอดรวมลงเอกสาร rollup ขนาดเล็กสองระดับ:
+    - daily:  หนึ่งเอกสารต่อเดือน key รูปแบบ `DD|metric`
+    - hourly: หนึ่งเอกสารต่อวัน  key รูปแบบ `HH|metric`
+  การดูสถิติรายวันทั้งปีจึงอ่านแค่ 12 เอกสาร (ต่อ shard) และรายชั่วโมงอ่านหนึ่งเอกสารต่อวัน
+* ช่วงเวลาแบ่งตาม ANALYTICS_TIMEZONE (ค่าเริ่มต้น Asia/Bangkok) ให้ตรงกับวันทำการของร้าน
+
+metric ที่นับ: messages_in, bot_replies, admin_replies, broadcast_messages, fallback_replies,
+manual_reply_required, `route:{route}` และ `failure:{failure_type}` (จาก create_error_log_entry)
+"""
+import datetime
+import os
+import random
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Tuple
+from zoneinfo import ZoneInfo
+
+from .pending_counters import PendingCounters
+from .storage import get_storage
+
+ANALYTICS_FLUSH_INTERVAL_S = float(os.getenv("ANALYTICS_FLUSH_INTERVAL_S", "60"))
+# แต่ละ instance เขียนเอกสารละครั้งต่อรอบ flush จึงไม่ต้องแบ่ง shard เว้นแต่มีหลาย instance มาก
+ANALYTICS_SHARDS = int(os.getenv("ANALYTICS_SHARDS", "1"))
+ANALYTICS_TIMEZONE = ZoneInfo(os.getenv("ANALYTICS_TIMEZONE", "Asia/Bangkok"))
+# ช่วงวันที่ยาวที่สุดที่ขอแบบรายชั่วโมงได้ (หนึ่งเอกสารต่อวัน)
+ANALYTICS_MAX_HOURLY_DAYS = 31
+
+GRANULARITIES = ("day", "hour")
+COUNT_METRICS = ("messages_in", "bot_replies", "admin_replies", "broadcast_messages", "fallback_replies", "manual_reply_required")
+
+
+def _write_rollup(storage, key: Tuple[str, str, str], counters: Dict[str, float]) -> None:
+    tenant_id, granularity, period = key
+    storage.increment_analytics(tenant_id, granularity, period, random.randrange(ANALYTICS_SHARDS), counters)
+
+
+_counters = PendingCounters("Analytics", _write_rollup, ANALYTICS_FLUSH_INTERVAL_S)
+
+
+def _local_time(timestamp: Any) -> datetime.datetime:
+    try:
+        parsed = datetime.datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    except (TypeError, ValueError):
+        parsed = datetime.datetime.now(datetime.timezone.utc)
+    return parsed.astimezone(ANALYTICS_TIMEZONE)
+
+
+def classify(message: Dict[str, Any]) -> List[str]:
+    """metric ที่ข้อความหนึ่งข้อความนับเข้า"""
+    if message.get('role') == 'user':
+        metrics = ['messages_in']
+        if message.get('failure_type'):
+            metrics.append(f"failure:{message['failure_type']}")
+        if message.get('status') == 'requires_manual_reply':
+            metrics.append('manual_reply_required')
+        return metrics
+    if message.get('campaign_id'):
+        return ['broadcast_messages']
+    if message.get('sender_type') == 'admin':
+        return ['admin_replies']
+    metrics = ['bot_replies', f"route:{message.get('route') or 'unknown'}"]
+    if message.get('fallback'):
+        metrics.append('fallback_replies')
+    return metrics
+
+
+def record_messages(tenant_id: str, messages: Iterable[Dict[str, Any]]) -> None:
+    """นับข้อความที่เพิ่งเขียนลง history (ความผิดพลาดไม่กระทบการบันทึกข้อความ)"""
+    try:
+        for message in messages:
+            local = _local_time(message.get('timestamp'))
+            metrics = classify(message)
+            _counters.add((tenant_id, 'daily', local.strftime('%Y-%m')), {f"{local.strftime('%d')}|{metric}": 1 for metric in metrics})
+            _counters.add((tenant_id, 'hourly', local.strftime('%Y-%m-%d')), {f"{local.strftime('%H')}|{metric}": 1 for metric in metrics})
+    except Exception as e:
+        print(f"⚠️ Analytics: Could not record messages for tenant {tenant_id}: {e}")
+
+
+def record_messages_bulk(tenant_id: str, messages_by_user: Dict[str, Iterable[Dict[str, Any]]]) -> None:
+    for messages in messages_by_user.values():
+        record_messages(tenant_id, messages)
+
+
+def flush() -> int:
+    """เขียนยอดสะสมทั้งหมดลง storage แล้วล้างตัวนับ คืนค่าจำนวนเอกสาร rollup ที่เขียน"""
+    return _counters.flush()
+
+
+async def run_flush_worker() -> None:
+    """Background loop (เริ่มจาก lifespan ของ app) ที่ flush ตัวนับสถิติเป็นระยะ"""
+    await _counters.run_flush_worker()
+
+
+def _summarize(counters: Dict[str, float]) -> Dict[str, Any]:
+    """แปลงตัวนับของหนึ่งช่วงเวลาเป็นยอดรวม อัตรา fallback และยอดแยกตาม route / failure_type"""
+    summary: Dict[str, Any] = {metric: int(counters.get(metric, 0)) for metric in COUNT_METRICS}
+    summary['routes'] = {key.split(':', 1)[1]: int(value) for key, value in counters.items() if key.startswith('route:')}
+    summary['failures'] = {key.split(':', 1)[1]: int(value) for key, value in counters.items() if key.startswith('failure:')}
+    bot, admin = summary['bot_replies'], summary['admin_replies']
+    summary['fallback_rate'] = round(summary['fallback_replies'] / bot, 4) if bot else 0.0
+    summary['bot_reply_share'] = round(bot / (bot + admin), 4) if bot + admin else 0.0
+    return summary
+
+
+def get_analytics(tenant_id: str, start: datetime.date, end: datetime.date, granularity: str = "day") -> Dict[str, Any]:
+    """
+    คืนสถิติช่วง [start, end] (รวมวันสุดท้าย) แยกเป็นรายวัน (`day`) หรือรายชั่วโมง (`hour`)
+    รวมยอดที่ยังไม่ flush ของ instance นี้ด้วย `series` มีเฉพาะช่วงที่มีข้อความ
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {GRANULARITIES}")
+    if end < start:
+        raise ValueError("end must not be before start")
+    if granularity == "hour" and (end - start).days >= ANALYTICS_MAX_HOURLY_DAYS:
+        raise ValueError(f"Hourly analytics are limited to {ANALYTICS_MAX_HOURLY_DAYS} days")
+
+    stored_granularity = 'daily' if granularity == "day" else 'hourly'
+    if granularity == "day":
+        start_period, end_period = start.strftime('%Y-%m'), end.strftime('%Y-%m')
+    else:
+        start_period, end_period = start.isoformat(), end.isoformat()
+
+    per_period: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for period, counters in get_storage().get_analytics(tenant_id, stored_granularity, start_period, end_period).items():
+        for key, value in counters.items():
+            per_period[period][key] += value
+    for (pending_tenant, pending_granularity, period), counters in _counters.pending():
+        if pending_tenant == tenant_id and pending_granularity == stored_granularity and start_period <= period <= end_period:
+            for key, value in counters.items():
+                per_period[period][key] += value
+
+    # แตกเอกสารของแต่ละช่วงเป็น bucket: "YYYY-MM-DD" (รายวัน) หรือ "YYYY-MM-DDTHH" (รายชั่วโมง)
+    per_bucket: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    start_bucket, end_bucket = start.isoformat(), f"{end.isoformat()}T99"
+    for period, counters in per_period.items():
+        for key, value in counters.items():
+            try:
+                slot, metric = key.split('|', 1)
+            except ValueError:
+                continue
+            bucket = f"{period}-{slot}" if granularity == "day" else f"{period}T{slot}"
+            if start_bucket <= bucket <= end_bucket:
+                per_bucket[bucket][metric] += value
+
+    all_counters: Dict[str, float] = defaultdict(float)
+    series = []
+    for bucket in sorted(per_bucket):
+        for key, value in per_bucket[bucket].items():
+            all_counters[key] += value
+        series.append({'bucket': bucket, **_summarize(per_bucket[bucket])})
+    return {
+        'tenant_id': tenant_id,
+        'start_date': start.isoformat(),
+        'end_date': end.isoformat(),
+        'granularity': granularity,
+        'timezone': str(ANALYTICS_TIMEZONE),
+        'totals': _summarize(all_counters),
+        'series': series,
+    }
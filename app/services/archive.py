@@ -0,0 +1,239 @@
+# app/services/archive.py
+"""
+Tiered history archival
+
+ข้อความที่ถูกสรุปแล้วจะไม่ถูกใช้สร้างคำตอบอีก (ใช้แค่ summary + ข้อความล่าสุด) จึงย้ายออกจาก `history`
+ของเอกสาร conversation ไปเก็บเป็น segment แบบ gzip NDJSON ใน Cloud Storage หรือโฟลเดอร์ในเครื่อง
+
+* แต่ละ segment คือไฟล์ `{tenant_id}/{user_id}/{index:06d}.ndjson.gz` (หนึ่งบรรทัดต่อหนึ่งข้อความ)
+* เอกสาร conversation เก็บรายการ segment ไว้ใน `archive_segments` และจำนวนรวมใน `archived_message_count`
+* หน้า inbox อ่านย้อนหลังได้ทีละ segment ผ่าน GET /api/inbox/{tenant_id}/{user_id}/archive
+"""
+import datetime
+import gzip
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from .storage import get_storage
+
+# เก็บข้อความไว้ใน history ไม่เกินจำนวนนี้ (ส่วนที่เกินและสรุปแล้วจะถูกย้ายไป archive)
+ARCHIVE_HOT_MESSAGES = int(os.getenv("ARCHIVE_HOT_MESSAGES", "200"))
+# ข้อความที่สรุปแล้วและเก่ากว่านี้จะถูกย้ายไป archive แม้ history ยังไม่เกิน ARCHIVE_HOT_MESSAGES
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+# ไม่สร้าง segment เล็กกว่านี้ เพื่อไม่ให้มีไฟล์ย่อยจำนวนมาก
+ARCHIVE_MIN_BATCH = int(os.getenv("ARCHIVE_MIN_BATCH", "50"))
+# การ sweep จะข้ามแชทที่ยังมีความเคลื่อนไหวภายในช่วงเวลานี้ เพื่อไม่ให้เขียนชนกับ get_bot_response
+ARCHIVE_IDLE_MINUTES = float(os.getenv("ARCHIVE_IDLE_MINUTES", "30"))
+# field ของเอกสาร conversation ที่ archive_history แก้ (sweep เขียนเฉพาะ field เหล่านี้)
+ARCHIVE_FIELDS = ('history', 'archive_segments', 'archived_message_count', 'summary_checkpoint')
+
+
+class LocalArchiveStore:
+    """เก็บ segment ไว้ในโฟลเดอร์ในเครื่อง (ใช้แทน Cloud Storage สำหรับ self-hosted / development)"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def write(self, key: str, data: bytes) -> None:
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read(self, key: str) -> Optional[bytes]:
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class GCSArchiveStore:
+    """เก็บ segment ไว้ใน Cloud Storage bucket (ต้องติดตั้ง google-cloud-storage)"""
+
+    def __init__(self, bucket_name: str, prefix: str = ""):
+        from google.cloud import storage as gcs
+        self.bucket = gcs.Client().bucket(bucket_name)
+        self.prefix = prefix.strip('/')
+
+    def _blob(self, key: str):
+        return self.bucket.blob(f"{self.prefix}/{key}" if self.prefix else key)
+
+    def write(self, key: str, data: bytes) -> None:
+        self._blob(key).upload_from_string(data, content_type="application/gzip")
+
+    def read(self, key: str) -> Optional[bytes]:
+        blob = self._blob(key)
+        if not blob.exists():
+            return None
+        return blob.download_as_bytes()
+
+
+# Private global variable to store the initialized archive store
+_archive_store_instance = None
+
+
+def get_archive_store():
+    """
+    Returns the configured archive store, initializing it on first access.
+
+    ARCHIVE_BACKEND=local (default) writes under ARCHIVE_DIR (default: archive);
+    ARCHIVE_BACKEND=gcs writes to ARCHIVE_GCS_BUCKET. Returns None if unavailable.
+    """
+    global _archive_store_instance
+    if _archive_store_instance is None:
+        backend = os.getenv("ARCHIVE_BACKEND", "local").lower()
+        try:
+            if backend == "gcs":
+                _archive_store_instance = GCSArchiveStore(os.environ["ARCHIVE_GCS_BUCKET"], os.getenv("ARCHIVE_GCS_PREFIX", "chat-archive"))
+            else:
+                _archive_store_instance = LocalArchiveStore(os.getenv("ARCHIVE_DIR", "archive"))
+            print(f"✅ Archive store initialized ({backend}).")
+        except Exception as e:
+            print(f"❌ CRITICAL: Could not initialize archive store ({backend}): {e}")
+    return _archive_store_instance
+
+
+def set_archive_store(store) -> None:
+    """Replaces the active archive store (used by benchmarks and tests)."""
+    global _archive_store_instance
+    _archive_store_instance = store
+
+
+def _segment_key(tenant_id: str, user_id: str, index: int) -> str:
+    return f"{tenant_id}/{user_id}/{index:06d}.ndjson.gz"
+
+
+def _encode_segment(messages: List[Dict[str, Any]]) -> bytes:
+    lines = "\n".join(json.dumps(msg, ensure_ascii=False, default=str) for msg in messages)
+    return gzip.compress(lines.encode('utf-8'))
+
+
+def _decode_segment(data: bytes) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines() if line]
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime.datetime]:
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (ValueError, TypeError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+def summary_checkpoint(conversation: Dict[str, Any]) -> int:
+    """
+    ตำแหน่งใน `history` (ที่ยังไม่ถูก archive) ที่ summary ครอบคลุมถึง ข้อความตั้งแต่ตำแหน่งนี้คือส่วนที่ยังไม่ถูกสรุป
+
+    เอกสารเก็บค่า `summary_checkpoint` เป็นจำนวนข้อความทั้งหมดที่สรุปแล้ว (นับรวมส่วนที่ archive ไปแล้ว)
+    จึงไม่ต้องแก้เมื่อมีการ archive เอกสารเก่าที่ยังไม่มีฟิลด์นี้จะคำนวณจาก flag `summarized` เดิมหนึ่งครั้ง
+    """
+    history = conversation.get('history') or []
+    archived = conversation.get('archived_message_count', 0)
+    checkpoint = conversation.get('summary_checkpoint')
+    if checkpoint is None:
+        hot_checkpoint = 0
+        for index, msg in enumerate(history):
+            if msg.get('summarized'):
+                hot_checkpoint = index + 1
+        return hot_checkpoint
+    return min(len(history), max(0, checkpoint - archived))
+
+
+def _archivable_count(conversation: Dict[str, Any]) -> int:
+    """จำนวนข้อความต้น history ที่ย้ายไป archive ได้ (ต้องสรุปแล้ว และเกินโควต้าหรือเก่าพอ)"""
+    history = conversation.get('history') or []
+    summarized = summary_checkpoint(conversation)
+
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+    aged = 0
+    for msg in history[:summarized]:
+        timestamp = _parse_timestamp(msg.get('timestamp'))
+        if timestamp is None or timestamp > cutoff:
+            break
+        aged += 1
+
+    over_quota = max(0, len(history) - ARCHIVE_HOT_MESSAGES)
+    return min(summarized, max(aged, over_quota))
+
+
+def archive_history(tenant_id: str, user_id: str, conversation: Dict[str, Any]) -> int:
+    """
+    ย้ายข้อความเก่าที่สรุปแล้วออกจาก `conversation['history']` ไปเขียนเป็น segment ใหม่
+    แก้ไข `conversation` ในตัว (ผู้เรียกต้องบันทึกเอกสารเอง) และคืนค่าจำนวนข้อความที่ย้าย
+    """
+    history = conversation.get('history') or []
+    count = _archivable_count(conversation)
+    if count < ARCHIVE_MIN_BATCH:
+        return 0
+    store = get_archive_store()
+    if store is None:
+        return 0
+    if conversation.get('summary_checkpoint') is None:
+        conversation['summary_checkpoint'] = conversation.get('archived_message_count', 0) + summary_checkpoint(conversation)
+
+    to_archive = history[:count]
+    segments = list(conversation.get('archive_segments') or [])
+    index = segments[-1]['index'] + 1 if segments else 0
+    # เขียน segment ให้สำเร็จก่อนตัดออกจาก history เสมอ ข้อความจึงไม่หายแม้การบันทึกเอกสารล้มเหลว
+    store.write(_segment_key(tenant_id, user_id, index), _encode_segment(to_archive))
+    segments.append({
+        'index': index,
+        'count': count,
+        'first_timestamp': to_archive[0].get('timestamp'),
+        'last_timestamp': to_archive[-1].get('timestamp'),
+    })
+    conversation['history'] = history[count:]
+    conversation['archive_segments'] = segments
+    conversation['archived_message_count'] = conversation.get('archived_message_count', 0) + count
+    print(f"🗄️ Archive: Moved {count} messages of {user_id} (tenant {tenant_id}) to segment {index}.")
+    return count
+
+
+def archive_tenant(tenant_id: str, page_size: int = 50) -> Dict[str, int]:
+    """
+    Sweep ทุกแชทของ tenant ที่ไม่มีความเคลื่อนไหวช่วงหลัง และย้ายข้อความเก่าไป archive
+    ไล่หน้าตาม user_id (แชทที่มีข้อความใหม่ระหว่าง sweep ไม่ขยับตำแหน่ง) และตัด history ผ่าน
+    `update_conversation` ซึ่งเขียนเฉพาะ ARCHIVE_FIELDS และอ่านใหม่หากเอกสารเปลี่ยนหลังอ่าน
+    """
+    storage = get_storage()
+    idle_cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=ARCHIVE_IDLE_MINUTES)
+    stats = {'conversations': 0, 'archived_conversations': 0, 'archived_messages': 0}
+
+    def is_active(conversation: Dict[str, Any]) -> bool:
+        last_message_time = _parse_timestamp(conversation.get('lastMessageTime'))
+        return last_message_time is not None and last_message_time > idle_cutoff
+
+    cursor = None
+    while True:
+        page = storage.list_conversations(tenant_id, limit=page_size, start_after=cursor, order_by_id=True, fields=['lastMessageTime'])
+        for conversation in page:
+            stats['conversations'] += 1
+            user_id = conversation['user_id']
+            if is_active(conversation):
+                continue
+            moved = 0
+
+            def trim(current: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+                nonlocal moved
+                moved = 0 if is_active(current) else archive_history(tenant_id, user_id, current)
+                return {field: current[field] for field in ARCHIVE_FIELDS if field in current} if moved else None
+
+            if storage.update_conversation(tenant_id, user_id, trim):
+                stats['archived_conversations'] += 1
+                stats['archived_messages'] += moved
+        if len(page) < page_size:
+            return stats
+        cursor = page[-1]['user_id']
+
+
+def read_segment(tenant_id: str, user_id: str, index: int) -> Optional[List[Dict[str, Any]]]:
+    """อ่านข้อความทั้งหมดใน segment ที่ระบุ (None หากไม่มี)"""
+    store = get_archive_store()
+    if store is None:
+        return None
+    data = store.read(_segment_key(tenant_id, user_id, index))
+    return _decode_segment(data) if data is not None else None
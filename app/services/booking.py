@@ -0,0 +1,249 @@
+# app/services/booking.py
+"""
+ดึงคิวว่างจากระบบจองภายนอกของร้าน (`bookingSystemIntegration`) สำหรับ tenant ประเภท service_appointment
+
+* เรียก `GET {bookingSystemIntegration}?start=YYYY-MM-DD&days=N` ผ่าน requests.Session ที่ใช้ connection ร่วมกัน
+  ระบบจองตอบเป็น JSON list ของ slot หรือ {"slots": [...]} โดยแต่ละ slot มี `start` (ISO 8601)
+  และอาจมี `end`, `available` (ค่าเริ่มต้น true), `service`, `staff`
+* เก็บผลไว้ต่อ tenant เป็นเวลา BOOKING_CACHE_TTL_S คำถามที่เข้ามาพร้อมกันขณะกำลังดึงจะรอผลของการดึงครั้งเดียวกัน
+  (ไม่ยิงไปที่ระบบจองซ้ำ) และหากระบบจองล่ม จะใช้ผลเก่าที่อายุไม่เกิน BOOKING_STALE_S แทน
+* get_bot_response ใส่คิวว่างลงใน prompt เฉพาะเมื่อคำถามเกี่ยวกับการจอง/เวลาว่าง
+"""
+import datetime
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+BOOKING_BUSINESS_TYPE = "service_appointment"
+BOOKING_CACHE_TTL_S = float(os.getenv("BOOKING_CACHE_TTL_S", "60"))
+# ระบบจองล่ม: ใช้ผลเก่าได้นานสุดเท่านี้หลังหมดอายุ (ดีกว่าให้บอทตอบว่าไม่ทราบคิว)
+BOOKING_STALE_S = float(os.getenv("BOOKING_STALE_S", "600"))
+BOOKING_TIMEOUT_S = float(os.getenv("BOOKING_TIMEOUT_S", "3"))
+BOOKING_WINDOW_DAYS = int(os.getenv("BOOKING_WINDOW_DAYS", "7"))
+BOOKING_TIMEZONE = ZoneInfo(os.getenv("BOOKING_TIMEZONE", "Asia/Bangkok"))
+# หลังดึงไม่สำเร็จ จะไม่เรียกระบบจองซ้ำในช่วงนี้ (ไม่ให้ทุกคำถามต้องรอ timeout)
+BOOKING_RETRY_AFTER_S = 15
+BOOKING_POOL_SIZE = 32
+# จำนวน slot สูงสุดที่ใส่ลงใน prompt
+BOOKING_MAX_SLOTS_IN_PROMPT = 40
+
+_BOOKING_QUESTION = re.compile(
+    r"ว่าง|จอง|คิว|นัด|เวลา|วันไหน|กี่โมง|เปิดกี่|พรุ่งนี้|มะรืน|วันนี้|สัปดาห์|อาทิตย์|"
+    r"จันทร์|อังคาร|พุธ|พฤหัส|ศุกร์|เสาร์|available|availability|book|slot|appointment|schedule|tomorrow|today",
+    re.IGNORECASE,
+)
+_THAI_WEEKDAYS = ("จ.", "อ.", "พ.", "พฤ.", "ศ.", "ส.", "อา.")
+_THAI_MONTHS = ("ม.ค.", "ก.พ.", "มี.ค.", "เม.ย.", "พ.ค.", "มิ.ย.", "ก.ค.", "ส.ค.", "ก.ย.", "ต.ค.", "พ.ย.", "ธ.ค.")
+
+BOOKING_UNAVAILABLE_NOTE = "ไม่สามารถตรวจสอบคิวว่างได้ในขณะนี้ อย่ายืนยันเวลานัดเอง ให้แจ้งลูกค้าว่าแอดมินจะยืนยันเวลาให้"
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=BOOKING_POOL_SIZE, pool_maxsize=BOOKING_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept": "application/json"})
+    return session
+
+
+_session = _make_session()
+
+
+def booking_enabled(config: Dict[str, Any]) -> bool:
+    url = (config.get('bookingSystemIntegration') or "").strip()
+    return (
+        config.get('businessType') == BOOKING_BUSINESS_TYPE
+        and bool(config.get('botBookingEnabled'))
+        and url.lower().startswith(("http://", "https://"))
+    )
+
+
+def wants_availability(user_input: str) -> bool:
+    """คำถามที่น่าจะต้องใช้ข้อมูลคิวว่าง (คำถามอื่นไม่ต้องเสียเวลาเรียกระบบจอง)"""
+    return bool(_BOOKING_QUESTION.search(user_input or ""))
+
+
+def _parse_slot(raw: Any) -> Optional[Dict[str, Any]]:
+    if not isinstance(raw, dict) or not raw.get('start'):
+        return None
+    try:
+        start = datetime.datetime.fromisoformat(str(raw['start']).replace("Z", "+00:00"))
+        end = datetime.datetime.fromisoformat(str(raw['end']).replace("Z", "+00:00")) if raw.get('end') else None
+    except ValueError:
+        return None
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=BOOKING_TIMEZONE)
+    if end is not None and end.tzinfo is None:
+        end = end.replace(tzinfo=BOOKING_TIMEZONE)
+    return {
+        'start': start.astimezone(BOOKING_TIMEZONE),
+        'end': end.astimezone(BOOKING_TIMEZONE) if end else None,
+        'available': bool(raw.get('available', True)),
+        'service': raw.get('service'),
+        'staff': raw.get('staff'),
+    }
+
+
+class _Flight:
+    """การดึงข้อมูลที่กำลังทำอยู่ของหนึ่ง key ผู้เรียกคนอื่นรอ `done` แล้วใช้ผลเดียวกัน"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry: Optional[Dict[str, Any]] = None
+        self.error: Optional[Exception] = None
+
+
+class AvailabilityCache:
+    """cache ของ slot ต่อ (tenant, URL, ช่วงวัน) พร้อมรวมคำขอที่เกิดพร้อมกันเป็นการดึงครั้งเดียว (ใช้ได้จากหลาย thread)"""
+
+    def __init__(self, session: Optional[requests.Session] = None, ttl_s: float = BOOKING_CACHE_TTL_S, stale_s: float = BOOKING_STALE_S, timeout_s: float = BOOKING_TIMEOUT_S):
+        self.session = session or _session
+        self.ttl_s = ttl_s
+        self.stale_s = stale_s
+        self.timeout_s = timeout_s
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str, str, int], Dict[str, Any]] = {}
+        self._flights: Dict[Tuple[str, str, str, int], _Flight] = {}
+        self._failed_until: Dict[Tuple[str, str, str, int], float] = {}
+
+    def _fetch(self, url: str, start_day: datetime.date, days: int) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, params={'start': start_day.isoformat(), 'days': days}, timeout=self.timeout_s)
+            response.raise_for_status()
+            payload = response.json()
+        finally:
+            metrics.observe("booking.fetch_latency", time.perf_counter() - started)
+        raw_slots = payload.get('slots', []) if isinstance(payload, dict) else payload
+        if not isinstance(raw_slots, list):
+            raise ValueError("Booking system returned an unexpected payload")
+        slots = [slot for slot in (_parse_slot(raw) for raw in raw_slots) if slot]
+        return sorted(slots, key=lambda slot: slot['start'])
+
+    def get(self, tenant_id: str, url: str, start_day: datetime.date, days: int = BOOKING_WINDOW_DAYS) -> Dict[str, Any]:
+        """
+        คืน {'slots': [...], 'source': 'cache'|'fetched'|'coalesced'|'stale', 'fetched_at': monotonic}
+        raise เมื่อดึงไม่สำเร็จและไม่มีผลเก่าที่ใช้ได้
+        """
+        key = (tenant_id, url, start_day.isoformat(), days)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry['fetched_at'] < self.ttl_s:
+                metrics.increment("booking.lookups", result="cache")
+                return dict(entry, source='cache')
+            backing_off = self._failed_until.get(key, 0) > now
+            flight = None if backing_off else self._flights.get(key)
+            leader = flight is None and not backing_off
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if backing_off:
+            return self._stale_or_raise(key, ConnectionError("Booking system recently failed; not retrying yet"))
+        if not leader:
+            flight.done.wait(self.timeout_s + 1.0)
+            if flight.entry is not None:
+                metrics.increment("booking.lookups", result="coalesced")
+                return dict(flight.entry, source='coalesced')
+            return self._stale_or_raise(key, flight.error or TimeoutError("Booking lookup timed out"))
+
+        try:
+            slots = self._fetch(url, start_day, days)
+            flight.entry = {'slots': slots, 'fetched_at': time.monotonic()}
+            with self._lock:
+                # ลบผลที่เก่าเกินใช้ (เช่น ช่วงวันของเมื่อวาน) ไม่ให้ cache โตไปเรื่อยๆ
+                expired_before = flight.entry['fetched_at'] - self.ttl_s - self.stale_s
+                for old_key in [k for k, v in self._entries.items() if v['fetched_at'] < expired_before]:
+                    del self._entries[old_key]
+                self._entries[key] = flight.entry
+                self._failed_until.pop(key, None)
+            metrics.increment("booking.lookups", result="fetched")
+            return dict(flight.entry, source='fetched')
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self._failed_until[key] = time.monotonic() + BOOKING_RETRY_AFTER_S
+            metrics.increment("booking.fetch_failures")
+            print(f"⚠️ Booking: Could not fetch availability for tenant {tenant_id}: {e}")
+            return self._stale_or_raise(key, e)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _stale_or_raise(self, key, error: Exception) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry['fetched_at'] < self.ttl_s + self.stale_s:
+            metrics.increment("booking.lookups", result="stale")
+            return dict(entry, source='stale')
+        raise error
+
+
+# Private global variable to store the initialized cache
+_availability_cache_instance: Optional[AvailabilityCache] = None
+
+
+def get_availability_cache() -> AvailabilityCache:
+    global _availability_cache_instance
+    if _availability_cache_instance is None:
+        _availability_cache_instance = AvailabilityCache()
+    return _availability_cache_instance
+
+
+def set_availability_cache(cache: Optional[AvailabilityCache]) -> None:
+    """Replaces the active cache (used by benchmarks and tests)."""
+    global _availability_cache_instance
+    _availability_cache_instance = cache
+
+
+def get_availability(tenant_id: str, config: Dict[str, Any], days: int = BOOKING_WINDOW_DAYS) -> Dict[str, Any]:
+    """slot ที่ยังว่างและยังไม่ถึงเวลา ตั้งแต่วันนี้ไป `days` วัน (เวลาตาม BOOKING_TIMEZONE)"""
+    now = datetime.datetime.now(BOOKING_TIMEZONE)
+    url = config['bookingSystemIntegration'].strip()
+    result = get_availability_cache().get(tenant_id, url, now.date(), days)
+    open_slots = [slot for slot in result['slots'] if slot['available'] and slot['start'] > now]
+    return {'slots': open_slots, 'source': result['source']}
+
+
+def format_slots(slots: List[Dict[str, Any]], limit: int = BOOKING_MAX_SLOTS_IN_PROMPT) -> str:
+    """จัดกลุ่ม slot ตามวัน เช่น "- จ. 20 ต.ค.: 10:00-11:00, 13:30 (ตัดผม)" """
+    if not slots:
+        return f"ไม่มีคิวว่างในช่วง {BOOKING_WINDOW_DAYS} วันข้างหน้า"
+    by_day: Dict[datetime.date, List[str]] = {}
+    for slot in slots[:limit]:
+        start = slot['start']
+        label = start.strftime("%H:%M")
+        if slot.get('end'):
+            label += f"-{slot['end'].strftime('%H:%M')}"
+        extra = " / ".join(str(v) for v in (slot.get('service'), slot.get('staff')) if v)
+        if extra:
+            label += f" ({extra})"
+        by_day.setdefault(start.date(), []).append(label)
+    lines = [
+        f"- {_THAI_WEEKDAYS[day.weekday()]} {day.day} {_THAI_MONTHS[day.month - 1]}: {', '.join(labels)}"
+        for day, labels in by_day.items()
+    ]
+    if len(slots) > limit:
+        lines.append(f"(และอีก {len(slots) - limit} คิว)")
+    return "\n".join(lines)
+
+
+def availability_section(tenant_id: str, config: Dict[str, Any], user_input: str) -> str:
+    """ข้อความคิวว่างสำหรับ prompt ("" เมื่อไม่เกี่ยวข้อง) ความผิดพลาดไม่ทำให้การตอบล้ม"""
+    if not booking_enabled(config) or not wants_availability(user_input):
+        return ""
+    try:
+        return format_slots(get_availability(tenant_id, config)['slots'])
+    except Exception as e:
+        print(f"⚠️ Booking: Availability unavailable for tenant {tenant_id}: {e}")
+        return BOOKING_UNAVAILABLE_NOTE
@@ -0,0 +1,195 @@
+# app/services/broadcast.py
+"""
+Broadcast campaign: ส่งข้อความเดียวกันถึงผู้ใช้จำนวนมากของ tenant
+
+* LINE: แบ่งผู้รับเป็นชุดละไม่เกิน 500 คนแล้วส่งด้วย multicast ครั้งเดียวต่อชุด
+* Facebook: ไม่มี multicast จึงส่งทีละคนแบบขนานด้วย thread pool
+* ทั้งสองแบบจำกัดอัตราการเรียก API ด้วย rate limiter และบันทึก history ของผู้รับที่ส่งสำเร็จ
+  ด้วย `append_messages_bulk` ทีละชุด พร้อมอัปเดตความคืบหน้าลงเอกสาร campaign
+"""
+import datetime
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from . import analytics, metrics
+from .delivery import send_with_retry
+from .facebook_api import send_facebook_message
+from .line_api import LINE_MULTICAST_MAX_RECIPIENTS, multicast_line_message
+from .search import index_messages_bulk
+from .storage import get_storage
+
+LINE_BATCHES_PER_S = float(os.getenv("BROADCAST_LINE_BATCHES_PER_S", "10"))
+FACEBOOK_SENDS_PER_S = float(os.getenv("BROADCAST_FACEBOOK_SENDS_PER_S", "50"))
+FACEBOOK_CONCURRENCY = int(os.getenv("BROADCAST_FACEBOOK_CONCURRENCY", "16"))
+SEND_ATTEMPTS = int(os.getenv("BROADCAST_SEND_ATTEMPTS", "3"))
+# จำนวนผู้รับ Facebook ต่อรอบการบันทึก history/ความคืบหน้า
+FACEBOOK_CHUNK_SIZE = 200
+RECIPIENT_PAGE_SIZE = 500
+# รายชื่อผู้รับที่ระบุเองถูกเก็บในเอกสาร campaign (Firestore จำกัดเอกสารละ 1 MiB)
+# 10,000 ID ใช้ราว 400 KB ส่งถึงทุกคนให้ใช้ user_ids = None แทน
+BROADCAST_MAX_USER_IDS = 10000
+
+
+class RateLimiter:
+    """จำกัดจำนวนการเรียกต่อวินาที (ใช้ร่วมกันได้หลาย thread)"""
+
+    def __init__(self, rate_per_s: float):
+        self.interval = 1.0 / rate_per_s if rate_per_s > 0 else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _now_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _chunks(items: List[str], size: int) -> Iterator[List[str]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def create_campaign(tenant_id: str, message: str, platform: str, user_ids: Optional[List[str]], sender: Dict[str, Any]) -> str:
+    """บันทึก campaign ใหม่ในสถานะ 'queued' และคืนค่า campaign_id (การส่งจริงทำใน `run_campaign`)"""
+    if user_ids is not None and len(user_ids) > BROADCAST_MAX_USER_IDS:
+        raise ValueError(f"user_ids is limited to {BROADCAST_MAX_USER_IDS} recipients; omit it to send to everyone.")
+    return get_storage().create_campaign(tenant_id, {
+        'message': message,
+        'platform': platform,
+        'user_ids': user_ids,
+        'status': 'queued',
+        'total': len(user_ids) if user_ids is not None else None,
+        'sent': 0,
+        'failed': 0,
+        'created_at': _now_iso(),
+        'sender_id': sender.get('uid'),
+        'sender_name': sender.get('name', 'Admin'),
+    })
+
+
+def _resolve_recipients(tenant_id: str, platform: str) -> List[str]:
+    """
+    รวบรวม user_id ทั้งหมดของ tenant บน platform ที่ระบุ อ่านทีละหน้าเฉพาะฟิลด์ `platform`
+    เรียงตาม user_id เพื่อไม่ข้าม/ซ้ำแชทที่มีข้อความใหม่ระหว่างไล่ และครอบคลุมแชทที่ไม่มี lastMessageTime
+    """
+    storage = get_storage()
+    recipients: List[str] = []
+    cursor = None
+    while True:
+        page = storage.list_conversations(
+            tenant_id, limit=RECIPIENT_PAGE_SIZE, start_after=cursor, order_by_id=True, fields=['platform']
+        )
+        recipients.extend(c['user_id'] for c in page if c.get('platform') == platform)
+        if len(page) < RECIPIENT_PAGE_SIZE:
+            return recipients
+        cursor = page[-1]['user_id']
+
+
+def _history_entry(campaign_id: str, campaign: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "role": "model",
+        "parts": [{"text": campaign['message']}],
+        "timestamp": _now_iso(),
+        "sender_type": "admin",
+        "sender_id": campaign.get('sender_id'),
+        "sender_name": campaign.get('sender_name'),
+        "campaign_id": campaign_id,
+    }
+
+
+def _record_progress(tenant_id: str, campaign_id: str, campaign: Dict[str, Any], delivered: List[str], failed_count: int, last_error: Optional[str]) -> None:
+    storage = get_storage()
+    if delivered:
+        entry = _history_entry(campaign_id, campaign)
+        messages_by_user = {user_id: [entry] for user_id in delivered}
+        storage.append_messages_bulk(tenant_id, messages_by_user)
+        index_messages_bulk(tenant_id, messages_by_user)
+        analytics.record_messages_bulk(tenant_id, messages_by_user)
+    campaign['sent'] += len(delivered)
+    campaign['failed'] += failed_count
+    progress = {'sent': campaign['sent'], 'failed': campaign['failed'], 'updated_at': _now_iso()}
+    if last_error:
+        progress['last_error'] = last_error
+    storage.update_campaign(tenant_id, campaign_id, progress)
+    metrics.increment("broadcast.sent", len(delivered), platform=campaign['platform'])
+    metrics.increment("broadcast.failed", failed_count, platform=campaign['platform'])
+
+
+def _run_line(tenant_id: str, campaign_id: str, campaign: Dict[str, Any], recipients: List[str], access_token: str) -> None:
+    limiter = RateLimiter(LINE_BATCHES_PER_S)
+    for batch in _chunks(recipients, LINE_MULTICAST_MAX_RECIPIENTS):
+        limiter.wait()
+        # retry key เดียวกันทุกครั้งที่ลองซ้ำ ทำให้ LINE ไม่ส่งชุดเดิมซ้ำ
+        retry_key = str(uuid.uuid4())
+        result = send_with_retry(lambda: multicast_line_message(batch, campaign['message'], access_token, retry_key=retry_key), SEND_ATTEMPTS)
+        if result.get("status") == "ok":
+            _record_progress(tenant_id, campaign_id, campaign, batch, 0, None)
+        else:
+            _record_progress(tenant_id, campaign_id, campaign, [], len(batch), result.get("message"))
+
+
+def _run_facebook(tenant_id: str, campaign_id: str, campaign: Dict[str, Any], recipients: List[str], access_token: str) -> None:
+    limiter = RateLimiter(FACEBOOK_SENDS_PER_S)
+
+    def send_one(user_id: str) -> Dict[str, Any]:
+        def attempt():
+            limiter.wait()
+            return send_facebook_message(user_id, campaign['message'], access_token)
+        return send_with_retry(attempt, SEND_ATTEMPTS)
+
+    with ThreadPoolExecutor(max_workers=FACEBOOK_CONCURRENCY) as executor:
+        for chunk in _chunks(recipients, FACEBOOK_CHUNK_SIZE):
+            results = list(executor.map(send_one, chunk))
+            delivered = [user_id for user_id, result in zip(chunk, results) if result.get("status") == "ok"]
+            errors = [result.get("message") for result in results if result.get("status") != "ok"]
+            _record_progress(tenant_id, campaign_id, campaign, delivered, len(errors), errors[-1] if errors else None)
+
+
+def run_campaign(tenant_id: str, campaign_id: str) -> None:
+    """ส่ง campaign จนเสร็จ (เรียกผ่าน BackgroundTasks ซึ่งรันใน threadpool)"""
+    storage = get_storage()
+    campaign = storage.get_campaign(tenant_id, campaign_id)
+    if not campaign:
+        print(f"❌ Broadcast: Campaign {campaign_id} not found for tenant {tenant_id}.")
+        return
+
+    started = time.time()
+    try:
+        platform = campaign['platform']
+        tenant_config = storage.get_tenant(tenant_id) or {}
+        access_token = tenant_config.get('lineAccessToken') if platform == "line" else tenant_config.get('facebookPageToken')
+        if not access_token:
+            storage.update_campaign(tenant_id, campaign_id, {'status': 'failed', 'last_error': f"Missing {platform} access token"})
+            return
+
+        recipients = list(dict.fromkeys(campaign.get('user_ids') or _resolve_recipients(tenant_id, platform)))
+        campaign.update(sent=0, failed=0)
+        storage.update_campaign(tenant_id, campaign_id, {'status': 'running', 'total': len(recipients), 'started_at': _now_iso()})
+        print(f"📣 Broadcast: Campaign {campaign_id} sending to {len(recipients)} {platform} users.")
+
+        if platform == "line":
+            _run_line(tenant_id, campaign_id, campaign, recipients, access_token)
+        else:
+            _run_facebook(tenant_id, campaign_id, campaign, recipients, access_token)
+
+        storage.update_campaign(tenant_id, campaign_id, {
+            'status': 'completed' if campaign['failed'] == 0 else 'completed_with_errors',
+            'finished_at': _now_iso(),
+        })
+        metrics.observe("broadcast.duration", time.time() - started, platform=platform)
+        print(f"✅ Broadcast: Campaign {campaign_id} finished in {time.time() - started:.1f}s "
+              f"({campaign['sent']} sent, {campaign['failed']} failed).")
+    except Exception as e:
+        print(f"❌ Broadcast: Campaign {campaign_id} failed: {e}")
+        storage.update_campaign(tenant_id, campaign_id, {'status': 'failed', 'last_error': str(e), 'finished_at': _now_iso()})
@@ -0,0 +1,365 @@
+# app/services/catalog.py
+"""
+แคตตาล็อกสินค้าแบบมีโครงสร้าง สำหรับ tenant ที่ขายสินค้าหลายรายการ (`businessType` = physical_products_multi)
+
+* นำเข้าเป็นชุดจาก CSV หรือ JSON และเก็บเป็นรายการสินค้าแยกตาม sku ใน storage
+* index ในหน่วยความจำต่อ tenant (สร้างใหม่เมื่อ `catalogVersion` ของ tenant เปลี่ยน) ประกอบด้วย
+  term ของชื่อ/หมวด/รายละเอียด, หมวดหมู่, ไซส์, สี และราคาที่เรียงไว้สำหรับค้นช่วงราคา
+* get_bot_response ใส่เฉพาะสินค้าที่ตรงกับคำถามมากที่สุด k รายการลงใน prompt
+  แทนการยัดแคตตาล็อกทั้งหมดลงใน knowledgeBase
+"""
+import bisect
+import csv
+import datetime
+import io
+import json
+import math
+import os
+import re
+import threading
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from . import metrics
+from .search import tokenize
+from .storage import get_storage
+
+CATALOG_TOP_K = int(os.getenv("CATALOG_TOP_K", "8"))
+CATALOG_MAX_PRODUCTS = 50000
+CATALOG_FORMATS = ("csv", "json")
+CATALOG_BUSINESS_TYPE = "physical_products_multi"
+
+# ชื่อคอลัมน์ที่รองรับ (ไทย/อังกฤษ) -> ฟิลด์มาตรฐาน คอลัมน์อื่นเก็บไว้ใน `attributes`
+_COLUMN_ALIASES = {
+    'sku': 'sku', 'id': 'sku', 'รหัส': 'sku', 'รหัสสินค้า': 'sku',
+    'name': 'name', 'title': 'name', 'ชื่อ': 'name', 'ชื่อสินค้า': 'name',
+    'category': 'category', 'หมวด': 'category', 'หมวดหมู่': 'category',
+    'price': 'price', 'ราคา': 'price',
+    'size': 'sizes', 'sizes': 'sizes', 'ไซส์': 'sizes', 'ขนาด': 'sizes',
+    'color': 'colors', 'colors': 'colors', 'colour': 'colors', 'colours': 'colors', 'สี': 'colors',
+    'description': 'description', 'detail': 'description', 'details': 'description', 'รายละเอียด': 'description',
+    'in_stock': 'in_stock', 'stock': 'in_stock', 'available': 'in_stock', 'คงเหลือ': 'in_stock',
+}
+_LIST_SEPARATOR = re.compile(r"\s*[|,/;]\s*")
+_NUMBER = r"(\d[\d,]*(?:\.\d+)?)"
+
+# ชื่อสีไทยกับอังกฤษให้เป็นค่าเดียวกัน ("สีดำ", "ดำ", "Black" -> black)
+_COLOR_SYNONYMS = {
+    'ดำ': 'black', 'ขาว': 'white', 'แดง': 'red', 'น้ำเงิน': 'blue', 'กรมท่า': 'navy', 'ฟ้า': 'light blue',
+    'เขียว': 'green', 'เหลือง': 'yellow', 'ชมพู': 'pink', 'เทา': 'gray', 'grey': 'gray', 'น้ำตาล': 'brown',
+    'ม่วง': 'purple', 'ส้ม': 'orange', 'ครีม': 'cream', 'เบจ': 'beige', 'ทอง': 'gold', 'เงิน': 'silver',
+}
+_PRICE_RANGE = re.compile(_NUMBER + r"\s*(?:-|–|ถึง|to)\s*" + _NUMBER)
+_PRICE_MAX = re.compile(r"(?:ไม่เกิน|ไม่ถึง|ต่ำกว่า|น้อยกว่า|งบ|under|below|less than|max)\s*" + _NUMBER, re.IGNORECASE)
+_PRICE_MIN = re.compile(r"(?:มากกว่า|เกิน|ตั้งแต่|over|above|more than|min)\s*" + _NUMBER + r"|" + _NUMBER + r"\s*(?:บาท)?\s*ขึ้นไป", re.IGNORECASE)
+
+# น้ำหนักของ term ตามฟิลด์ที่พบ
+_FIELD_WEIGHTS = (('sku', 3.0), ('name', 3.0), ('category', 2.0), ('description', 1.0))
+# สีที่ถามเป็นคะแนนเพิ่ม (ไม่ใช่ตัวกรอง) เทียบเท่า term ที่พบในหมวดหมู่
+_COLOR_WEIGHT = 2.0
+# ตัวอักษรที่ชื่อสีต้องไม่ติดอยู่ (ภาษาไทยไม่เว้นวรรค "ครีมกันแดด"/"ไฟฟ้า" จึงไม่ใช่สีครีม/สีฟ้า)
+_WORD_LETTERS = "a-z\u0e00-\u0e7f"
+
+
+def _now_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _number(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r"[,\s฿]|บาท", "", str(value))
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    items = value if isinstance(value, list) else _LIST_SEPARATOR.split(str(value))
+    return [str(item).strip() for item in items if str(item).strip()]
+
+
+def _color_key(color: str) -> str:
+    key = color.strip().lower()
+    if key.startswith("สี"):
+        key = key[len("สี"):]
+    return _COLOR_SYNONYMS.get(key, key)
+
+
+def _in_stock(value: Any) -> bool:
+    if value is None or value == "":
+        return True
+    if isinstance(value, bool):
+        return value
+    number = _number(value)
+    if number is not None:
+        return number > 0
+    return str(value).strip().lower() not in ("false", "no", "0", "หมด", "ไม่มี", "out of stock")
+
+
+def normalize_product(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """แปลงแถวจาก CSV/JSON เป็นรายการสินค้ามาตรฐาน (ValueError หากไม่มีชื่อหรือราคาไม่ถูกต้อง)"""
+    product: Dict[str, Any] = {'attributes': {}}
+    for key, value in raw.items():
+        if key is None:
+            continue
+        field = _COLUMN_ALIASES.get(str(key).strip().lower())
+        if field:
+            product[field] = value
+        elif value not in (None, ""):
+            product['attributes'][str(key).strip()] = str(value).strip()
+
+    name = str(product.get('name') or "").strip()
+    if not name:
+        raise ValueError("missing product name")
+    price = _number(product.get('price'))
+    if product.get('price') not in (None, "") and price is None:
+        raise ValueError(f"invalid price '{product.get('price')}'")
+    return {
+        'sku': str(product.get('sku') or "").strip() or name,
+        'name': name,
+        'category': str(product.get('category') or "").strip(),
+        'price': price,
+        'sizes': _as_list(product.get('sizes')),
+        'colors': _as_list(product.get('colors')),
+        'description': str(product.get('description') or "").strip(),
+        'in_stock': _in_stock(product.get('in_stock')),
+        'attributes': product['attributes'],
+    }
+
+
+def parse_catalog(data: bytes, fmt: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """แปลงไฟล์นำเข้าเป็น (สินค้า, ข้อผิดพลาดรายแถว) sku ซ้ำใช้แถวหลังสุด"""
+    text = data.decode('utf-8-sig')
+    if fmt == "csv":
+        rows: List[Any] = list(csv.DictReader(io.StringIO(text)))
+    else:
+        parsed = json.loads(text)
+        rows = parsed.get('products', []) if isinstance(parsed, dict) else parsed
+        if not isinstance(rows, list):
+            raise ValueError("JSON catalog must be a list of products or {\"products\": [...]}")
+    if len(rows) > CATALOG_MAX_PRODUCTS:
+        raise ValueError(f"catalog has {len(rows)} rows (max {CATALOG_MAX_PRODUCTS})")
+
+    products: Dict[str, Dict[str, Any]] = {}
+    errors: List[Dict[str, Any]] = []
+    for row_number, row in enumerate(rows, start=1):
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("row is not an object")
+            product = normalize_product(row)
+            products[product['sku']] = product
+        except ValueError as e:
+            errors.append({'row': row_number, 'error': str(e)})
+    return list(products.values()), errors
+
+
+class ProductIndex:
+    """index ในหน่วยความจำของแคตตาล็อกหนึ่งเวอร์ชัน (อ่านอย่างเดียวหลังสร้าง จึงใช้จากหลาย thread ได้)"""
+
+    def __init__(self, products: List[Dict[str, Any]], version: Optional[str] = None):
+        self.version = version
+        self.products = products
+        self._terms: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self._categories: Dict[str, Set[int]] = defaultdict(set)
+        self._sizes: Dict[str, Set[int]] = defaultdict(set)
+        self._colors: Dict[str, Set[int]] = defaultdict(set)
+        priced = []
+        for pid, product in enumerate(products):
+            for field, weight in _FIELD_WEIGHTS:
+                for term in set(tokenize(product.get(field) or "")):
+                    self._terms[term][pid] = max(self._terms[term].get(pid, 0.0), weight)
+            for value in product.get('attributes', {}).values():
+                for term in set(tokenize(value)):
+                    self._terms[term].setdefault(pid, 1.0)
+            if product.get('category'):
+                self._categories[product['category'].lower()].add(pid)
+            for size in product.get('sizes') or []:
+                self._sizes[size.lower()].add(pid)
+            for color in product.get('colors') or []:
+                self._colors[_color_key(color)].add(pid)
+            if product.get('price') is not None:
+                priced.append((product['price'], pid))
+        priced.sort()
+        self._price_values = [price for price, _ in priced]
+        self._price_ids = [pid for _, pid in priced]
+        # คำที่ใช้ค้นหาสีในคำถาม รวมสีที่ไม่มีในแคตตาล็อก ชื่อสีต้องตามหลัง "สี" หรือไม่ติดกับตัวอักษรอื่น
+        # เรียงคำยาวก่อน เพื่อให้ "น้ำเงิน" ไม่ถูกนับเป็น "เงิน" ด้วย
+        self._color_words = dict(_COLOR_SYNONYMS)
+        self._color_words.update({key: key for key in list(_COLOR_SYNONYMS.values()) + list(self._colors)})
+        alternatives = "|".join(re.escape(word) for word in sorted(self._color_words, key=len, reverse=True))
+        self._color_pattern = re.compile(
+            rf"สี\s*({alternatives})|(?<![{_WORD_LETTERS}])({alternatives})(?![{_WORD_LETTERS}])"
+        )
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def parse_query(self, text: str) -> Dict[str, Any]:
+        """แยกเงื่อนไข (ช่วงราคา, ไซส์, สี, หมวดหมู่) ออกจากคำถาม ส่วนที่เหลือใช้ค้นแบบ term"""
+        lowered = text.lower()
+        query: Dict[str, Any] = {'min_price': None, 'max_price': None, 'sizes': set(), 'colors': set(), 'categories': set()}
+
+        match = _PRICE_RANGE.search(lowered)
+        if match:
+            low, high = sorted((_number(match.group(1)), _number(match.group(2))))
+            query['min_price'], query['max_price'] = low, high
+            lowered = lowered.replace(match.group(0), " ")
+        match = _PRICE_MAX.search(lowered)
+        if match:
+            query['max_price'] = _number(match.group(1))
+            lowered = lowered.replace(match.group(0), " ")
+        match = _PRICE_MIN.search(lowered)
+        if match:
+            query['min_price'] = _number(match.group(1) or match.group(2))
+            lowered = lowered.replace(match.group(0), " ")
+
+        for size in self._sizes:
+            if re.search(rf"(?<![a-z0-9]){re.escape(size)}(?![a-z0-9])", lowered):
+                query['sizes'].add(size)
+
+        def take_color(match: re.Match) -> str:
+            query['colors'].add(self._color_words[match.group(1) or match.group(2)])
+            return " "
+
+        lowered = self._color_pattern.sub(take_color, lowered)
+        for category in self._categories:
+            if category in lowered:
+                query['categories'].add(category)
+        query['terms'] = set(tokenize(lowered))
+        return query
+
+    def _price_ids_between(self, low: Optional[float], high: Optional[float]) -> Set[int]:
+        start = 0 if low is None else bisect.bisect_left(self._price_values, low)
+        end = len(self._price_values) if high is None else bisect.bisect_right(self._price_values, high)
+        return set(self._price_ids[start:end])
+
+    def search(self, text: str, k: int = CATALOG_TOP_K) -> Dict[str, Any]:
+        """
+        คืน {'products': [...], 'filtered': bool}
+        เงื่อนไขราคา/ไซส์/หมวดหมู่เป็นตัวกรองบังคับ ส่วน term และสีใช้จัดอันดับ
+        (ถามสีที่ไม่มีจึงยังได้สินค้าที่ชื่อตรง ซึ่ง prompt แสดงสีที่มีจริงไว้ให้)
+        `filtered` เป็น True เมื่อคำถามมีเงื่อนไขหรือสี (ผลว่างจึงแปลว่า "ไม่มีสินค้าที่ตรง")
+        """
+        query = self.parse_query(text)
+        candidates: Optional[Set[int]] = None
+        filters = []
+        if query['min_price'] is not None or query['max_price'] is not None:
+            filters.append(self._price_ids_between(query['min_price'], query['max_price']))
+        for field, index in (('sizes', self._sizes), ('categories', self._categories)):
+            if query[field]:
+                filters.append(set().union(*(index.get(value, set()) for value in query[field])))
+        for ids in filters:
+            candidates = ids if candidates is None else candidates & ids
+
+        scores: Dict[int, float] = defaultdict(float)
+        total = max(len(self.products), 1)
+        for term in query['terms']:
+            postings = self._terms.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + total / len(postings))
+            for pid, weight in postings.items():
+                if candidates is None or pid in candidates:
+                    scores[pid] += weight * idf
+        if query['colors']:
+            colored = set().union(*(self._colors.get(color, set()) for color in query['colors']))
+            if colored:
+                idf = math.log(1 + total / len(colored))
+                for pid in colored:
+                    if candidates is None or pid in candidates:
+                        scores[pid] += _COLOR_WEIGHT * idf
+
+        if candidates is not None:
+            ranked = sorted(candidates, key=lambda pid: (-scores.get(pid, 0.0), not self.products[pid]['in_stock'], self.products[pid].get('price') or 0))
+        else:
+            ranked = sorted(scores, key=lambda pid: (-scores[pid], not self.products[pid]['in_stock']))
+        return {'products': [self.products[pid] for pid in ranked[:k]], 'filtered': bool(filters or query['colors'])}
+
+
+_index_lock = threading.Lock()
+_indexes: Dict[str, ProductIndex] = {}
+
+
+def catalog_enabled(config: Dict[str, Any]) -> bool:
+    return (
+        config.get('businessType') == CATALOG_BUSINESS_TYPE
+        and bool(config.get('productRecommendationEnabled'))
+        and bool(config.get('catalogVersion'))
+    )
+
+
+def get_product_index(tenant_id: str, version: Optional[str]) -> ProductIndex:
+    """index ของ tenant ที่ตรงกับ `version` (โหลดจาก storage ใหม่เมื่อแคตตาล็อกถูกนำเข้าใหม่)"""
+    index = _indexes.get(tenant_id)
+    if index is not None and index.version == version:
+        return index
+    with _index_lock:
+        index = _indexes.get(tenant_id)
+        if index is None or index.version != version:
+            products = get_storage().list_products(tenant_id)
+            index = _indexes[tenant_id] = ProductIndex(products, version)
+            print(f"🛍️ Catalog: Indexed {len(index)} products for tenant {tenant_id} (version {version}).")
+    return index
+
+
+def search_products(tenant_id: str, config: Dict[str, Any], text: str, k: int = CATALOG_TOP_K) -> Dict[str, Any]:
+    """ค้นสินค้าสำหรับ prompt ความผิดพลาดไม่ทำให้การตอบล้ม (คืนผลว่าง)"""
+    try:
+        result = get_product_index(tenant_id, config.get('catalogVersion')).search(text, k)
+        metrics.increment("catalog.searches", hit=bool(result['products']))
+        return result
+    except Exception as e:
+        print(f"⚠️ Catalog: Search failed for tenant {tenant_id}: {e}")
+        return {'products': [], 'filtered': False}
+
+
+def format_products(result: Dict[str, Any]) -> str:
+    """แสดงสินค้าแบบกระชับบรรทัดละรายการสำหรับใส่ใน prompt"""
+    if not result['products']:
+        return "ไม่มีสินค้าที่ตรงกับเงื่อนไขที่ลูกค้าถาม" if result['filtered'] else ""
+    lines = []
+    for product in result['products']:
+        details = [f"[{product['sku']}] {product['name']}"]
+        if product.get('category'):
+            details.append(f"หมวด: {product['category']}")
+        if product.get('price') is not None:
+            details.append(f"ราคา: {product['price']:,.0f} บาท")
+        if product.get('sizes'):
+            details.append(f"ไซส์: {'/'.join(product['sizes'])}")
+        if product.get('colors'):
+            details.append(f"สี: {'/'.join(product['colors'])}")
+        if not product.get('in_stock', True):
+            details.append("สินค้าหมด")
+        details.extend(f"{key}: {value}" for key, value in (product.get('attributes') or {}).items())
+        if product.get('description'):
+            details.append(product['description'])
+        lines.append("- " + " | ".join(details))
+    return "\n".join(lines)
+
+
+def import_catalog(tenant_id: str, products: List[Dict[str, Any]], replace: bool = False) -> Dict[str, Any]:
+    """
+    บันทึกสินค้าที่นำเข้า (replace=True ลบสินค้าที่ไม่อยู่ในไฟล์นี้ออก) แล้วเปลี่ยน `catalogVersion`
+    เพื่อให้ทุก instance สร้าง index ใหม่
+    """
+    storage = get_storage()
+    existing = {product['sku'] for product in storage.list_products(tenant_id)}
+    storage.upsert_products(tenant_id, products)
+    imported = {product['sku'] for product in products}
+    removed = sorted(existing - imported) if replace else []
+    if removed:
+        storage.delete_products(tenant_id, removed)
+    total = len((existing | imported) - set(removed))
+    version = uuid.uuid4().hex[:12]
+    storage.update_tenant(tenant_id, {'catalogVersion': version, 'catalogProductCount': total, 'catalogUpdatedAt': _now_iso()})
+    with _index_lock:
+        _indexes.pop(tenant_id, None)
+    print(f"🛍️ Catalog: Imported {len(products)} products for tenant {tenant_id} ({len(removed)} removed, {total} total).")
+    return {'imported': len(products), 'deleted': len(removed), 'total': total, 'version': version}
@@ -1,19 +1,34 @@
 # app/services/chatbot_logic.py
-import re
+import time
 from typing import List, Dict, Any, Optional
-from google.generativeai.types import content_types
 import datetime
-from firebase_admin import firestore # ✨ เพิ่ม import ที่จำเป็น
 
-# ✨ ย้าย `db` มา import จาก `firebase_utils` ที่เดียวกับ `firestore` เพื่อความสอดคล้องกัน
-from ..services.firebase_utils import db
-from ..config.settings import get_gemini_end_user_model, get_openai_client
+from ..models.conversation import Conversation, gemini_content
+from ..services.storage import get_storage
+from ..services.archive import archive_history, summary_checkpoint
+from ..services import analytics, booking, catalog, kb_retrieval, load_shedder, model_router, usage, work_queue
+from ..services.context_cache import CONTEXT_CACHE_TIERS, get_context_cache
+from ..services.search import index_messages
+from ..config.settings import get_gemini_tier_model, get_openai_client
 from ..prompts.summarization_prompt import SUMMARIZATION_PROMPT
 
 # Constants for conversational summarization
 SUMMARIZATION_THRESHOLD = 10
 RECENT_MESSAGES_TO_KEEP = 4
 
+# ฟิลด์ที่ถูกแก้ด้วยการเขียนเฉพาะจุด (เช่น mark-as-read) จึงไม่เขียนทับจาก snapshot ตอนบันทึกรอบสุดท้าย
+SERVER_MANAGED_FIELDS = ('unread_count', 'admin_last_seen_timestamp')
+# ฟิลด์ของ conversation ที่ get_bot_response เปลี่ยนในแต่ละรอบ (บันทึกพร้อมกับการต่อท้ายข้อความ)
+CONVERSATION_TURN_FIELDS = ('summary', 'summary_checkpoint', 'lastMessageTime', 'displayName', 'platform')
+
+
+def _count_inbound_message(storage, tenant_id: str, user_id: str) -> None:
+    """เพิ่มตัวนับข้อความที่แอดมินยังไม่ได้อ่าน (ความล้มเหลวไม่กระทบการตอบลูกค้า)"""
+    try:
+        storage.increment_unread(tenant_id, user_id)
+    except Exception as e:
+        print(f"⚠️ Could not update unread counter for {user_id}: {e}")
+
 
 # ✨ 1. สร้างฟังก์ชันกลางสำหรับสร้าง Log ของ Error
 def create_error_log_entry(user_input: str, error_message: str, failure_type: str) -> dict:
@@ -23,7 +38,7 @@ def create_error_log_entry(user_input: str, error_message: str, failure_type: st
     print(f"INFO: Creating error log entry. Type: '{failure_type}', Details: {error_message}")
 
     # กำหนดสถานะของข้อความตามประเภทของความล้มเหลว
-    status = 'requires_manual_reply' if failure_type in ['full_fallback_failed', 'core_logic_error', 'initialization_error'] else 'requires_review'
+    status = 'requires_manual_reply' if failure_type in ['full_fallback_failed', 'core_logic_error', 'initialization_error', 'overloaded'] else 'requires_review'
 
     # สร้างและ return Dictionary ของข้อความที่มีปัญหา
     error_entry = {
@@ -38,35 +53,128 @@ def create_error_log_entry(user_input: str, error_message: str, failure_type: st
 
 
 # ✨ 2. นี่คือฟังก์ชัน get_bot_response ทั้งหมดที่ถูกปรับปรุงใหม่
+def _reply_later(storage, tenant_id: str, user_id: str, user_input: str, config: Dict[str, Any], last_message_time: Optional[str]) -> str:
+    """ระบบรับงานไม่ไหว: ตอบข้อความสำเร็จรูปทันทีและทำเครื่องหมายข้อความให้แอดมินตอบเอง (ไม่เรียก LLM)"""
+    reply_msg = model_router.overload_reply(config)
+    new_messages = [
+        create_error_log_entry(user_input, "Bot is overloaded; reply deferred to an admin.", "overloaded"),
+        {
+            'role': 'model',
+            'parts': [{'text': reply_msg}],
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'route': 'overload'
+        },
+    ]
+    try:
+        storage.append_messages(tenant_id, user_id, new_messages, {
+            'lastMessageTime': last_message_time or datetime.datetime.now(datetime.timezone.utc).isoformat()
+        })
+        _count_inbound_message(storage, tenant_id, user_id)
+        index_messages(tenant_id, user_id, new_messages)
+        analytics.record_messages(tenant_id, new_messages)
+        work_queue.enqueue_flagged(tenant_id, user_id, new_messages)
+    except Exception as e:
+        print(f"❌ Tenant {tenant_id}: Could not save deferred message for {user_id}: {e}")
+    print(f"🚦 Tenant {tenant_id}: Overloaded, sent canned reply to {user_id} (requires manual reply).")
+    return reply_msg
+
+
+def _reply_canned(
+    storage,
+    tenant_id: str,
+    user_id: str,
+    user_input: str,
+    config: Dict[str, Any],
+    routing: Dict[str, str],
+    platform: str,
+    display_name: Optional[str],
+    last_message_time: Optional[str]
+) -> str:
+    """ตอบข้อความขอบคุณ/รับทราบด้วยข้อความสำเร็จรูป บันทึกแค่ข้อความใหม่ (summary จะตามทันในรอบถัดไป)"""
+    started = time.perf_counter()
+    reply_msg = model_router.canned_reply(config, user_input)
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    new_messages = [
+        {'role': 'user', 'parts': [{'text': user_input}], 'timestamp': now},
+        {'role': 'model', 'parts': [{'text': reply_msg}], 'timestamp': now, 'route': routing['route']},
+    ]
+    fields: Dict[str, Any] = {'lastMessageTime': last_message_time or now, 'platform': platform}
+    if display_name: fields['displayName'] = display_name
+    try:
+        storage.append_messages(tenant_id, user_id, new_messages, fields)
+        _count_inbound_message(storage, tenant_id, user_id)
+        index_messages(tenant_id, user_id, new_messages)
+        analytics.record_messages(tenant_id, new_messages)
+    except Exception as e:
+        print(f"❌ Tenant {tenant_id}: Could not save canned reply for {user_id}: {e}")
+    model_router.record(routing['route'], time.perf_counter() - started, reason=routing['reason'])
+    print(f"✅ Tenant {tenant_id}: Canned reply ({routing['reason']}) sent to {user_id}.")
+    return reply_msg
+
+
+def build_prompt_template(config: Dict[str, Any]) -> str:
+    """persona ของร้านพร้อมคำสั่งเรื่องน้ำเสียงและลักษณะการตอบตามการตั้งค่าของ tenant"""
+    behavioral_instructions = []
+    if config.get('is_detailed_response', False): behavioral_instructions.append("- จงตอบคำถามอย่างละเอียดและให้ข้อมูลครบถ้วน")
+    else: behavioral_instructions.append("- จงตอบคำถามให้สั้น กระชับ และตรงประเด็น")
+    if config.get('is_sweet_tone', False): behavioral_instructions.append("- จงใช้น้ำเสียงที่อ่อนหวาน สุภาพ และกล่าวชื่นชมลูกค้าตามความเหมาะสม")
+    else: behavioral_instructions.append("- สามารถสอดแทรกมุกตลกเล็กๆ น้อยๆ หรือใช้คำพูดที่ดูเท่ห์และทันสมัยได้")
+    if config.get('show_empathy', False): behavioral_instructions.append("- จงแสดงความใส่ใจในปัญหาของลูกค้า ถามไถ่ด้วยความเป็นห่วงเป็นใย")
+    if config.get('high_sales_drive', False): behavioral_instructions.append("- จงพยายามหาโอกาสในการปิดการขายอย่างสม่ำเสมอ เสนอสินค้าหรือบริการที่เกี่ยวข้องเพื่อกระตุ้นการตัดสินใจ")
+    else: behavioral_instructions.append("- จงเน้นการให้ข้อมูลที่เป็นประโยชน์และตอบคำถามให้ชัดเจน ไม่ต้องกดดันลูกค้าให้ซื้อสินค้า")
+    behavioral_prompt_section = "\n".join(behavioral_instructions)
+    base_persona = config.get('botPersona', "คุณคือผู้ช่วย AI")
+    return f"{base_persona}\n\n--- คำสั่งและลักษณะนิสัยเพิ่มเติม ---\n{behavioral_prompt_section}"
+
+
+def relevant_knowledge(tenant_id: str, knowledge_base: str, text: str, k: int = kb_retrieval.KB_TOP_K) -> List[str]:
+    """ส่วนของ knowledge base (แบ่งด้วย ###) ที่เกี่ยวข้องกับข้อความมากที่สุดไม่เกิน k ส่วน (ดู kb_retrieval)"""
+    return kb_retrieval.retrieve(tenant_id, knowledge_base, text, k)
+
+
 def get_bot_response(
     tenant_id: str,
     user_id: str,
     user_input: str,
     platform: str = "unknown",
     display_name: Optional[str] = None,
-    last_message_time: Optional[str] = None
+    last_message_time: Optional[str] = None,
+    load_level: Optional[int] = None
 ) -> str:
     """
     Generates a bot response using Gemini, with OpenAI fallback, and robust error logging.
+    Admission control decides how much work this response may do (see load_shedder).
+    Webhooks admit in the event loop and pass `load_level`; other callers are admitted here.
     """
-    end_user_model = get_gemini_end_user_model()
+    if load_level is not None:
+        return _generate_bot_response(tenant_id, user_id, user_input, platform, display_name, last_message_time, load_level)
+    with load_shedder.get_admission_controller().admit() as load_level:
+        return _generate_bot_response(tenant_id, user_id, user_input, platform, display_name, last_message_time, load_level)
+
+
+def _generate_bot_response(
+    tenant_id: str,
+    user_id: str,
+    user_input: str,
+    platform: str,
+    display_name: Optional[str],
+    last_message_time: Optional[str],
+    load_level: int
+) -> str:
     openai_client = get_openai_client()
-    history_ref = db.collection('chat_sessions').document(tenant_id).collection('users').document(user_id)
+    storage = get_storage()
     
     # ดึงข้อมูลการตั้งค่าและประวัติแชท
     try:
-        tenant_ref = db.collection('tenants').document(tenant_id)
-        tenant_data = tenant_ref.get()
-        if not tenant_data.exists:
+        config = storage.get_tenant(tenant_id)
+        if config is None:
             return "ขออภัยค่ะ ไม่พบข้อมูลผู้ให้บริการ"
-        config = tenant_data.to_dict()
 
-        history_doc = history_ref.get()
-        user_profile_data = history_doc.to_dict() if history_doc.exists else {}
-        history_data_from_db = user_profile_data.get('history', [])
+        user_profile_data = storage.get_conversation(tenant_id, user_id) or {}
+        conversation = Conversation(user_profile_data)
 
-        if history_data_from_db: # ตรวจสอบว่ามีประวัติแชทหรือไม่
-            last_message = history_data_from_db[-1]
+        if conversation.history: # ตรวจสอบว่ามีประวัติแชทหรือไม่
+            last_message = conversation.history[-1]
             if 'timestamp' in last_message:
                 try:
                     # แปลง ISO string ที่อาจมี 'Z' หรือ '+00:00' ให้ถูกต้อง
@@ -81,7 +189,7 @@ def get_bot_response(
                     
                     if hours_diff > 1:
                         print(f"INFO: Chat for user {user_id} is older than 1 hour. Forcing bot ON.")
-                        history_ref.set({'is_bot_active': True}, merge=True)
+                        storage.set_conversation(tenant_id, user_id, {'is_bot_active': True}, merge=True)
                         user_profile_data['is_bot_active'] = True
                 except (ValueError, TypeError) as e:
                     print(f"WARN: Could not parse timestamp '{last_message.get('timestamp')}' for user {user_id}. Error: {e}")
@@ -96,105 +204,145 @@ def get_bot_response(
                 'parts': [{'text': user_input}],
                 'timestamp': last_message_time or datetime.datetime.now(datetime.timezone.utc).isoformat()
             }
-            history_ref.set({'history': firestore.ArrayUnion([user_msg_for_history])}, merge=True)
+            storage.append_messages(tenant_id, user_id, [user_msg_for_history])
+            _count_inbound_message(storage, tenant_id, user_id)
+            index_messages(tenant_id, user_id, [user_msg_for_history])
+            analytics.record_messages(tenant_id, [user_msg_for_history])
             return ""
 
+        if load_level >= load_shedder.LEVEL_CANNED:
+            return _reply_later(storage, tenant_id, user_id, user_input, config, last_message_time)
+
+        # ข้อความขอบคุณ/รับทราบล้วนๆ: ตอบทันทีโดยไม่ต้องสรุป ค้น KB แคตตาล็อก หรือคิวว่าง
+        routing = model_router.canned_route(config, user_input)
+        if routing is not None:
+            return _reply_canned(storage, tenant_id, user_id, user_input, config, routing, platform, display_name, last_message_time)
+
         current_summary = user_profile_data.get('summary', "")
         
         # --- ส่วนของโค้ด Summarization ---
-        messages_to_summarize = [msg for msg in history_data_from_db if not msg.get('summarized', False)]
-        if len(messages_to_summarize) > SUMMARIZATION_THRESHOLD and end_user_model:
+        # summary ครอบคลุมถึง checkpoint แล้ว จึงดูเฉพาะข้อความหลัง checkpoint (ไม่ต้องไล่ทั้ง history)
+        checkpoint = summary_checkpoint(user_profile_data)
+        messages_to_summarize = conversation.window(checkpoint)
+        summarization_model = get_gemini_tier_model(model_router.SUMMARIZATION_TIER)
+        # ระบบโหลดสูง: เลื่อนการสรุปออกไป (ข้อความยังอยู่หลัง checkpoint จึงถูกสรุปในรอบถัดไป)
+        if load_level >= load_shedder.LEVEL_SKIP_SUMMARIZATION and len(messages_to_summarize) > SUMMARIZATION_THRESHOLD:
+            print(f"🚦 Tenant {tenant_id}: Summarization deferred (load level {load_shedder.LEVEL_NAMES[load_level]}).")
+        elif len(messages_to_summarize) > SUMMARIZATION_THRESHOLD and summarization_model:
             print(f"🔄 Tenant {tenant_id}: New messages exceed threshold. Attempting summarization...")
             try:
-                new_conversation_text = ""
-                for msg in messages_to_summarize:
-                    role = msg['role']
-                    text_parts = [part['text'] for part in msg['parts'] if 'text' in part]
-                    new_conversation_text += f"{role}: {' '.join(text_parts)}\n"
+                new_conversation_text = "".join(msg.summary_line() for msg in messages_to_summarize)
                 context_for_summarizer = f"PREVIOUS SUMMARY:\n{current_summary}\n\n---\n\nNEW MESSAGES TO ADD TO SUMMARY:\n{new_conversation_text}"
-                summarization_chat = end_user_model.start_chat(history=[])
+                summarization_chat = summarization_model.start_chat(history=[])
                 summary_response = summarization_chat.send_message(
                     SUMMARIZATION_PROMPT.format(conversation_history=context_for_summarizer)
                 )
+                usage.record_gemini_usage(tenant_id, summarization_model, summary_response, "summarization")
                 new_summary = summary_response.text
                 print(f"✅ Tenant {tenant_id}: Summarization successful.")
                 current_summary = new_summary
-                for msg in history_data_from_db:
-                    if not msg.get('summarized'):
-                        msg['summarized'] = True
-                print(f"✅ Tenant {tenant_id}: Marked {len(messages_to_summarize)} messages as summarized.")
+                checkpoint = len(conversation)
+                print(f"✅ Tenant {tenant_id}: Summary checkpoint advanced by {len(messages_to_summarize)} messages.")
             except Exception as sum_e:
                 # หากการสรุปล้มเหลว ให้สร้าง Log แต่ยังคงทำงานต่อไป
                 error_entry = create_error_log_entry(user_input, str(sum_e), "summarization_failed")
-                history_data_from_db.append(error_entry)
+                conversation.append(error_entry)
                 print(f"⚠️ Tenant {tenant_id}: Summarization failed but process continues.")
 
         # --- ส่วนของ Prompt Template ---
-        behavioral_instructions = []
-        if config.get('is_detailed_response', False): behavioral_instructions.append("- จงตอบคำถามอย่างละเอียดและให้ข้อมูลครบถ้วน")
-        else: behavioral_instructions.append("- จงตอบคำถามให้สั้น กระชับ และตรงประเด็น")
-        if config.get('is_sweet_tone', False): behavioral_instructions.append("- จงใช้น้ำเสียงที่อ่อนหวาน สุภาพ และกล่าวชื่นชมลูกค้าตามความเหมาะสม")
-        else: behavioral_instructions.append("- สามารถสอดแทรกมุกตลกเล็กๆ น้อยๆ หรือใช้คำพูดที่ดูเท่ห์และทันสมัยได้")
-        if config.get('show_empathy', False): behavioral_instructions.append("- จงแสดงความใส่ใจในปัญหาของลูกค้า ถามไถ่ด้วยความเป็นห่วงเป็นใย")
-        if config.get('high_sales_drive', False): behavioral_instructions.append("- จงพยายามหาโอกาสในการปิดการขายอย่างสม่ำเสมอ เสนอสินค้าหรือบริการที่เกี่ยวข้องเพื่อกระตุ้นการตัดสินใจ")
-        else: behavioral_instructions.append("- จงเน้นการให้ข้อมูลที่เป็นประโยชน์และตอบคำถามให้ชัดเจน ไม่ต้องกดดันลูกค้าให้ซื้อสินค้า")
-        behavioral_prompt_section = "\n".join(behavioral_instructions)
-        base_persona = config.get('botPersona', "คุณคือผู้ช่วย AI")
-        prompt_template = f"{base_persona}\n\n--- คำสั่งและลักษณะนิสัยเพิ่มเติม ---\n{behavioral_prompt_section}"
+        prompt_template = build_prompt_template(config)
         knowledge_base = config.get('knowledgeBase', "")
         
         # --- ส่วนเตรียม History สำหรับ Model ---
         chat_history_for_model = []
         if current_summary:
-            chat_history_for_model.append(content_types.to_content({'role': 'user', 'parts': [{'text': f"Summary of previous conversation:\n{current_summary}"}]}))
-            chat_history_for_model.append(content_types.to_content({'role': 'model', 'parts': [{'text': "OK, I understand the context."}]}))
+            chat_history_for_model.append(gemini_content('user', (f"Summary of previous conversation:\n{current_summary}",)))
+            chat_history_for_model.append(gemini_content('model', ("OK, I understand the context.",)))
         
-        clean_history = [{'role': item['role'], 'parts': item['parts']} for item in history_data_from_db[-RECENT_MESSAGES_TO_KEEP:] if item.get('status') is None]
-        chat_history_for_model.extend([content_types.to_content(item) for item in clean_history])
+        recent_to_keep = load_shedder.SHED_RECENT_MESSAGES if load_level >= load_shedder.LEVEL_SHRINK_CONTEXT else RECENT_MESSAGES_TO_KEEP
+        clean_history = list(conversation.recent(recent_to_keep).clean())
+        chat_history_for_model.extend(message.to_gemini() for message in clean_history)
 
-        keywords = re.split(r'\s+', user_input)
-        relevant_chunks = [chunk.strip() for chunk in knowledge_base.split('###') if any(kw in chunk for kw in keywords if len(kw) > 2)]
+        kb_top_k = load_shedder.SHED_MAX_KB_CHUNKS if load_level >= load_shedder.LEVEL_SHRINK_CONTEXT else kb_retrieval.KB_TOP_K
+        relevant_chunks = relevant_knowledge(tenant_id, knowledge_base, user_input, kb_top_k)
         retrieved_info = "\n\n".join(relevant_chunks) if relevant_chunks else "ไม่มีข้อมูลที่เกี่ยวข้องโดยตรง"
-        final_prompt = f"{prompt_template}\n\n--- ข้อมูลอ้างอิง ---\n{retrieved_info}\n\n--- คำถามล่าสุด ---\n{user_input}"
+        # ร้านที่มีแคตตาล็อก: ใส่เฉพาะสินค้าที่ตรงกับคำถามที่สุด k รายการ
+        dynamic_sections = ""
+        if catalog.catalog_enabled(config):
+            top_k = load_shedder.SHED_MAX_PRODUCTS if load_level >= load_shedder.LEVEL_SHRINK_CONTEXT else catalog.CATALOG_TOP_K
+            product_lines = catalog.format_products(catalog.search_products(tenant_id, config, user_input, top_k))
+            if product_lines:
+                dynamic_sections = f"\n\n--- สินค้าที่เกี่ยวข้อง ---\n{product_lines}"
+        # ร้านรับนัดที่เชื่อมระบบจอง: ใส่คิวว่างเมื่อคำถามเกี่ยวกับเวลา/การจอง
+        slot_lines = booking.availability_section(tenant_id, config, user_input)
+        if slot_lines:
+            dynamic_sections += f"\n\n--- คิวว่าง ---\n{slot_lines}"
+        final_prompt = f"{prompt_template}\n\n--- ข้อมูลอ้างอิง ---\n{retrieved_info}{dynamic_sections}\n\n--- คำถามล่าสุด ---\n{user_input}"
+
+        # เลือกระดับ model ตามความยากของข้อความ (ข้อความขอบคุณล้วนๆ ตอบได้โดยไม่เรียก LLM)
+        routing = model_router.choose_tier(config, user_input, len(relevant_chunks))
+        route = routing['route']
+        if load_level >= load_shedder.LEVEL_CHEAP_MODEL and route in ("standard", "strong"):
+            routing = {'route': 'lite', 'reason': 'load_shedding'}
+            route = 'lite'
 
     except Exception as e:
         print(f"❌ INITIALIZATION ERROR for tenant {tenant_id}, user {user_id}: {e}")
         error_entry = create_error_log_entry(user_input, str(e), "initialization_error")
         try:
-            history_ref.update({'history': firestore.ArrayUnion([error_entry])})
+            storage.append_messages(tenant_id, user_id, [error_entry])
+            _count_inbound_message(storage, tenant_id, user_id)
+            index_messages(tenant_id, user_id, [error_entry])
+            analytics.record_messages(tenant_id, [error_entry])
+            work_queue.enqueue_flagged(tenant_id, user_id, [error_entry], display_name, platform)
         except Exception as db_e:
             print(f"❌ CRITICAL DB ERROR during init: Could not log error. Reason: {db_e}")
         return "ขออภัยค่ะ ระบบขัดข้อง โปรดลองอีกครั้ง"
 
     # --- ส่วน Logic การสร้างคำตอบที่ปรับปรุงใหม่ ---
-    history_to_save = list(history_data_from_db)
     reply_msg = ""
     is_successful = False
+    used_fallback = False
 
+    generation_started = time.perf_counter()
     try:
-        if not end_user_model: raise Exception("Gemini model not available")
-        chat = end_user_model.start_chat(history=chat_history_for_model)
-        response = chat.send_message(final_prompt)
+        chat_model = get_gemini_tier_model(route)
+        if not chat_model: raise Exception("Gemini model not available")
+        prompt = final_prompt
+        if route in CONTEXT_CACHE_TIERS:
+            # KB ขนาดใหญ่: persona + KB ทั้งหมดอยู่ใน cache ของ provider แล้ว ส่งแค่คำถามล่าสุด
+            stable_prefix = f"{prompt_template}\n\n--- ข้อมูลอ้างอิง ---\n{knowledge_base}"
+            cached_model = get_context_cache().get_model(tenant_id, config, getattr(chat_model, 'model_name', route), stable_prefix)
+            if cached_model is not None:
+                chat_model = cached_model
+                prompt = f"{dynamic_sections.lstrip()}\n\n--- คำถามล่าสุด ---\n{user_input}".lstrip()
+        chat = chat_model.start_chat(history=chat_history_for_model)
+        response = chat.send_message(prompt)
+        usage.record_gemini_usage(tenant_id, chat_model, response, "chat")
         reply_msg = response.text
         is_successful = True
-        print(f"✅ Tenant {tenant_id}: Got response from Gemini.")
+        print(f"✅ Tenant {tenant_id}: Got response from Gemini ({route}, {routing['reason']}).")
+        model_router.record(route, time.perf_counter() - generation_started, reason=routing['reason'])
 
     except Exception as gemini_e:
+        model_router.record(route, time.perf_counter() - generation_started, ok=False, reason=routing['reason'])
         print(f"⚠️ Tenant {tenant_id}: Gemini failed ({gemini_e}). Attempting fallback to OpenAI...")
         try:
             if not openai_client: raise Exception("OpenAI client not available for fallback")
             openai_messages = []
             if current_summary: openai_messages.append({"role": "system", "content": f"Summary of previous conversation:\n{current_summary}"})
-            openai_messages.extend([{"role": "assistant" if item['role'] == 'model' else item['role'], "content": ' '.join([p['text'] for p in item['parts'] if 'text' in p])} for item in clean_history])
+            openai_messages.extend(message.to_openai() for message in clean_history)
             openai_messages.append({"role": "user", "content": final_prompt})
             completion = openai_client.chat.completions.create(model="gpt-3.5-turbo", messages=openai_messages)
+            usage.record_openai_usage(tenant_id, "gpt-3.5-turbo", completion, "chat_fallback")
             reply_msg = completion.choices[0].message.content
             is_successful = True
+            used_fallback = True
             print(f"✅ Tenant {tenant_id}: Got response from OpenAI fallback.")
         except Exception as openai_e:
             print(f"❌ Tenant {tenant_id}: OpenAI fallback also failed: {openai_e}")
             error_entry = create_error_log_entry(user_input, str(openai_e), "full_fallback_failed")
-            history_to_save.append(error_entry)
+            conversation.append(error_entry)
             reply_msg = "ขออภัยค่ะ ขณะนี้ระบบ AI ทั้งระบบหลักและระบบสำรองขัดข้อง โปรดลองอีกครั้งภายหลัง"
 
     # --- ส่วนสุดท้าย: การบันทึกข้อมูลลง DB เพียงครั้งเดียว ---
@@ -208,19 +356,41 @@ def get_bot_response(
             model_reply_for_history = {
                 'role': 'model',
                 'parts': [{'text': reply_msg}],
-                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat()
+                'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'route': route
             }
-            history_to_save.append(user_msg_for_history)
-            history_to_save.append(model_reply_for_history)
+            if used_fallback:
+                model_reply_for_history['fallback'] = True
+            conversation.append(user_msg_for_history)
+            conversation.append(model_reply_for_history)
         
-        user_profile_data['history'] = history_to_save
+        new_messages = conversation.new_messages()
         user_profile_data['summary'] = current_summary
+        user_profile_data['summary_checkpoint'] = user_profile_data.get('archived_message_count', 0) + checkpoint
         user_profile_data['lastMessageTime'] = last_message_time if last_message_time else datetime.datetime.now(datetime.timezone.utc).isoformat()
         if display_name: user_profile_data['displayName'] = display_name
         if 'platform' not in user_profile_data: user_profile_data['platform'] = platform
 
-        history_ref.set(user_profile_data)
-        print(f"✅ Tenant {tenant_id}: Final data saved to Firestore. Success: {is_successful}")
+        # ย้ายข้อความเก่าที่สรุปแล้วไป archive ในการเขียนครั้งเดียวกัน เพื่อให้เอกสาร conversation มีขนาดเล็ก
+        archived = 0
+        try:
+            archived = archive_history(tenant_id, user_id, user_profile_data)
+        except Exception as archive_e:
+            print(f"⚠️ Tenant {tenant_id}: History archival skipped: {archive_e}")
+
+        if archived:
+            # history ถูกตัดออก ต้องเขียน history ที่เหลือใหม่ทั้งหมด (เกิดเฉพาะรอบที่มีการ archive)
+            conversation_update = {k: v for k, v in user_profile_data.items() if k not in SERVER_MANAGED_FIELDS}
+            storage.set_conversation(tenant_id, user_id, conversation_update, merge=True)
+        else:
+            # รอบปกติ: ต่อท้ายเฉพาะข้อความใหม่ ไม่เขียนข้อความเก่าซ้ำ
+            conversation_fields = {field: user_profile_data[field] for field in CONVERSATION_TURN_FIELDS if field in user_profile_data}
+            storage.append_messages(tenant_id, user_id, new_messages, conversation_fields)
+        _count_inbound_message(storage, tenant_id, user_id)
+        index_messages(tenant_id, user_id, new_messages)
+        analytics.record_messages(tenant_id, new_messages)
+        work_queue.enqueue_flagged(tenant_id, user_id, new_messages, user_profile_data.get('displayName'), user_profile_data.get('platform'))
+        print(f"✅ Tenant {tenant_id}: Final data saved to storage ({storage.name}). Success: {is_successful}")
 
     except Exception as final_db_e:
         print(f"❌ CRITICAL FINAL SAVE ERROR for tenant {tenant_id}: {final_db_e}")
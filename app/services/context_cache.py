@@ -0,0 +1,210 @@
+# app/services/context_cache.py
+"""
+Context caching ฝั่ง provider สำหรับ tenant ที่มี knowledge base ขนาดใหญ่
+
+ส่วนต้นของ prompt ที่ไม่เปลี่ยนระหว่างข้อความ (persona, คำสั่งพฤติกรรม และ knowledge base ทั้งหมด)
+ถูกอัปโหลดเป็น cached content ของ Gemini ครั้งเดียวต่อเวอร์ชัน แล้วทุกการเรียกหลังจากนั้นอ้างอิง cache นั้น
+จึงส่งแค่ history + คำถามล่าสุด และ token ส่วนที่ cache ถูกคิดราคาถูกกว่าและประมวลผลเร็วกว่า
+
+* เวอร์ชันคือ hash ของ model + เนื้อหาส่วนต้น แก้ persona/KB เมื่อไรก็ได้ cache ใหม่อัตโนมัติ
+* handle ของ cache เก็บไว้ในเอกสาร tenant (`contextCaches`) ให้ทุก instance ใช้ cache เดียวกัน
+* ต่ออายุ (TTL) เมื่อใกล้หมดอายุ และลบ cache เก่าเมื่อ `invalidate` (เรียกจาก update_knowledge_base)
+* ใช้เฉพาะ KB ที่ใหญ่กว่า CONTEXT_CACHE_MIN_TOKENS เพราะ provider ไม่รับ cache ขนาดเล็ก
+"""
+import datetime
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from . import metrics
+from .storage import get_storage
+
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "32768"))
+CONTEXT_CACHE_TTL_S = int(os.getenv("CONTEXT_CACHE_TTL_S", "3600"))
+# ต่ออายุเมื่อเหลือเวลาน้อยกว่านี้ (ต้องมากกว่าเวลาที่ใช้ตอบหนึ่งข้อความ)
+CONTEXT_CACHE_RENEW_S = int(os.getenv("CONTEXT_CACHE_RENEW_S", "600"))
+# หลังสร้าง cache ไม่สำเร็จ จะไม่ลองใหม่ในช่วงนี้ เพื่อไม่ให้ทุกข้อความต้องรอ provider ปฏิเสธ
+CONTEXT_CACHE_RETRY_AFTER_S = 300
+# ระดับ model ที่ใช้ cache (แต่ละระดับต้องมี cache ของตัวเอง) ระดับ lite ส่งเฉพาะส่วนของ KB ที่เกี่ยวข้องอยู่แล้ว
+CONTEXT_CACHE_TIERS = tuple(t.strip() for t in os.getenv("CONTEXT_CACHE_TIERS", "standard,strong").split(",") if t.strip())
+
+
+def estimate_tokens(text: str) -> int:
+    # ประมาณคร่าวๆ (ภาษาไทยประมาณ 3 ตัวอักษรต่อ token) ใช้แค่ตัดสินว่าคุ้มที่จะ cache หรือไม่
+    return len(text) // 3
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _parse_time(value: Any) -> Optional[datetime.datetime]:
+    try:
+        return datetime.datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class GeminiContextCacheProvider:
+    """สร้าง/ต่ออายุ/ลบ cached content ผ่าน `google.generativeai.caching`"""
+
+    def create(self, model_name: str, system_instruction: str, ttl_s: int, display_name: str) -> Dict[str, Any]:
+        from google.generativeai import caching
+        cached = caching.CachedContent.create(
+            model=model_name,
+            display_name=display_name[:128],
+            system_instruction=system_instruction,
+            ttl=datetime.timedelta(seconds=ttl_s),
+        )
+        return {'name': cached.name, 'expire_time': cached.expire_time.isoformat()}
+
+    def renew(self, name: str, ttl_s: int) -> str:
+        from google.generativeai import caching
+        cached = caching.CachedContent.get(name)
+        cached.update(ttl=datetime.timedelta(seconds=ttl_s))
+        return cached.expire_time.isoformat()
+
+    def delete(self, name: str) -> None:
+        from google.generativeai import caching
+        caching.CachedContent.get(name).delete()
+
+    def model(self, name: str):
+        import google.generativeai as genai
+        from google.generativeai import caching
+        return genai.GenerativeModel.from_cached_content(caching.CachedContent.get(name))
+
+
+class ContextCacheManager:
+    """ดูแล cache หนึ่งชุดต่อ (tenant, model) และคืน model ที่ผูกกับ cache ให้ get_bot_response ใช้"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self._lock = threading.Lock()
+        self._models: Dict[str, Any] = {}
+        # entry ล่าสุดที่ instance นี้รู้จัก (config ของ request ที่อ่านไว้ก่อน cache ถูกสร้างอาจยังเป็นค่าเก่า)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._failed_until: Dict[str, float] = {}
+        self._tenant_locks: Dict[str, threading.Lock] = {}
+
+    def _tenant_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._tenant_locks.setdefault(key, threading.Lock())
+
+    def get_model(self, tenant_id: str, config: Dict[str, Any], model_name: str, stable_prefix: str):
+        """
+        คืน model ที่อ้างอิง cache ของ `stable_prefix` (สร้างหรือต่ออายุตามต้องการ)
+        คืน None หากไม่ควร/ไม่สามารถใช้ cache ได้ ผู้เรียกจะส่ง prompt เต็มแบบเดิม
+        """
+        if not CONTEXT_CACHE_ENABLED or estimate_tokens(stable_prefix) < CONTEXT_CACHE_MIN_TOKENS:
+            return None
+        version = hashlib.sha256(f"{model_name}\n{stable_prefix}".encode('utf-8')).hexdigest()[:16]
+        field_key = model_name.replace("models/", "").replace(".", "_")
+        key = f"{tenant_id}:{field_key}"
+        if self._failed_until.get(key, 0) > time.monotonic():
+            return None
+
+        with self._tenant_lock(key):
+            entry = self._entries.get(key) or {}
+            if entry.get('version') != version:
+                entry = (config.get('contextCaches') or {}).get(field_key) or {}
+            try:
+                if entry.get('version') != version:
+                    entry = self._create(tenant_id, field_key, model_name, stable_prefix, version, entry)
+                else:
+                    expire_time = _parse_time(entry.get('expire_time'))
+                    if expire_time is None or (expire_time - _now()).total_seconds() < CONTEXT_CACHE_RENEW_S:
+                        entry = self._renew(tenant_id, field_key, model_name, stable_prefix, version, entry)
+                self._entries[key] = entry
+                model = self._models.get(entry['name'])
+                if model is None:
+                    model = self.provider.model(entry['name'])
+                    with self._lock:
+                        self._models[entry['name']] = model
+                metrics.increment("context_cache.hits")
+                return model
+            except Exception as e:
+                self._failed_until[key] = time.monotonic() + CONTEXT_CACHE_RETRY_AFTER_S
+                metrics.increment("context_cache.errors")
+                print(f"⚠️ Context cache unavailable for tenant {tenant_id} ({model_name}): {e}")
+                return None
+
+    def _save_entry(self, tenant_id: str, field_key: str, entry: Dict[str, Any]) -> None:
+        # handle ของ cache ไม่ใช่การตั้งค่าของร้าน จึงไม่เปลี่ยน configVersion (ETag / cache ของ inbox tools ยังใช้ได้)
+        get_storage().update_tenant(tenant_id, {'contextCaches': {field_key: entry}}, bump_version=False)
+
+    def _create(self, tenant_id: str, field_key: str, model_name: str, stable_prefix: str, version: str, old_entry: Dict[str, Any]) -> Dict[str, Any]:
+        created = self.provider.create(model_name, stable_prefix, CONTEXT_CACHE_TTL_S, f"allchat-{tenant_id}-{version}")
+        entry = {'version': version, 'model': model_name, 'name': created['name'], 'expire_time': created['expire_time']}
+        self._save_entry(tenant_id, field_key, entry)
+        metrics.increment("context_cache.created")
+        print(f"🧊 Context cache: Created {entry['name']} for tenant {tenant_id} (version {version}).")
+        if old_entry.get('name'):
+            self._delete_quietly(old_entry['name'])
+        return entry
+
+    def _renew(self, tenant_id: str, field_key: str, model_name: str, stable_prefix: str, version: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            entry = dict(entry, expire_time=self.provider.renew(entry['name'], CONTEXT_CACHE_TTL_S))
+        except Exception as e:
+            # cache หมดอายุหรือถูกลบไปแล้ว จึงสร้างใหม่
+            print(f"⚠️ Context cache: Could not renew {entry.get('name')} ({e}). Recreating.")
+            with self._lock:
+                self._models.pop(entry.get('name'), None)
+            return self._create(tenant_id, field_key, model_name, stable_prefix, version, {})
+        self._save_entry(tenant_id, field_key, entry)
+        metrics.increment("context_cache.renewed")
+        return entry
+
+    def _delete_quietly(self, name: str) -> None:
+        with self._lock:
+            self._models.pop(name, None)
+        try:
+            self.provider.delete(name)
+        except Exception as e:
+            print(f"⚠️ Context cache: Could not delete {name}: {e}")
+
+    def invalidate(self, tenant_id: str) -> None:
+        """ลบ cache ทั้งหมดของ tenant (เรียกเมื่อ persona/KB เปลี่ยน เพื่อไม่ต้องจ่ายค่าเก็บ cache ที่ไม่ใช้แล้ว)"""
+        storage = get_storage()
+        tenant_data = storage.get_tenant(tenant_id) or {}
+        caches = tenant_data.get('contextCaches') or {}
+        for entry in caches.values():
+            if entry.get('name'):
+                self._delete_quietly(entry['name'])
+        with self._lock:
+            for state in (self._entries, self._failed_until):
+                for key in [k for k in state if k.startswith(f"{tenant_id}:")]:
+                    state.pop(key, None)
+        if caches:
+            # update_tenant เป็นการ merge จึงล้างด้วยค่า None แทนการลบฟิลด์
+            storage.update_tenant(tenant_id, {'contextCaches': {key: {'name': None, 'version': None} for key in caches}}, bump_version=False)
+            print(f"🧊 Context cache: Invalidated {len(caches)} cache(s) for tenant {tenant_id}.")
+
+
+# Private global variable to store the initialized cache manager
+_context_cache_instance: Optional[ContextCacheManager] = None
+
+
+def get_context_cache() -> ContextCacheManager:
+    """Returns the context cache manager, backed by the Gemini caching API by default."""
+    global _context_cache_instance
+    if _context_cache_instance is None:
+        _context_cache_instance = ContextCacheManager(GeminiContextCacheProvider())
+    return _context_cache_instance
+
+
+def set_context_cache(manager: Optional[ContextCacheManager]) -> None:
+    """Replaces the active cache manager (used by benchmarks and tests)."""
+    global _context_cache_instance
+    _context_cache_instance = manager
+
+
+def invalidate_tenant(tenant_id: str) -> None:
+    """ล้าง cache ของ tenant โดยไม่ทำให้การบันทึกการตั้งค่าล้มเหลว"""
+    try:
+        get_context_cache().invalidate(tenant_id)
+    except Exception as e:
+        print(f"⚠️ Context cache: Could not invalidate tenant {tenant_id}: {e}")
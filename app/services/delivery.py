@@ -0,0 +1,199 @@
+# app/services/delivery.py
+"""
+Outbound delivery ของข้อความตอบกลับไปยัง LINE / Facebook
+
+* LINE: ใช้ replyToken เมื่อยังไม่หมดอายุ (อายุนับจาก timestamp ของ event) หากหมดอายุหรือส่งแบบ
+  reply ไม่สำเร็จ จะ fallback ไปใช้ push_line_message พร้อม X-Line-Retry-Key
+* ข้อผิดพลาดชั่วคราว (network, 429, 5xx) จะลองส่งซ้ำทันทีแบบ backoff สั้นๆ ก่อน หากยังไม่สำเร็จ
+  จะบันทึกลง outbound queue ใน storage ให้ retry worker ส่งซ้ำภายหลัง
+* บันทึก latency และจำนวนความล้มเหลวลง metrics (ดูได้ที่ GET /api/metrics)
+"""
+import asyncio
+import datetime
+import os
+import random
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from . import metrics
+from .facebook_api import send_facebook_message
+from .line_api import push_line_message, send_line_message
+from .storage import get_storage
+
+# LINE ให้ replyToken มีอายุสั้นมาก (ประมาณ 1 นาที) จึงเผื่อเวลาไว้ก่อนหมดอายุจริง
+LINE_REPLY_TOKEN_MAX_AGE_S = float(os.getenv("LINE_REPLY_TOKEN_MAX_AGE_S", "50"))
+INLINE_ATTEMPTS = int(os.getenv("DELIVERY_INLINE_ATTEMPTS", "2"))
+INLINE_BACKOFF_S = float(os.getenv("DELIVERY_INLINE_BACKOFF_S", "0.5"))
+QUEUE_MAX_ATTEMPTS = int(os.getenv("DELIVERY_QUEUE_MAX_ATTEMPTS", "8"))
+QUEUE_BACKOFF_BASE_S = float(os.getenv("DELIVERY_QUEUE_BACKOFF_BASE_S", "10"))
+QUEUE_BACKOFF_MAX_S = float(os.getenv("DELIVERY_QUEUE_BACKOFF_MAX_S", "900"))
+RETRY_WORKER_INTERVAL_S = float(os.getenv("DELIVERY_RETRY_INTERVAL_S", "15"))
+RETRY_LEASE_S = 120
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _is_retryable(result: Dict[str, Any]) -> bool:
+    status_code = result.get("status_code")
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def _failure_reason(result: Dict[str, Any]) -> str:
+    status_code = result.get("status_code")
+    return f"http_{status_code}" if status_code else "network"
+
+
+def send_with_retry(send: Callable[[], Dict[str, Any]], attempts: int) -> Dict[str, Any]:
+    """เรียก send ซ้ำเมื่อเป็นข้อผิดพลาดชั่วคราว โดยเว้นระยะแบบ exponential backoff + jitter"""
+    result: Dict[str, Any] = {"status": "error", "message": "not attempted"}
+    for attempt in range(max(1, attempts)):
+        result = send()
+        if result.get("status") == "ok" or not _is_retryable(result):
+            return result
+        if attempt + 1 < attempts:
+            time.sleep(INLINE_BACKOFF_S * (2 ** attempt) * (0.5 + random.random()))
+    return result
+
+
+def _send_once(platform: str, user_id: str, text: str, access_token: str, retry_key: str, attempts: int) -> Dict[str, Any]:
+    if platform == "line":
+        return send_with_retry(lambda: push_line_message(user_id, text, access_token, retry_key=retry_key), attempts)
+    if platform == "facebook":
+        return send_with_retry(lambda: send_facebook_message(user_id, text, access_token), attempts)
+    return {"status": "error", "message": f"Unsupported platform: {platform}", "status_code": 400}
+
+
+def _access_token(platform: str, tenant_config: Dict[str, Any]) -> Optional[str]:
+    return tenant_config.get('lineAccessToken') if platform == "line" else tenant_config.get('facebookPageToken')
+
+
+def _persist_undelivered(tenant_id: str, platform: str, user_id: str, text: str, retry_key: str, result: Dict[str, Any], received_at: float) -> None:
+    retryable = _is_retryable(result)
+    item = {
+        'tenant_id': tenant_id,
+        'platform': platform,
+        'user_id': user_id,
+        'text': text,
+        'retry_key': retry_key,
+        'attempts': 1,
+        'status': 'pending' if retryable else 'failed',
+        'last_error': result.get("message"),
+        'received_at': received_at,
+        'created_at': _now().isoformat(),
+        'next_attempt_at': (_now() + datetime.timedelta(seconds=QUEUE_BACKOFF_BASE_S)).isoformat(),
+    }
+    try:
+        get_storage().enqueue_outbound(item)
+        metrics.increment("delivery.queued" if retryable else "delivery.dead_lettered", platform=platform)
+        print(f"📥 Delivery: Message to {user_id} ({platform}) persisted with status '{item['status']}'.")
+    except Exception as e:
+        metrics.increment("delivery.lost", platform=platform)
+        print(f"❌ CRITICAL: Could not persist undelivered message for {user_id}: {e}")
+
+
+def deliver_message(
+    tenant_id: str,
+    platform: str,
+    user_id: str,
+    text: str,
+    access_token: Optional[str],
+    reply_token: Optional[str] = None,
+    event_timestamp: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    ส่งข้อความตอบกลับไปยังผู้ใช้ โดยเลือกใช้ replyToken หรือ push ตามอายุของ token
+    `event_timestamp` คือเวลาที่ event เกิดขึ้น (epoch วินาที) ใช้คำนวณอายุ replyToken และ latency
+    คืนค่า dict ที่มี `status` ('ok', 'queued' หรือ 'error') และ `method` ที่ใช้ส่ง
+    """
+    received_at = event_timestamp or time.time()
+    retry_key = str(uuid.uuid4())
+
+    if not access_token:
+        metrics.increment("delivery.failures", platform=platform, reason="missing_token")
+        result = {"status": "error", "message": f"Missing {platform} access token", "status_code": 401}
+        _persist_undelivered(tenant_id, platform, user_id, text, retry_key, result, received_at)
+        return {"status": "error", "method": None, "message": result["message"]}
+
+    if platform == "line" and reply_token:
+        token_age = time.time() - received_at
+        if token_age < LINE_REPLY_TOKEN_MAX_AGE_S:
+            result = send_line_message(reply_token, text, access_token)
+            if result.get("status") == "ok":
+                metrics.observe("delivery.latency", time.time() - received_at, platform=platform, method="reply")
+                metrics.increment("delivery.sent", platform=platform, method="reply")
+                return {"status": "ok", "method": "reply"}
+            # replyToken ใช้ได้ครั้งเดียวและหมดอายุเร็ว ความล้มเหลวใดๆ จึง fallback ไป push ทันที
+            metrics.increment("delivery.reply_fallbacks", platform=platform, reason=_failure_reason(result))
+        else:
+            print(f"⏱️ Delivery: Reply token for {user_id} is {token_age:.1f}s old. Using push instead.")
+            metrics.increment("delivery.reply_fallbacks", platform=platform, reason="token_stale")
+
+    result = _send_once(platform, user_id, text, access_token, retry_key, INLINE_ATTEMPTS)
+    if result.get("status") == "ok":
+        method = "push" if platform == "line" else "send"
+        metrics.observe("delivery.latency", time.time() - received_at, platform=platform, method=method)
+        metrics.increment("delivery.sent", platform=platform, method=method)
+        return {"status": "ok", "method": method}
+
+    metrics.increment("delivery.failures", platform=platform, reason=_failure_reason(result))
+    _persist_undelivered(tenant_id, platform, user_id, text, retry_key, result, received_at)
+    return {"status": "queued" if _is_retryable(result) else "error", "method": None, "message": result.get("message")}
+
+
+def process_outbound_queue(limit: int = 50) -> int:
+    """ส่งข้อความที่ค้างอยู่ใน outbound queue ซ้ำ คืนค่าจำนวนที่ส่งสำเร็จ"""
+    storage = get_storage()
+    if not storage:
+        return 0
+    now = _now()
+    items = storage.claim_due_outbound(now.isoformat(), (now + datetime.timedelta(seconds=RETRY_LEASE_S)).isoformat(), limit)
+    delivered = 0
+    tenant_configs: Dict[str, Dict[str, Any]] = {}
+    for item in items:
+        tenant_id, platform = item['tenant_id'], item['platform']
+        if tenant_id not in tenant_configs:
+            tenant_configs[tenant_id] = storage.get_tenant(tenant_id) or {}
+        access_token = _access_token(platform, tenant_configs[tenant_id])
+        if access_token:
+            result = _send_once(platform, item['user_id'], item['text'], access_token, item.get('retry_key') or str(uuid.uuid4()), 1)
+        else:
+            result = {"status": "error", "message": f"Missing {platform} access token", "status_code": None}
+
+        if result.get("status") == "ok":
+            storage.delete_outbound(item['id'])
+            delivered += 1
+            metrics.observe("delivery.latency", time.time() - item.get('received_at', time.time()), platform=platform, method="queued")
+            metrics.increment("delivery.sent", platform=platform, method="queued")
+            continue
+
+        attempts = item.get('attempts', 0) + 1
+        metrics.increment("delivery.failures", platform=platform, reason=_failure_reason(result))
+        if attempts >= QUEUE_MAX_ATTEMPTS or not _is_retryable(result):
+            storage.update_outbound(item['id'], {'status': 'failed', 'attempts': attempts, 'last_error': result.get("message")})
+            metrics.increment("delivery.dead_lettered", platform=platform)
+            print(f"❌ Delivery: Giving up on message to {item['user_id']} after {attempts} attempts.")
+        else:
+            backoff = min(QUEUE_BACKOFF_MAX_S, QUEUE_BACKOFF_BASE_S * (2 ** attempts))
+            storage.update_outbound(item['id'], {
+                'attempts': attempts,
+                'last_error': result.get("message"),
+                'next_attempt_at': (now + datetime.timedelta(seconds=backoff)).isoformat(),
+            })
+    if items:
+        print(f"📤 Delivery: Retried {len(items)} queued messages, {delivered} delivered.")
+    return delivered
+
+
+async def run_retry_worker() -> None:
+    """Background loop (เริ่มจาก lifespan ของ app) ที่ส่งข้อความค้างใน queue เป็นระยะ"""
+    while True:
+        try:
+            await run_in_threadpool(process_outbound_queue)
+        except Exception as e:
+            print(f"❌ Delivery retry worker error: {e}")
+        await asyncio.sleep(RETRY_WORKER_INTERVAL_S)
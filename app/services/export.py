@@ -0,0 +1,152 @@
+# app/services/export.py
+"""
+Export ประวัติแชททั้งหมดของ tenant (สำหรับนำเข้า CRM / audit) แบบ streaming
+
+* อ่าน conversation ทีละหน้าด้วย cursor ของ `list_conversations` และส่งออกทีละข้อความ
+  หน่วยความจำที่ใช้จึงคงที่ไม่ว่า tenant จะมีแชทมากเท่าไร
+* รวมข้อความที่ถูก archive แล้วด้วย (อ่านเฉพาะ segment ที่ช่วงเวลาทับกับช่วงที่ขอ)
+* รูปแบบ `ndjson` (หนึ่งบรรทัดต่อข้อความ) หรือ `csv` และบีบอัด gzip ระหว่างส่งได้
+"""
+import csv
+import datetime
+import io
+import json
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+
+from .archive import read_segment
+from .storage import get_storage
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_COLUMNS = ["user_id", "display_name", "platform", "timestamp", "role", "sender_type", "sender_name", "text"]
+EXPORT_PAGE_SIZE = 50
+# รวมข้อมูลให้ได้ขนาดประมาณนี้ก่อนส่งออกหนึ่ง chunk เพื่อลดจำนวนครั้งที่เขียนลง socket
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime.datetime]:
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (ValueError, TypeError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+def _in_range(value: Any, start: Optional[datetime.datetime], end: Optional[datetime.datetime]) -> bool:
+    if start is None and end is None:
+        return True
+    timestamp = _parse_timestamp(value)
+    if timestamp is None:
+        return False
+    return (start is None or timestamp >= start) and (end is None or timestamp < end)
+
+
+def _segment_overlaps(segment: Dict[str, Any], start: Optional[datetime.datetime], end: Optional[datetime.datetime]) -> bool:
+    first = _parse_timestamp(segment.get('first_timestamp'))
+    last = _parse_timestamp(segment.get('last_timestamp'))
+    if start is not None and last is not None and last < start:
+        return False
+    if end is not None and first is not None and first >= end:
+        return False
+    return True
+
+
+def _row(user_id: str, conversation: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "display_name": conversation.get('displayName'),
+        "platform": conversation.get('platform'),
+        "timestamp": message.get('timestamp'),
+        "role": message.get('role'),
+        "sender_type": message.get('sender_type') or ("customer" if message.get('role') == 'user' else "bot"),
+        "sender_name": message.get('sender_name'),
+        "text": "".join(part.get('text', '') for part in message.get('parts') or [] if isinstance(part, dict)),
+    }
+
+
+def iter_messages(tenant_id: str, start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None) -> Iterator[Dict[str, Any]]:
+    """
+    คืนข้อความทั้งหมดของ tenant ในช่วง [start, end) ทีละแถว เรียงตาม user_id
+
+    ไล่หน้าตาม user_id (document ID) ซึ่งไม่เปลี่ยนเมื่อแชทมีข้อความใหม่ ทุกแชทจึงอยู่ใน export ครั้งละหนึ่งครั้ง
+    ช่วงเวลากรองรายข้อความ (แชทที่ข้อความล่าสุดเก่ากว่า start ข้ามได้ทั้งแชท)
+    """
+    storage = get_storage()
+    cursor = None
+    while True:
+        page = storage.list_conversations(tenant_id, limit=EXPORT_PAGE_SIZE, start_after=cursor, order_by_id=True)
+        for conversation in page:
+            user_id = conversation['user_id']
+            last_message_time = _parse_timestamp(conversation.get('lastMessageTime'))
+            if start is not None and last_message_time is not None and last_message_time < start:
+                continue
+            for segment in conversation.get('archive_segments') or []:
+                if not _segment_overlaps(segment, start, end):
+                    continue
+                for message in read_segment(tenant_id, user_id, segment['index']) or []:
+                    if _in_range(message.get('timestamp'), start, end):
+                        yield _row(user_id, conversation, message)
+            for message in conversation.get('history') or []:
+                if _in_range(message.get('timestamp'), start, end):
+                    yield _row(user_id, conversation, message)
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        cursor = page[-1]['user_id']
+
+
+def _encode_rows(rows: Iterator[Dict[str, Any]], fmt: str) -> Iterator[bytes]:
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+        # BOM ทำให้ Excel เปิดไฟล์ภาษาไทยได้ถูกต้อง
+        buffer.write('\ufeff')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+        return
+
+    chunk: List[str] = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row, ensure_ascii=False, default=str) + "\n"
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(chunk).encode('utf-8')
+            chunk, size = [], 0
+    yield "".join(chunk).encode('utf-8')
+
+
+def _gzip_stream(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(
+    tenant_id: str,
+    fmt: str = "ndjson",
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    compress: bool = False,
+) -> Iterator[bytes]:
+    """Generator ของไฟล์ export (ใช้กับ StreamingResponse ซึ่งจะวน generator แบบ sync ใน threadpool)"""
+    chunks = _encode_rows(iter_messages(tenant_id, start, end), fmt)
+    if compress:
+        chunks = _gzip_stream(chunks)
+    exported = 0
+    try:
+        for chunk in chunks:
+            if chunk:
+                exported += len(chunk)
+                yield chunk
+    finally:
+        print(f"📦 Export: Streamed {exported} bytes ({fmt}{', gzip' if compress else ''}) for tenant {tenant_id}.")
@@ -1,7 +1,15 @@
 # app/services/facebook_api.py
+import os
 import requests
 from typing import Dict, Any
 
+# Base URL ของ Facebook Graph API (override ได้เพื่อชี้ไปยัง fake server ตอนทำ benchmark)
+FACEBOOK_GRAPH_BASE_URL = os.getenv("FACEBOOK_GRAPH_BASE_URL", "https://graph.facebook.com").rstrip("/")
+
+def _status_code(e: requests.exceptions.RequestException):
+    """HTTP status ของ error (None หากเป็นปัญหาเครือข่าย) ใช้ตัดสินว่าควรลองส่งซ้ำหรือไม่"""
+    return e.response.status_code if getattr(e, "response", None) is not None else None
+
 def send_facebook_message(recipient_id: str, message_text: str, page_access_token: str) -> Dict[str, Any]:
     """
     Sends a message back to Facebook Messenger.
@@ -15,20 +23,20 @@ def send_facebook_message(recipient_id: str, message_text: str, page_access_toke
     data = {"recipient": {"id": recipient_id}, "message": {"text": message_text}}
 
     try:
-        r = requests.post("https://graph.facebook.com/v20.0/me/messages", params=params, headers=headers, json=data)
+        r = requests.post(f"{FACEBOOK_GRAPH_BASE_URL}/v20.0/me/messages", params=params, headers=headers, json=data)
         r.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
         print(f"✅ Facebook API: Message sent successfully. Response: {r.json()}")
         return {"status": "ok", "response": r.json()}
     except requests.exceptions.RequestException as e:
         print(f"❌ Facebook API: Failed to send message: {e}")
-        return {"status": "error", "message": f"Failed to send Facebook message: {e}"}
+        return {"status": "error", "message": f"Failed to send Facebook message: {e}", "status_code": _status_code(e)}
 
 # ✨ --- เพิ่มฟังก์ชันใหม่ด้านล่างนี้ --- ✨
 def get_facebook_user_profile(user_id: str, page_access_token: str) -> dict:
     """
     ดึงข้อมูลโปรไฟล์ผู้ใช้จาก Facebook Graph API
     """
-    url = f"https://graph.facebook.com/{user_id}?fields=name,profile_pic&access_token={page_access_token}"
+    url = f"{FACEBOOK_GRAPH_BASE_URL}/{user_id}?fields=name,profile_pic&access_token={page_access_token}"
     try:
         response = requests.get(url)
         response.raise_for_status()
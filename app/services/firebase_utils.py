@@ -4,6 +4,9 @@ import firebase_admin
 from firebase_admin import credentials, firestore, auth as firebase_auth
 from typing import Optional
 
+from .storage import get_storage
+from . import context_cache, webhook_guard
+
 # Global Firebase instances
 _db = None
 _auth = None
@@ -39,81 +42,92 @@ _initialize_firebase_once()
 db = _db
 auth = _auth
 
-# --- Functions for updating tenant data in Firestore ---
+# --- Functions for updating tenant data through the storage backend ---
 # These functions are called by the AI assistants (Settings Assistant, Wizard)
 
 def update_bot_persona(tenant_id: str, persona: str) -> str:
     """Updates the bot's persona (role and personality) for a given tenant."""
-    if not db: return "Error: Database not available."
+    storage = get_storage()
+    if not storage: return "Error: Database not available."
     try:
-        db.collection('tenants').document(tenant_id).set({'botPersona': persona}, merge=True)
+        storage.update_tenant(tenant_id, {'botPersona': persona})
+        context_cache.invalidate_tenant(tenant_id)
         return f"Bot persona for tenant '{tenant_id}' has been updated successfully."
     except Exception as e: return f"Error updating persona: {e}"
 
 def update_knowledge_base(tenant_id: str, knowledge: str) -> str:
     """Updates the knowledge base for a given tenant's bot."""
-    if not db: return "Error: Database not available."
+    storage = get_storage()
+    if not storage: return "Error: Database not available."
     try:
-        db.collection('tenants').document(tenant_id).set({'knowledgeBase': knowledge}, merge=True)
+        storage.update_tenant(tenant_id, {'knowledgeBase': knowledge})
+        context_cache.invalidate_tenant(tenant_id)
         return f"Knowledge base for tenant '{tenant_id}' has been updated successfully."
     except Exception as e: return f"Error updating knowledge base: {e}"
 
 def update_line_token(tenant_id: str, token: str) -> str:
     """Updates the LINE Channel Access Token for a given tenant."""
-    if not db: return "Error: Database not available."
+    storage = get_storage()
+    if not storage: return "Error: Database not available."
     try:
-        db.collection('tenants').document(tenant_id).set({'lineAccessToken': token}, merge=True)
+        storage.update_tenant(tenant_id, {'lineAccessToken': token})
+        webhook_guard.invalidate_config(tenant_id)
         return f"LINE token for tenant '{tenant_id}' has been updated successfully."
     except Exception as e: return f"Error updating LINE token: {e}"
 
 def update_business_type(tenant_id: str, business_type: str) -> str:
     """Updates the business type for a given tenant."""
-    if not db: return "Error: Database not available."
+    storage = get_storage()
+    if not storage: return "Error: Database not available."
     try:
-        db.collection('tenants').document(tenant_id).set({'businessType': business_type}, merge=True)
+        storage.update_tenant(tenant_id, {'businessType': business_type})
         return f"Business type for tenant '{tenant_id}' has been updated to '{business_type}' successfully."
     except Exception as e: return f"Error updating business type: {e}"
 
 def update_product_recommendation_setting(tenant_id: str, enabled: bool) -> str:
     """Enables or disables the product recommendation feature for a product-based business."""
-    if not db: return "Error: Database not available."
+    storage = get_storage()
+    if not storage: return "Error: Database not available."
     try:
-        db.collection('tenants').document(tenant_id).set({'productRecommendationEnabled': enabled}, merge=True)
+        storage.update_tenant(tenant_id, {'productRecommendationEnabled': enabled})
         status = "enabled" if enabled else "disabled"
         return f"Product recommendation for tenant '{tenant_id}' has been {status} successfully."
     except Exception as e: return f"Error updating product recommendation setting: {e}"
 
 def update_booking_settings(tenant_id: str, integration_url: Optional[str] = None, bot_enabled: Optional[bool] = None) -> str:
     """Updates booking system integration URL and/or bot booking enablement for service appointment businesses."""
-    if not db: return "Error: Database not available."
+    storage = get_storage()
+    if not storage: return "Error: Database not available."
     try:
         update_data = {}
         if integration_url is not None: update_data['bookingSystemIntegration'] = integration_url
         if bot_enabled is not None: update_data['botBookingEnabled'] = bot_enabled
         if update_data:
-            db.collection('tenants').document(tenant_id).set(update_data, merge=True)
+            storage.update_tenant(tenant_id, update_data)
             return f"Booking settings for tenant '{tenant_id}' updated successfully."
         return "No booking settings provided for update."
     except Exception as e: return f"Error updating booking settings: {e}"
 
 def update_project_status_setting(tenant_id: str, enabled: bool) -> str:
     """Enables or disables project status update feature for project-based businesses."""
-    if not db: return "Error: Database not available."
+    storage = get_storage()
+    if not storage: return "Error: Database not available."
     try:
-        db.collection('tenants').document(tenant_id).set({'projectStatusUpdateEnabled': enabled}, merge=True)
+        storage.update_tenant(tenant_id, {'projectStatusUpdateEnabled': enabled})
         status = "enabled" if enabled else "disabled"
         return f"Project status update for tenant '{tenant_id}' has been {status} successfully."
     except Exception as e: return f"Error updating project status setting: {e}"
 
 def update_chatbot_general_settings(tenant_id: str, name: Optional[str] = None, welcome_message: Optional[str] = None) -> str:
     """Updates general chatbot settings like name and welcome message."""
-    if not db: return "Error: Database not available."
+    storage = get_storage()
+    if not storage: return "Error: Database not available."
     try:
         update_data = {}
         if name is not None: update_data['chatbotName'] = name
         if welcome_message is not None: update_data['welcomeMessage'] = welcome_message
         if update_data:
-            db.collection('tenants').document(tenant_id).set(update_data, merge=True)
+            storage.update_tenant(tenant_id, update_data)
             return f"Chatbot general settings for tenant '{tenant_id}' updated successfully."
         return "No general chatbot settings provided for update."
     except Exception as e: return f"Error updating chatbot general settings: {e}"
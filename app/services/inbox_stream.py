@@ -0,0 +1,192 @@
+# app/services/inbox_stream.py
+"""
+กระจายการเปลี่ยนแปลงของ inbox ไปยังแอดมินทุกคนที่เปิดหน้า inbox อยู่ (server-side fan-out)
+
+* แต่ละ instance ฟังการเปลี่ยนแปลงของ tenant เพียงครั้งเดียว (`watch_conversations` ของ storage)
+  ไม่ว่าจะมีแอดมินเปิดหน้า inbox อยู่กี่แท็บ และหยุดฟังเมื่อแท็บสุดท้ายปิด
+* ส่งเฉพาะส่วนที่เปลี่ยน (delta) แทนเอกสารแชททั้งก้อน:
+    - `conversation` แชทใหม่ (ข้อมูลสรุป ไม่มี history)
+    - `message`      ข้อความใหม่ของแชท
+    - `unread`       จำนวนข้อความที่ยังไม่ได้อ่านของแชทเปลี่ยน
+    - `bot`          เปิด/ปิดบอทของแชท
+    - `work_queue`   จำนวนงานที่รอแอดมินตอบเอง (work_queue) เปลี่ยน
+    - `resync`       ผู้รับอ่านไม่ทัน ให้เชื่อมต่อใหม่เพื่อรับ snapshot ล่าสุด
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+
+from . import metrics, work_queue
+from .storage import get_storage
+
+INBOX_STREAM_POLL_S = float(os.getenv("INBOX_STREAM_POLL_S", "1.0"))
+# จำนวนแชทล่าสุดที่ตรวจเมื่อ backend ไม่มี change feed ของตัวเอง
+INBOX_STREAM_POLL_LIMIT = 200
+# จำนวนแชทล่าสุดใน snapshot แรกของ stream (เท่ากับที่ watcher ตรวจ)
+INBOX_SNAPSHOT_LIMIT = INBOX_STREAM_POLL_LIMIT
+INBOX_STREAM_QUEUE_SIZE = 1000
+# อ่านยอดงานค้างซ้ำทุกช่วงนี้ (การเปลี่ยนจาก instance นี้ส่งทันที จาก instance อื่นช้าสุดเท่านี้)
+WORK_QUEUE_POLL_S = float(os.getenv("WORK_QUEUE_POLL_S", "5"))
+WORK_QUEUE_EXPIRY_INTERVAL_S = 300
+
+# ฟิลด์ที่หน้า inbox ใช้แสดงรายชื่อแชท
+SUMMARY_FIELDS = (
+    'displayName', 'pictureUrl', 'platform', 'lastMessageTime',
+    'unread_count', 'is_bot_active', 'admin_last_seen_timestamp', 'lead_score_info',
+)
+
+
+def conversation_summary(conversation: Dict[str, Any]) -> Dict[str, Any]:
+    summary = {field: conversation.get(field) for field in SUMMARY_FIELDS if field in conversation}
+    summary['user_id'] = conversation['user_id']
+    return summary
+
+
+class _TenantFeed:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.state: Dict[str, Dict[str, Any]] = {}
+        self.primed = False
+        self.stop: Optional[Callable[[], None]] = None
+        self.work_open: Optional[int] = None
+        self.work_changed = asyncio.Event()
+        self.work_task: Optional[asyncio.Task] = None
+
+
+class InboxHub:
+    """ทะเบียนผู้ฟังต่อ tenant ใน instance นี้ ใช้จาก event loop ยกเว้น `_on_change` ที่ถูกเรียกจาก thread ของ watcher"""
+
+    def __init__(self):
+        self._feeds: Dict[str, _TenantFeed] = {}
+        self._lock = threading.Lock()
+
+    async def subscribe(self, tenant_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=INBOX_STREAM_QUEUE_SIZE)
+        feed = self._feeds.get(tenant_id)
+        start_watch = feed is None
+        if start_watch:
+            feed = self._feeds[tenant_id] = _TenantFeed(asyncio.get_running_loop())
+        feed.subscribers.add(queue)
+        metrics.set_gauge("inbox_stream.subscribers", len(feed.subscribers), tenant=tenant_id)
+        if start_watch:
+            feed.stop = await run_in_threadpool(
+                get_storage().watch_conversations, tenant_id,
+                lambda conversations: self._on_change(tenant_id, feed, conversations),
+                INBOX_STREAM_POLL_S, INBOX_STREAM_POLL_LIMIT,
+            )
+            feed.work_task = asyncio.create_task(self._watch_work_queue(tenant_id, feed))
+            print(f"📡 Inbox stream: Watching tenant {tenant_id}.")
+        return queue
+
+    async def unsubscribe(self, tenant_id: str, queue: asyncio.Queue) -> None:
+        feed = self._feeds.get(tenant_id)
+        if feed is None:
+            return
+        feed.subscribers.discard(queue)
+        metrics.set_gauge("inbox_stream.subscribers", len(feed.subscribers), tenant=tenant_id)
+        if feed.subscribers or feed.stop is None:
+            return
+        del self._feeds[tenant_id]
+        if feed.work_task is not None:
+            feed.work_task.cancel()
+        await run_in_threadpool(feed.stop)
+        print(f"📡 Inbox stream: Stopped watching tenant {tenant_id}.")
+
+    def _on_change(self, tenant_id: str, feed: _TenantFeed, conversations: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            events = self._deltas(feed, conversations)
+            feed.primed = True
+        if events:
+            metrics.increment("inbox_stream.events", len(events))
+            feed.loop.call_soon_threadsafe(self._deliver, feed, events)
+
+    def notify_work_queue(self, tenant_id: str) -> None:
+        """คิวงานของ tenant เปลี่ยนใน instance นี้ (เรียกได้จากทุก thread) ให้อ่านยอดใหม่ทันที"""
+        feed = self._feeds.get(tenant_id)
+        if feed is not None:
+            feed.loop.call_soon_threadsafe(feed.work_changed.set)
+
+    async def _watch_work_queue(self, tenant_id: str, feed: _TenantFeed) -> None:
+        """ส่ง event `work_queue` เมื่อยอดงานค้างเปลี่ยน และทำให้งานที่ค้างนานเกินไปหมดอายุเป็นระยะ"""
+        last_expiry = 0.0
+        while True:
+            feed.work_changed.clear()
+            try:
+                if time.monotonic() - last_expiry >= WORK_QUEUE_EXPIRY_INTERVAL_S:
+                    last_expiry = time.monotonic()
+                    await run_in_threadpool(work_queue.expire_stale, tenant_id)
+                count = await run_in_threadpool(work_queue.open_count, tenant_id)
+                if count != feed.work_open:
+                    feed.work_open = count
+                    self._deliver(feed, [{'type': 'work_queue', 'open': count}])
+            except Exception as e:
+                print(f"⚠️ Inbox stream: Could not refresh work queue for tenant {tenant_id}: {e}")
+            try:
+                await asyncio.wait_for(feed.work_changed.wait(), WORK_QUEUE_POLL_S)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def _deltas(feed: _TenantFeed, conversations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        events: List[Dict[str, Any]] = []
+        for conversation in conversations:
+            user_id = conversation['user_id']
+            recent = conversation.get('recent_messages') or []
+            current = {
+                # นับรวมข้อความที่ archive แล้ว การย้ายไป archive จึงไม่ถูกมองเป็นข้อความหาย
+                'total': conversation.get('archived_message_count', 0) + conversation.get('message_count', 0),
+                'unread': conversation.get('unread_count', 0),
+                'bot': conversation.get('is_bot_active', True),
+            }
+            previous = feed.state.get(user_id)
+            feed.state[user_id] = current
+            if not feed.primed:
+                continue
+            if previous is None:
+                events.append({'type': 'conversation', 'user_id': user_id, 'conversation': conversation_summary(conversation)})
+                continue
+            new_count = current['total'] - previous['total']
+            if new_count > 0:
+                events.append({
+                    'type': 'message',
+                    'user_id': user_id,
+                    # มาพร้อมกันเกิน WATCH_RECENT_MESSAGES ข้อความ: ส่งเท่าที่มี หน้าเว็บโหลดแชทเต็มเองเมื่อเปิด
+                    'messages': recent[-new_count:],
+                    'lastMessageTime': conversation.get('lastMessageTime'),
+                })
+            if current['unread'] != previous['unread']:
+                events.append({'type': 'unread', 'user_id': user_id, 'count': current['unread']})
+            if current['bot'] != previous['bot']:
+                events.append({'type': 'bot', 'user_id': user_id, 'active': current['bot']})
+        return events
+
+    @staticmethod
+    def _deliver(feed: _TenantFeed, events: List[Dict[str, Any]]) -> None:
+        for queue in list(feed.subscribers):
+            for event in events:
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # ผู้รับช้าเกินไป ทิ้งคิวแล้วบอกให้โหลด snapshot ใหม่
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait({'type': 'resync'})
+                    metrics.increment("inbox_stream.resyncs")
+                    break
+
+
+# Private global variable to store the initialized hub
+_inbox_hub_instance: Optional[InboxHub] = None
+
+
+def get_inbox_hub() -> InboxHub:
+    global _inbox_hub_instance
+    if _inbox_hub_instance is None:
+        _inbox_hub_instance = InboxHub()
+        work_queue.add_listener(_inbox_hub_instance.notify_work_queue)
+    return _inbox_hub_instance
@@ -0,0 +1,171 @@
+# app/services/inbox_tools.py
+"""
+เครื่องมือช่วยแอดมินในหน้า inbox: สรุปบทสนทนา และร่างคำตอบจากคีย์เวิร์ด
+
+* ไม่ส่ง history ทั้งหมดให้ model: ใช้ `summary` ที่บอทสรุปเก็บไว้แล้ว (ดู chatbot_logic) บวกเฉพาะข้อความหลัง
+  summary checkpoint (ไม่เกิน INBOX_TOOLS_MAX_TAIL ข้อความ)
+* ผลลัพธ์ถูก cache ตามเวอร์ชันของบทสนทนา (จำนวนข้อความทั้งหมด + เวลาของข้อความล่าสุด) การกดซ้ำโดยที่ยังไม่มี
+  ข้อความใหม่จึงได้ผลทันทีโดยไม่เรียก model เมื่อมีข้อความใหม่ key จะเปลี่ยนเอง (ไม่ต้องสั่งล้าง cache)
+* ผลลัพธ์ส่งกลับเป็น event ทีละส่วนขณะ model กำลังตอบ (`delta`) แล้วปิดด้วย `done` ที่มีข้อความเต็ม
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from . import metrics, usage
+from .archive import summary_checkpoint
+from .chatbot_logic import build_prompt_template, relevant_knowledge
+from ..config.settings import get_gemini_tier_model
+from ..models.conversation import Conversation
+from ..prompts.inbox_tools_prompt import DRAFT_REPLY_PROMPT, INBOX_SUMMARY_PROMPT
+
+INBOX_TOOLS_MODEL_TIER = os.getenv("INBOX_TOOLS_MODEL_TIER", "lite")
+INBOX_TOOLS_CACHE_TTL_S = float(os.getenv("INBOX_TOOLS_CACHE_TTL_S", "3600"))
+INBOX_TOOLS_CACHE_SIZE = int(os.getenv("INBOX_TOOLS_CACHE_SIZE", "1000"))
+# จำนวนข้อความหลัง summary checkpoint ที่ส่งให้ model มากที่สุด
+INBOX_TOOLS_MAX_TAIL = 40
+INBOX_TOOLS_MAX_KB_CHUNKS = 5
+DRAFT_MAX_KEYWORDS_CHARS = 500
+
+
+class ResultCache:
+    """LRU + TTL ของผลลัพธ์ (ข้อความ) ภายใน instance"""
+
+    def __init__(self, max_entries: int = INBOX_TOOLS_CACHE_SIZE, ttl_s: float = INBOX_TOOLS_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[Tuple, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_s:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Private global variable to store the initialized result cache
+_result_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache()
+    return _result_cache
+
+
+def set_result_cache(cache: Optional[ResultCache]) -> None:
+    global _result_cache
+    _result_cache = cache
+
+
+def conversation_version(conversation: Dict[str, Any]) -> str:
+    """เปลี่ยนทุกครั้งที่มีข้อความใหม่ (รวมข้อความที่ archive ไปแล้วในการนับ จึงไม่เปลี่ยนเพราะการ archive)"""
+    history = conversation.get('history') or []
+    total = conversation.get('archived_message_count', 0) + len(history)
+    last_timestamp = history[-1].get('timestamp', "") if history else ""
+    return f"{total}:{last_timestamp}"
+
+
+def _context(data: Dict[str, Any]) -> Tuple[str, str, int]:
+    """(summary ที่เก็บไว้, ข้อความหลัง checkpoint, จำนวนข้อความหลัง checkpoint)"""
+    conversation = Conversation(data)
+    start = max(summary_checkpoint(data), len(conversation) - INBOX_TOOLS_MAX_TAIL)
+    tail = conversation.window(start)
+    return data.get('summary', "") or "", "".join(message.summary_line() for message in tail), len(tail)
+
+
+def _stream_model(tenant_id: str, prompt: str, purpose: str) -> Iterator[str]:
+    model = get_gemini_tier_model(INBOX_TOOLS_MODEL_TIER)
+    if not model:
+        raise ValueError("Gemini model not available")
+    response = model.generate_content(prompt, stream=True)
+    for chunk in response:
+        text = getattr(chunk, 'text', "")
+        if text:
+            yield text
+    usage.record_gemini_usage(tenant_id, model, response, purpose)
+
+
+def _cached_stream(tool: str, key: Tuple, tenant_id: str, build_prompt: Callable[[], Optional[str]], fallback: str) -> Iterator[Dict[str, Any]]:
+    cache = get_result_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.increment("inbox_tools.cache_hit", tool=tool)
+        yield {'type': 'done', 'text': cached, 'cached': True}
+        return
+    metrics.increment("inbox_tools.cache_miss", tool=tool)
+    prompt = build_prompt()
+    if prompt is None:
+        # ไม่มีอะไรให้ model ทำ (เช่น ไม่มีข้อความใหม่หลัง summary) ใช้ผลที่มีอยู่แล้ว
+        cache.put(key, fallback)
+        yield {'type': 'done', 'text': fallback, 'cached': False}
+        return
+    started = time.perf_counter()
+    parts = []
+    try:
+        for text in _stream_model(tenant_id, prompt, f"inbox_{tool}"):
+            parts.append(text)
+            yield {'type': 'delta', 'text': text}
+    except Exception as e:
+        print(f"❌ Inbox tools: {tool} failed for tenant {tenant_id}: {e}")
+        metrics.increment("inbox_tools.error", tool=tool)
+        yield {'type': 'error', 'detail': str(e)}
+        return
+    metrics.observe("inbox_tools.generate_s", time.perf_counter() - started, tool=tool)
+    result = "".join(parts).strip()
+    cache.put(key, result)
+    yield {'type': 'done', 'text': result, 'cached': False}
+
+
+def summarize_stream(tenant_id: str, user_id: str, conversation: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """event ของการสรุปบทสนทนาสำหรับแอดมิน"""
+    key = ('summary', tenant_id, user_id, conversation_version(conversation))
+
+    def build_prompt() -> Optional[str]:
+        summary, recent_messages, count = _context(conversation)
+        if not count:
+            return None
+        return INBOX_SUMMARY_PROMPT.format(summary=summary or "(ไม่มี)", recent_messages=recent_messages)
+
+    fallback = conversation.get('summary') or "ยังไม่มีข้อความในบทสนทนานี้"
+    return _cached_stream('summary', key, tenant_id, build_prompt, fallback)
+
+
+def draft_reply_stream(tenant_id: str, user_id: str, config: Dict[str, Any], conversation: Dict[str, Any], keywords: str) -> Iterator[Dict[str, Any]]:
+    """event ของการร่างคำตอบจากคีย์เวิร์ดของแอดมิน (persona/KB เดียวกับที่บอทใช้)"""
+    keywords = " ".join(keywords.split())[:DRAFT_MAX_KEYWORDS_CHARS]
+    if not keywords:
+        raise ValueError("keywords must not be empty")
+    keywords_hash = hashlib.sha1(keywords.encode("utf-8")).hexdigest()
+    key = ('draft', tenant_id, user_id, conversation_version(conversation), config.get('configVersion', 0), keywords_hash)
+
+    def build_prompt() -> str:
+        summary, recent_messages, _ = _context(conversation)
+        chunks = relevant_knowledge(tenant_id, config.get('knowledgeBase', ""), keywords, INBOX_TOOLS_MAX_KB_CHUNKS)
+        return DRAFT_REPLY_PROMPT.format(
+            prompt_template=build_prompt_template(config),
+            retrieved_info="\n\n".join(chunks) if chunks else "ไม่มีข้อมูลที่เกี่ยวข้องโดยตรง",
+            summary=summary or "(ไม่มี)",
+            recent_messages=recent_messages or "(ไม่มี)",
+            keywords=keywords,
+        )
+
+    return _cached_stream('draft', key, tenant_id, build_prompt, "")
@@ -0,0 +1,365 @@
+# app/services/kb_retrieval.py
+"""
+ค้นส่วนของ knowledge base (แบ่งด้วย ###) ที่เกี่ยวกับคำถามด้วย embedding แทนการจับคำตรงตัว
+(คำถาม "ส่งกี่วัน" จึงเจอหัวข้อ "ระยะเวลาจัดส่ง" ได้)
+
+* index ต่อ tenant ถูกสร้างครั้งเดียวต่อเวอร์ชันของ KB (hash ของเนื้อหา + ชื่อ embedder) และเก็บเป็นไฟล์
+  `.npy` (เมทริกซ์ float32 ต่อเนื่อง แต่ละแถว normalize แล้ว) ใต้ KB_INDEX_DIR แล้วเปิดแบบ memory-map
+  KB ที่แก้ไขจะได้เวอร์ชันใหม่เอง ไม่ต้องสั่งล้าง index
+* การค้นคือ matmul ครั้งเดียว (cosine ของทุก chunk) รวมกับคะแนนคำที่ตรงกัน (น้ำหนัก KB_LEXICAL_WEIGHT)
+  แล้วเลือก top-k ที่คะแนนไม่ต่ำกว่าเกณฑ์ของ embedder (`min_score` หรือ KB_MIN_SCORE หากตั้งไว้) และไม่ต่ำกว่า
+  KB_RELATIVE_MIN_SCORE เท่าของคะแนนสูงสุด (คะแนนของแต่ละ embedder อยู่คนละช่วงกัน เกณฑ์ตายตัวจึงใช้ร่วมกันไม่ได้)
+* embedder: Gemini (`KB_EMBEDDING_MODEL`) เมื่อมี GEMINI_API_KEY หรือ `local` ซึ่งเป็น hashing ของคำและ
+  character n-gram ที่ทำงานได้โดยไม่ต้องต่อเน็ต (ใช้ใน benchmark/ทดสอบ หรือบังคับด้วย KB_EMBEDDING_BACKEND=local)
+* index ที่ยังไม่มีจะถูกสร้างใน thread เบื้องหลัง ระหว่างนั้นหรือหากค้นไม่สำเร็จ จะกลับไปใช้การจับคำแบบเดิม
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from . import metrics
+from .search import tokenize
+
+KB_INDEX_DIR = os.getenv("KB_INDEX_DIR", "kb_index")
+KB_EMBEDDING_BACKEND = os.getenv("KB_EMBEDDING_BACKEND", "auto")  # auto | gemini | local
+KB_EMBEDDING_MODEL = os.getenv("KB_EMBEDDING_MODEL", "models/text-embedding-004")
+KB_TOP_K = int(os.getenv("KB_TOP_K", "5"))
+# ไม่ตั้ง = ใช้เกณฑ์ของ embedder (LocalEmbedder.min_score / GeminiEmbedder.min_score)
+KB_MIN_SCORE: Optional[float] = float(os.environ["KB_MIN_SCORE"]) if os.getenv("KB_MIN_SCORE") else None
+# chunk ต้องได้คะแนนอย่างน้อยเท่านี้ของคะแนนสูงสุด (ตัด chunk ท้ายๆ ที่แค่บังเอิญมีคำร่วม)
+KB_RELATIVE_MIN_SCORE = float(os.getenv("KB_RELATIVE_MIN_SCORE", "0.5"))
+KB_LEXICAL_WEIGHT = float(os.getenv("KB_LEXICAL_WEIGHT", "0.3"))
+LOCAL_EMBEDDING_DIM = 1024
+_EMBED_BATCH = 100
+_QUERY_CACHE_SIZE = 2048
+
+
+def split_chunks(knowledge_base: str) -> List[str]:
+    return [chunk.strip() for chunk in (knowledge_base or "").split('###') if chunk.strip()]
+
+
+def keyword_chunks(knowledge_base: str, text: str) -> List[str]:
+    """การจับคำแบบเดิม: chunk ที่มีคำจากข้อความ (คำยาวกว่า 2 ตัวอักษร)"""
+    keywords = [kw for kw in (text or "").split() if len(kw) > 2]
+    return [chunk.strip() for chunk in (knowledge_base or "").split('###') if any(kw in chunk for kw in keywords)]
+
+
+# --- Embedders ---
+class LocalEmbedder:
+    """
+    Hashing embedder ที่ไม่ต้องใช้ network: term จาก `search.tokenize` และ character 2/3-gram ของแต่ละ term
+    ถูก hash ลงเวกเตอร์ขนาด LOCAL_EMBEDDING_DIM (น้ำหนัก log tf) คำที่เขียนต่างกันแต่มีส่วนร่วมกัน
+    (เช่น "ส่ง" ใน "จัดส่ง") จึงยังได้ cosine ที่สูงกว่าศูนย์
+    คะแนนของ chunk ที่เกี่ยวข้องจริงมักอยู่แค่ราว 0.15-0.35 จึงใช้เกณฑ์ต่ำกว่า Gemini
+    """
+    min_score = 0.1
+
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"local-{dim}"
+
+    def _features(self, text: str) -> Dict[str, float]:
+        counts: Dict[str, float] = {}
+        for term in tokenize(text):
+            counts[f"w:{term}"] = counts.get(f"w:{term}", 0.0) + 1.0
+            padded = f" {term} "
+            for n in (2, 3):
+                for i in range(len(padded) - n + 1):
+                    gram = f"c:{padded[i:i + n]}"
+                    counts[gram] = counts.get(gram, 0.0) + 0.5
+        return counts
+
+    def embed(self, texts: Sequence[str], is_query: bool = False) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                sign = 1.0 if digest[4] & 1 else -1.0
+                matrix[row, bucket] += sign * (1.0 + np.log(count))
+        return matrix
+
+
+class GeminiEmbedder:
+    min_score = 0.3
+
+    def __init__(self, model: str = KB_EMBEDDING_MODEL):
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        self._genai = genai
+        self.model = model
+        self.name = f"gemini-{model.rsplit('/', 1)[-1]}"
+
+    def embed(self, texts: Sequence[str], is_query: bool = False) -> np.ndarray:
+        rows: List[List[float]] = []
+        task_type = "retrieval_query" if is_query else "retrieval_document"
+        for start in range(0, len(texts), _EMBED_BATCH):
+            result = self._genai.embed_content(model=self.model, content=list(texts[start:start + _EMBED_BATCH]), task_type=task_type)
+            rows.extend(result['embedding'])
+        return np.asarray(rows, dtype=np.float32)
+
+
+# Private global variable to store the initialized embedder
+_embedder: Optional[Any] = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        backend = KB_EMBEDDING_BACKEND
+        if backend == "auto":
+            backend = "gemini" if os.getenv("GEMINI_API_KEY") else "local"
+        if backend == "gemini":
+            try:
+                _embedder = GeminiEmbedder()
+            except Exception as e:
+                print(f"⚠️ KB retrieval: Gemini embeddings unavailable ({e}), using local embeddings.")
+        if _embedder is None:
+            _embedder = LocalEmbedder()
+        print(f"✅ KB retrieval: Using '{_embedder.name}' embeddings.")
+    return _embedder
+
+
+def set_embedder(embedder) -> None:
+    global _embedder
+    _embedder = embedder
+
+
+def min_score_for(embedder) -> float:
+    """เกณฑ์คะแนนขั้นต่ำ: KB_MIN_SCORE หากตั้งไว้ ไม่งั้นใช้ของ embedder"""
+    if KB_MIN_SCORE is not None:
+        return KB_MIN_SCORE
+    return getattr(embedder, 'min_score', LocalEmbedder.min_score)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+# --- Index ---
+class KnowledgeIndex:
+    """index ของ KB หนึ่งเวอร์ชัน: เมทริกซ์ embedding (memory-mapped) + postings ของคำสำหรับคะแนน lexical"""
+
+    def __init__(self, version: str, chunks: List[str], matrix: np.ndarray):
+        self.version = version
+        self.chunks = chunks
+        self.matrix = matrix
+        postings: Dict[str, List[int]] = {}
+        for position, chunk in enumerate(chunks):
+            for term in set(tokenize(chunk)):
+                postings.setdefault(term, []).append(position)
+        count = max(len(chunks), 1)
+        self._postings = {term: (np.asarray(ids, dtype=np.intp), float(np.log(1 + count / len(ids)))) for term, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def lexical_scores(self, text: str) -> np.ndarray:
+        """สัดส่วน (ถ่วงด้วย idf) ของคำในคำถามที่พบใน chunk ค่า 0..1"""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        total = 0.0
+        for term in set(tokenize(text)):
+            entry = self._postings.get(term)
+            if entry is None:
+                total += float(np.log(1 + max(len(self.chunks), 1)))
+                continue
+            ids, idf = entry
+            scores[ids] += idf
+            total += idf
+        return scores / total if total else scores
+
+    def search(
+        self,
+        query_vector: np.ndarray,
+        text: str,
+        k: int = KB_TOP_K,
+        min_score: Optional[float] = None,
+        relative_min_score: float = KB_RELATIVE_MIN_SCORE,
+        lexical_weight: float = KB_LEXICAL_WEIGHT,
+    ) -> List[Dict[str, Any]]:
+        if not self.chunks:
+            return []
+        scores = self.matrix @ query_vector
+        if lexical_weight:
+            scores = (1.0 - lexical_weight) * scores + lexical_weight * self.lexical_scores(text)
+        k = min(k, len(self.chunks))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if min_score is None:
+            min_score = min_score_for(get_embedder())
+        min_score = max(min_score, relative_min_score * float(scores[top[0]]))
+        return [{'chunk': self.chunks[i], 'score': round(float(scores[i]), 4)} for i in top if scores[i] >= min_score]
+
+
+def kb_version(knowledge_base: str, embedder_name: str) -> str:
+    return hashlib.sha1(f"{embedder_name}\n{knowledge_base}".encode("utf-8")).hexdigest()[:16]
+
+
+class KnowledgeIndexStore:
+    """index บนดิสก์ต่อ tenant (`{root}/{tenant_id}/{version}.npy` + `.json`) และที่เปิดไว้แล้วในหน่วยความจำ"""
+
+    def __init__(self, root: str = KB_INDEX_DIR):
+        self.root = root
+        self._open: Dict[str, KnowledgeIndex] = {}
+        self._tenant_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._query_vectors: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._building: set = set()
+
+    def _paths(self, tenant_id: str, version: str):
+        directory = os.path.join(self.root, tenant_id.replace('/', '_'))
+        return directory, os.path.join(directory, f"{version}.npy"), os.path.join(directory, f"{version}.json")
+
+    def _load(self, tenant_id: str, version: str) -> Optional[KnowledgeIndex]:
+        _, matrix_path, meta_path = self._paths(tenant_id, version)
+        if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        return KnowledgeIndex(version, meta['chunks'], np.load(matrix_path, mmap_mode='r'))
+
+    def build(self, tenant_id: str, knowledge_base: str, embedder=None) -> KnowledgeIndex:
+        """embed ทุก chunk แล้วเขียนไฟล์ (แทนที่ไฟล์แบบ atomic) และลบ index เวอร์ชันเก่าของ tenant"""
+        embedder = embedder or get_embedder()
+        version = kb_version(knowledge_base, embedder.name)
+        directory, matrix_path, meta_path = self._paths(tenant_id, version)
+        chunks = split_chunks(knowledge_base)
+        started = time.perf_counter()
+        matrix = _normalize(embedder.embed(chunks)) if chunks else np.zeros((0, 1), dtype=np.float32)
+        os.makedirs(directory, exist_ok=True)
+        # หลาย process อาจสร้าง index เดียวกันพร้อมกัน จึงเขียนไฟล์ชั่วคราวแยกกันแล้วค่อยแทนที่
+        suffix = f".{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(matrix_path + suffix, "wb") as f:
+            np.save(f, matrix)
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump({'chunks': chunks, 'embedder': embedder.name}, f, ensure_ascii=False)
+        os.replace(meta_path + suffix, meta_path)
+        os.replace(matrix_path + suffix, matrix_path)
+        for name in os.listdir(directory):
+            if not name.startswith(version) and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+        elapsed = time.perf_counter() - started
+        metrics.observe("kb_retrieval.build_s", elapsed)
+        print(f"📚 KB retrieval: Indexed {len(chunks)} chunks for tenant {tenant_id} in {elapsed:.2f}s (version {version}).")
+        return KnowledgeIndex(version, chunks, np.load(matrix_path, mmap_mode='r'))
+
+    def get(self, tenant_id: str, knowledge_base: str, wait: bool = True, build: bool = True) -> Optional[KnowledgeIndex]:
+        """
+        index ของ KB ปัจจุบัน เปิดจากดิสก์หรือสร้างใหม่หากยังไม่มี
+        หาก thread อื่นกำลังสร้างอยู่และ `wait` เป็น False คืน None (ผู้เรียกใช้การจับคำแทน)
+        `build` เป็น False: คืน None แทนการ embed ทั้ง KB เองเมื่อยังไม่มี index บนดิสก์
+        """
+        embedder = get_embedder()
+        version = kb_version(knowledge_base, embedder.name)
+        index = self._open.get(tenant_id)
+        if index is not None and index.version == version:
+            return index
+        with self._lock:
+            tenant_lock = self._tenant_locks.setdefault(tenant_id, threading.Lock())
+        if not tenant_lock.acquire(blocking=wait):
+            return None
+        try:
+            index = self._open.get(tenant_id)
+            if index is None or index.version != version:
+                index = self._load(tenant_id, version)
+                if index is None:
+                    if not build:
+                        return None
+                    index = self.build(tenant_id, knowledge_base, embedder)
+                self._open[tenant_id] = index
+            return index
+        finally:
+            tenant_lock.release()
+
+    def build_in_background(self, tenant_id: str, knowledge_base: str) -> None:
+        """สร้าง index ใน thread เบื้องหลัง (ครั้งละหนึ่ง thread ต่อ tenant) ความผิดพลาดไม่กระทบผู้เรียก"""
+        with self._lock:
+            if tenant_id in self._building:
+                return
+            self._building.add(tenant_id)
+
+        def run() -> None:
+            try:
+                self.get(tenant_id, knowledge_base)
+            except Exception as e:
+                print(f"⚠️ KB retrieval: Could not index knowledge base for tenant {tenant_id}: {e}")
+            finally:
+                with self._lock:
+                    self._building.discard(tenant_id)
+
+        threading.Thread(target=run, name=f"kb-index-{tenant_id}", daemon=True).start()
+
+    def query_vector(self, text: str) -> np.ndarray:
+        """embedding ของคำถาม (normalize แล้ว) cache ไว้เพราะคำถามสั้นๆ ซ้ำกันบ่อย"""
+        embedder = get_embedder()
+        key = (embedder.name, text)
+        with self._lock:
+            vector = self._query_vectors.get(key)
+            if vector is not None:
+                self._query_vectors.move_to_end(key)
+                return vector
+        vector = _normalize(embedder.embed([text], is_query=True))[0]
+        with self._lock:
+            self._query_vectors[key] = vector
+            while len(self._query_vectors) > _QUERY_CACHE_SIZE:
+                self._query_vectors.popitem(last=False)
+        return vector
+
+
+# Private global variable to store the initialized index store
+_index_store: Optional[KnowledgeIndexStore] = None
+
+
+def get_index_store() -> KnowledgeIndexStore:
+    global _index_store
+    if _index_store is None:
+        _index_store = KnowledgeIndexStore()
+    return _index_store
+
+
+def set_index_store(store: Optional[KnowledgeIndexStore]) -> None:
+    global _index_store
+    _index_store = store
+
+
+def warm(tenant_id: str, knowledge_base: str) -> None:
+    """สร้าง index ล่วงหน้า (เรียกเบื้องหลังหลังแก้ KB) ความผิดพลาดไม่กระทบผู้เรียก"""
+    try:
+        get_index_store().get(tenant_id, knowledge_base)
+    except Exception as e:
+        print(f"⚠️ KB retrieval: Could not index knowledge base for tenant {tenant_id}: {e}")
+
+
+def retrieve(tenant_id: str, knowledge_base: str, text: str, k: int = KB_TOP_K) -> List[str]:
+    """
+    chunk ที่เกี่ยวข้องที่สุดไม่เกิน k ส่วน (กลับไปใช้การจับคำหากค้นแบบ embedding ไม่ได้)
+    ไม่ embed KB ใน request: index ที่ยังไม่มีจะถูกสร้างเบื้องหลัง และใช้การจับคำไปก่อน
+    """
+    if not knowledge_base or not knowledge_base.strip():
+        return []
+    started = time.perf_counter()
+    try:
+        store = get_index_store()
+        index = store.get(tenant_id, knowledge_base, wait=False, build=False)
+        if index is None:
+            store.build_in_background(tenant_id, knowledge_base)
+        else:
+            results = index.search(store.query_vector(text), text, k)
+            metrics.observe("kb_retrieval.search_s", time.perf_counter() - started)
+            metrics.increment("kb_retrieval.searches", hit=bool(results))
+            return [result['chunk'] for result in results]
+    except Exception as e:
+        print(f"⚠️ KB retrieval: Semantic search failed for tenant {tenant_id}, using keywords: {e}")
+    metrics.increment("kb_retrieval.keyword_fallback")
+    return keyword_chunks(knowledge_base, text)[:k]
@@ -1,6 +1,14 @@
 # app/services/line_api.py
+import os
 import requests
-from typing import Dict, Any # ✨ เพิ่มการ import Type Hint
+from typing import Dict, Any, List, Optional # ✨ เพิ่มการ import Type Hint
+
+# Base URL ของ LINE Messaging API (override ได้เพื่อชี้ไปยัง fake server ตอนทำ benchmark)
+LINE_API_BASE_URL = os.getenv("LINE_API_BASE_URL", "https://api.line.me").rstrip("/")
+
+def _status_code(e: requests.exceptions.RequestException):
+    """HTTP status ของ error (None หากเป็นปัญหาเครือข่าย) ใช้ตัดสินว่าควรลองส่งซ้ำหรือไม่"""
+    return e.response.status_code if getattr(e, "response", None) is not None else None
 
 def send_line_message(reply_token: str, message_text: str, line_access_token: str) -> Dict[str, Any]:
     """
@@ -20,20 +28,20 @@ def send_line_message(reply_token: str, message_text: str, line_access_token: st
     }
 
     try:
-        response = requests.post("https://api.line.me/v2/bot/message/reply", headers=line_headers, json=reply_body)
+        response = requests.post(f"{LINE_API_BASE_URL}/v2/bot/message/reply", headers=line_headers, json=reply_body)
         response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
         print(f"✅ LINE API: Message sent successfully. Response: {response.json()}")
         return {"status": "ok", "response": response.json()}
     except requests.exceptions.RequestException as e:
         print(f"❌ LINE API: Failed to send message: {e}")
-        return {"status": "error", "message": f"Failed to send LINE message: {e}"}
+        return {"status": "error", "message": f"Failed to send LINE message: {e}", "status_code": _status_code(e)}
 
 # ✨ --- เพิ่มฟังก์ชันใหม่ด้านล่างนี้ --- ✨
 def get_line_user_profile(user_id: str, access_token: str) -> dict:
     """
     ดึงข้อมูลโปรไฟล์ผู้ใช้จาก LINE โดยใช้ User ID
     """
-    url = f"https://api.line.me/v2/bot/profile/{user_id}"
+    url = f"{LINE_API_BASE_URL}/v2/bot/profile/{user_id}"
     headers = {"Authorization": f"Bearer {access_token}"}
     try:
         response = requests.get(url, headers=headers)
@@ -43,21 +51,24 @@ def get_line_user_profile(user_id: str, access_token: str) -> dict:
         print(f"❌ Could not fetch LINE profile for {user_id}: {e}")
         return {} # คืนค่า dict ว่างเปล่าหากเกิดข้อผิดพลาด
 
-def push_line_message(user_id: str, message_text: str, line_access_token: str) -> Dict[str, Any]:
+def push_line_message(user_id: str, message_text: str, line_access_token: str, retry_key: Optional[str] = None) -> Dict[str, Any]:
     """
     Sends a push message to a specific user via the LINE Messaging API.
-    Used for admin-initiated messages.
+    Used for admin-initiated messages and as the fallback when a reply token has expired.
+    `retry_key` (a UUID) makes retries idempotent: LINE answers 409 if it was already accepted.
     """
     if not line_access_token:
         print("❌ LINE API (Push): Missing LINE Channel Access Token.")
         return {"status": "error", "message": "Missing LINE token"}
 
-    push_url = "https://api.line.me/v2/bot/message/push"
+    push_url = f"{LINE_API_BASE_URL}/v2/bot/message/push"
     
     headers = {
         "Authorization": f"Bearer {line_access_token}",
         "Content-Type": "application/json"
     }
+    if retry_key:
+        headers["X-Line-Retry-Key"] = retry_key
 
     body = {
         "to": user_id,
@@ -70,5 +81,48 @@ def push_line_message(user_id: str, message_text: str, line_access_token: str) -
         print(f"✅ LINE API (Push): Message pushed successfully to {user_id}.")
         return {"status": "ok", "response": response.json()}
     except requests.exceptions.RequestException as e:
+        if retry_key and _status_code(e) == 409:
+            print(f"✅ LINE API (Push): Message to {user_id} was already accepted (retry key {retry_key}).")
+            return {"status": "ok", "response": {}}
         print(f"❌ LINE API (Push): Failed to push message: {e}")
-        return {"status": "error", "message": f"Failed to push LINE message: {e}"}
\ No newline at end of file
+        return {"status": "error", "message": f"Failed to push LINE message: {e}", "status_code": _status_code(e)}
+
+
+# LINE จำกัดผู้รับต่อการเรียก multicast หนึ่งครั้งไว้ที่ 500 คน
+LINE_MULTICAST_MAX_RECIPIENTS = 500
+
+
+def multicast_line_message(user_ids: List[str], message_text: str, line_access_token: str, retry_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Sends the same message to up to 500 users in a single LINE Messaging API call.
+    Used by broadcast campaigns; `retry_key` works the same way as in `push_line_message`.
+    """
+    if not line_access_token:
+        print("❌ LINE API (Multicast): Missing LINE Channel Access Token.")
+        return {"status": "error", "message": "Missing LINE token"}
+    if len(user_ids) > LINE_MULTICAST_MAX_RECIPIENTS:
+        return {"status": "error", "message": f"Multicast supports at most {LINE_MULTICAST_MAX_RECIPIENTS} recipients", "status_code": 400}
+
+    headers = {
+        "Authorization": f"Bearer {line_access_token}",
+        "Content-Type": "application/json"
+    }
+    if retry_key:
+        headers["X-Line-Retry-Key"] = retry_key
+
+    body = {
+        "to": user_ids,
+        "messages": [{"type": "text", "text": message_text.strip()}]
+    }
+
+    try:
+        response = requests.post(f"{LINE_API_BASE_URL}/v2/bot/message/multicast", headers=headers, json=body)
+        response.raise_for_status()
+        print(f"✅ LINE API (Multicast): Message sent to {len(user_ids)} users.")
+        return {"status": "ok", "response": response.json()}
+    except requests.exceptions.RequestException as e:
+        if retry_key and _status_code(e) == 409:
+            print(f"✅ LINE API (Multicast): Batch was already accepted (retry key {retry_key}).")
+            return {"status": "ok", "response": {}}
+        print(f"❌ LINE API (Multicast): Failed to send message: {e}")
+        return {"status": "error", "message": f"Failed to multicast LINE message: {e}", "status_code": _status_code(e)}
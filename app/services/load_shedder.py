@@ -0,0 +1,218 @@
+# app/services/load_shedder.py
+"""
+Admission control และการลดคุณภาพแบบเป็นขั้น (graceful degradation) ของการสร้างคำตอบบอท
+
+จำกัดจำนวนคำตอบที่สร้างพร้อมกัน (`BOT_MAX_CONCURRENCY`) และจำนวนที่รอคิว (`BOT_MAX_QUEUE`)
+ยิ่งงานค้างมากเท่าไร (load = (กำลังทำ + รอคิว) / BOT_MAX_CONCURRENCY) ก็ยิ่งตัดงานที่ไม่จำเป็นออก:
+
+    0 normal               ทำงานเต็มรูปแบบ
+    1 skip_summarization   ไม่สรุปบทสนทนา (ทำในข้อความถัดไปเมื่อโหลดลดลง)
+    2 shrink_context       ส่ง history และข้อมูลอ้างอิงให้ model น้อยลง
+    3 cheap_model          ใช้ model ระดับ lite แทน standard/strong
+    4 canned               คิวเต็มหรือรอนานเกินไป: ตอบข้อความ "จะรีบตอบกลับ" และให้แอดมินตอบเอง
+
+ระดับปัจจุบันดูได้จาก gauge `load.level`, `load.in_flight`, `load.waiting` ที่ GET /api/metrics
+
+webhook รอคิวด้วย `admit_async` ใน event loop ก่อนส่งงานเข้า threadpool งานที่รอคิวจึงไม่ถือ thread ไว้
+"""
+import asyncio
+import os
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Deque, Iterator, Optional, Sequence, Tuple
+
+from . import metrics
+
+LEVEL_NORMAL = 0
+LEVEL_SKIP_SUMMARIZATION = 1
+LEVEL_SHRINK_CONTEXT = 2
+LEVEL_CHEAP_MODEL = 3
+LEVEL_CANNED = 4
+LEVEL_NAMES = ("normal", "skip_summarization", "shrink_context", "cheap_model", "canned")
+
+BOT_MAX_CONCURRENCY = int(os.getenv("BOT_MAX_CONCURRENCY", "64"))
+BOT_MAX_QUEUE = int(os.getenv("BOT_MAX_QUEUE", "256"))
+# รอคิวได้นานสุดเท่านี้ ก่อนตอบแบบ canned (replyToken ของ LINE มีอายุจำกัด)
+BOT_QUEUE_TIMEOUT_S = float(os.getenv("BOT_QUEUE_TIMEOUT_S", "10"))
+# load ที่เริ่มใช้ระดับ 1, 2, 3 ตามลำดับ
+LOAD_SHED_THRESHOLDS = tuple(float(v) for v in os.getenv("LOAD_SHED_THRESHOLDS", "0.5,0.75,1.0").split(","))
+
+# ขนาด context เมื่อถึงระดับ shrink_context
+SHED_RECENT_MESSAGES = 2
+SHED_MAX_KB_CHUNKS = 2
+SHED_MAX_PRODUCTS = 3
+
+
+class _Waiter:
+    """งานหนึ่งงานที่รอคิว: `granted` ถูกตั้งเมื่อได้ slot ต่อจากงานที่เสร็จ แล้วปลุกด้วย `wake`"""
+    __slots__ = ("granted", "wake")
+
+    def __init__(self, wake: Callable[[], None]):
+        self.granted = False
+        self.wake = wake
+
+
+class AdmissionController:
+    """
+    จำกัดงานที่ทำพร้อมกัน/รอคิว และบอกระดับการลดคุณภาพของงานที่ได้รับเข้ามา (ใช้ได้จากหลาย thread)
+    คิวเป็น FIFO เดียวกันทั้งงานที่รอแบบ sync (`admit`) และแบบ async (`admit_async`)
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = BOT_MAX_CONCURRENCY,
+        max_queue: int = BOT_MAX_QUEUE,
+        queue_timeout_s: float = BOT_QUEUE_TIMEOUT_S,
+        thresholds: Sequence[float] = LOAD_SHED_THRESHOLDS,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout_s = queue_timeout_s
+        self.thresholds = tuple(thresholds)
+        self._lock = threading.Lock()
+        self._waiters: Deque[_Waiter] = deque()
+        self.in_flight = 0
+        self.waiting = 0
+
+    def _level_locked(self) -> int:
+        load = (self.in_flight + self.waiting) / self.max_concurrency
+        level = LEVEL_NORMAL
+        for candidate, threshold in enumerate(self.thresholds, start=1):
+            if load >= threshold:
+                level = candidate
+        return min(level, LEVEL_CHEAP_MODEL)
+
+    def _publish_locked(self, level: int) -> None:
+        metrics.set_gauge("load.in_flight", self.in_flight)
+        metrics.set_gauge("load.waiting", self.waiting)
+        metrics.set_gauge("load.level", level)
+
+    def level(self) -> int:
+        with self._lock:
+            return self._level_locked()
+
+    def _enter(self, wake: Callable[[], None]) -> Tuple[Optional[int], Optional[_Waiter]]:
+        """
+        ได้ slot ทันที -> (ระดับ, None), ต้องรอ -> (None, waiter), คิวเต็ม -> (None, None)
+        ถ้ามีงานรอคิวอยู่ งานใหม่ต้องต่อท้ายคิวแม้จะมี slot ว่าง (ไม่แซงคิว)
+        """
+        with self._lock:
+            if self.in_flight < self.max_concurrency and not self._waiters:
+                self.in_flight += 1
+                level = self._level_locked()
+                self._publish_locked(level)
+                return level, None
+            if self.waiting >= self.max_queue:
+                self._publish_locked(LEVEL_CANNED)
+                return None, None
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            self.waiting += 1
+            self._publish_locked(self._level_locked())
+            return None, waiter
+
+    def _finish_wait(self, waiter: _Waiter) -> Optional[int]:
+        """หลังรอเสร็จ (ได้ slot, หมดเวลา หรือถูกยกเลิก): คืนระดับถ้าได้ slot แล้ว ไม่งั้นออกจากคิวและคืน None"""
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                self.waiting -= 1
+                self._publish_locked(LEVEL_CANNED)
+                return None
+            level = self._level_locked()
+            self._publish_locked(level)
+            return level
+
+    def _release(self) -> None:
+        """คืน slot: ส่งต่อให้งานแรกในคิวโดยตรง (in_flight ไม่เปลี่ยน) หรือลด in_flight ถ้าไม่มีใครรอ"""
+        with self._lock:
+            waiter = self._waiters.popleft() if self._waiters else None
+            if waiter is not None:
+                waiter.granted = True
+                self.waiting -= 1
+            else:
+                self.in_flight -= 1
+            self._publish_locked(self._level_locked())
+        if waiter is not None:
+            waiter.wake()
+
+    @staticmethod
+    def _record_admission(level: Optional[int], queued: bool) -> int:
+        if level is None:
+            metrics.increment("load.shed", reason="queue_timeout" if queued else "queue_full")
+            return LEVEL_CANNED
+        metrics.increment("load.admitted", level=LEVEL_NAMES[level])
+        return level
+
+    @contextmanager
+    def admit(self) -> Iterator[int]:
+        """
+        ใช้ครอบการสร้างคำตอบหนึ่งครั้ง คืนระดับการลดคุณภาพที่งานนี้ควรใช้
+        thread ที่เรียกจะถูกบล็อกระหว่างรอคิว: โค้ด async ควรใช้ `admit_async` ก่อน run_in_threadpool
+        """
+        granted = threading.Event()
+        level, waiter = self._enter(granted.set)
+        if waiter is not None:
+            granted.wait(self.queue_timeout_s)
+            level = self._finish_wait(waiter)
+        admitted = level is not None
+        level = self._record_admission(level, queued=waiter is not None)
+        if not admitted:
+            yield level
+            return
+        try:
+            yield level
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def admit_async(self) -> AsyncIterator[int]:
+        """
+        เหมือน `admit` แต่รอคิวใน event loop จึงไม่กิน thread ของ threadpool ระหว่างรอ
+        (งานที่รอคิวอยู่จะไม่ทำให้ endpoint อื่นแย่ง thread ไม่ได้)
+        """
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake() -> None:
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        level, waiter = self._enter(wake)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout_s)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # ถูกยกเลิกระหว่างรอ: ออกจากคิว หรือคืน slot ที่เพิ่งได้รับต่อมา
+                if self._finish_wait(waiter) is not None:
+                    self._release()
+                raise
+            level = self._finish_wait(waiter)
+        admitted = level is not None
+        level = self._record_admission(level, queued=waiter is not None)
+        if not admitted:
+            yield level
+            return
+        try:
+            yield level
+        finally:
+            self._release()
+
+
+# Private global variable to store the initialized controller
+_admission_controller_instance: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    global _admission_controller_instance
+    if _admission_controller_instance is None:
+        _admission_controller_instance = AdmissionController()
+    return _admission_controller_instance
+
+
+def set_admission_controller(controller: Optional[AdmissionController]) -> None:
+    """Replaces the active controller (used by benchmarks to try different limits)."""
+    global _admission_controller_instance
+    _admission_controller_instance = controller
@@ -0,0 +1,82 @@
+# app/services/metrics.py
+"""
+In-process metrics (counters, gauges and latency samples) for this instance.
+
+Metrics are keyed by name plus optional labels, e.g.
+`increment("delivery.failures", platform="line", reason="http_500")`.
+Latency samples are kept in a bounded window per key so percentiles reflect
+recent traffic. `snapshot()` is served by `GET /api/metrics`.
+"""
+import threading
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict
+
+LATENCY_WINDOW = 2048
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, float] = {}
+_timings: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+_timing_totals: Dict[str, int] = defaultdict(int)
+
+
+def _key(name: str, labels: Dict[str, Any]) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+def increment(name: str, value: float = 1, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Records a latency sample (in seconds)."""
+    key = _key(name, labels)
+    with _lock:
+        _timings[key].append(seconds)
+        _timing_totals[key] += 1
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        timings = {key: (sorted(values), _timing_totals[key]) for key, values in _timings.items()}
+    return {
+        "counters": counters,
+        "gauges": gauges,
+        "latencies_ms": {
+            key: {
+                "count": total,
+                "p50": round(1000 * _percentile(values, 50), 2),
+                "p95": round(1000 * _percentile(values, 95), 2),
+                "p99": round(1000 * _percentile(values, 99), 2),
+            }
+            for key, (values, total) in timings.items()
+        },
+    }
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
+        _timing_totals.clear()
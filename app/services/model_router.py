@@ -0,0 +1,107 @@
+# app/services/model_router.py
+"""
+เลือกระดับ model ต่อข้อความตามความยากของคำถาม เพื่อลด latency และค่าใช้จ่ายโดยไม่ลดคุณภาพคำตอบ
+
+* `canned`   ข้อความขอบคุณ/รับทราบล้วนๆ ตอบด้วยข้อความสำเร็จรูปโดยไม่เรียก LLM
+* `lite`     ข้อความสั้นที่ไม่ใช่คำถามและไม่ตรงกับ knowledge base (เช่น ทักทาย)
+* `standard` คำถามทั่วไป (model เดิมของระบบ)
+* `strong`   คำถามยาว เปรียบเทียบ หรืออ้างอิงข้อมูลหลายส่วนของ knowledge base
+
+tenant ปรับได้ด้วยฟิลด์ `modelRoutingEnabled` (false = ใช้ standard เสมอ), `modelTierOverride`
+(บังคับระดับ model) และ `cannedRepliesEnabled` / `cannedReplies` (ข้อความสำเร็จรูปของร้าน)
+"""
+import os
+import re
+from typing import Any, Dict, Optional
+
+from . import metrics
+
+MODEL_TIERS = ("lite", "standard", "strong")
+# summarization ไม่ต้องใช้ความสามารถสูง จึงใช้ model ระดับเบาเป็นค่าเริ่มต้น
+SUMMARIZATION_TIER = os.getenv("SUMMARIZATION_MODEL_TIER", "lite")
+
+LITE_MAX_CHARS = 25
+STRONG_MIN_CHARS = 250
+STRONG_MIN_KB_HITS = 3
+
+_ACK_WORDS = re.compile(r"ขอบคุณ|ขอบใจ|แต๊งกิ้ว|รับทราบ|โอเค|thank|thx|\bty\b|\bok(ay)?\b", re.IGNORECASE)
+# คำลงท้าย/คำเสริม อีโมจิ และเครื่องหมายที่อาจตามหลังคำขอบคุณ (ถ้าเหลืออย่างอื่นแสดงว่ามีเนื้อหาเพิ่ม)
+_ACK_FILLER = re.compile(
+    r"ขอบคุณ|ขอบใจ|แต๊งกิ้ว|รับทราบ|โอเค|thanks?|thx|\bty\b|\bok(ay)?\b|\byou\b|\bso\b|\bmuch\b|"
+    r"มากๆ|มาก|เลย|นะคะ|นะครับ|นะ|ค่ะ|คะ|ค่า|ครับ|คับ|จ้า|จ้ะ|ๆ|"
+    r"[\s\W_]|[\U0001F300-\U0001FAFF☀-➿]",
+    re.IGNORECASE,
+)
+_QUESTION = re.compile(r"\?|ไหม|มั้ย|มั๊ย|อะไร|เท่าไร|เท่าไหร่|ยังไง|อย่างไร|ที่ไหน|เมื่อไร|เมื่อไหร่|กี่|ทำไม|หรือเปล่า|รึเปล่า|หรือยัง|รึยัง|ยัง(คะ|ครับ)?\s*$|ได้ไหม|how|what|when|where|why|which", re.IGNORECASE)
+_COMPARISON = re.compile(r"เปรียบเทียบ|ต่างกัน|แตกต่าง|ดีกว่า|อันไหนดี|ตัวไหนดี|แบบไหนดี|ข้อดีข้อเสีย|compare|\bvs\.?\b", re.IGNORECASE)
+
+DEFAULT_CANNED_THANKS = "ยินดีให้บริการ{particle} 😊 หากต้องการสอบถามเพิ่มเติมทักมาได้ตลอดเลย{particle}"
+DEFAULT_CANNED_ACK = "รับทราบ{particle} 😊"
+DEFAULT_CANNED_OVERLOAD = "ขณะนี้มีผู้ติดต่อเข้ามาจำนวนมาก แอดมินจะรีบตอบกลับโดยเร็วที่สุด{particle} 🙏"
+
+
+def is_acknowledgement(user_input: str) -> bool:
+    """ข้อความที่มีแค่คำขอบคุณ/รับทราบ (และคำลงท้าย อีโมจิ) ไม่มีคำถามหรือเนื้อหาอื่น"""
+    text = user_input.strip()
+    if not text or len(text) > 40 or _QUESTION.search(text):
+        return False
+    return bool(_ACK_WORDS.search(text)) and not _ACK_FILLER.sub("", text)
+
+
+def canned_route(config: Dict[str, Any], user_input: str) -> Optional[Dict[str, str]]:
+    """route `canned` หากตอบข้อความนี้ด้วยข้อความสำเร็จรูปได้ (ตัดสินจากข้อความอย่างเดียว จึงเรียกก่อนเตรียม context)"""
+    if config.get('cannedRepliesEnabled', True) and is_acknowledgement(user_input):
+        return {'route': 'canned', 'reason': 'acknowledgement'}
+    return None
+
+
+def choose_tier(config: Dict[str, Any], user_input: str, kb_hits: int) -> Dict[str, str]:
+    """ระดับ model (lite/standard/strong) สำหรับข้อความที่ต้องเรียก LLM ตามการตั้งค่าของ tenant"""
+    override = config.get('modelTierOverride')
+    if override in MODEL_TIERS:
+        return {'route': override, 'reason': 'tenant_override'}
+    if not config.get('modelRoutingEnabled', True):
+        return {'route': 'standard', 'reason': 'routing_disabled'}
+
+    text = user_input.strip()
+    if len(text) >= STRONG_MIN_CHARS:
+        return {'route': 'strong', 'reason': 'long_query'}
+    if kb_hits >= STRONG_MIN_KB_HITS:
+        return {'route': 'strong', 'reason': 'many_kb_hits'}
+    if _COMPARISON.search(text) or len(_QUESTION.findall(text)) >= 3:
+        return {'route': 'strong', 'reason': 'comparison'}
+    if len(text) <= LITE_MAX_CHARS and kb_hits == 0 and not _QUESTION.search(text):
+        return {'route': 'lite', 'reason': 'short_no_question'}
+    return {'route': 'standard', 'reason': 'default'}
+
+
+def choose_route(config: Dict[str, Any], user_input: str, kb_hits: int) -> Dict[str, str]:
+    """คืน {'route': ..., 'reason': ...} สำหรับข้อความนี้ตามการตั้งค่าของ tenant"""
+    return canned_route(config, user_input) or choose_tier(config, user_input, kb_hits)
+
+
+def _particle(config: Dict[str, Any]) -> str:
+    return "ครับ" if "ครับ" in (config.get('botPersona') or "") else "ค่ะ"
+
+
+def canned_reply(config: Dict[str, Any], user_input: str) -> str:
+    """ข้อความสำเร็จรูป (ใช้ของร้านจาก `cannedReplies` ถ้ามี) ใช้คำลงท้ายตาม persona ของบอท"""
+    overrides = config.get('cannedReplies') or {}
+    particle = _particle(config)
+    if re.search(r"ขอบคุณ|ขอบใจ|แต๊งกิ้ว|thank|thx|\bty\b", user_input, re.IGNORECASE):
+        return overrides.get('thanks') or DEFAULT_CANNED_THANKS.format(particle=particle)
+    return overrides.get('ack') or DEFAULT_CANNED_ACK.format(particle=particle)
+
+
+def overload_reply(config: Dict[str, Any]) -> str:
+    """ข้อความ "จะรีบตอบกลับ" เมื่อระบบรับงานไม่ไหว (ร้านกำหนดเองได้ที่ `cannedReplies.overload`)"""
+    overrides = config.get('cannedReplies') or {}
+    return overrides.get('overload') or DEFAULT_CANNED_OVERLOAD.format(particle=_particle(config))
+
+
+def record(route: str, seconds: float, ok: bool = True, reason: str = "") -> None:
+    """บันทึกจำนวนและ latency ต่อ route (ดูได้ที่ GET /api/metrics)"""
+    metrics.increment("llm.route", route=route, reason=reason)
+    metrics.observe("llm.route_latency", seconds, route=route)
+    if not ok:
+        metrics.increment("llm.route_failures", route=route)
@@ -0,0 +1,71 @@
+# app/services/pending_counters.py
+"""
+ตัวนับในหน่วยความจำที่ถูกรวมยอดแล้วเขียนลง storage เป็นระยะ (ใช้ร่วมกันโดย usage และ analytics)
+
+* `add` เพิ่มยอดลง key (tuple เช่น (tenant_id, วัน)) โดยไม่เขียน DB
+* `flush()` สลับตัวนับชุดใหม่เข้าแทน แล้วเขียนยอดของแต่ละ key ผ่าน `write(storage, key, counters)`
+  key ที่เขียนไม่สำเร็จจะถูกคืนยอดกลับเข้าตัวนับเพื่อให้รอบถัดไปเขียนซ้ำ
+* `run_flush_worker()` คือ background loop ที่เริ่มจาก lifespan ของ app
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from .storage import get_storage
+
+CounterKey = Tuple[str, ...]
+
+
+def _new_pending() -> Dict[CounterKey, Dict[str, float]]:
+    return defaultdict(lambda: defaultdict(float))
+
+
+class PendingCounters:
+    """ตัวนับที่รอ flush หนึ่งชุด (ใช้ได้จากหลาย thread)"""
+
+    def __init__(self, name: str, write: Callable[[Any, CounterKey, Dict[str, float]], None], flush_interval_s: float):
+        self.name = name
+        self.flush_interval_s = flush_interval_s
+        self._write = write
+        self._lock = threading.Lock()
+        self._pending = _new_pending()
+
+    def add(self, key: CounterKey, deltas: Dict[str, float]) -> None:
+        with self._lock:
+            counters = self._pending[key]
+            for metric, value in deltas.items():
+                counters[metric] += value
+
+    def pending(self) -> List[Tuple[CounterKey, Dict[str, float]]]:
+        """สำเนาของยอดที่ยังไม่ flush (ให้การอ่านสถิติรวมยอดล่าสุดของ instance นี้ได้)"""
+        with self._lock:
+            return [(key, dict(counters)) for key, counters in self._pending.items()]
+
+    def flush(self) -> int:
+        """เขียนยอดสะสมทั้งหมดลง storage แล้วล้างตัวนับ คืนค่าจำนวน key ที่เขียนสำเร็จ"""
+        with self._lock:
+            pending, self._pending = self._pending, _new_pending()
+        storage = get_storage()
+        if not pending or not storage:
+            return 0
+        written = 0
+        for key, counters in pending.items():
+            try:
+                self._write(storage, key, dict(counters))
+                written += 1
+            except Exception as e:
+                print(f"❌ {self.name}: Could not flush {'/'.join(key)}: {e}")
+                self.add(key, counters)
+        return written
+
+    async def run_flush_worker(self) -> None:
+        """Background loop ที่ flush ตัวนับทุก `flush_interval_s` วินาที"""
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            try:
+                await run_in_threadpool(self.flush)
+            except Exception as e:
+                print(f"❌ {self.name} flush worker error: {e}")
@@ -0,0 +1,307 @@
+# app/services/search.py
+"""
+Full-text search ของข้อความในแชทแต่ละ tenant (SQLite FTS5 แบบฝังตัว)
+
+index เป็นไฟล์ SQLite ในเครื่อง (SEARCH_INDEX_PATH) ที่อัปเดตทีละข้อความทุกครั้งที่มีการบันทึกข้อความใหม่
+จึงเปิดใช้เฉพาะกับ storage แบบ SQLite (instance เดียว ไฟล์อยู่เครื่องเดียวกับข้อมูล) บน Firestore ซึ่งรันหลาย
+instance (Cloud Run) แต่ละ instance จะมี index ไม่ครบและหายทุกครั้งที่ deploy ใหม่ การค้นหาจึงปิดไว้
+
+ภาษาไทยไม่มีการเว้นวรรคระหว่างคำ จึงตัดคำก่อนส่งเข้า FTS5:
+* ถ้าติดตั้ง pythainlp ไว้ ใช้ตัวตัดคำ newmm
+* ถ้าไม่มี แบ่งเป็นกลุ่มตัวอักษร (พยัญชนะ + สระ/วรรณยุกต์ที่ซ้อนอยู่) แล้วทำเป็น bigram
+  ข้อความค้นหาถูกแปลงแบบเดียวกันและค้นเป็น phrase จึงหาคำที่อยู่กลางประโยคได้
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+from .archive import read_segment
+from .storage import get_storage
+
+try:
+    from pythainlp.tokenize import word_tokenize as _thai_word_tokenize
+except ImportError:  # pythainlp เป็น optional dependency
+    _thai_word_tokenize = None
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed_messages (
+    id INTEGER PRIMARY KEY,
+    tenant_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    message_key TEXT NOT NULL,
+    role TEXT,
+    timestamp TEXT,
+    text TEXT NOT NULL,
+    UNIQUE (tenant_id, message_key)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS message_terms USING fts5(
+    tenant_id,
+    terms,
+    tokenize = "unicode61 categories 'L* N* M* Co'"
+);
+"""
+
+_THAI_RUN = re.compile(r'[฀-๿]+')
+_TOKEN = re.compile(r'[฀-๿]+|[^\W_฀-๿]+', re.UNICODE)
+# สระหน้า (เ แ โ ใ ไ) เขียนก่อนพยัญชนะ จึงต้องรวมเข้ากับพยัญชนะตัวถัดไป
+_THAI_LEADING_VOWELS = set('เแโใไ')
+SNIPPET_RADIUS = 40
+
+
+def _thai_clusters(run: str) -> List[str]:
+    clusters: List[str] = []
+    pending = ""
+    for char in run:
+        if clusters and not pending and unicodedata.category(char) == 'Mn':
+            clusters[-1] += char
+        elif char in _THAI_LEADING_VOWELS:
+            pending += char
+        else:
+            clusters.append(pending + char)
+            pending = ""
+    if pending:
+        clusters.append(pending)
+    return clusters
+
+
+def _thai_terms(run: str) -> List[str]:
+    if _thai_word_tokenize is not None:
+        return [word for word in _thai_word_tokenize(run, engine="newmm") if word.strip()]
+    clusters = _thai_clusters(run)
+    if len(clusters) == 1:
+        return clusters
+    return [clusters[i] + clusters[i + 1] for i in range(len(clusters) - 1)]
+
+
+def tokenize(text: str) -> List[str]:
+    """แปลงข้อความเป็นรายการ term (ตัวพิมพ์เล็ก) สำหรับ index และการค้นหา"""
+    terms: List[str] = []
+    for token in _TOKEN.findall(unicodedata.normalize('NFC', text or "").lower()):
+        if _THAI_RUN.fullmatch(token):
+            terms.extend(_thai_terms(token))
+        else:
+            terms.append(token)
+    return terms
+
+
+def _match_expression(query: str) -> Optional[str]:
+    """สร้าง FTS5 MATCH expression: ทุกคำในคำค้นต้องพบ (คำไทยค้นเป็น phrase ของ term ที่ตัดไว้)"""
+    clauses = []
+    for token in _TOKEN.findall(unicodedata.normalize('NFC', query or "").lower()):
+        if _THAI_RUN.fullmatch(token):
+            terms = _thai_terms(token)
+            if _thai_word_tokenize is None and len(terms) == 1:
+                # คำค้นที่มีกลุ่มอักษรเดียวให้ค้นแบบ prefix ของ bigram
+                clauses.append(f'"{terms[0]}"*')
+                continue
+            clauses.append('"' + " ".join(terms) + '"')
+        else:
+            clauses.append(f'"{token}"*')
+    return " AND ".join(clauses) if clauses else None
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    return " ".join(part.get('text', '') for part in message.get('parts', []) if isinstance(part, dict)).strip()
+
+
+def _message_key(user_id: str, message: Dict[str, Any], text: str) -> str:
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+    return f"{user_id}|{message.get('timestamp')}|{message.get('role')}|{digest}"
+
+
+def _snippet(text: str, query: str) -> str:
+    lowered = text.lower()
+    positions = [lowered.find(token) for token in _TOKEN.findall(query.lower())]
+    positions = [p for p in positions if p >= 0]
+    if not positions:
+        return text[:SNIPPET_RADIUS * 2]
+    start = max(0, min(positions) - SNIPPET_RADIUS)
+    end = min(len(text), min(positions) + SNIPPET_RADIUS)
+    return ("…" if start > 0 else "") + text[start:end] + ("…" if end < len(text) else "")
+
+
+class SearchIndex:
+    """Index ของข้อความทุก tenant ในไฟล์ SQLite เดียว (ใช้ connection เดียวพร้อม lock)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def index_messages(self, tenant_id: str, user_id: str, messages: Iterable[Dict[str, Any]]) -> int:
+        """เพิ่มข้อความเข้า index (ข้อความที่เคย index แล้วจะถูกข้าม) คืนค่าจำนวนที่เพิ่ม"""
+        return self.index_bulk(tenant_id, {user_id: messages})
+
+    def index_bulk(self, tenant_id: str, messages_by_user: Dict[str, Iterable[Dict[str, Any]]]) -> int:
+        """เหมือน `index_messages` แต่รวมหลายแชทใน transaction เดียว (ใช้กับ broadcast)"""
+        rows = []
+        for user_id, messages in messages_by_user.items():
+            for message in messages:
+                text = _message_text(message)
+                if text:
+                    rows.append((user_id, message, text))
+        if not rows:
+            return 0
+        added = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, message, text in rows:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO indexed_messages (tenant_id, user_id, message_key, role, timestamp, text) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (tenant_id, user_id, _message_key(user_id, message, text), message.get('role'), message.get('timestamp'), text),
+                    )
+                    if cursor.rowcount:
+                        self._conn.execute(
+                            "INSERT INTO message_terms (rowid, tenant_id, terms) VALUES (?, ?, ?)",
+                            (cursor.lastrowid, tenant_id, " ".join(tokenize(text))),
+                        )
+                        added += 1
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return added
+
+    def search(self, tenant_id: str, query: str, limit: int = 20, offset: int = 0, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        ค้นหาข้อความของ tenant เรียงตามความเกี่ยวข้อง (bm25) แล้วตามเวลาล่าสุด
+        คืนค่าข้อความที่พบ (แบ่งหน้าด้วย limit/offset) และสรุปรายแชทจากผลทั้งหมด
+        """
+        expression = _match_expression(query)
+        if not expression:
+            return {"query": query, "total": 0, "messages": [], "conversations": []}
+
+        # จำกัด tenant ภายใน FTS เอง เพื่อไม่ให้ต้องไล่ผลลัพธ์ของ tenant อื่น
+        tenant_phrase = tenant_id.replace('"', '""')
+        where = "message_terms MATCH ? AND m.tenant_id = ?"
+        params: List[Any] = [f'tenant_id : "{tenant_phrase}" AND terms : ({expression})', tenant_id]
+        if user_id:
+            where += " AND m.user_id = ?"
+            params.append(user_id)
+        base = f"FROM message_terms CROSS JOIN indexed_messages m ON m.id = message_terms.rowid WHERE {where}"
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) AS total {base}", params).fetchone()['total']
+            hits = self._conn.execute(
+                f"SELECT m.user_id, m.role, m.timestamp, m.text, bm25(message_terms) AS score {base} "
+                "ORDER BY score, m.timestamp DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+            conversations = self._conn.execute(
+                f"WITH scored AS MATERIALIZED (SELECT m.user_id, m.timestamp, bm25(message_terms) AS score {base}) "
+                "SELECT user_id, COUNT(*) AS hits, MIN(score) AS best_score, MAX(timestamp) AS last_hit_at "
+                "FROM scored GROUP BY user_id ORDER BY best_score, last_hit_at DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+
+        return {
+            "query": query,
+            "total": total,
+            "messages": [
+                {
+                    "user_id": row['user_id'],
+                    "role": row['role'],
+                    "timestamp": row['timestamp'],
+                    "snippet": _snippet(row['text'], query),
+                    "score": round(-row['score'], 4),
+                }
+                for row in hits
+            ],
+            "conversations": [
+                {
+                    "user_id": row['user_id'],
+                    "hits": row['hits'],
+                    "score": round(-row['best_score'], 4),
+                    "last_hit_at": row['last_hit_at'],
+                }
+                for row in conversations
+            ],
+        }
+
+    def clear_tenant(self, tenant_id: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                "DELETE FROM message_terms WHERE rowid IN (SELECT id FROM indexed_messages WHERE tenant_id = ?)", (tenant_id,)
+            )
+            self._conn.execute("DELETE FROM indexed_messages WHERE tenant_id = ?", (tenant_id,))
+            self._conn.execute("COMMIT")
+
+
+# Private global variable to store the initialized index
+_search_index_instance: Optional[SearchIndex] = None
+
+
+def get_search_index() -> Optional[SearchIndex]:
+    """
+    Returns the search index at SEARCH_INDEX_PATH (default: search_index.db), opening it on first access.
+    Returns None unless the storage backend is SQLite (see the module docstring).
+    """
+    global _search_index_instance
+    if _search_index_instance is None:
+        storage = get_storage()
+        if storage is None or storage.name != "sqlite":
+            return None
+        index_path = os.getenv("SEARCH_INDEX_PATH", "search_index.db")
+        try:
+            _search_index_instance = SearchIndex(index_path)
+            print(f"✅ Search index opened at '{index_path}'.")
+        except Exception as e:
+            print(f"❌ CRITICAL: Could not open search index at '{index_path}': {e}")
+    return _search_index_instance
+
+
+def set_search_index(index: Optional[SearchIndex]) -> None:
+    """Replaces the active search index (used by benchmarks and tests)."""
+    global _search_index_instance
+    _search_index_instance = index
+
+
+def index_messages(tenant_id: str, user_id: str, messages: Iterable[Dict[str, Any]]) -> None:
+    """เพิ่มข้อความใหม่เข้า index โดยไม่ทำให้ flow หลักล้มหาก index มีปัญหา"""
+    index_messages_bulk(tenant_id, {user_id: messages})
+
+
+def index_messages_bulk(tenant_id: str, messages_by_user: Dict[str, Iterable[Dict[str, Any]]]) -> None:
+    try:
+        index = get_search_index()
+        if index:
+            index.index_bulk(tenant_id, messages_by_user)
+    except Exception as e:
+        print(f"⚠️ Search: Could not index messages for tenant {tenant_id}: {e}")
+
+
+def reindex_tenant(tenant_id: str, page_size: int = 50) -> int:
+    """สร้าง index ของ tenant ใหม่ทั้งหมดจาก storage (ใช้ครั้งแรกหรือเมื่อ index เสีย) คืนค่าจำนวนข้อความ"""
+    index = get_search_index()
+    if index is None:
+        print(f"⚠️ Search: Reindex skipped for tenant {tenant_id}, search index is not available.")
+        return 0
+    storage = get_storage()
+    index.clear_tenant(tenant_id)
+    total = 0
+    cursor = None
+    while True:
+        # ไล่ตาม user_id ซึ่งไม่เปลี่ยน แชทที่มีข้อความใหม่ระหว่าง reindex จึงไม่ถูกข้าม
+        page = storage.list_conversations(tenant_id, limit=page_size, start_after=cursor, order_by_id=True)
+        for conversation in page:
+            user_id = conversation['user_id']
+            for segment in conversation.get('archive_segments') or []:
+                total += index.index_messages(tenant_id, user_id, read_segment(tenant_id, user_id, segment['index']) or [])
+            total += index.index_messages(tenant_id, user_id, conversation.get('history') or [])
+        if len(page) < page_size:
+            break
+        cursor = page[-1]['user_id']
+    print(f"✅ Search: Reindexed {total} messages for tenant {tenant_id}.")
+    return total
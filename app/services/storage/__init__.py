@@ -0,0 +1,73 @@
+# app/services/storage/__init__.py
+import functools
+import os
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from .base import StorageBackend
+
+# Private global variable to store the initialized backend
+_storage_instance: Optional[StorageBackend] = None
+
+
+def get_storage() -> Optional[StorageBackend]:
+    """
+    Returns the configured storage backend, initializing it on first access.
+
+    STORAGE_BACKEND=firestore (default) uses the Firebase Admin client from
+    `firebase_utils`; STORAGE_BACKEND=sqlite uses an embedded database at
+    SQLITE_PATH (default: allchat.db). Returns None if the backend is unavailable.
+    """
+    global _storage_instance
+    if _storage_instance is None:
+        backend = os.getenv("STORAGE_BACKEND", "firestore").lower()
+        if backend == "sqlite":
+            from .sqlite_backend import SQLiteStorage
+            sqlite_path = os.getenv("SQLITE_PATH", "allchat.db")
+            try:
+                _storage_instance = SQLiteStorage(sqlite_path)
+                print(f"✅ SQLite storage initialized at '{sqlite_path}'.")
+            except Exception as e:
+                print(f"❌ CRITICAL: Could not open SQLite storage at '{sqlite_path}': {e}")
+        else:
+            from .. import firebase_utils
+            from .firestore_backend import FirestoreStorage
+            if firebase_utils.db is not None:
+                _storage_instance = FirestoreStorage(firebase_utils.db)
+            else:
+                print("⚠️ Firestore client not available. Storage will not be available.")
+    return _storage_instance
+
+
+def set_storage(storage: Optional[StorageBackend]) -> None:
+    """Replaces the active backend (used by benchmarks and self-hosted bootstrapping)."""
+    global _storage_instance
+    _storage_instance = storage
+
+
+class AsyncStorage:
+    """
+    ตัวห่อ backend สำหรับเรียกจาก `async def` handler: ทุก method คืน coroutine ที่รันการเรียกแบบ sync
+    ใน threadpool ทำให้ I/O ของ Firestore/SQLite ไม่บล็อก event loop เช่น
+    `await get_async_storage().get_tenant(tenant_id)`
+    """
+
+    def __getattr__(self, name: str):
+        method = getattr(get_storage(), name)
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await run_in_threadpool(method, *args, **kwargs)
+        return call
+
+    def __bool__(self) -> bool:
+        return get_storage() is not None
+
+
+_async_storage = AsyncStorage()
+
+
+def get_async_storage() -> AsyncStorage:
+    """Returns an awaitable view of the active backend (see `AsyncStorage`)."""
+    return _async_storage
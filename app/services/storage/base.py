@@ -0,0 +1,263 @@
+# app/services/storage/base.py
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# จำนวนข้อความท้าย history ที่ watch_conversations ส่งให้ callback (แทน history ทั้งก้อน)
+WATCH_RECENT_MESSAGES = 20
+
+
+def watch_entry(user_id: str, conversation: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    รูปแบบที่ watch_conversations ส่งให้ callback: ทุกฟิลด์ยกเว้น `history` และ `archive_segments`
+    แทนด้วย `message_count` (จำนวนข้อความใน history) และ `recent_messages` (ข้อความล่าสุดไม่เกิน WATCH_RECENT_MESSAGES)
+    """
+    entry = {k: v for k, v in conversation.items() if k not in ('history', 'archive_segments')}
+    history = conversation.get('history') or []
+    entry['message_count'] = len(history)
+    entry['recent_messages'] = history[-WATCH_RECENT_MESSAGES:]
+    entry['user_id'] = user_id
+    return entry
+
+
+class StorageBackend:
+    """
+    Interface ของชั้นจัดเก็บข้อมูลที่ทุก module ใช้แทนการเรียก Firestore `db` โดยตรง
+
+    ข้อมูลแบ่งเป็น 3 กลุ่ม:
+    * tenants       - เอกสารการตั้งค่าของร้านค้า (tenants/{tenant_id})
+    * users         - โปรไฟล์ผู้ใช้ระบบหลังบ้าน (users/{uid})
+    * conversations - session แชทของลูกค้าแต่ละคน (chat_sessions/{tenant_id}/users/{user_id})
+                      โดยมีรายการข้อความอยู่ในฟิลด์ `history` ตามรูปแบบเดิมของ Firestore
+    """
+
+    name = "base"
+
+    # --- Tenants ---
+    def get_tenant(self, tenant_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """คืนค่าเอกสาร tenant หรือ None หากไม่มี ระบุ `fields` เพื่ออ่านเฉพาะฟิลด์ระดับบนสุดเหล่านั้น"""
+        raise NotImplementedError
+
+    def create_tenant(self, data: Dict[str, Any]) -> str:
+        """สร้าง tenant ใหม่ด้วย ID ที่สุ่มขึ้น และคืนค่า tenant_id"""
+        raise NotImplementedError
+
+    def update_tenant(self, tenant_id: str, data: Dict[str, Any], bump_version: bool = True) -> None:
+        """
+        Merge ฟิลด์ที่ส่งมาเข้ากับเอกสาร tenant (สร้างใหม่หากยังไม่มี) และเพิ่ม `configVersion` ขึ้นหนึ่ง
+        ข้อมูลที่ระบบเขียนเองและไม่ใช่การตั้งค่า (เช่น handle ของ context cache) ใช้ `bump_version=False`
+        """
+        raise NotImplementedError
+
+    # --- Users ---
+    def get_user(self, uid: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def set_user(self, uid: str, data: Dict[str, Any], merge: bool = False) -> None:
+        raise NotImplementedError
+
+    # --- Conversations ---
+    def get_conversation(self, tenant_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """คืนค่าเอกสาร conversation ทั้งหมดรวม `history` หรือ None หากไม่มี"""
+        raise NotImplementedError
+
+    def set_conversation(self, tenant_id: str, user_id: str, data: Dict[str, Any], merge: bool = False) -> None:
+        """
+        เขียนเอกสาร conversation หาก merge=False จะเขียนทับทั้งเอกสาร (รวม `history`)
+        หาก merge=True จะอัปเดตเฉพาะฟิลด์ที่ส่งมา (ข้อความใหม่ควรใช้ `append_messages` ส่ง `history` มาเฉพาะตอนตัด history)
+        """
+        raise NotImplementedError
+
+    def append_messages(self, tenant_id: str, user_id: str, messages: List[Dict[str, Any]], fields: Optional[Dict[str, Any]] = None) -> None:
+        """ต่อท้ายข้อความเข้า `history` และ merge `fields` เพิ่มเติมในการเขียนครั้งเดียวกัน"""
+        raise NotImplementedError
+
+    def append_messages_bulk(self, tenant_id: str, messages_by_user: Dict[str, List[Dict[str, Any]]]) -> None:
+        """
+        ต่อท้ายข้อความให้ผู้ใช้หลายคนพร้อมกัน (ใช้กับ broadcast) backend ควรรวมเป็น batch write
+        ค่าเริ่มต้นเรียก `append_messages` ทีละคน
+        """
+        for user_id, messages in messages_by_user.items():
+            self.append_messages(tenant_id, user_id, messages)
+
+    def update_conversation(
+        self,
+        tenant_id: str,
+        user_id: str,
+        mutate: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        อ่าน-แก้-เขียนแบบ atomic: `mutate` รับเอกสารปัจจุบัน (รวม `history`) แล้วคืน field ระดับบนสุดที่จะเขียนทับ
+        (None = ไม่เปลี่ยน) field อื่นไม่ถูกแตะ และหากเอกสารเปลี่ยนระหว่างอ่านกับเขียนจะอ่านใหม่แล้วเรียก `mutate` อีกครั้ง
+        คืน field ที่เขียน หรือ None หากไม่พบ/ไม่เปลี่ยน
+        """
+        raise NotImplementedError
+
+    def list_conversations(
+        self,
+        tenant_id: str,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        include_history: bool = True,
+        order_by_id: bool = False,
+        fields: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        คืนรายการ conversation ของ tenant เรียงตาม `lastMessageTime` ล่าสุดก่อน
+        แต่ละรายการมี `user_id` และใช้ `start_after` (user_id ตัวสุดท้ายของหน้าก่อน) เป็น cursor
+        ระบุ `fields` เพื่ออ่านเฉพาะฟิลด์ระดับบนสุดเหล่านั้น (ไม่มี `history`) แทนการดาวน์โหลดเอกสารเต็ม
+
+        `order_by_id=True` เรียงตาม user_id (document ID) แทน ลำดับนี้ไม่เปลี่ยนเมื่อมีข้อความใหม่
+        จึงใช้กับงานที่ต้องไล่ครบทุกแชท (export, reindex) ได้โดยไม่ข้ามแชทที่ขยับระหว่างไล่หน้า
+        """
+        raise NotImplementedError
+
+    def watch_conversations(
+        self,
+        tenant_id: str,
+        callback: Callable[[List[Dict[str, Any]]], None],
+        interval_s: float = 1.0,
+        limit: int = 200,
+    ) -> Callable[[], None]:
+        """
+        เรียก `callback(conversations)` จาก thread เบื้องหลังทุกครั้งที่ conversation ล่าสุด `limit` รายการของ tenant เปลี่ยน
+        (แต่ละรายการอยู่ในรูป `watch_entry` ไม่มี history ทั้งก้อน) ครั้งแรกส่งทุกรายการเป็นสถานะเริ่มต้น คืนฟังก์ชันสำหรับหยุดฟัง
+
+        ค่าเริ่มต้น poll แชทล่าสุด `limit` รายการทุก `interval_s` วินาทีแล้วส่งเฉพาะเอกสารที่เปลี่ยน
+        backend ที่มี change feed ของตัวเอง (เช่น Firestore `on_snapshot`) ควร override
+        """
+        stop_event = threading.Event()
+
+        def fingerprint(conversation: Dict[str, Any]) -> str:
+            fields = {k: v for k, v in conversation.items() if k != 'history'}
+            return f"{len(conversation.get('history') or [])}|{json.dumps(fields, sort_keys=True, default=str)}"
+
+        def poll() -> None:
+            seen: Dict[str, str] = {}
+            while not stop_event.is_set():
+                try:
+                    changed = []
+                    for conversation in self.list_conversations(tenant_id, limit=limit):
+                        key = fingerprint(conversation)
+                        if seen.get(conversation['user_id']) != key:
+                            seen[conversation['user_id']] = key
+                            changed.append(watch_entry(conversation.pop('user_id'), conversation))
+                    if changed:
+                        callback(changed)
+                except Exception as e:
+                    print(f"⚠️ Storage: Conversation watch for tenant {tenant_id} failed: {e}")
+                stop_event.wait(interval_s)
+
+        threading.Thread(target=poll, name=f"watch-{tenant_id}", daemon=True).start()
+        return stop_event.set
+
+    # --- Unread counters ---
+    def increment_unread(self, tenant_id: str, user_id: str, delta: int = 1) -> None:
+        """เพิ่ม `unread_count` ของ conversation และยอดรวมของ tenant ในการเขียนเดียวกัน"""
+        raise NotImplementedError
+
+    def reset_unread(self, tenant_id: str, user_id: str, fields: Optional[Dict[str, Any]] = None) -> int:
+        """
+        ตั้ง `unread_count` เป็น 0 (พร้อม merge `fields`) และหักออกจากยอดรวมของ tenant
+        คืนค่าจำนวนที่ยังไม่ได้อ่านก่อน reset
+        """
+        raise NotImplementedError
+
+    def get_unread_total(self, tenant_id: str) -> int:
+        raise NotImplementedError
+
+    # --- Outbound delivery queue ---
+    def enqueue_outbound(self, item: Dict[str, Any]) -> str:
+        """บันทึกข้อความที่ยังส่งไม่สำเร็จ (ต้องมี `status` และ `next_attempt_at`) และคืนค่า ID"""
+        raise NotImplementedError
+
+    def claim_due_outbound(self, now: str, lease_until: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        จองรายการ `pending` ที่ถึงเวลาส่ง (`next_attempt_at` <= now) โดยเลื่อน `next_attempt_at`
+        ไปเป็น `lease_until` เพื่อไม่ให้ worker ตัวอื่นหยิบซ้ำ คืนค่ารายการพร้อม `id`
+        """
+        raise NotImplementedError
+
+    def update_outbound(self, item_id: str, fields: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def delete_outbound(self, item_id: str) -> None:
+        raise NotImplementedError
+
+    # --- Broadcast campaigns ---
+    def create_campaign(self, tenant_id: str, data: Dict[str, Any]) -> str:
+        """สร้างเอกสาร campaign ของ tenant และคืนค่า campaign_id"""
+        raise NotImplementedError
+
+    def get_campaign(self, tenant_id: str, campaign_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def update_campaign(self, tenant_id: str, campaign_id: str, fields: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    # --- Manual-reply work queue ---
+    def create_work_item(self, tenant_id: str, item: Dict[str, Any]) -> str:
+        """บันทึกงานที่ต้องให้แอดมินดู (ต้องมี `status` = 'open', `created_at`, `user_id`) เพิ่มยอดงานค้าง และคืนค่า ID"""
+        raise NotImplementedError
+
+    def get_work_item(self, tenant_id: str, item_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def list_work_items(
+        self,
+        tenant_id: str,
+        status: str = "open",
+        limit: int = 50,
+        start_after: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """งานตาม `status` เรียงจากเก่าไปใหม่ (`created_at`) ต่อจากรายการ `start_after` (ID) พร้อม `id`"""
+        raise NotImplementedError
+
+    def update_work_item(
+        self,
+        tenant_id: str,
+        item_id: str,
+        mutate: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        อ่าน-แก้-เขียนแบบ atomic: `mutate` รับข้อมูลปัจจุบันแล้วคืน field ที่จะเปลี่ยน (None = ไม่เปลี่ยน)
+        ลดยอดงานค้างเมื่อ status เปลี่ยนจาก 'open' คืนค่ารายการหลังแก้ หรือ None หากไม่พบ/ไม่เปลี่ยน
+        """
+        raise NotImplementedError
+
+    def get_open_work_count(self, tenant_id: str) -> int:
+        raise NotImplementedError
+
+    # --- Product catalog ---
+    def upsert_products(self, tenant_id: str, products: List[Dict[str, Any]]) -> None:
+        """เขียนสินค้าหลายรายการ (ทุกรายการต้องมี `sku` ที่ไม่ซ้ำใน tenant) เขียนทับรายการที่มี sku เดิม"""
+        raise NotImplementedError
+
+    def list_products(self, tenant_id: str) -> List[Dict[str, Any]]:
+        """คืนสินค้าทั้งหมดของ tenant (ใช้สร้าง index ในหน่วยความจำ)"""
+        raise NotImplementedError
+
+    def delete_products(self, tenant_id: str, skus: List[str]) -> None:
+        raise NotImplementedError
+
+    # --- Usage counters ---
+    def increment_usage(self, tenant_id: str, day: str, shard: int, counters: Dict[str, float]) -> None:
+        """บวกค่าตัวนับ (key -> จำนวน) เข้ากับ shard ของ tenant ในวันที่ระบุ (รูปแบบ YYYY-MM-DD)"""
+        raise NotImplementedError
+
+    def get_usage(self, tenant_id: str, start_day: str, end_day: str) -> Dict[str, Dict[str, float]]:
+        """คืนตัวนับรายวัน {day: {key: value}} ที่รวมทุก shard แล้ว ในช่วงวันที่ระบุ (รวมวันสุดท้าย)"""
+        raise NotImplementedError
+
+    # --- Analytics rollups ---
+    def increment_analytics(self, tenant_id: str, granularity: str, period: str, shard: int, counters: Dict[str, float]) -> None:
+        """
+        บวกค่าตัวนับเข้ากับเอกสาร rollup หนึ่งช่วง: granularity 'daily' เก็บหนึ่งเอกสารต่อเดือน (period YYYY-MM, key "DD|metric")
+        และ 'hourly' เก็บหนึ่งเอกสารต่อวัน (period YYYY-MM-DD, key "HH|metric")
+        """
+        raise NotImplementedError
+
+    def get_analytics(self, tenant_id: str, granularity: str, start_period: str, end_period: str) -> Dict[str, Dict[str, float]]:
+        """คืน {period: {key: value}} ที่รวมทุก shard แล้ว ในช่วง period ที่ระบุ (รวมช่วงสุดท้าย)"""
+        raise NotImplementedError
@@ -0,0 +1,385 @@
+# app/services/storage/firestore_backend.py
+import random
+from typing import Any, Callable, Dict, List, Optional
+
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition
+
+from .base import StorageBackend, watch_entry
+
+# Firestore จำกัดจำนวน operation ต่อ batch write ไว้ที่ 500
+FIRESTORE_BATCH_LIMIT = 500
+# เอกสารหนึ่งรับการเขียนต่อเนื่องได้ราว 1 ครั้ง/วินาที ยอด unread รวมของ tenant จึงกระจายไปหลาย shard
+UNREAD_SHARDS = 10
+
+
+class FirestoreStorage(StorageBackend):
+    """Storage backend ที่ใช้ Cloud Firestore (โครงสร้าง collection เดิมของระบบ)"""
+
+    name = "firestore"
+
+    def __init__(self, db):
+        self.db = db
+
+    def _conversation_ref(self, tenant_id: str, user_id: str):
+        return self.db.collection('chat_sessions').document(tenant_id).collection('users').document(user_id)
+
+    # --- Tenants ---
+    def get_tenant(self, tenant_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        doc_ref = self.db.collection('tenants').document(tenant_id)
+        doc = doc_ref.get(field_paths=fields) if fields else doc_ref.get()
+        return doc.to_dict() if doc.exists else None
+
+    def create_tenant(self, data: Dict[str, Any]) -> str:
+        tenant_doc_ref = self.db.collection('tenants').document()
+        tenant_doc_ref.set({**data, 'configVersion': 1})
+        return tenant_doc_ref.id
+
+    def update_tenant(self, tenant_id: str, data: Dict[str, Any], bump_version: bool = True) -> None:
+        update = {**data, 'configVersion': firestore.Increment(1)} if bump_version else data
+        self.db.collection('tenants').document(tenant_id).set(update, merge=True)
+
+    # --- Users ---
+    def get_user(self, uid: str) -> Optional[Dict[str, Any]]:
+        doc = self.db.collection('users').document(uid).get()
+        return doc.to_dict() if doc.exists else None
+
+    def set_user(self, uid: str, data: Dict[str, Any], merge: bool = False) -> None:
+        self.db.collection('users').document(uid).set(data, merge=merge)
+
+    # --- Conversations ---
+    def get_conversation(self, tenant_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        doc = self._conversation_ref(tenant_id, user_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def set_conversation(self, tenant_id: str, user_id: str, data: Dict[str, Any], merge: bool = False) -> None:
+        self._conversation_ref(tenant_id, user_id).set(data, merge=merge)
+
+    def append_messages(self, tenant_id: str, user_id: str, messages: List[Dict[str, Any]], fields: Optional[Dict[str, Any]] = None) -> None:
+        update = dict(fields or {})
+        update['history'] = firestore.ArrayUnion(messages)
+        self._conversation_ref(tenant_id, user_id).set(update, merge=True)
+
+    def append_messages_bulk(self, tenant_id: str, messages_by_user: Dict[str, List[Dict[str, Any]]]) -> None:
+        items = list(messages_by_user.items())
+        for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for user_id, messages in items[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(self._conversation_ref(tenant_id, user_id), {'history': firestore.ArrayUnion(messages)}, merge=True)
+            batch.commit()
+
+    def update_conversation(
+        self,
+        tenant_id: str,
+        user_id: str,
+        mutate: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        doc_ref = self._conversation_ref(tenant_id, user_id)
+        for _ in range(5):
+            snapshot = doc_ref.get()
+            if not snapshot.exists:
+                return None
+            fields = mutate(snapshot.to_dict() or {})
+            if not fields:
+                return None
+            try:
+                # Precondition: ข้อความหรือ field ที่เขียนหลังเราอ่าน (เช่น unread_count) จะไม่ถูกเขียนทับ
+                doc_ref.update(fields, option=self.db.write_option(last_update_time=snapshot.update_time))
+            except FailedPrecondition:
+                continue
+            return fields
+        raise RuntimeError(f"Could not update conversation {user_id} after repeated conflicts")
+
+    def list_conversations(
+        self,
+        tenant_id: str,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        include_history: bool = True,
+        order_by_id: bool = False,
+        fields: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        users_ref = self.db.collection('chat_sessions').document(tenant_id).collection('users')
+        if order_by_id:
+            query = users_ref.order_by('__name__')
+            if start_after:
+                query = query.start_after({'__name__': users_ref.document(start_after)})
+        else:
+            query = users_ref.order_by('lastMessageTime', direction=firestore.Query.DESCENDING)
+            if start_after:
+                cursor_doc = users_ref.document(start_after).get()
+                if cursor_doc.exists:
+                    query = query.start_after(cursor_doc)
+        if limit:
+            query = query.limit(limit)
+        if fields:
+            # projection ฝั่ง server: ไม่ต้องดาวน์โหลด history ของทุกแชท
+            query = query.select(fields)
+
+        conversations = []
+        for doc in query.stream():
+            data = doc.to_dict() or {}
+            if not include_history:
+                data.pop('history', None)
+            data['user_id'] = doc.id
+            conversations.append(data)
+        return conversations
+
+    def watch_conversations(
+        self,
+        tenant_id: str,
+        callback: Callable[[List[Dict[str, Any]]], None],
+        interval_s: float = 1.0,
+        limit: int = 200,
+    ) -> Callable[[], None]:
+        users_ref = self.db.collection('chat_sessions').document(tenant_id).collection('users')
+        # listener เดียวต่อ tenant ต่อ instance เฉพาะแชทล่าสุด `limit` รายการ เหมือนการ poll
+        # (Firestore ส่งเฉพาะเอกสารที่เปลี่ยน แชทที่หลุดจากช่วงนี้มาเป็น REMOVED)
+        query = users_ref.order_by('lastMessageTime', direction=firestore.Query.DESCENDING).limit(limit)
+        if not hasattr(query, 'on_snapshot'):
+            # client ที่ไม่มี realtime listener (เช่น emulator ใน benchmark) ใช้การ poll แทน
+            return super().watch_conversations(tenant_id, callback, interval_s, limit)
+
+        def on_snapshot(docs, changes, read_time):
+            changed = []
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    continue
+                # ไม่ส่ง history ทั้งก้อนต่อให้ callback (เฉพาะจำนวนและข้อความล่าสุด)
+                changed.append(watch_entry(change.document.id, change.document.to_dict() or {}))
+            if changed:
+                callback(changed)
+
+        watch = query.on_snapshot(on_snapshot)
+        return watch.unsubscribe
+
+    # --- Unread counters ---
+    def _unread_shard_ref(self, tenant_id: str, shard: int):
+        return self.db.collection('tenants').document(tenant_id).collection('unread_shards').document(str(shard))
+
+    def increment_unread(self, tenant_id: str, user_id: str, delta: int = 1) -> None:
+        batch = self.db.batch()
+        batch.set(self._conversation_ref(tenant_id, user_id), {'unread_count': firestore.Increment(delta)}, merge=True)
+        batch.set(self._unread_shard_ref(tenant_id, random.randrange(UNREAD_SHARDS)), {'count': firestore.Increment(delta)}, merge=True)
+        batch.commit()
+
+    def reset_unread(self, tenant_id: str, user_id: str, fields: Optional[Dict[str, Any]] = None) -> int:
+        doc_ref = self._conversation_ref(tenant_id, user_id)
+        update = dict(fields or {})
+        update['unread_count'] = 0
+        for _ in range(5):
+            snapshot = doc_ref.get()
+            if not snapshot.exists:
+                doc_ref.set(update, merge=True)
+                return 0
+            unread = (snapshot.to_dict() or {}).get('unread_count') or 0
+            batch = self.db.batch()
+            # Precondition ทำให้ไม่หักยอดรวมผิด หากมีข้อความใหม่เข้ามาระหว่างอ่านกับเขียน
+            batch.update(doc_ref, update, option=self.db.write_option(last_update_time=snapshot.update_time))
+            if unread:
+                batch.set(self._unread_shard_ref(tenant_id, random.randrange(UNREAD_SHARDS)), {'count': firestore.Increment(-unread)}, merge=True)
+            try:
+                batch.commit()
+                return unread
+            except FailedPrecondition as e:
+                # มีการเขียนระหว่างอ่านกับเขียน: อ่านยอดใหม่แล้วลองอีกครั้ง (ความผิดพลาดอื่นส่งต่อให้ผู้เรียก)
+                print(f"⚠️ Unread reset for {user_id} conflicted, retrying: {e}")
+        raise RuntimeError(f"Could not reset unread count for {user_id} after repeated conflicts")
+
+    def get_unread_total(self, tenant_id: str) -> int:
+        shards = self.db.collection('tenants').document(tenant_id).collection('unread_shards').stream()
+        return max(0, int(sum((doc.to_dict() or {}).get('count', 0) for doc in shards)))
+
+    # --- Outbound delivery queue ---
+    def enqueue_outbound(self, item: Dict[str, Any]) -> str:
+        doc_ref = self.db.collection('outbound_queue').document()
+        doc_ref.set(item)
+        return doc_ref.id
+
+    def claim_due_outbound(self, now: str, lease_until: str, limit: int = 50) -> List[Dict[str, Any]]:
+        query = (
+            self.db.collection('outbound_queue')
+            .where('status', '==', 'pending')
+            .where('next_attempt_at', '<=', now)
+            .order_by('next_attempt_at')
+            .limit(limit)
+        )
+        claimed = []
+        for doc in query.stream():
+            try:
+                # Precondition บน update_time ทำให้ instance อื่นที่อ่านเอกสารเดียวกันจองซ้ำไม่ได้
+                doc.reference.update(
+                    {'next_attempt_at': lease_until},
+                    option=self.db.write_option(last_update_time=doc.update_time),
+                )
+            except Exception:
+                continue
+            item = doc.to_dict()
+            item['next_attempt_at'] = lease_until
+            item['id'] = doc.id
+            claimed.append(item)
+        return claimed
+
+    def update_outbound(self, item_id: str, fields: Dict[str, Any]) -> None:
+        self.db.collection('outbound_queue').document(item_id).set(fields, merge=True)
+
+    def delete_outbound(self, item_id: str) -> None:
+        self.db.collection('outbound_queue').document(item_id).delete()
+
+    # --- Manual-reply work queue ---
+    def _work_items_ref(self, tenant_id: str):
+        return self.db.collection('tenants').document(tenant_id).collection('work_items')
+
+    def _work_count_shard_ref(self, tenant_id: str, shard: int):
+        return self.db.collection('tenants').document(tenant_id).collection('work_queue_shards').document(str(shard))
+
+    def create_work_item(self, tenant_id: str, item: Dict[str, Any]) -> str:
+        doc_ref = self._work_items_ref(tenant_id).document()
+        batch = self.db.batch()
+        batch.set(doc_ref, item)
+        if item.get('status') == 'open':
+            batch.set(self._work_count_shard_ref(tenant_id, random.randrange(UNREAD_SHARDS)), {'count': firestore.Increment(1)}, merge=True)
+        batch.commit()
+        return doc_ref.id
+
+    def get_work_item(self, tenant_id: str, item_id: str) -> Optional[Dict[str, Any]]:
+        snapshot = self._work_items_ref(tenant_id).document(item_id).get()
+        if not snapshot.exists:
+            return None
+        return dict(snapshot.to_dict(), id=snapshot.id)
+
+    def list_work_items(
+        self,
+        tenant_id: str,
+        status: str = "open",
+        limit: int = 50,
+        start_after: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        items_ref = self._work_items_ref(tenant_id)
+        query = items_ref.where('status', '==', status)
+        if user_id:
+            query = query.where('user_id', '==', user_id)
+        # ต้องมี composite index (status, created_at) และ (status, user_id, created_at)
+        query = query.order_by('created_at')
+        if start_after:
+            cursor_doc = items_ref.document(start_after).get()
+            if cursor_doc.exists:
+                query = query.start_after(cursor_doc)
+        return [dict(doc.to_dict(), id=doc.id) for doc in query.limit(limit).stream()]
+
+    def update_work_item(
+        self,
+        tenant_id: str,
+        item_id: str,
+        mutate: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        doc_ref = self._work_items_ref(tenant_id).document(item_id)
+        for _ in range(5):
+            snapshot = doc_ref.get()
+            if not snapshot.exists:
+                return None
+            current = dict(snapshot.to_dict(), id=item_id)
+            fields = mutate(current)
+            if not fields:
+                return None
+            batch = self.db.batch()
+            # Precondition ทำให้แอดมินสองคนรับงานเดียวกันพร้อมกันไม่ได้ และไม่หักยอดงานค้างซ้ำ
+            batch.update(doc_ref, fields, option=self.db.write_option(last_update_time=snapshot.update_time))
+            if current.get('status') == 'open' and fields.get('status', 'open') != 'open':
+                batch.set(self._work_count_shard_ref(tenant_id, random.randrange(UNREAD_SHARDS)), {'count': firestore.Increment(-1)}, merge=True)
+            try:
+                batch.commit()
+            except FailedPrecondition:
+                # เอกสารถูกแก้หลังเราอ่าน: อ่านใหม่แล้วลองอีกครั้ง (ความผิดพลาดอื่นส่งต่อให้ผู้เรียก)
+                continue
+            return dict(current, **fields)
+        raise RuntimeError(f"Could not update work item {item_id} after repeated conflicts")
+
+    def get_open_work_count(self, tenant_id: str) -> int:
+        shards = self.db.collection('tenants').document(tenant_id).collection('work_queue_shards').stream()
+        return max(0, int(sum((doc.to_dict() or {}).get('count', 0) for doc in shards)))
+
+    # --- Broadcast campaigns ---
+    def _campaigns_ref(self, tenant_id: str):
+        return self.db.collection('tenants').document(tenant_id).collection('campaigns')
+
+    def create_campaign(self, tenant_id: str, data: Dict[str, Any]) -> str:
+        doc_ref = self._campaigns_ref(tenant_id).document()
+        doc_ref.set(data)
+        return doc_ref.id
+
+    def get_campaign(self, tenant_id: str, campaign_id: str) -> Optional[Dict[str, Any]]:
+        doc = self._campaigns_ref(tenant_id).document(campaign_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def update_campaign(self, tenant_id: str, campaign_id: str, fields: Dict[str, Any]) -> None:
+        self._campaigns_ref(tenant_id).document(campaign_id).set(fields, merge=True)
+
+    # --- Product catalog ---
+    def _product_ref(self, tenant_id: str, sku: str):
+        # '/' ใช้เป็นชื่อเอกสารไม่ได้
+        return self.db.collection('tenants').document(tenant_id).collection('products').document(sku.replace('/', '%2F'))
+
+    def upsert_products(self, tenant_id: str, products: List[Dict[str, Any]]) -> None:
+        for start in range(0, len(products), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for product in products[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(self._product_ref(tenant_id, product['sku']), product)
+            batch.commit()
+
+    def list_products(self, tenant_id: str) -> List[Dict[str, Any]]:
+        products_ref = self.db.collection('tenants').document(tenant_id).collection('products')
+        return [doc.to_dict() for doc in products_ref.stream()]
+
+    def delete_products(self, tenant_id: str, skus: List[str]) -> None:
+        for start in range(0, len(skus), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for sku in skus[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.delete(self._product_ref(tenant_id, sku))
+            batch.commit()
+
+    # --- Usage counters ---
+    def increment_usage(self, tenant_id: str, day: str, shard: int, counters: Dict[str, float]) -> None:
+        doc_ref = self.db.collection('tenants').document(tenant_id).collection('usage_shards').document(f"{day}_{shard}")
+        update: Dict[str, Any] = {'day': day}
+        update['counters'] = {key: firestore.Increment(value) for key, value in counters.items()}
+        doc_ref.set(update, merge=True)
+
+    def get_usage(self, tenant_id: str, start_day: str, end_day: str) -> Dict[str, Dict[str, float]]:
+        query = (
+            self.db.collection('tenants').document(tenant_id).collection('usage_shards')
+            .where('day', '>=', start_day)
+            .where('day', '<=', end_day)
+        )
+        usage: Dict[str, Dict[str, float]] = {}
+        for doc in query.stream():
+            data = doc.to_dict()
+            day_counters = usage.setdefault(data['day'], {})
+            for key, value in (data.get('counters') or {}).items():
+                day_counters[key] = day_counters.get(key, 0) + value
+        return usage
+
+    # --- Analytics rollups ---
+    def _analytics_ref(self, tenant_id: str, granularity: str):
+        return self.db.collection('tenants').document(tenant_id).collection(f'analytics_{granularity}')
+
+    def increment_analytics(self, tenant_id: str, granularity: str, period: str, shard: int, counters: Dict[str, float]) -> None:
+        doc_ref = self._analytics_ref(tenant_id, granularity).document(f"{period}_{shard}")
+        update: Dict[str, Any] = {'period': period}
+        update['counters'] = {key: firestore.Increment(value) for key, value in counters.items()}
+        doc_ref.set(update, merge=True)
+
+    def get_analytics(self, tenant_id: str, granularity: str, start_period: str, end_period: str) -> Dict[str, Dict[str, float]]:
+        query = (
+            self._analytics_ref(tenant_id, granularity)
+            .where('period', '>=', start_period)
+            .where('period', '<=', end_period)
+        )
+        rollups: Dict[str, Dict[str, float]] = {}
+        for doc in query.stream():
+            data = doc.to_dict()
+            period_counters = rollups.setdefault(data['period'], {})
+            for key, value in (data.get('counters') or {}).items():
+                period_counters[key] = period_counters.get(key, 0) + value
+        return rollups
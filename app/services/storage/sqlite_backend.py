@@ -0,0 +1,574 @@
+# app/services/storage/sqlite_backend.py
+import contextlib
+import json
+import sqlite3
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .base import StorageBackend
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tenants (
+    tenant_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    uid TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    tenant_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    last_message_time TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (tenant_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_recent ON conversations (tenant_id, last_message_time);
+CREATE TABLE IF NOT EXISTS messages (
+    tenant_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    ts TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (tenant_id, user_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages (tenant_id, user_id, ts);
+CREATE TABLE IF NOT EXISTS outbound_queue (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    next_attempt_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbound_due ON outbound_queue (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS unread_totals (
+    tenant_id TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usage_counters (
+    tenant_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (tenant_id, day, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS analytics_counters (
+    tenant_id TEXT NOT NULL,
+    granularity TEXT NOT NULL,
+    period TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (tenant_id, granularity, period, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS campaigns (
+    tenant_id TEXT NOT NULL,
+    campaign_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (tenant_id, campaign_id)
+);
+CREATE TABLE IF NOT EXISTS work_items (
+    tenant_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (tenant_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS idx_work_items_queue ON work_items (tenant_id, status, created_at, item_id);
+CREATE TABLE IF NOT EXISTS products (
+    tenant_id TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (tenant_id, sku)
+) WITHOUT ROWID;
+"""
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _deep_merge(target: Dict[str, Any], updates: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge แบบเดียวกับ `set(..., merge=True)` ของ Firestore (map ซ้อนจะถูก merge ต่อ)"""
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Storage backend แบบฝังตัวด้วย SQLite (WAL mode) สำหรับ self-hosted และ tenant ที่มีแชทปริมาณสูง
+
+    ข้อความแต่ละรายการถูกเก็บเป็นแถวในตาราง `messages` (เรียงตาม seq) แทนการเก็บเป็น array
+    ในเอกสารเดียว ทำให้การต่อท้ายข้อความไม่ต้องเขียนประวัติทั้งหมดใหม่
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        # ฐานข้อมูลแบบ :memory: ใช้ connection ร่วมกันไม่ได้ระหว่าง thread จึงใช้ connection เดียวพร้อม lock
+        self._shared_conn = None
+        self._shared_lock = threading.RLock()
+        if path == ":memory:":
+            self._shared_conn = self._connect()
+        with self._guard():
+            self._conn().executescript(_SCHEMA)
+
+    # --- Connection handling ---
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._shared_conn is not None:
+            return self._shared_conn
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _guard(self):
+        return self._shared_lock if self._shared_conn is not None else contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def _transaction(self, write: bool = True) -> Iterator[sqlite3.Connection]:
+        # การอ่านหลายคำสั่งต่อเนื่องก็ต้องอยู่ใน transaction เดียวกันเพื่อให้เห็น snapshot เดียวกัน
+        with self._guard():
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._guard():
+            return self._conn().execute(sql, params).fetchall()
+
+    # --- Tenants ---
+    def get_tenant(self, tenant_id: str, fields: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT data FROM tenants WHERE tenant_id = ?", (tenant_id,))
+        if not rows:
+            return None
+        data = json.loads(rows[0]['data'])
+        return {field: data[field] for field in fields if field in data} if fields else data
+
+    def create_tenant(self, data: Dict[str, Any]) -> str:
+        tenant_id = uuid.uuid4().hex[:20]
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO tenants (tenant_id, data) VALUES (?, ?)", (tenant_id, _dumps({**data, 'configVersion': 1})))
+        return tenant_id
+
+    def update_tenant(self, tenant_id: str, data: Dict[str, Any], bump_version: bool = True) -> None:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM tenants WHERE tenant_id = ?", (tenant_id,)).fetchone()
+            merged = _deep_merge(json.loads(row['data']) if row else {}, data)
+            if bump_version:
+                merged['configVersion'] = merged.get('configVersion', 0) + 1
+            conn.execute(
+                "INSERT INTO tenants (tenant_id, data) VALUES (?, ?) ON CONFLICT(tenant_id) DO UPDATE SET data = excluded.data",
+                (tenant_id, _dumps(merged)),
+            )
+
+    # --- Users ---
+    def get_user(self, uid: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT data FROM users WHERE uid = ?", (uid,))
+        return json.loads(rows[0]['data']) if rows else None
+
+    def set_user(self, uid: str, data: Dict[str, Any], merge: bool = False) -> None:
+        with self._transaction() as conn:
+            if merge:
+                row = conn.execute("SELECT data FROM users WHERE uid = ?", (uid,)).fetchone()
+                data = _deep_merge(json.loads(row['data']) if row else {}, data)
+            conn.execute(
+                "INSERT INTO users (uid, data) VALUES (?, ?) ON CONFLICT(uid) DO UPDATE SET data = excluded.data",
+                (uid, _dumps(data)),
+            )
+
+    # --- Conversations ---
+    def _load_history(self, conn: sqlite3.Connection, tenant_id: str, user_id: str) -> List[Dict[str, Any]]:
+        rows = conn.execute(
+            "SELECT data FROM messages WHERE tenant_id = ? AND user_id = ? ORDER BY seq",
+            (tenant_id, user_id),
+        ).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def _write_conversation_row(self, conn: sqlite3.Connection, tenant_id: str, user_id: str, data: Dict[str, Any]) -> None:
+        conn.execute(
+            "INSERT INTO conversations (tenant_id, user_id, last_message_time, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(tenant_id, user_id) DO UPDATE SET last_message_time = excluded.last_message_time, data = excluded.data",
+            (tenant_id, user_id, data.get('lastMessageTime'), _dumps(data)),
+        )
+
+    def _insert_messages(self, conn: sqlite3.Connection, tenant_id: str, user_id: str, messages: List[Dict[str, Any]], start_seq: int) -> None:
+        conn.executemany(
+            "INSERT INTO messages (tenant_id, user_id, seq, ts, data) VALUES (?, ?, ?, ?, ?)",
+            [(tenant_id, user_id, start_seq + i, msg.get('timestamp'), _dumps(msg)) for i, msg in enumerate(messages)],
+        )
+
+    def get_conversation(self, tenant_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._transaction(write=False) as conn:
+            row = conn.execute(
+                "SELECT data FROM conversations WHERE tenant_id = ? AND user_id = ?", (tenant_id, user_id)
+            ).fetchone()
+            if row is None:
+                return None
+            data = json.loads(row['data'])
+            data['history'] = self._load_history(conn, tenant_id, user_id)
+        return data
+
+    def set_conversation(self, tenant_id: str, user_id: str, data: Dict[str, Any], merge: bool = False) -> None:
+        fields = dict(data)
+        history = fields.pop('history', None)
+        with self._transaction() as conn:
+            if merge:
+                row = conn.execute(
+                    "SELECT data FROM conversations WHERE tenant_id = ? AND user_id = ?", (tenant_id, user_id)
+                ).fetchone()
+                fields = _deep_merge(json.loads(row['data']) if row else {}, fields)
+            self._write_conversation_row(conn, tenant_id, user_id, fields)
+            if history is not None or not merge:
+                self._write_history(conn, tenant_id, user_id, history or [], append=merge)
+
+    def update_conversation(
+        self,
+        tenant_id: str,
+        user_id: str,
+        mutate: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM conversations WHERE tenant_id = ? AND user_id = ?", (tenant_id, user_id)
+            ).fetchone()
+            if row is None:
+                return None
+            stored = json.loads(row['data'])
+            fields = mutate(dict(stored, history=self._load_history(conn, tenant_id, user_id)))
+            if not fields:
+                return None
+            update = dict(fields)
+            history = update.pop('history', None)
+            self._write_conversation_row(conn, tenant_id, user_id, {**stored, **update})
+            if history is not None:
+                self._write_history(conn, tenant_id, user_id, history, append=True)
+        return fields
+
+    def _write_history(self, conn: sqlite3.Connection, tenant_id: str, user_id: str, history: List[Dict[str, Any]], append: bool) -> None:
+        """
+        เขียน `history` ทั้งรายการ: หากแถวที่เก็บไว้เป็นส่วนต้นของรายการใหม่ (ข้อความสุดท้ายที่เก็บตรงกับตำแหน่งเดียวกัน)
+        จะ insert เฉพาะข้อความที่ต่อท้าย มิฉะนั้น (เช่น history ถูกตัดไป archive) จึงลบแล้วเขียนใหม่ทั้งหมด
+        """
+        if append:
+            last = conn.execute(
+                "SELECT seq, data FROM messages WHERE tenant_id = ? AND user_id = ? ORDER BY seq DESC LIMIT 1",
+                (tenant_id, user_id),
+            ).fetchone()
+            if last is None:
+                self._insert_messages(conn, tenant_id, user_id, history, 0)
+                return
+            if last['seq'] < len(history) and last['data'] == _dumps(history[last['seq']]):
+                self._insert_messages(conn, tenant_id, user_id, history[last['seq'] + 1:], last['seq'] + 1)
+                return
+        conn.execute("DELETE FROM messages WHERE tenant_id = ? AND user_id = ?", (tenant_id, user_id))
+        self._insert_messages(conn, tenant_id, user_id, history, 0)
+
+    def _append_in_transaction(self, conn: sqlite3.Connection, tenant_id: str, user_id: str, messages: List[Dict[str, Any]], fields: Optional[Dict[str, Any]]) -> None:
+        row = conn.execute(
+            "SELECT data FROM conversations WHERE tenant_id = ? AND user_id = ?", (tenant_id, user_id)
+        ).fetchone()
+        if row is None or fields:
+            merged = _deep_merge(json.loads(row['data']) if row else {}, fields or {})
+            self._write_conversation_row(conn, tenant_id, user_id, merged)
+        next_seq = conn.execute(
+            "SELECT COALESCE(MAX(seq), -1) + 1 AS next_seq FROM messages WHERE tenant_id = ? AND user_id = ?",
+            (tenant_id, user_id),
+        ).fetchone()['next_seq']
+        self._insert_messages(conn, tenant_id, user_id, messages, next_seq)
+
+    def append_messages(self, tenant_id: str, user_id: str, messages: List[Dict[str, Any]], fields: Optional[Dict[str, Any]] = None) -> None:
+        with self._transaction() as conn:
+            self._append_in_transaction(conn, tenant_id, user_id, messages, fields)
+
+    def append_messages_bulk(self, tenant_id: str, messages_by_user: Dict[str, List[Dict[str, Any]]]) -> None:
+        with self._transaction() as conn:
+            for user_id, messages in messages_by_user.items():
+                self._append_in_transaction(conn, tenant_id, user_id, messages, None)
+
+    def list_conversations(
+        self,
+        tenant_id: str,
+        limit: Optional[int] = None,
+        start_after: Optional[str] = None,
+        include_history: bool = True,
+        order_by_id: bool = False,
+        fields: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        if order_by_id:
+            sql = "SELECT user_id, last_message_time, data FROM conversations WHERE tenant_id = ?"
+            params: list = [tenant_id]
+            if start_after:
+                sql += " AND user_id > ?"
+                params.append(start_after)
+            sql += " ORDER BY user_id"
+        else:
+            sql = "SELECT user_id, last_message_time, data FROM conversations WHERE tenant_id = ? AND last_message_time IS NOT NULL"
+            params = [tenant_id]
+            if start_after:
+                cursor = self._query(
+                    "SELECT last_message_time FROM conversations WHERE tenant_id = ? AND user_id = ?", (tenant_id, start_after)
+                )
+                if cursor:
+                    sql += " AND (last_message_time < ? OR (last_message_time = ? AND user_id > ?))"
+                    params += [cursor[0]['last_message_time'], cursor[0]['last_message_time'], start_after]
+            sql += " ORDER BY last_message_time DESC, user_id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._transaction(write=False) as conn:
+            conversations = []
+            for row in conn.execute(sql, tuple(params)).fetchall():
+                data = json.loads(row['data'])
+                if fields:
+                    data = {field: data[field] for field in fields if field in data}
+                elif include_history:
+                    data['history'] = self._load_history(conn, tenant_id, row['user_id'])
+                data['user_id'] = row['user_id']
+                conversations.append(data)
+        return conversations
+
+    # --- Unread counters ---
+    def _conversation_fields(self, conn: sqlite3.Connection, tenant_id: str, user_id: str) -> Dict[str, Any]:
+        row = conn.execute(
+            "SELECT data FROM conversations WHERE tenant_id = ? AND user_id = ?", (tenant_id, user_id)
+        ).fetchone()
+        return json.loads(row['data']) if row else {}
+
+    def _add_unread_total(self, conn: sqlite3.Connection, tenant_id: str, delta: int) -> None:
+        conn.execute(
+            "INSERT INTO unread_totals (tenant_id, count) VALUES (?, ?) "
+            "ON CONFLICT(tenant_id) DO UPDATE SET count = count + excluded.count",
+            (tenant_id, delta),
+        )
+
+    def increment_unread(self, tenant_id: str, user_id: str, delta: int = 1) -> None:
+        with self._transaction() as conn:
+            data = self._conversation_fields(conn, tenant_id, user_id)
+            data['unread_count'] = (data.get('unread_count') or 0) + delta
+            self._write_conversation_row(conn, tenant_id, user_id, data)
+            self._add_unread_total(conn, tenant_id, delta)
+
+    def reset_unread(self, tenant_id: str, user_id: str, fields: Optional[Dict[str, Any]] = None) -> int:
+        with self._transaction() as conn:
+            data = self._conversation_fields(conn, tenant_id, user_id)
+            unread = data.get('unread_count') or 0
+            _deep_merge(data, dict(fields or {}, unread_count=0))
+            self._write_conversation_row(conn, tenant_id, user_id, data)
+            if unread:
+                self._add_unread_total(conn, tenant_id, -unread)
+        return unread
+
+    def get_unread_total(self, tenant_id: str) -> int:
+        rows = self._query("SELECT count FROM unread_totals WHERE tenant_id = ?", (tenant_id,))
+        return max(0, rows[0]['count']) if rows else 0
+
+    # --- Outbound delivery queue ---
+    def enqueue_outbound(self, item: Dict[str, Any]) -> str:
+        item_id = uuid.uuid4().hex[:20]
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO outbound_queue (id, status, next_attempt_at, data) VALUES (?, ?, ?, ?)",
+                (item_id, item['status'], item['next_attempt_at'], _dumps(item)),
+            )
+        return item_id
+
+    def claim_due_outbound(self, now: str, lease_until: str, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, data FROM outbound_queue WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            claimed = []
+            for row in rows:
+                item = json.loads(row['data'])
+                item['next_attempt_at'] = lease_until
+                conn.execute(
+                    "UPDATE outbound_queue SET next_attempt_at = ?, data = ? WHERE id = ?",
+                    (lease_until, _dumps(item), row['id']),
+                )
+                item['id'] = row['id']
+                claimed.append(item)
+        return claimed
+
+    def update_outbound(self, item_id: str, fields: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM outbound_queue WHERE id = ?", (item_id,)).fetchone()
+            if row is None:
+                return
+            item = _deep_merge(json.loads(row['data']), fields)
+            conn.execute(
+                "UPDATE outbound_queue SET status = ?, next_attempt_at = ?, data = ? WHERE id = ?",
+                (item['status'], item['next_attempt_at'], _dumps(item), item_id),
+            )
+
+    def delete_outbound(self, item_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM outbound_queue WHERE id = ?", (item_id,))
+
+    # --- Manual-reply work queue ---
+    def create_work_item(self, tenant_id: str, item: Dict[str, Any]) -> str:
+        item_id = uuid.uuid4().hex[:20]
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO work_items (tenant_id, item_id, status, user_id, created_at, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (tenant_id, item_id, item['status'], item['user_id'], item['created_at'], _dumps(item)),
+            )
+        return item_id
+
+    def get_work_item(self, tenant_id: str, item_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT data FROM work_items WHERE tenant_id = ? AND item_id = ?", (tenant_id, item_id))
+        return dict(json.loads(rows[0]['data']), id=item_id) if rows else None
+
+    def list_work_items(
+        self,
+        tenant_id: str,
+        status: str = "open",
+        limit: int = 50,
+        start_after: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        sql = "SELECT item_id, data FROM work_items WHERE tenant_id = ? AND status = ?"
+        params: list = [tenant_id, status]
+        if user_id:
+            sql += " AND user_id = ?"
+            params.append(user_id)
+        if start_after:
+            cursor = self._query("SELECT created_at FROM work_items WHERE tenant_id = ? AND item_id = ?", (tenant_id, start_after))
+            if cursor:
+                sql += " AND (created_at > ? OR (created_at = ? AND item_id > ?))"
+                params += [cursor[0]['created_at'], cursor[0]['created_at'], start_after]
+        sql += " ORDER BY created_at, item_id LIMIT ?"
+        params.append(limit)
+        return [dict(json.loads(row['data']), id=row['item_id']) for row in self._query(sql, tuple(params))]
+
+    def update_work_item(
+        self,
+        tenant_id: str,
+        item_id: str,
+        mutate: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM work_items WHERE tenant_id = ? AND item_id = ?", (tenant_id, item_id)).fetchone()
+            if row is None:
+                return None
+            current = dict(json.loads(row['data']), id=item_id)
+            fields = mutate(current)
+            if not fields:
+                return None
+            item = dict(current, **fields)
+            item.pop('id')
+            conn.execute(
+                "UPDATE work_items SET status = ?, data = ? WHERE tenant_id = ? AND item_id = ?",
+                (item['status'], _dumps(item), tenant_id, item_id),
+            )
+        return dict(item, id=item_id)
+
+    def get_open_work_count(self, tenant_id: str) -> int:
+        rows = self._query("SELECT COUNT(*) AS count FROM work_items WHERE tenant_id = ? AND status = 'open'", (tenant_id,))
+        return rows[0]['count']
+
+    # --- Broadcast campaigns ---
+    def create_campaign(self, tenant_id: str, data: Dict[str, Any]) -> str:
+        campaign_id = uuid.uuid4().hex[:20]
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO campaigns (tenant_id, campaign_id, data) VALUES (?, ?, ?)",
+                (tenant_id, campaign_id, _dumps(data)),
+            )
+        return campaign_id
+
+    def get_campaign(self, tenant_id: str, campaign_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT data FROM campaigns WHERE tenant_id = ? AND campaign_id = ?", (tenant_id, campaign_id))
+        return json.loads(rows[0]['data']) if rows else None
+
+    def update_campaign(self, tenant_id: str, campaign_id: str, fields: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM campaigns WHERE tenant_id = ? AND campaign_id = ?", (tenant_id, campaign_id)
+            ).fetchone()
+            merged = _deep_merge(json.loads(row['data']) if row else {}, fields)
+            conn.execute(
+                "INSERT INTO campaigns (tenant_id, campaign_id, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(tenant_id, campaign_id) DO UPDATE SET data = excluded.data",
+                (tenant_id, campaign_id, _dumps(merged)),
+            )
+
+    # --- Product catalog ---
+    def upsert_products(self, tenant_id: str, products: List[Dict[str, Any]]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO products (tenant_id, sku, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(tenant_id, sku) DO UPDATE SET data = excluded.data",
+                [(tenant_id, product['sku'], _dumps(product)) for product in products],
+            )
+
+    def list_products(self, tenant_id: str) -> List[Dict[str, Any]]:
+        rows = self._query("SELECT data FROM products WHERE tenant_id = ?", (tenant_id,))
+        return [json.loads(row['data']) for row in rows]
+
+    def delete_products(self, tenant_id: str, skus: List[str]) -> None:
+        with self._transaction() as conn:
+            conn.executemany("DELETE FROM products WHERE tenant_id = ? AND sku = ?", [(tenant_id, sku) for sku in skus])
+
+    # --- Usage counters ---
+    def increment_usage(self, tenant_id: str, day: str, shard: int, counters: Dict[str, float]) -> None:
+        # SQLite เขียนผ่าน writer เดียวอยู่แล้ว จึงไม่ต้องแยก shard
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO usage_counters (tenant_id, day, key, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(tenant_id, day, key) DO UPDATE SET value = value + excluded.value",
+                [(tenant_id, day, key, value) for key, value in counters.items()],
+            )
+
+    def get_usage(self, tenant_id: str, start_day: str, end_day: str) -> Dict[str, Dict[str, float]]:
+        rows = self._query(
+            "SELECT day, key, value FROM usage_counters WHERE tenant_id = ? AND day BETWEEN ? AND ?",
+            (tenant_id, start_day, end_day),
+        )
+        usage: Dict[str, Dict[str, float]] = {}
+        for row in rows:
+            usage.setdefault(row['day'], {})[row['key']] = row['value']
+        return usage
+
+    # --- Analytics rollups ---
+    def increment_analytics(self, tenant_id: str, granularity: str, period: str, shard: int, counters: Dict[str, float]) -> None:
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO analytics_counters (tenant_id, granularity, period, key, value) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(tenant_id, granularity, period, key) DO UPDATE SET value = value + excluded.value",
+                [(tenant_id, granularity, period, key, value) for key, value in counters.items()],
+            )
+
+    def get_analytics(self, tenant_id: str, granularity: str, start_period: str, end_period: str) -> Dict[str, Dict[str, float]]:
+        rows = self._query(
+            "SELECT period, key, value FROM analytics_counters WHERE tenant_id = ? AND granularity = ? AND period BETWEEN ? AND ?",
+            (tenant_id, granularity, start_period, end_period),
+        )
+        rollups: Dict[str, Dict[str, float]] = {}
+        for row in rows:
+            rollups.setdefault(row['period'], {})[row['key']] = row['value']
+        return rollups
@@ -0,0 +1,150 @@
+# app/services/usage.py
+"""
+Usage ledger: จำนวนการเรียก LLM และ token ที่แต่ละ tenant ใช้ (รวม summarization, fallback และผู้ช่วยตั้งค่า)
+
+* ทุกคำตอบจาก model ถูกบันทึกผ่าน `record_gemini_usage` / `record_openai_usage` ลงตัวนับในหน่วยความจำ
+* `flush()` (เรียกเป็นระยะจาก background worker) รวมยอดแล้วเขียนลง counter รายวันแบบ sharded ใน storage
+  ครั้งเดียวต่อ tenant ต่อวัน จึงไม่มีการเขียน DB ต่อข้อความ
+* ตัวนับใช้ key รูปแบบ `{provider}|{model}|{purpose}|{metric}` เช่น `gemini|gemini-1.5-flash|chat|prompt_tokens`
+"""
+import datetime
+import os
+import random
+from collections import defaultdict
+from typing import Any, Dict, Tuple
+
+from .pending_counters import PendingCounters
+from .storage import get_storage
+
+USAGE_FLUSH_INTERVAL_S = float(os.getenv("USAGE_FLUSH_INTERVAL_S", "60"))
+# จำนวน shard ต่อ tenant ต่อวัน เพื่อกระจายการเขียนจากหลาย instance ไม่ให้ชนเอกสารเดียวกัน
+USAGE_SHARDS = int(os.getenv("USAGE_SHARDS", "4"))
+
+# ราคาโดยประมาณ (USD ต่อ 1M tokens) สำหรับคำนวณค่าใช้จ่าย: (prompt, completion)
+MODEL_PRICING_PER_MILLION = {
+    "gemini-1.5-flash-8b": (0.0375, 0.15),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+METRICS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+def _write_usage(storage, key: Tuple[str, str], counters: Dict[str, float]) -> None:
+    tenant_id, day = key
+    storage.increment_usage(tenant_id, day, random.randrange(USAGE_SHARDS), counters)
+
+
+_counters = PendingCounters("Usage", _write_usage, USAGE_FLUSH_INTERVAL_S)
+
+
+def _today() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def _normalize_model_name(model_name: str) -> str:
+    # ชื่อ model ของ Gemini มี prefix "models/" และใช้เป็นส่วนหนึ่งของ key ที่คั่นด้วย '|'
+    return str(model_name).replace("models/", "").replace("|", "_")
+
+
+def record(tenant_id: str, provider: str, model_name: str, purpose: str, prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0) -> None:
+    """เพิ่มยอดการใช้งานหนึ่งครั้งลงตัวนับในหน่วยความจำ"""
+    prefix = f"{provider}|{_normalize_model_name(model_name)}|{purpose}"
+    _counters.add((tenant_id, _today()), {
+        f"{prefix}|calls": 1,
+        f"{prefix}|prompt_tokens": prompt_tokens or 0,
+        f"{prefix}|completion_tokens": completion_tokens or 0,
+        f"{prefix}|cached_tokens": cached_tokens or 0,
+    })
+
+
+def record_gemini_usage(tenant_id: str, model: Any, response: Any, purpose: str) -> None:
+    """บันทึก usage_metadata จาก response ของ Gemini (ไม่ทำให้ flow หลักล้มหากอ่านไม่ได้)"""
+    try:
+        metadata = getattr(response, 'usage_metadata', None)
+        record(
+            tenant_id, "gemini", getattr(model, 'model_name', 'gemini'), purpose,
+            prompt_tokens=getattr(metadata, 'prompt_token_count', 0),
+            completion_tokens=getattr(metadata, 'candidates_token_count', 0),
+            cached_tokens=getattr(metadata, 'cached_content_token_count', 0),
+        )
+    except Exception as e:
+        print(f"⚠️ Usage: Could not record Gemini usage for tenant {tenant_id}: {e}")
+
+
+def record_openai_usage(tenant_id: str, model_name: str, completion: Any, purpose: str) -> None:
+    """บันทึก usage จาก response ของ OpenAI chat completion"""
+    try:
+        usage = getattr(completion, 'usage', None)
+        record(
+            tenant_id, "openai", model_name, purpose,
+            prompt_tokens=getattr(usage, 'prompt_tokens', 0),
+            completion_tokens=getattr(usage, 'completion_tokens', 0),
+        )
+    except Exception as e:
+        print(f"⚠️ Usage: Could not record OpenAI usage for tenant {tenant_id}: {e}")
+
+
+def flush() -> int:
+    """เขียนยอดสะสมทั้งหมดลง storage แล้วล้างตัวนับ คืนค่าจำนวนเอกสาร (tenant, วัน) ที่เขียน"""
+    return _counters.flush()
+
+
+async def run_flush_worker() -> None:
+    """Background loop (เริ่มจาก lifespan ของ app) ที่ flush ยอดการใช้งานเป็นระยะ"""
+    await _counters.run_flush_worker()
+
+
+def _estimated_cost(model_name: str, prompt_tokens: float, completion_tokens: float) -> float:
+    prompt_price, completion_price = MODEL_PRICING_PER_MILLION.get(model_name, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def _summarize(counters: Dict[str, float]) -> Dict[str, Any]:
+    """แปลงตัวนับแบบ flat key ให้เป็นยอดรวมและยอดแยกตาม model/purpose พร้อมค่าใช้จ่ายโดยประมาณ"""
+    totals = {metric: 0 for metric in METRICS}
+    breakdown: Dict[str, Dict[str, Any]] = {}
+    for key, value in counters.items():
+        try:
+            provider, model_name, purpose, metric = key.split('|')
+        except ValueError:
+            continue
+        if metric not in totals:
+            continue
+        totals[metric] += int(value)
+        entry = breakdown.setdefault(f"{provider}|{model_name}|{purpose}", {
+            'provider': provider, 'model': model_name, 'purpose': purpose, **{m: 0 for m in METRICS}
+        })
+        entry[metric] += int(value)
+
+    cost = 0.0
+    for entry in breakdown.values():
+        entry['estimated_cost_usd'] = round(_estimated_cost(entry['model'], entry['prompt_tokens'], entry['completion_tokens']), 6)
+        cost += entry['estimated_cost_usd']
+    totals['estimated_cost_usd'] = round(cost, 6)
+    return {**totals, 'breakdown': sorted(breakdown.values(), key=lambda e: -e['calls'])}
+
+
+def get_usage(tenant_id: str, days: int = 30) -> Dict[str, Any]:
+    """คืนยอดการใช้งานรายวันย้อนหลัง `days` วัน (รวมยอดที่ยังไม่ flush ของ instance นี้)"""
+    end_day = datetime.datetime.now(datetime.timezone.utc).date()
+    start_day = (end_day - datetime.timedelta(days=max(1, days) - 1)).isoformat()
+    per_day: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    storage = get_storage()
+    for day, counters in storage.get_usage(tenant_id, start_day, end_day.isoformat()).items():
+        for key, value in counters.items():
+            per_day[day][key] += value
+    for (pending_tenant, day), counters in _counters.pending():
+        if pending_tenant == tenant_id and day >= start_day:
+            for key, value in counters.items():
+                per_day[day][key] += value
+
+    all_counters: Dict[str, float] = defaultdict(float)
+    daily = []
+    for day in sorted(per_day):
+        for key, value in per_day[day].items():
+            all_counters[key] += value
+        daily.append({'date': day, **_summarize(per_day[day])})
+    return {'tenant_id': tenant_id, 'start_date': start_day, 'end_date': end_day.isoformat(), 'totals': _summarize(all_counters), 'daily': daily}
@@ -0,0 +1,104 @@
+# app/services/webhook_guard.py
+"""
+ด่านหน้าของ webhook: ตัดทิ้ง request ที่ไม่ควรเสียค่า I/O ให้เร็วที่สุด
+
+* กรอง event ที่ไม่มีทางได้คำตอบ (sticker, follow/unfollow, echo, delivery/read) ออกก่อนแตะ storage
+* ตรวจ HMAC-SHA256 ของ body กับ `X-Line-Signature` (channel secret) หรือ `X-Hub-Signature-256` (app secret)
+* secret และ token ของ tenant ถูก cache ในหน่วยความจำ (รวมถึง tenant ที่ไม่มีอยู่) จึงไม่อ่าน tenant ทุก request
+* กัน event ซ้ำ (platform ส่งซ้ำหรือถูก replay) ด้วย ID ของ event ที่เคยเห็นล่าสุด
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .storage import get_storage
+
+WEBHOOK_CONFIG_TTL_S = float(os.getenv("WEBHOOK_CONFIG_TTL_S", "60"))
+# true = ปฏิเสธ webhook ของ tenant ที่ยังไม่ได้ตั้ง channel/app secret (ค่าเริ่มต้นยอมให้ผ่านเพื่อรองรับ tenant เดิม)
+WEBHOOK_REQUIRE_SIGNATURE = os.getenv("WEBHOOK_REQUIRE_SIGNATURE", "false").lower() == "true"
+SEEN_EVENT_CAPACITY = 50000
+
+# ฟิลด์ของ tenant ที่ webhook ต้องใช้ (ไม่ cache ทั้งเอกสาร)
+WEBHOOK_CONFIG_FIELDS = ('lineAccessToken', 'lineChannelSecret', 'facebookPageToken', 'facebookAppSecret')
+
+_lock = threading.Lock()
+_config_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_seen_events: "OrderedDict[str, None]" = OrderedDict()
+
+
+def cached_config(tenant_id: str) -> Optional[Dict[str, Any]]:
+    """config ของ tenant จาก cache (None หากไม่มีหรือหมดอายุ) ไม่มี I/O"""
+    entry = _config_cache.get(tenant_id)
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    return entry[1]
+
+
+def load_config(tenant_id: str) -> Dict[str, Any]:
+    """อ่าน config จาก storage แล้ว cache ไว้ (tenant ที่ไม่มีอยู่จะได้ dict ว่าง)"""
+    tenant_data = get_storage().get_tenant(tenant_id) or {}
+    config = {field: tenant_data.get(field) for field in WEBHOOK_CONFIG_FIELDS}
+    with _lock:
+        _config_cache[tenant_id] = (time.monotonic() + WEBHOOK_CONFIG_TTL_S, config)
+    return config
+
+
+def invalidate_config(tenant_id: str) -> None:
+    """ล้าง cache เมื่อมีการแก้ token/secret (instance อื่นจะเห็นค่าใหม่เมื่อ TTL หมด)"""
+    with _lock:
+        _config_cache.pop(tenant_id, None)
+
+
+def line_signature_valid(body: bytes, signature: str, channel_secret: str) -> bool:
+    digest = hmac.new(channel_secret.encode('utf-8'), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode('ascii'), signature)
+
+
+def facebook_signature_valid(body: bytes, signature: str, app_secret: str) -> bool:
+    if not signature.startswith("sha256="):
+        return False
+    digest = hmac.new(app_secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(digest, signature[len("sha256="):])
+
+
+def line_reply_events(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """เฉพาะ event ข้อความ text จากผู้ใช้ ซึ่งเป็นชนิดเดียวที่บอทตอบ"""
+    return [
+        event for event in payload.get("events") or []
+        if event.get("type") == "message"
+        and (event.get("message") or {}).get("type") == "text"
+        and (event.get("source") or {}).get("userId")
+    ]
+
+
+def facebook_message_events(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """เฉพาะข้อความ text จากลูกค้า (ข้าม echo ของเพจเอง, delivery, read และ postback)"""
+    if payload.get("object") != "page":
+        return []
+    return [
+        messaging_event
+        for entry in payload.get("entry") or []
+        for messaging_event in entry.get("messaging") or []
+        if (messaging_event.get("message") or {}).get("text")
+        and not messaging_event["message"].get("is_echo")
+        and (messaging_event.get("sender") or {}).get("id")
+    ]
+
+
+def is_duplicate(tenant_id: str, event_id: Optional[str]) -> bool:
+    """True หาก event นี้เคยถูกรับแล้ว (ใช้ webhookEventId ของ LINE หรือ mid ของ Facebook)"""
+    if not event_id:
+        return False
+    key = f"{tenant_id}:{event_id}"
+    with _lock:
+        if key in _seen_events:
+            return True
+        _seen_events[key] = None
+        if len(_seen_events) > SEEN_EVENT_CAPACITY:
+            _seen_events.popitem(last=False)
+    return False
@@ -0,0 +1,189 @@
+# app/services/work_queue.py
+"""
+คิวงานที่ต้องให้แอดมินดูแลเอง แยกจาก history (ไม่ต้องไล่หา status ในทุกแชทฝั่ง client)
+
+* ทุกข้อความที่ create_error_log_entry ทำเครื่องหมาย `requires_manual_reply` / `requires_review`
+  ถูกบันทึกเป็นงานหนึ่งรายการในคิวของ tenant ด้วย (index ตาม status + เวลาที่สร้าง)
+* `claim`   แอดมินรับงาน (ถือไว้ได้ WORK_CLAIM_TTL_S วินาที หลังจากนั้นคนอื่นรับต่อได้)
+* `resolve` ปิดงาน และปิดงานที่ค้างของแชทนั้นอัตโนมัติเมื่อแอดมินตอบลูกค้า
+* `expire_stale` งานที่ค้างนานเกิน WORK_ITEM_TTL_S ถือว่าหมดอายุ (ตรวจเมื่อมีแอดมินเปิด inbox ของ tenant)
+* ยอดงานค้างส่งถึงหน้า inbox แบบ realtime เป็น event `work_queue` ของ inbox stream
+"""
+import datetime
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from . import metrics
+from .storage import get_storage
+
+WORK_QUEUE_STATUSES = ("open", "resolved", "expired")
+# status ของข้อความใน history ที่ต้องสร้างงาน
+FLAGGED_MESSAGE_STATUSES = ("requires_manual_reply", "requires_review")
+WORK_CLAIM_TTL_S = int(os.getenv("WORK_CLAIM_TTL_S", "900"))
+WORK_ITEM_TTL_S = int(os.getenv("WORK_ITEM_TTL_S", str(72 * 3600)))
+WORK_QUEUE_PAGE_SIZE = 50
+WORK_QUEUE_MAX_PAGE_SIZE = 200
+# ความยาวสูงสุดของข้อความลูกค้า/รายละเอียด error ที่คัดลอกมาเก็บในงาน
+_SNIPPET_CHARS = 500
+
+_listeners: List[Callable[[str], None]] = []
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def add_listener(listener: Callable[[str], None]) -> None:
+    """ลงทะเบียนฟังก์ชันที่ถูกเรียก (ด้วย tenant_id) ทุกครั้งที่คิวของ tenant เปลี่ยนใน instance นี้"""
+    _listeners.append(listener)
+
+
+def _notify(tenant_id: str) -> None:
+    for listener in _listeners:
+        try:
+            listener(tenant_id)
+        except Exception as e:
+            print(f"⚠️ Work queue: Listener failed for tenant {tenant_id}: {e}")
+
+
+def enqueue_flagged(tenant_id: str, user_id: str, messages: Iterable[Dict[str, Any]], display_name: Optional[str] = None, platform: Optional[str] = None) -> int:
+    """สร้างงานจากข้อความที่ถูกทำเครื่องหมายไว้ (ความผิดพลาดไม่กระทบการตอบลูกค้า) คืนค่าจำนวนงานที่สร้าง"""
+    created = 0
+    for message in messages:
+        if message.get('status') not in FLAGGED_MESSAGE_STATUSES:
+            continue
+        item = {
+            'user_id': user_id,
+            'kind': message['status'],
+            'failure_type': message.get('failure_type'),
+            'error_details': str(message.get('error_details') or "")[:_SNIPPET_CHARS],
+            'message_text': " ".join(p.get('text', '') for p in message.get('parts', []) if isinstance(p, dict))[:_SNIPPET_CHARS],
+            'message_timestamp': message.get('timestamp'),
+            'display_name': display_name,
+            'platform': platform,
+            'status': 'open',
+            'created_at': _now().isoformat(),
+        }
+        try:
+            get_storage().create_work_item(tenant_id, item)
+            created += 1
+            metrics.increment("work_queue.created", kind=item['kind'])
+        except Exception as e:
+            print(f"❌ Work queue: Could not enqueue {item['kind']} for {user_id} (tenant {tenant_id}): {e}")
+    if created:
+        _notify(tenant_id)
+    return created
+
+
+def _claimed_by_other(item: Dict[str, Any], uid: str, now_iso: str) -> bool:
+    holder = item.get('claimed_by')
+    return bool(holder) and holder != uid and (item.get('claim_expires_at') or "") > now_iso
+
+
+def claim(tenant_id: str, item_id: str, admin: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    รับงาน (หรือต่อเวลาถือครองของงานที่รับไว้แล้ว) คืนงานหลังแก้ หรือ None หากไม่พบ
+    raise ValueError หากงานปิดไปแล้วหรือแอดมินคนอื่นถือครองอยู่
+    """
+    now = _now()
+
+    def mutate(item: Dict[str, Any]) -> Dict[str, Any]:
+        if item.get('status') != 'open':
+            raise ValueError(f"Work item is already {item.get('status')}.")
+        if _claimed_by_other(item, admin['uid'], now.isoformat()):
+            raise ValueError(f"Work item is claimed by {item.get('claimed_by_name') or item['claimed_by']}.")
+        return {
+            'claimed_by': admin['uid'],
+            'claimed_by_name': admin.get('name'),
+            'claimed_at': now.isoformat(),
+            'claim_expires_at': (now + datetime.timedelta(seconds=WORK_CLAIM_TTL_S)).isoformat(),
+        }
+
+    item = get_storage().update_work_item(tenant_id, item_id, mutate)
+    if item is not None:
+        metrics.increment("work_queue.claimed")
+        _notify(tenant_id)
+    return item
+
+
+def resolve(tenant_id: str, item_id: str, admin: Dict[str, Any], resolution: str = "resolved", force: bool = False) -> Optional[Dict[str, Any]]:
+    """ปิดงาน คืนงานหลังแก้ หรือ None หากไม่พบ raise ValueError หากปิดไปแล้ว หรือคนอื่นถือครองอยู่ (เว้นแต่ `force`)"""
+    now_iso = _now().isoformat()
+
+    def mutate(item: Dict[str, Any]) -> Dict[str, Any]:
+        if item.get('status') != 'open':
+            raise ValueError(f"Work item is already {item.get('status')}.")
+        if not force and _claimed_by_other(item, admin['uid'], now_iso):
+            raise ValueError(f"Work item is claimed by {item.get('claimed_by_name') or item['claimed_by']}.")
+        return {
+            'status': 'resolved',
+            'resolution': resolution,
+            'resolved_by': admin['uid'],
+            'resolved_by_name': admin.get('name'),
+            'resolved_at': now_iso,
+        }
+
+    item = get_storage().update_work_item(tenant_id, item_id, mutate)
+    if item is not None:
+        metrics.increment("work_queue.resolved", resolution=resolution)
+        _notify(tenant_id)
+    return item
+
+
+def resolve_for_user(tenant_id: str, user_id: str, admin: Dict[str, Any], resolution: str = "admin_replied") -> int:
+    """ปิดงานที่ค้างทั้งหมดของแชทนี้ (เรียกเมื่อแอดมินตอบลูกค้าแล้ว) คืนค่าจำนวนงานที่ปิด"""
+    resolved = 0
+    for item in get_storage().list_work_items(tenant_id, "open", WORK_QUEUE_MAX_PAGE_SIZE, user_id=user_id):
+        try:
+            if resolve(tenant_id, item['id'], admin, resolution, force=True):
+                resolved += 1
+        except ValueError:
+            continue
+    return resolved
+
+
+def expire_stale(tenant_id: str) -> int:
+    """ปิดงานที่ค้างนานเกิน WORK_ITEM_TTL_S (ไล่จากงานเก่าสุดจนเจองานที่ยังไม่หมดอายุ) คืนค่าจำนวนงานที่หมดอายุ"""
+    storage = get_storage()
+    now = _now()
+    cutoff = (now - datetime.timedelta(seconds=WORK_ITEM_TTL_S)).isoformat()
+
+    def mutate(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if item.get('status') != 'open':
+            return None
+        return {'status': 'expired', 'expired_at': now.isoformat()}
+
+    expired = 0
+    while True:
+        page = storage.list_work_items(tenant_id, "open", WORK_QUEUE_MAX_PAGE_SIZE)
+        stale = [item for item in page if item['created_at'] < cutoff]
+        for item in stale:
+            if storage.update_work_item(tenant_id, item['id'], mutate):
+                expired += 1
+        if len(stale) < len(page) or len(page) < WORK_QUEUE_MAX_PAGE_SIZE:
+            break
+    if expired:
+        metrics.increment("work_queue.expired", expired)
+        print(f"🗂️ Work queue: Expired {expired} stale item(s) for tenant {tenant_id}.")
+        _notify(tenant_id)
+    return expired
+
+
+def list_items(tenant_id: str, status: str = "open", limit: int = WORK_QUEUE_PAGE_SIZE, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """งานหนึ่งหน้า เรียงจากเก่าไปใหม่ ส่ง `next_cursor` กลับมาเพื่อขอหน้าถัดไป"""
+    if status not in WORK_QUEUE_STATUSES:
+        raise ValueError(f"status must be one of {WORK_QUEUE_STATUSES}")
+    storage = get_storage()
+    limit = max(1, min(limit, WORK_QUEUE_MAX_PAGE_SIZE))
+    items = storage.list_work_items(tenant_id, status, limit + 1, start_after=cursor)
+    has_more = len(items) > limit
+    items = items[:limit]
+    return {
+        'items': items,
+        'next_cursor': items[-1]['id'] if has_more else None,
+        'open_count': storage.get_open_work_count(tenant_id),
+    }
+
+
+def open_count(tenant_id: str) -> int:
+    return get_storage().get_open_work_count(tenant_id)
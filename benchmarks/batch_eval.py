@@ -0,0 +1,440 @@
+# benchmarks/batch_eval.py
+"""
+Batch evaluation of prompt and config changes.
+
+Replays a corpus of recorded conversations through `get_bot_response`: each
+case seeds a conversation (history, optional summary) and sends one more
+customer message. The tenant config comes from `--tenant-file`, with overrides
+(`--set key=value`, `--persona-file`, `--summarization-prompt-file`) for the
+change being evaluated.
+
+* Cases run in parallel on a process pool. Each worker has its own in-memory
+  SQLite storage, search index, archive directory and KB index.
+* `--model fake` (default) answers with `benchmarks.fakes.FakeGeminiModel`. The
+  reply is derived from the prompt, so it changes exactly when the prompt does.
+  This needs no credentials. `--model real` uses the configured Gemini/OpenAI clients.
+* Results are cached in `--cache-dir` under (prompt version, case). The prompt
+  version hashes the tenant config, `SUMMARIZATION_PROMPT` and the model mode,
+  so a re-run only replays the cases whose prompt changed.
+  Use `--no-cache` after changing code rather than prompts.
+* The report shows latency, tokens by purpose, and answer diffs against
+  `--baseline` (the `--json` output of an earlier run). It also shows
+  similarity to the recorded `reference` reply when the corpus has one.
+
+Corpus: NDJSON, one case per line:
+    {"id": "...", "history": [{"role": "user"|"model", "text": "..."}, ...],
+     "summary": "...", "summary_checkpoint": 0, "input": "...", "reference": "..."}
+History entries may also use the stored form `{"role", "parts": [{"text"}]}`.
+`--from-export` builds cases from a tenant export (`GET /api/tenant/{tenant_id}/export`, NDJSON):
+every customer message that got a reply becomes a case with the preceding messages as history.
+
+Usage:
+    python -m benchmarks.batch_eval --json before.json
+    python -m benchmarks.batch_eval --persona-file new_persona.txt --baseline before.json --json after.json
+    python -m benchmarks.batch_eval --from-export export.ndjson --limit 200 --workers 8
+    python -m benchmarks.batch_eval --model real --set is_detailed_response=true
+"""
+import argparse
+import concurrent.futures
+import datetime
+import difflib
+import hashlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+PAYLOAD_DIR = os.path.join(os.path.dirname(__file__), "payloads")
+EVAL_TENANT_ID = "eval-tenant"
+# ค่าใน config ที่เปลี่ยนเองระหว่างใช้งาน ไม่ได้มีผลกับ prompt
+VOLATILE_CONFIG_FIELDS = ("configVersion", "contextCaches", "updatedAt")
+
+# token ของ case ที่ worker กำลังรัน แยกตาม purpose (usage.record ถูกแทนด้วย _record_usage ใน worker)
+_case_usage: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+
+def fake_reply(prompt: str) -> str:
+    """คำตอบของ model ปลอม: กำหนดได้จาก prompt ทั้งหมด จึงเปลี่ยนเมื่อ prompt เปลี่ยนเท่านั้น"""
+    digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:10]
+    if "--- คำถามล่าสุด ---" in prompt:
+        question = prompt.rsplit("--- คำถามล่าสุด ---", 1)[1].strip()
+        reference = ""
+        if "--- ข้อมูลอ้างอิง ---" in prompt:
+            reference = prompt.split("--- ข้อมูลอ้างอิง ---", 1)[1].strip().split("\n", 1)[0]
+        return f"ตอบ \"{question[:80]}\" จาก: {reference[:80] or '(cached context)'} [prompt {digest}]"
+    lines = [line for line in prompt.strip().splitlines() if line.strip()]
+    return f"สรุป: {lines[-1][:80] if lines else ''} [prompt {digest}]"
+
+
+# --- Corpus ---
+
+def _message(entry: Dict[str, Any], timestamp: str) -> Dict[str, Any]:
+    message = dict(entry)
+    if 'parts' not in message:
+        message['parts'] = [{'text': message.pop('text', "")}]
+    message.setdefault('timestamp', timestamp)
+    return message
+
+
+def load_cases(path: str) -> List[Dict[str, Any]]:
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            if not case.get('input'):
+                raise ValueError(f"{path}:{line_number}: case has no 'input'")
+            case.setdefault('id', f"case-{line_number}")
+            cases.append(case)
+    return cases
+
+
+def cases_from_export(path: str, max_history: int) -> List[Dict[str, Any]]:
+    """แปลงไฟล์ export (NDJSON) เป็น case: ข้อความลูกค้าที่มีคำตอบต่อท้าย 1 ข้อความ = 1 case"""
+    by_user: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                by_user[row['user_id']].append(row)
+    cases = []
+    for user_id, rows in by_user.items():
+        for i in range(len(rows) - 1):
+            if rows[i].get('role') != 'user' or rows[i + 1].get('role') != 'model' or not rows[i].get('text'):
+                continue
+            history = [{'role': row['role'], 'text': row.get('text') or "", 'timestamp': row.get('timestamp')}
+                       for row in rows[max(0, i - max_history):i] if row.get('role') in ('user', 'model')]
+            cases.append({'id': f"{user_id}-{i}", 'history': history, 'input': rows[i]['text'], 'reference': rows[i + 1].get('text') or ""})
+    return cases
+
+
+def load_tenant_config(args) -> Dict[str, Any]:
+    with open(args.tenant_file, encoding="utf-8") as f:
+        config = json.load(f)
+    for assignment in args.set or []:
+        key, sep, value = assignment.partition("=")
+        if not sep:
+            raise ValueError(f"--set expects key=value, got {assignment!r}")
+        try:
+            config[key] = json.loads(value)
+        except json.JSONDecodeError:
+            config[key] = value
+    if args.persona_file:
+        with open(args.persona_file, encoding="utf-8") as f:
+            config['botPersona'] = f.read().strip()
+    return config
+
+
+def load_summarization_prompt(args) -> str:
+    if args.summarization_prompt_file:
+        with open(args.summarization_prompt_file, encoding="utf-8") as f:
+            return f.read()
+    from app.prompts.summarization_prompt import SUMMARIZATION_PROMPT
+    return SUMMARIZATION_PROMPT
+
+
+# --- Caching ---
+
+def _digest(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def prompt_version(config: Dict[str, Any], summarization_prompt: str, model: str) -> str:
+    stable_config = {k: v for k, v in config.items() if k not in VOLATILE_CONFIG_FIELDS}
+    return _digest({'config': stable_config, 'summarization_prompt': summarization_prompt, 'model': model})[:16]
+
+
+def case_key(version: str, case: Dict[str, Any]) -> str:
+    # reference ไม่มีผลกับคำตอบ จึงไม่อยู่ใน key
+    return _digest({'version': version, 'case': {k: v for k, v in case.items() if k != 'reference'}})
+
+
+class ResultCache:
+    """ผลของแต่ละ case เก็บเป็นไฟล์ JSON ตาม key (เขียนจาก process หลักเท่านั้น)"""
+
+    def __init__(self, directory: Optional[str]):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+# --- Worker ---
+
+def _record_usage(tenant_id: str, provider: str, model_name: str, purpose: str, prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0) -> None:
+    counters = _case_usage[purpose]
+    counters['calls'] += 1
+    counters['prompt_tokens'] += prompt_tokens or 0
+    counters['completion_tokens'] += completion_tokens or 0
+    counters['cached_tokens'] += cached_tokens or 0
+
+
+def _init_worker(options: Dict[str, Any]) -> None:
+    """ตั้งค่า app ใน process ของ worker: storage/index/archive แยกต่อ process และ model ตาม --model"""
+    if not options['verbose']:
+        sys.stdout = open(os.devnull, "w")
+    work_dir = tempfile.mkdtemp(prefix="allchat-eval-")
+    os.environ["SEARCH_INDEX_PATH"] = os.path.join(work_dir, "search_index.db")
+    os.environ["ARCHIVE_DIR"] = os.path.join(work_dir, "archive")
+
+    from app.config import settings
+    from app.services import chatbot_logic, context_cache, kb_retrieval, usage
+    from app.services import storage as storage_module
+    from app.services.storage.sqlite_backend import SQLiteStorage
+
+    storage = SQLiteStorage(":memory:")
+    storage_module.set_storage(storage)
+    storage.update_tenant(EVAL_TENANT_ID, options['config'])
+    chatbot_logic.SUMMARIZATION_PROMPT = options['summarization_prompt']
+    usage.record = _record_usage
+    kb_retrieval.set_embedder(kb_retrieval.LocalEmbedder())
+    kb_retrieval.set_index_store(kb_retrieval.KnowledgeIndexStore(os.path.join(work_dir, "kb_index")))
+    # สร้าง index ก่อนเริ่ม ไม่งั้นเคสแรกๆ จะได้ผลจากการจับคำระหว่างที่ index สร้างอยู่เบื้องหลัง
+    kb_retrieval.warm(EVAL_TENANT_ID, options['config'].get('knowledgeBase', ''))
+
+    if options['model'] == "fake":
+        from benchmarks.fakes import FakeContextCacheProvider, FakeGeminiModel, FakeOpenAIClient, LatencyProfile
+
+        def profile() -> LatencyProfile:
+            return LatencyProfile(options['llm_median_ms'], options['llm_p95_ms'])
+
+        settings._end_user_model_instance = FakeGeminiModel(profile(), reply_factory=fake_reply)
+        settings._tier_model_instances = {
+            tier: FakeGeminiModel(profile(), reply_factory=fake_reply, model_name=f"fake-gemini-{tier}")
+            for tier in settings.GEMINI_MODEL_TIERS
+        }
+        settings._openai_client_instance = FakeOpenAIClient(profile())
+        context_cache.set_context_cache(context_cache.ContextCacheManager(FakeContextCacheProvider(
+            lambda **kwargs: FakeGeminiModel(profile(), reply_factory=fake_reply, **kwargs)
+        )))
+
+
+def _seed_history(case: Dict[str, Any]) -> List[Dict[str, Any]]:
+    history = case.get('history') or []
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        _message(entry, (now - datetime.timedelta(minutes=len(history) - i)).isoformat())
+        for i, entry in enumerate(history)
+    ]
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    from app.services.chatbot_logic import get_bot_response
+    from app.services.storage import get_storage
+
+    storage = get_storage()
+    user_id = f"eval-{hashlib.sha1(str(case['id']).encode('utf-8')).hexdigest()[:12]}"
+    history = _seed_history(case)
+    storage.set_conversation(EVAL_TENANT_ID, user_id, {
+        'history': history,
+        'summary': case.get('summary', ""),
+        'summary_checkpoint': case.get('summary_checkpoint', 0),
+        'is_bot_active': True,
+        'platform': "eval",
+    })
+    _case_usage.clear()
+    result: Dict[str, Any] = {'id': case['id']}
+    started = time.perf_counter()
+    try:
+        result['reply'] = get_bot_response(EVAL_TENANT_ID, user_id, case['input'], platform="eval")
+    except Exception as e:
+        result['reply'] = ""
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    result['usage'] = {purpose: dict(counters) for purpose, counters in _case_usage.items()}
+
+    conversation = storage.get_conversation(EVAL_TENANT_ID, user_id) or {}
+    new_messages = (conversation.get('history') or [])[len(history):]
+    result['summary'] = conversation.get('summary', "")
+    result['route'] = next((m.get('route') for m in new_messages if m.get('role') == 'model' and m.get('route')), None)
+    failures = [m['failure_type'] for m in new_messages if m.get('failure_type')]
+    if failures and 'error' not in result:
+        result['error'] = ", ".join(failures)
+    return result
+
+
+# --- Report ---
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))] if sorted_values else 0.0
+
+
+def _diff(before: str, after: str) -> Iterator[str]:
+    return difflib.unified_diff(before.splitlines(), after.splitlines(), "baseline", "current", lineterm="", n=1)
+
+
+def build_report(results: List[Dict[str, Any]], cases: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    latencies = sorted(r['latency_ms'] for r in results)
+    tokens: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for r in results:
+        for purpose, counters in r['usage'].items():
+            for name, value in counters.items():
+                tokens[purpose][name] += value
+    report: Dict[str, Any] = {
+        'cases': len(results),
+        'cached': sum(1 for r in results if r.get('cached')),
+        'errors': sum(1 for r in results if r.get('error')),
+        'latency_ms': {
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95),
+            'max': latencies[-1] if latencies else 0.0,
+            'mean': round(statistics.mean(latencies), 2) if latencies else 0.0,
+        },
+        'tokens': {purpose: dict(counters) for purpose, counters in sorted(tokens.items())},
+    }
+    routes: Dict[str, int] = defaultdict(int)
+    for r in results:
+        routes[r.get('route') or "none"] += 1
+    report['routes'] = dict(sorted(routes.items()))
+
+    references = {c['id']: c['reference'] for c in cases if c.get('reference')}
+    if references:
+        ratios = [difflib.SequenceMatcher(None, references[r['id']], r['reply']).ratio() for r in results if r['id'] in references]
+        report['reference_similarity'] = round(statistics.mean(ratios), 3)
+
+    if baseline is not None:
+        before = {r['id']: r for r in baseline.get('results', [])}
+        changed = [r['id'] for r in results if r['id'] in before and before[r['id']].get('reply') != r['reply']]
+        report['baseline'] = {
+            'prompt_version': baseline.get('prompt_version'),
+            'compared': sum(1 for r in results if r['id'] in before),
+            'changed': changed,
+            'summary_changed': [r['id'] for r in results if r['id'] in before and before[r['id']].get('summary') != r['summary']],
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any], results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]], max_diffs: int, elapsed_s: float, version: str) -> None:
+    latency = report['latency_ms']
+    print(f"prompt version {version}: {report['cases']} cases, {report['cases'] - report['cached']} run, "
+          f"{report['cached']} from cache, {report['errors']} errors, {elapsed_s:.1f}s")
+    print(f"latency ms: p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  max {latency['max']:.1f}  mean {latency['mean']:.1f}")
+    print(f"routes: {', '.join(f'{route}={count}' for route, count in report['routes'].items())}")
+    print(f"{'purpose':<16}{'calls':>8}{'prompt':>10}{'completion':>12}{'cached':>9}")
+    for purpose, counters in report['tokens'].items():
+        print(f"{purpose:<16}{counters.get('calls', 0):>8}{counters.get('prompt_tokens', 0):>10}"
+              f"{counters.get('completion_tokens', 0):>12}{counters.get('cached_tokens', 0):>9}")
+    if 'reference_similarity' in report:
+        print(f"similarity to reference replies: {report['reference_similarity']:.3f}")
+    for r in results:
+        if r.get('error'):
+            print(f"❌ {r['id']}: {r['error']}")
+    if baseline is None:
+        return
+    comparison = report['baseline']
+    print(f"vs baseline {comparison['prompt_version']}: {len(comparison['changed'])}/{comparison['compared']} replies changed, "
+          f"{len(comparison['summary_changed'])} summaries changed")
+    before = {r['id']: r for r in baseline.get('results', [])}
+    for case_id in comparison['changed'][:max_diffs]:
+        current = next(r for r in results if r['id'] == case_id)
+        print(f"--- {case_id}")
+        for line in _diff(before[case_id].get('reply', ""), current['reply']):
+            print(line)
+    if len(comparison['changed']) > max_diffs:
+        print(f"... {len(comparison['changed']) - max_diffs} more (see --json)")
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay recorded conversations through get_bot_response")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--cases", default=os.path.join(PAYLOAD_DIR, "eval_cases.ndjson"), help="corpus NDJSON")
+    source.add_argument("--from-export", help="build cases from a tenant export NDJSON")
+    parser.add_argument("--max-history", type=int, default=20, help="history messages per case from --from-export")
+    parser.add_argument("--limit", type=int, default=0, help="evaluate only the first N cases")
+    parser.add_argument("--tenant-file", default=os.path.join(PAYLOAD_DIR, "tenant.json"))
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a tenant config field (value parsed as JSON if possible)")
+    parser.add_argument("--persona-file", help="use this file as botPersona")
+    parser.add_argument("--summarization-prompt-file", help="use this file as SUMMARIZATION_PROMPT")
+    parser.add_argument("--model", choices=("fake", "real"), default="fake")
+    parser.add_argument("--llm-median-ms", type=float, default=0.0, help="fake model latency")
+    parser.add_argument("--llm-p95-ms", type=float, default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--cache-dir", default=".eval_cache")
+    parser.add_argument("--no-cache", action="store_true", help="replay every case (cache is still refreshed)")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to diff against")
+    parser.add_argument("--max-diffs", type=int, default=20)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show application logs")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    cases = cases_from_export(args.from_export, args.max_history) if args.from_export else load_cases(args.cases)
+    if args.limit:
+        cases = cases[:args.limit]
+    config = load_tenant_config(args)
+    summarization_prompt = load_summarization_prompt(args)
+    model = "fake" if args.model == "fake" else "real:" + ",".join(
+        os.getenv(name, "") for name in ("GEMINI_MODEL_LITE", "GEMINI_MODEL_STANDARD", "GEMINI_MODEL_STRONG"))
+    version = prompt_version(config, summarization_prompt, model)
+    cache = ResultCache(args.cache_dir)
+
+    started = time.perf_counter()
+    results: Dict[str, Dict[str, Any]] = {}
+    pending = []
+    for case in cases:
+        key = case_key(version, case)
+        cached = None if args.no_cache else cache.get(key)
+        if cached is not None:
+            results[case['id']] = dict(cached, cached=True)
+        else:
+            pending.append((key, case))
+
+    if pending:
+        options = {
+            'config': config,
+            'summarization_prompt': summarization_prompt,
+            'model': args.model,
+            'llm_median_ms': args.llm_median_ms,
+            'llm_p95_ms': args.llm_p95_ms,
+            'verbose': args.verbose,
+        }
+        workers = max(1, min(args.workers, len(pending)))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as pool:
+            chunksize = max(1, len(pending) // (workers * 4))
+            for (key, case), result in zip(pending, pool.map(run_case, [case for _, case in pending], chunksize=chunksize)):
+                if not result.get('error'):
+                    cache.put(key, result)
+                results[case['id']] = dict(result, cached=False)
+    elapsed_s = time.perf_counter() - started
+
+    ordered = [results[case['id']] for case in cases]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    report = build_report(ordered, cases, baseline)
+    print_report(report, ordered, baseline, args.max_diffs, elapsed_s, version)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'prompt_version': version, 'report': report, 'results': ordered}, f, ensure_ascii=False, indent=2)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,5 @@
+# benchmarks/fakes/__init__.py
+from .firestore import InMemoryFirestore
+from .llm import FakeContextCacheProvider, FakeGeminiModel, FakeOpenAIClient, FakeProviderError, LatencyProfile
+from .platform_server import FakePlatformServer
+from .booking_server import FakeBookingServer
@@ -0,0 +1,155 @@
+# benchmarks/fakes/booking_server.py
+"""
+Local fake of a tenant's external booking system.
+
+Start it with `FakeBookingServer().start()` and set the tenant's
+`bookingSystemIntegration` to `server.availability_url`. It answers
+`GET /availability?start=YYYY-MM-DD&days=N` with `{"slots": [...]}`: one slot
+per `slot_minutes` between `open_hour` and `close_hour` each day, with every
+`booked_every`-th slot marked unavailable. Requests are counted (so tests can
+check caching and coalescing) and answered after an optional artificial
+latency; `error_rate` makes a fraction of lookups return HTTP 503.
+
+Can also be run standalone:
+    python -m benchmarks.fakes.booking_server --port 9200 --latency-ms 300
+"""
+import argparse
+import datetime
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeBookingServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0.0,
+        error_rate: float = 0.0,
+        open_hour: int = 10,
+        close_hour: int = 18,
+        slot_minutes: int = 60,
+        booked_every: int = 3,
+        utc_offset_hours: int = 7,
+    ):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.open_hour = open_hour
+        self.close_hour = close_hour
+        self.slot_minutes = slot_minutes
+        self.booked_every = booked_every
+        self.tz = datetime.timezone(datetime.timedelta(hours=utc_offset_hours))
+        self.requests: Counter = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def availability_url(self) -> str:
+        return f"{self.base_url}/availability"
+
+    def start(self) -> "FakeBookingServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-booking-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    # --- Slot generation ---
+    def slots(self, start: datetime.date, days: int) -> List[Dict[str, Any]]:
+        result = []
+        index = 0
+        for offset in range(days):
+            day = start + datetime.timedelta(days=offset)
+            current = datetime.datetime.combine(day, datetime.time(self.open_hour), tzinfo=self.tz)
+            closing = datetime.datetime.combine(day, datetime.time(self.close_hour), tzinfo=self.tz)
+            while current + datetime.timedelta(minutes=self.slot_minutes) <= closing:
+                end = current + datetime.timedelta(minutes=self.slot_minutes)
+                index += 1
+                result.append({
+                    "start": current.isoformat(),
+                    "end": end.isoformat(),
+                    "available": not (self.booked_every and index % self.booked_every == 0),
+                    "service": "บริการทั่วไป",
+                })
+                current = end
+        return result
+
+    # --- Request handling ---
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def _handle(self, path: str) -> Tuple[int, Dict[str, Any]]:
+        parts = urlsplit(path)
+        route = "availability" if parts.path == "/availability" else "unknown"
+        with self._lock:
+            self.requests[route] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if route == "unknown":
+            return 404, {"message": "Not found"}
+        if self._should_fail():
+            return 503, {"message": "Injected failure"}
+
+        query = parse_qs(parts.query)
+        try:
+            start = datetime.date.fromisoformat(query.get("start", [""])[0])
+        except ValueError:
+            start = datetime.datetime.now(self.tz).date()
+        try:
+            days = max(1, min(31, int(query.get("days", ["7"])[0])))
+        except ValueError:
+            days = 7
+        return 200, {"slots": self.slots(start, days)}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status_code, payload = server._handle(self.path)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake external booking system")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeBookingServer(args.host, args.port, args.latency_ms, args.error_rate).start()
+    print(f"✅ Fake booking server listening on {fake.availability_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,432 @@
+# benchmarks/fakes/firestore.py
+"""
+In-memory stand-in for the Firestore client returned by `firestore.client()`.
+
+Only the subset of the API that the AllChat backend uses is implemented:
+collections/documents, get/set(merge)/update/delete, simple queries
+(where, order_by, limit, start_after, select), write batches and the field transforms
+(ArrayUnion, ArrayRemove, Increment, SERVER_TIMESTAMP, DELETE_FIELD).
+
+Values are deep-copied on every read and write so callers observe the same
+copy semantics as with the real client, and an optional per-operation latency
+can be injected to emulate network round trips.
+"""
+import copy
+import datetime
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from google.api_core.exceptions import FailedPrecondition
+from google.cloud.firestore_v1 import transforms
+
+_MISSING = object()
+
+
+def _now_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _split_field_path(field_path: str) -> List[str]:
+    return [part for part in field_path.split('.') if part]
+
+
+def _get_field(data: Dict[str, Any], field_path: str) -> Any:
+    current: Any = data
+    for part in _split_field_path(field_path):
+        if not isinstance(current, dict) or part not in current:
+            return _MISSING
+        current = current[part]
+    return current
+
+
+def _apply_value(existing: Any, value: Any) -> Any:
+    """Resolves Firestore transforms against the current field value."""
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now_iso()
+    if isinstance(value, transforms.ArrayUnion):
+        current = list(existing) if isinstance(existing, list) else []
+        for item in value.values:
+            if item not in current:
+                current.append(copy.deepcopy(item))
+        return current
+    if isinstance(value, transforms.ArrayRemove):
+        current = list(existing) if isinstance(existing, list) else []
+        return [item for item in current if item not in value.values]
+    if isinstance(value, transforms.Increment):
+        base = existing if isinstance(existing, (int, float)) and not isinstance(existing, bool) else 0
+        return base + value.value
+    if isinstance(value, dict):
+        return {k: _apply_value(_MISSING, v) for k, v in value.items() if v is not transforms.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def _set_field(data: Dict[str, Any], field_path: str, value: Any) -> None:
+    parts = _split_field_path(field_path)
+    current = data
+    for part in parts[:-1]:
+        if not isinstance(current.get(part), dict):
+            current[part] = {}
+        current = current[part]
+    if value is transforms.DELETE_FIELD:
+        current.pop(parts[-1], None)
+    else:
+        current[parts[-1]] = _apply_value(current.get(parts[-1], _MISSING), value)
+
+
+def _merge_into(target: Dict[str, Any], updates: Dict[str, Any]) -> None:
+    """Deep merge used by `set(..., merge=True)`."""
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge_into(target[key], value)
+        elif value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        else:
+            target[key] = _apply_value(target.get(key, _MISSING), value)
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference: "FakeDocumentReference", data: Optional[Dict[str, Any]], update_time: Optional[int] = None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        if self._data is None:
+            return None
+        value = _get_field(self._data, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class FakeDocumentReference:
+    def __init__(self, client: "InMemoryFirestore", path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name: str) -> "FakeCollectionReference":
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths: Optional[List[str]] = None, **kwargs) -> FakeDocumentSnapshot:
+        data, update_time = self._client._read(self.path)
+        if data is not None and field_paths:
+            projected: Dict[str, Any] = {}
+            for field_path in field_paths:
+                value = _get_field(data, field_path)
+                if value is not _MISSING:
+                    _set_field(projected, field_path, value)
+            data = projected
+        return FakeDocumentSnapshot(self, data, update_time)
+
+    def set(self, document_data: Dict[str, Any], merge: bool = False) -> None:
+        self._client._write(self.path, document_data, merge=merge)
+
+    def update(self, field_updates: Dict[str, Any], option: Optional[Dict[str, Any]] = None) -> None:
+        self._client._update(self.path, field_updates, option=option)
+
+    def delete(self) -> None:
+        self._client._delete(self.path)
+
+
+class FakeQuery:
+    def __init__(self, client: "InMemoryFirestore", collection_path: str):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._orders: List[Tuple[str, str]] = []
+        self._limit: Optional[int] = None
+        self._start_after: Optional[Tuple[Any, ...]] = None
+        self._projection: Optional[List[str]] = None
+
+    def _copy(self) -> "FakeQuery":
+        clone = FakeQuery(self._client, self._collection_path)
+        clone._filters = list(self._filters)
+        clone._orders = list(self._orders)
+        clone._limit = self._limit
+        clone._start_after = self._start_after
+        clone._projection = self._projection
+        return clone
+
+    def where(self, field_path: str, op_string: str, value: Any) -> "FakeQuery":
+        clone = self._copy()
+        clone._filters.append((field_path, op_string, value))
+        return clone
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING") -> "FakeQuery":
+        clone = self._copy()
+        clone._orders.append((field_path, direction))
+        return clone
+
+    def select(self, field_paths: List[str]) -> "FakeQuery":
+        clone = self._copy()
+        clone._projection = list(field_paths)
+        return clone
+
+    def limit(self, count: int) -> "FakeQuery":
+        clone = self._copy()
+        clone._limit = count
+        return clone
+
+    def start_after(self, document_fields_or_snapshot: Any) -> "FakeQuery":
+        clone = self._copy()
+        if isinstance(document_fields_or_snapshot, FakeDocumentSnapshot):
+            data = document_fields_or_snapshot._data or {}
+            clone._start_after = tuple(_get_field(data, f) for f, _ in self._orders) + (document_fields_or_snapshot.id,)
+        else:
+            values = document_fields_or_snapshot
+            clone._start_after = tuple(
+                getattr(values.get(f), 'id', values.get(f, _MISSING)) if f == "__name__" else values.get(f, _MISSING)
+                for f, _ in self._orders
+            )
+        return clone
+
+    @staticmethod
+    def _matches(data: Dict[str, Any], field_path: str, op: str, value: Any) -> bool:
+        current = _get_field(data, field_path)
+        if current is _MISSING:
+            return False
+        try:
+            if op == '==': return current == value
+            if op == '!=': return current != value
+            if op == '<': return current < value
+            if op == '<=': return current <= value
+            if op == '>': return current > value
+            if op == '>=': return current >= value
+            if op == 'in': return current in value
+            if op == 'array_contains': return isinstance(current, list) and value in current
+        except TypeError:
+            return False
+        raise ValueError(f"Unsupported operator in fake Firestore: {op}")
+
+    @staticmethod
+    def _order_value(item: Tuple[str, Dict[str, Any]], field_path: str) -> Any:
+        # '__name__' orders by document ID, like FieldPath.document_id() in the real client.
+        return item[0] if field_path == "__name__" else _get_field(item[1], field_path)
+
+    def _sort_key(self, item: Tuple[str, Dict[str, Any]]) -> Tuple[Any, ...]:
+        return tuple(self._order_value(item, f) for f, _ in self._orders) + (item[0],)
+
+    def stream(self, **kwargs) -> Iterator[FakeDocumentSnapshot]:
+        items = self._client._list(self._collection_path)
+        for field_path, op, value in self._filters:
+            items = [(i, d) for i, d in items if self._matches(d, field_path, op, value)]
+        # Firestore excludes documents that are missing an order_by field.
+        for field_path, _ in self._orders:
+            items = [item for item in items if self._order_value(item, field_path) is not _MISSING]
+        for index in reversed(range(len(self._orders))):
+            field_path, direction = self._orders[index]
+            items.sort(key=lambda item: (self._order_value(item, field_path), item[0]), reverse=(direction == "DESCENDING"))
+        if self._start_after is not None:
+            cursor = self._start_after
+            matches = [i for i, item in enumerate(items) if self._sort_key(item)[:len(cursor)] == cursor]
+            if matches:
+                items = items[matches[-1] + 1:]
+            elif self._orders:
+                field_path, direction = self._orders[0]
+                descending = direction == "DESCENDING"
+                items = [
+                    item for item in items
+                    if (self._order_value(item, field_path) < cursor[0] if descending else self._order_value(item, field_path) > cursor[0])
+                ]
+        if self._limit is not None:
+            items = items[:self._limit]
+        for doc_id, data in items:
+            path = f"{self._collection_path}/{doc_id}"
+            if self._projection is not None:
+                data = {field: data[field] for field in self._projection if field in data}
+            yield FakeDocumentSnapshot(FakeDocumentReference(self._client, path), copy.deepcopy(data), self._client._versions.get(path))
+
+    def get(self, **kwargs) -> List[FakeDocumentSnapshot]:
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: "InMemoryFirestore", path: str):
+        super().__init__(client, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id: Optional[str] = None) -> FakeDocumentReference:
+        return FakeDocumentReference(self._client, f"{self._collection_path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data: Dict[str, Any]) -> Tuple[str, FakeDocumentReference]:
+        doc_ref = self.document()
+        doc_ref.set(document_data)
+        return _now_iso(), doc_ref
+
+
+class FakeWriteBatch:
+    def __init__(self, client: "InMemoryFirestore"):
+        self._client = client
+        self._ops: List[Tuple[str, Callable[[], None]]] = []
+
+    def set(self, reference: FakeDocumentReference, document_data: Dict[str, Any], merge: bool = False) -> None:
+        self._ops.append((reference.path, lambda: self._client._write(reference.path, document_data, merge=merge, timed=False)))
+
+    def update(self, reference: FakeDocumentReference, field_updates: Dict[str, Any], option: Optional[Dict[str, Any]] = None) -> None:
+        self._ops.append((reference.path, lambda: self._client._update(reference.path, field_updates, timed=False, option=option)))
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._ops.append((reference.path, lambda: self._client._delete(reference.path, timed=False)))
+
+    def commit(self) -> List[Any]:
+        started = time.perf_counter()
+        self._client._sleep(self._client.write_latency_s)
+        ops, self._ops = self._ops, []
+        with self._client._lock:
+            # A failed write (e.g. a precondition) rolls back the whole batch, like a real commit.
+            touched = {path for path, _ in ops}
+            saved = {path: (copy.deepcopy(self._client._docs.get(path)), self._client._versions.get(path)) for path in touched}
+            try:
+                for _, op in ops:
+                    op()
+            except Exception:
+                for path, (data, version) in saved.items():
+                    if data is None:
+                        self._client._docs.pop(path, None)
+                        self._client._versions.pop(path, None)
+                    else:
+                        self._client._store(path, data)
+                        self._client._versions[path] = version
+                raise
+        self._client._record("write", time.perf_counter() - started)
+        return [None] * len(ops)
+
+
+class InMemoryFirestore:
+    """
+    Thread-safe in-memory replacement for `google.cloud.firestore.Client`.
+
+    `read_latency_s` / `write_latency_s` add an artificial delay per round trip
+    and `on_operation(kind, seconds)` is called after every read or write so a
+    benchmark can attribute time to the storage stage.
+    """
+
+    def __init__(
+        self,
+        read_latency_s: float = 0.0,
+        write_latency_s: float = 0.0,
+        on_operation: Optional[Callable[[str, float], None]] = None,
+    ):
+        self.read_latency_s = read_latency_s
+        self.write_latency_s = write_latency_s
+        self.on_operation = on_operation
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._collections: Dict[str, Dict[str, None]] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    # --- Public client API ---
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, name)
+
+    def document(self, path: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, path)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def write_option(self, **kwargs) -> Dict[str, Any]:
+        """Only `last_update_time` preconditions are supported (compared against a per-document version)."""
+        return kwargs
+
+    def seed(self, path: str, data: Dict[str, Any]) -> None:
+        """Stores a document without latency or transforms (fixture loading)."""
+        with self._lock:
+            self._store(path, copy.deepcopy(data))
+
+    def dump(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return copy.deepcopy(self._docs)
+
+    # --- Internals ---
+    @staticmethod
+    def _sleep(seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _record(self, kind: str, seconds: float) -> None:
+        if self.on_operation:
+            self.on_operation(kind, seconds)
+
+    def _store(self, path: str, data: Dict[str, Any]) -> None:
+        collection_path, doc_id = path.rsplit('/', 1)
+        self._docs[path] = data
+        self._versions[path] = self._versions.get(path, 0) + 1
+        self._collections.setdefault(collection_path, {})[doc_id] = None
+
+    def _read(self, path: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        started = time.perf_counter()
+        self._sleep(self.read_latency_s)
+        with self._lock:
+            data = copy.deepcopy(self._docs.get(path))
+            version = self._versions.get(path)
+        self._record("read", time.perf_counter() - started)
+        return data, version
+
+    def _list(self, collection_path: str) -> List[Tuple[str, Dict[str, Any]]]:
+        started = time.perf_counter()
+        self._sleep(self.read_latency_s)
+        with self._lock:
+            ids = list(self._collections.get(collection_path, {}))
+            items = [(doc_id, self._docs[f"{collection_path}/{doc_id}"]) for doc_id in ids if f"{collection_path}/{doc_id}" in self._docs]
+        self._record("read", time.perf_counter() - started)
+        return items
+
+    def _write(self, path: str, document_data: Dict[str, Any], merge: bool = False, timed: bool = True) -> None:
+        started = time.perf_counter()
+        if timed:
+            self._sleep(self.write_latency_s)
+        with self._lock:
+            if merge and path in self._docs:
+                target = self._docs[path]
+                _merge_into(target, document_data)
+                self._versions[path] += 1
+            else:
+                target = {}
+                _merge_into(target, document_data)
+                self._store(path, target)
+        if timed:
+            self._record("write", time.perf_counter() - started)
+
+    def _update(self, path: str, field_updates: Dict[str, Any], timed: bool = True, option: Optional[Dict[str, Any]] = None) -> None:
+        started = time.perf_counter()
+        if timed:
+            self._sleep(self.write_latency_s)
+        with self._lock:
+            if path not in self._docs:
+                raise KeyError(f"404 No document to update: {path}")
+            if option and 'last_update_time' in option and option['last_update_time'] != self._versions.get(path):
+                raise FailedPrecondition(f"{path} was modified concurrently")
+            target = self._docs[path]
+            for field_path, value in field_updates.items():
+                _set_field(target, field_path, value)
+            self._versions[path] += 1
+        if timed:
+            self._record("write", time.perf_counter() - started)
+
+    def _delete(self, path: str, timed: bool = True) -> None:
+        started = time.perf_counter()
+        if timed:
+            self._sleep(self.write_latency_s)
+        with self._lock:
+            self._versions.pop(path, None)
+            if self._docs.pop(path, None) is not None:
+                collection_path, doc_id = path.rsplit('/', 1)
+                self._collections.get(collection_path, {}).pop(doc_id, None)
+        if timed:
+            self._record("write", time.perf_counter() - started)
@@ -0,0 +1,262 @@
+# benchmarks/fakes/llm.py
+"""
+Fake Gemini and OpenAI clients with configurable latency and error rates.
+
+`FakeGeminiModel` mimics the parts of `genai.GenerativeModel` used by the
+chat pipeline (`start_chat().send_message()` and `generate_content()`, also
+with `stream=True`), and `FakeOpenAIClient` mimics `openai.OpenAI().chat.completions.create()`.
+`FakeContextCacheProvider` stands in for Gemini's cached-content API so the
+context cache manager can be exercised without a provider account.
+Responses carry usage metadata shaped like the real SDK objects so that code
+reading token counts works against the fakes too.
+"""
+import asyncio
+import datetime
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+
+class LatencyProfile:
+    """
+    Latency/error distribution for a fake provider.
+
+    Latencies are drawn from a log-normal distribution with the given median
+    and p95 (in milliseconds); `error_rate` is the probability that a call
+    raises instead of answering.
+    """
+
+    def __init__(self, median_ms: float = 0.0, p95_ms: Optional[float] = None, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.median_ms = median_ms
+        self.p95_ms = p95_ms if p95_ms is not None else median_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_seconds(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        # p95 of a log-normal is median * exp(1.645 * sigma)
+        sigma = math.log(max(self.p95_ms, self.median_ms) / self.median_ms) / 1.645 if self.p95_ms > self.median_ms else 0.0
+        with self._lock:
+            value = self._random.lognormvariate(math.log(self.median_ms), sigma) if sigma else self.median_ms
+        return value / 1000.0
+
+    def should_fail(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+
+def _estimate_tokens(text: str) -> int:
+    # Rough heuristic good enough for load modelling (Thai text tokenizes densely).
+    return max(1, len(text) // 3)
+
+
+def _prompt_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    parts = getattr(content, 'parts', None)
+    if parts is None and isinstance(content, dict):
+        parts = content.get('parts', [])
+    texts = []
+    for part in parts or []:
+        text = part.get('text') if isinstance(part, dict) else getattr(part, 'text', None)
+        if text:
+            texts.append(text)
+    return ' '.join(texts)
+
+
+class FakeProviderError(Exception):
+    """Raised by the fakes to emulate a provider-side failure."""
+
+
+class _FakeChatSession:
+    def __init__(self, model: "FakeGeminiModel", history: Optional[List[Any]]):
+        self._model = model
+        self.history = list(history or [])
+
+    def send_message(self, content: Any, **kwargs) -> Any:
+        response = self._model._respond(self.history, content)
+        self.history.append(content)
+        return response
+
+    async def send_message_async(self, content: Any, **kwargs) -> Any:
+        return await asyncio.to_thread(self.send_message, content, **kwargs)
+
+
+class _FakeStreamResponse:
+    """Iterates a finished response word by word, like `generate_content(..., stream=True)`."""
+
+    def __init__(self, response: Any):
+        self._response = response
+        self.text = response.text
+        self.usage_metadata = response.usage_metadata
+
+    def __iter__(self):
+        for word in re.findall(r"\S+\s*", self.text):
+            yield SimpleNamespace(text=word)
+
+
+class FakeGeminiModel:
+    """Drop-in replacement for `genai.GenerativeModel` in the end-user pipeline."""
+
+    def __init__(
+        self,
+        profile: Optional[LatencyProfile] = None,
+        reply_factory: Optional[Callable[[str], str]] = None,
+        model_name: str = "fake-gemini",
+        on_call: Optional[Callable[[str, float, bool], None]] = None,
+        cached_prefix_tokens: int = 0,
+    ):
+        self.profile = profile or LatencyProfile()
+        self.reply_factory = reply_factory or (lambda prompt: "ได้เลยค่ะ ขอบคุณที่สอบถามนะคะ")
+        self.model_name = model_name
+        self.on_call = on_call
+        # Size of the cached content this model is bound to (see FakeContextCacheProvider).
+        self.cached_prefix_tokens = cached_prefix_tokens
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def start_chat(self, history: Optional[List[Any]] = None, **kwargs) -> _FakeChatSession:
+        return _FakeChatSession(self, history)
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs) -> Any:
+        if isinstance(contents, list):
+            response = self._respond(contents[:-1], contents[-1] if contents else "")
+        else:
+            response = self._respond([], contents)
+        return _FakeStreamResponse(response) if stream else response
+
+    def _respond(self, history: List[Any], content: Any) -> Any:
+        with self._lock:
+            self.calls += 1
+        started = time.perf_counter()
+        delay = self.profile.sample_seconds()
+        if delay:
+            time.sleep(delay)
+        failed = self.profile.should_fail()
+        if self.on_call:
+            self.on_call(self.model_name, time.perf_counter() - started, not failed)
+        if failed:
+            raise FakeProviderError(f"{self.model_name}: injected failure")
+        prompt_text = _prompt_text(content)
+        history_tokens = sum(_estimate_tokens(_prompt_text(item)) for item in history)
+        text = self.reply_factory(prompt_text)
+        usage = SimpleNamespace(
+            prompt_token_count=self.cached_prefix_tokens + history_tokens + _estimate_tokens(prompt_text),
+            candidates_token_count=_estimate_tokens(text),
+            cached_content_token_count=self.cached_prefix_tokens,
+        )
+        usage.total_token_count = usage.prompt_token_count + usage.candidates_token_count
+        part = SimpleNamespace(text=text, function_call=None)
+        candidate = SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason=1)
+        return SimpleNamespace(text=text, candidates=[candidate], usage_metadata=usage)
+
+
+class FakeContextCacheProvider:
+    """
+    In-memory stand-in for `google.generativeai.caching.CachedContent`.
+
+    Implements the provider interface of `app.services.context_cache`
+    (create/renew/delete/model). `model(name)` returns a FakeGeminiModel built
+    by `model_factory` whose usage reports the cached prefix as cached tokens.
+    Expired or deleted caches raise like the real API does.
+    """
+
+    def __init__(self, model_factory: Optional[Callable[..., FakeGeminiModel]] = None):
+        self.model_factory = model_factory or FakeGeminiModel
+        self.caches: Dict[str, Dict[str, Any]] = {}
+        self.created = 0
+        self.renewed = 0
+        self.deleted = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _expire_time(ttl_s: int) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=ttl_s)
+
+    def _live(self, name: str) -> Dict[str, Any]:
+        cache = self.caches.get(name)
+        if cache is None or cache['expire_time'] <= datetime.datetime.now(datetime.timezone.utc):
+            raise FakeProviderError(f"{name} not found or expired")
+        return cache
+
+    def create(self, model_name: str, system_instruction: str, ttl_s: int, display_name: str) -> Dict[str, Any]:
+        with self._lock:
+            self.created += 1
+            name = f"cachedContents/fake-{self.created}"
+            self.caches[name] = {
+                'model': model_name,
+                'display_name': display_name,
+                'tokens': _estimate_tokens(system_instruction),
+                'expire_time': self._expire_time(ttl_s),
+            }
+        return {'name': name, 'expire_time': self.caches[name]['expire_time'].isoformat()}
+
+    def renew(self, name: str, ttl_s: int) -> str:
+        with self._lock:
+            cache = self._live(name)
+            cache['expire_time'] = self._expire_time(ttl_s)
+            self.renewed += 1
+        return cache['expire_time'].isoformat()
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            if self.caches.pop(name, None) is None:
+                raise FakeProviderError(f"{name} not found")
+            self.deleted += 1
+
+    def model(self, name: str) -> FakeGeminiModel:
+        with self._lock:
+            cache = self._live(name)
+        return self.model_factory(model_name=cache['model'], cached_prefix_tokens=cache['tokens'])
+
+
+class _FakeCompletions:
+    def __init__(self, client: "FakeOpenAIClient"):
+        self._client = client
+
+    def create(self, model: str, messages: List[dict], **kwargs) -> Any:
+        return self._client._respond(model, messages)
+
+
+class FakeOpenAIClient:
+    """Drop-in replacement for `openai.OpenAI` as used by the fallback path."""
+
+    def __init__(
+        self,
+        profile: Optional[LatencyProfile] = None,
+        reply_factory: Optional[Callable[[str], str]] = None,
+        on_call: Optional[Callable[[str, float, bool], None]] = None,
+    ):
+        self.profile = profile or LatencyProfile()
+        self.reply_factory = reply_factory or (lambda prompt: "ได้เลยค่ะ (ระบบสำรอง)")
+        self.on_call = on_call
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_FakeCompletions(self))
+
+    def _respond(self, model: str, messages: List[dict]) -> Any:
+        with self._lock:
+            self.calls += 1
+        started = time.perf_counter()
+        delay = self.profile.sample_seconds()
+        if delay:
+            time.sleep(delay)
+        failed = self.profile.should_fail()
+        if self.on_call:
+            self.on_call(model, time.perf_counter() - started, not failed)
+        if failed:
+            raise FakeProviderError(f"{model}: injected failure")
+        prompt_text = messages[-1]["content"] if messages else ""
+        text = self.reply_factory(prompt_text)
+        prompt_tokens = sum(_estimate_tokens(m.get("content") or "") for m in messages)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=_estimate_tokens(text), total_tokens=prompt_tokens + _estimate_tokens(text))
+        message = SimpleNamespace(role="assistant", content=text)
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")], usage=usage)
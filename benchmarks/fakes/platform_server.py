@@ -0,0 +1,149 @@
+# benchmarks/fakes/platform_server.py
+"""
+Local fake of the LINE Messaging API and the Facebook Graph API.
+
+Start it with `FakePlatformServer().start()` and point the backend at it via
+`LINE_API_BASE_URL` / `FACEBOOK_GRAPH_BASE_URL` (both default to the real
+endpoints). Every request is counted per route and answered after an optional
+artificial latency; `error_rate` makes a fraction of sends return HTTP 500.
+
+Can also be run standalone:
+    python -m benchmarks.fakes.platform_server --port 9100 --latency-ms 40
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class FakePlatformServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, error_rate: float = 0.0, reply_token_ttl_s: Optional[float] = None):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        # When set, reply tokens older than this (based on the `issued_at`
+        # registry below) are rejected like LINE does for expired tokens.
+        self.reply_token_ttl_s = reply_token_ttl_s
+        self.reply_tokens_issued_at: Dict[str, float] = {}
+        self.requests: Counter = Counter()
+        self.sent_messages: List[Tuple[str, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakePlatformServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-platform-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def issue_reply_token(self, token: str) -> None:
+        with self._lock:
+            self.reply_tokens_issued_at[token] = time.monotonic()
+
+    # --- Request handling ---
+    def _should_fail(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def _handle(self, method: str, path: str, body: Optional[Dict[str, Any]]) -> Tuple[int, Dict[str, Any]]:
+        route = self._route_name(method, path)
+        with self._lock:
+            self.requests[route] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+        if route == "line.profile":
+            user_id = path.rsplit('/', 1)[-1]
+            return 200, {"userId": user_id, "displayName": f"LINE {user_id[-6:]}", "pictureUrl": None}
+        if route == "facebook.profile":
+            user_id = path.split('?', 1)[0].rsplit('/', 1)[-1]
+            return 200, {"id": user_id, "name": f"FB {user_id[-6:]}", "profile_pic": None}
+        if route == "unknown":
+            return 404, {"message": "Not found"}
+
+        if self._should_fail():
+            return 500, {"message": "Injected failure"}
+        if route == "line.reply" and self.reply_token_ttl_s is not None:
+            issued_at = self.reply_tokens_issued_at.get((body or {}).get("replyToken"))
+            if issued_at is None or time.monotonic() - issued_at > self.reply_token_ttl_s:
+                return 400, {"message": "Invalid reply token"}
+        with self._lock:
+            self.sent_messages.append((route, body or {}))
+        if route == "facebook.send":
+            return 200, {"recipient_id": (body or {}).get("recipient", {}).get("id"), "message_id": f"m_{len(self.sent_messages)}"}
+        return 200, {"sentMessages": [{"id": str(len(self.sent_messages))}]}
+
+    @staticmethod
+    def _route_name(method: str, path: str) -> str:
+        clean_path = path.split('?', 1)[0]
+        if method == "POST" and clean_path == "/v2/bot/message/reply": return "line.reply"
+        if method == "POST" and clean_path == "/v2/bot/message/push": return "line.push"
+        if method == "POST" and clean_path == "/v2/bot/message/multicast": return "line.multicast"
+        if method == "GET" and clean_path.startswith("/v2/bot/profile/"): return "line.profile"
+        if method == "POST" and re.fullmatch(r"/v[\d.]+/me/messages", clean_path): return "facebook.send"
+        if method == "GET" and re.fullmatch(r"/[\w-]+", clean_path): return "facebook.profile"
+        return "unknown"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = None
+                if length:
+                    try:
+                        body = json.loads(self.rfile.read(length))
+                    except ValueError:
+                        body = None
+                status_code, payload = server._handle(method, self.path, body)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake LINE / Facebook Graph API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakePlatformServer(args.host, args.port, args.latency_ms, args.error_rate).start()
+    print(f"✅ Fake platform server listening on {fake.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
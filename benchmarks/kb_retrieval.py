@@ -0,0 +1,117 @@
+# benchmarks/kb_retrieval.py
+"""
+Retrieval quality and latency of knowledge-base lookup.
+
+Builds a synthetic shop knowledge base (topic chunks plus filler chunks to
+reach `--chunks`), then asks paraphrased questions whose wording does not
+match the chunk text exactly (e.g. "ส่งกี่วัน" for the "ระยะเวลาจัดส่ง" chunk).
+For each question the expected chunk is known, so the report shows hit@k and
+how many chunks end up in the prompt for:
+
+* keyword  - the previous exact keyword matching
+* semantic - `app.services.kb_retrieval` (embedding matmul + lexical fusion)
+
+Uses the offline local embedder by default, so it runs without credentials.
+
+Usage:
+    python -m benchmarks.kb_retrieval --chunks 500 --k 5
+    python -m benchmarks.kb_retrieval --backend gemini   # needs GEMINI_API_KEY
+"""
+import argparse
+import json
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from app.services import kb_retrieval
+
+# (หัวข้อใน KB, คำถามที่ใช้คำต่างจากหัวข้อ)
+TOPICS: List[Tuple[str, List[str]]] = [
+    ("ระยะเวลาจัดส่ง: จัดส่งทั่วประเทศภายใน 2-3 วันทำการ ต่างจังหวัดห่างไกล 3-5 วันทำการ",
+     ["ส่งกี่วันถึงคะ", "สั่งวันนี้ได้ของวันไหน", "จัดส่งนานไหม"]),
+    ("ค่าจัดส่ง: ค่าส่ง 50 บาท ฟรีค่าส่งเมื่อสั่งซื้อครบ 1,000 บาท",
+     ["ค่าส่งเท่าไหร่", "ส่งฟรีไหมคะ", "ซื้อเท่าไหร่ถึงส่งฟรี"]),
+    ("การชำระเงิน: โอนผ่านบัญชีธนาคารกสิกรไทย พร้อมเพย์ หรือเก็บเงินปลายทาง (COD)",
+     ["จ่ายเงินยังไง", "มีเก็บปลายทางไหม", "โอนเงินเข้าบัญชีไหน"]),
+    ("การคืนสินค้า: เปลี่ยนหรือคืนสินค้าได้ภายใน 7 วันหลังได้รับ สินค้าต้องอยู่ในสภาพเดิมพร้อมป้าย",
+     ["ของไม่พอดีเปลี่ยนได้ไหม", "คืนของได้กี่วัน", "ขอเปลี่ยนไซส์ได้ไหมคะ"]),
+    ("เวลาทำการ: ร้านเปิดทุกวัน 10:00-20:00 น. แอดมินตอบแชทจนถึง 22:00 น.",
+     ["ร้านเปิดกี่โมง", "ปิดกี่โมงคะ", "แอดมินตอบถึงกี่โมง"]),
+    ("ที่ตั้งร้าน: หน้าร้านอยู่ชั้น 2 ห้างเซ็นทรัลลาดพร้าว ใกล้ BTS ห้าแยกลาดพร้าว",
+     ["ร้านอยู่ที่ไหน", "ไปหน้าร้านยังไง", "มีหน้าร้านไหมคะ"]),
+    ("การรับประกัน: สินค้าอิเล็กทรอนิกส์รับประกัน 1 ปี เคลมผ่านร้านได้โดยตรง",
+     ["มีประกันไหม", "เสียแล้วเคลมได้ไหม", "ประกันกี่ปี"]),
+    ("ตารางไซส์: S อก 34 นิ้ว, M อก 36 นิ้ว, L อก 38 นิ้ว, XL อก 40 นิ้ว",
+     ["อก 36 ใส่ไซส์อะไร", "ไซส์ M อกเท่าไหร่", "มีไซส์ใหญ่ไหม"]),
+]
+
+FILLER_WORDS = ["สินค้า", "คุณภาพ", "คอลเลกชัน", "ผ้าฝ้าย", "ดีไซน์", "ลวดลาย", "กระเป๋า", "รองเท้า", "หมวก", "เสื้อ",
+                "กางเกง", "เครื่องประดับ", "นาฬิกา", "แว่นตา", "ถุงเท้า", "ผ้าพันคอ", "สีพาสเทล", "ลายทาง", "รุ่นใหม่", "ลิมิเต็ด"]
+
+
+def build_knowledge_base(chunks: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    parts = [text for text, _ in TOPICS]
+    while len(parts) < chunks:
+        parts.append(f"สินค้ารหัส P{len(parts):04d}: " + " ".join(rng.choice(FILLER_WORDS) for _ in range(12)))
+    rng.shuffle(parts)
+    return "\n###\n".join(parts)
+
+
+def evaluate(name: str, search, k: int) -> Dict[str, float]:
+    hits, sizes, latencies = 0, [], []
+    questions = [(text, question) for text, questions in TOPICS for question in questions]
+    for expected, question in questions:
+        started = time.perf_counter()
+        results = search(question)
+        latencies.append((time.perf_counter() - started) * 1000)
+        sizes.append(len(results))
+        hits += any(expected in chunk for chunk in results[:k])
+    latencies.sort()
+    return {
+        'method': name,
+        'hit_at_k': round(hits / len(questions), 3),
+        'avg_chunks_in_prompt': round(statistics.mean(sizes), 2),
+        'p50_ms': round(latencies[len(latencies) // 2], 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Knowledge-base retrieval benchmark")
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--k", type=int, default=kb_retrieval.KB_TOP_K)
+    parser.add_argument("--backend", choices=("local", "gemini"), default="local")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    knowledge_base = build_knowledge_base(args.chunks)
+    kb_retrieval.set_embedder(kb_retrieval.GeminiEmbedder() if args.backend == "gemini" else kb_retrieval.LocalEmbedder())
+    index_dir = tempfile.mkdtemp(prefix="kb_index_")
+    kb_retrieval.set_index_store(kb_retrieval.KnowledgeIndexStore(index_dir))
+    try:
+        started = time.perf_counter()
+        kb_retrieval.get_index_store().get("bench-tenant", knowledge_base)
+        build_s = time.perf_counter() - started
+        results = [
+            evaluate("keyword", lambda q: kb_retrieval.keyword_chunks(knowledge_base, q), args.k),
+            evaluate("semantic", lambda q: kb_retrieval.retrieve("bench-tenant", knowledge_base, q, args.k), args.k),
+        ]
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+    print(f"{args.chunks} chunks, k={args.k}, embedder={kb_retrieval.get_embedder().name}, index build {build_s * 1000:.0f} ms")
+    print(f"{'method':<10}{'hit@k':>8}{'chunks':>8}{'p50 ms':>9}{'p95 ms':>9}")
+    for r in results:
+        print(f"{r['method']:<10}{r['hit_at_k']:>8.3f}{r['avg_chunks_in_prompt']:>8.2f}{r['p50_ms']:>9.3f}{r['p95_ms']:>9.3f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'chunks': args.chunks, 'k': args.k, 'build_ms': round(build_s * 1000, 1), 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
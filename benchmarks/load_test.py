@@ -0,0 +1,390 @@
+# benchmarks/load_test.py
+"""
+Offline load test for the webhook -> get_bot_response -> reply path.
+
+The FastAPI app is served by uvicorn on a local port with every external
+dependency replaced by a fake: an in-memory Firestore (or a temporary SQLite
+database with `--storage sqlite`), fake Gemini/OpenAI
+clients with configurable latency and error rates, and a local fake of the
+LINE / Facebook Graph APIs. Recorded webhook payloads are replayed at a target
+request rate (open loop, so a slow server cannot slow the generator down) and
+p50/p95/p99 latency plus throughput are reported per stage.
+
+Usage:
+    python -m benchmarks.load_test --rps 50 --duration 20 --llm-median-ms 400
+    python -m benchmarks.load_test --json results.json
+    python -m benchmarks.load_test --baseline results.json --tolerance 0.25
+
+With `--baseline`, the run exits with status 1 when any stage's p95 regresses
+by more than the tolerance, so it can gate changes to the hot path in CI.
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import copy
+import hashlib
+import hmac
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+PAYLOAD_DIR = os.path.join(os.path.dirname(__file__), "payloads")
+DEFAULT_TENANT_ID = "bench-tenant"
+
+# (module, attribute, stage) — functions wrapped with a timer when present.
+STAGE_HOOKS = [
+    ("app.routers.webhook", "get_bot_response", "get_bot_response"),
+    ("app.routers.webhook", "get_line_user_profile", "platform.profile"),
+    ("app.routers.webhook", "get_facebook_user_profile", "platform.profile"),
+    ("app.routers.webhook", "deliver_message", "delivery"),
+    ("app.services.delivery", "send_line_message", "platform.send"),
+    ("app.services.delivery", "push_line_message", "platform.send"),
+    ("app.services.delivery", "send_facebook_message", "platform.send"),
+]
+
+
+class StageRecorder:
+    """Thread-safe collector of per-stage durations."""
+
+    def __init__(self):
+        self._samples: Dict[str, List[float]] = defaultdict(list)
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            self._samples[stage].append(seconds)
+            if not ok:
+                self._errors[stage] += 1
+
+    def wrap(self, stage: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = not (isinstance(result, dict) and result.get("status") == "error")
+                return result
+            finally:
+                self.record(stage, time.perf_counter() - started, ok)
+        timed.__wrapped__ = fn
+        return timed
+
+    def summary(self, wall_seconds: float) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            errors = dict(self._errors)
+        report = {}
+        for stage, values in sorted(samples.items()):
+            report[stage] = {
+                "count": len(values),
+                "errors": errors.get(stage, 0),
+                "rps": len(values) / wall_seconds if wall_seconds else 0.0,
+                "mean_ms": 1000 * sum(values) / len(values),
+                "p50_ms": 1000 * percentile(values, 50),
+                "p95_ms": 1000 * percentile(values, 95),
+                "p99_ms": 1000 * percentile(values, 99),
+                "max_ms": 1000 * values[-1],
+            }
+        return report
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile over an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def load_payloads(path: str) -> List[Dict[str, Any]]:
+    payloads = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                payloads.append(json.loads(line))
+    if not payloads:
+        raise SystemExit(f"No payloads found in {path}")
+    return payloads
+
+
+def personalize(payload: Dict[str, Any], user_id: str, sequence: int) -> Dict[str, Any]:
+    """Rewrites the sender, reply token, event IDs and event time of a recorded payload."""
+    body = copy.deepcopy(payload["body"])
+    if payload["platform"] == "line":
+        for index, event in enumerate(body.get("events", [])):
+            event.setdefault("source", {})["userId"] = user_id
+            event["replyToken"] = f"bench-reply-{sequence}"
+            event["webhookEventId"] = f"bench-event-{sequence}-{index}"
+            # Recorded timestamps are old; a fresh one keeps the reply token usable so the reply path is measured.
+            event["timestamp"] = int(time.time() * 1000)
+    else:
+        for entry in body.get("entry", []):
+            for index, messaging_event in enumerate(entry.get("messaging", [])):
+                messaging_event["sender"] = {"id": user_id}
+                if "message" in messaging_event:
+                    messaging_event["message"]["mid"] = f"bench-mid-{sequence}-{index}"
+    return body
+
+
+def sign(platform: str, content: bytes, tenant_data: Dict[str, Any]) -> Dict[str, str]:
+    """Signature header the platform would send with this body."""
+    if platform == "line":
+        digest = hmac.new(tenant_data.get("lineChannelSecret", "").encode(), content, hashlib.sha256).digest()
+        return {"X-Line-Signature": base64.b64encode(digest).decode()}
+    digest = hmac.new(tenant_data.get("facebookAppSecret", "").encode(), content, hashlib.sha256).hexdigest()
+    return {"X-Hub-Signature-256": f"sha256={digest}"}
+
+
+def seed_store(storage, tenant_id: str, tenant_data: Dict[str, Any], users: int, history_length: int) -> None:
+    storage.update_tenant(tenant_id, tenant_data)
+    if history_length <= 0:
+        return
+    now = time.time()
+    for index in range(users):
+        history = []
+        for turn in range(history_length):
+            role = 'user' if turn % 2 == 0 else 'model'
+            history.append({
+                'role': role,
+                'parts': [{'text': f"ข้อความเก่าลำดับที่ {turn} ของลูกค้า {index}"}],
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(now - (history_length - turn) * 60)),
+            })
+        for platform_prefix in ("bench-line", "bench-fb"):
+            storage.set_conversation(tenant_id, f"{platform_prefix}-{index}", {
+                'history': history,
+                'summary': "ลูกค้าสอบถามเรื่องเสื้อยืดและการจัดส่ง",
+                'summary_checkpoint': max(0, history_length - 4),
+                'lastMessageTime': history[-1]['timestamp'],
+                'is_bot_active': True,
+            })
+
+
+def build_storage(args, recorder: StageRecorder):
+    """Creates the storage backend under test, seeded with the benchmark tenant."""
+    from app.services.storage.firestore_backend import FirestoreStorage
+    from app.services.storage.sqlite_backend import SQLiteStorage
+    from benchmarks.fakes import InMemoryFirestore
+
+    if args.storage == "sqlite":
+        import tempfile
+        storage = SQLiteStorage(os.path.join(tempfile.mkdtemp(prefix="allchat-bench-"), "bench.db"))
+    else:
+        fake_db = InMemoryFirestore()
+        storage = FirestoreStorage(fake_db)
+
+    with open(args.tenant_file, encoding="utf-8") as f:
+        seed_store(storage, args.tenant_id, json.load(f), args.users, args.history)
+
+    if args.storage != "sqlite":
+        # Latency and timing apply only to the load itself, not to seeding.
+        fake_db.read_latency_s = fake_db.write_latency_s = args.db_latency_ms / 1000.0
+        fake_db.on_operation = lambda kind, seconds: recorder.record(f"firestore.{kind}", seconds)
+    for method in ("get_tenant", "get_conversation", "set_conversation", "append_messages"):
+        setattr(storage, method, recorder.wrap(f"storage.{method}", getattr(storage, method)))
+    return storage
+
+
+def install_fakes(storage, gemini_model, openai_client, recorder: StageRecorder, tier_models: Optional[Dict[str, Any]] = None) -> None:
+    """Points the app at the fake storage/LLMs and wraps stage hooks."""
+    import tempfile
+    from app.config import settings
+    from app.services import context_cache, kb_retrieval
+    from benchmarks.fakes import FakeContextCacheProvider, FakeGeminiModel
+    from app.services import storage as storage_module
+
+    storage_module.set_storage(storage)
+    settings._end_user_model_instance = gemini_model
+    settings._tier_model_instances = dict(tier_models or {})
+    settings._openai_client_instance = openai_client
+    # Large knowledge bases use the in-memory cache provider instead of the real caching API.
+    context_cache.set_context_cache(context_cache.ContextCacheManager(FakeContextCacheProvider(
+        lambda **kwargs: FakeGeminiModel(profile=gemini_model.profile, reply_factory=gemini_model.reply_factory, on_call=gemini_model.on_call, **kwargs)
+    )))
+    # KB embeddings: offline local embedder, index files in a throwaway directory.
+    kb_retrieval.set_embedder(kb_retrieval.LocalEmbedder())
+    kb_retrieval.set_index_store(kb_retrieval.KnowledgeIndexStore(tempfile.mkdtemp(prefix="allchat-kb-index-")))
+
+    for module_name, attribute, stage in STAGE_HOOKS:
+        module = sys.modules.get(module_name)
+        if module is not None and hasattr(module, attribute):
+            setattr(module, attribute, recorder.wrap(stage, getattr(module, attribute)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def replay(base_url: str, payloads: List[Dict[str, Any]], args, recorder: StageRecorder, platform_server) -> float:
+    import httpx
+
+    total = int(args.rps * args.duration)
+    with open(args.tenant_file, encoding="utf-8") as f:
+        tenant_data = json.load(f)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        async def fire(sequence: int, intended_start: float):
+            payload = payloads[sequence % len(payloads)]
+            prefix = "bench-line" if payload["platform"] == "line" else "bench-fb"
+            user_id = f"{prefix}-{sequence % args.users}"
+            body = personalize(payload, user_id, sequence)
+            if payload["platform"] == "line":
+                for event in body.get("events", []):
+                    platform_server.issue_reply_token(event["replyToken"])
+            path = f"/webhook/{payload['platform']}/{args.tenant_id}"
+            content = json.dumps(body).encode("utf-8")
+            headers = {"Content-Type": "application/json", **sign(payload["platform"], content, tenant_data)}
+            ok = False
+            try:
+                response = await client.post(path, content=content, headers=headers)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            # Measured from the intended send time to avoid coordinated omission.
+            recorder.record(f"webhook.{payload['platform']}", time.perf_counter() - intended_start, ok)
+
+        started = time.perf_counter()
+        tasks = []
+        for sequence in range(total):
+            intended_start = started + sequence / args.rps
+            delay = intended_start - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(fire(sequence, intended_start)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+
+def print_report(report: Dict[str, Dict[str, float]], wall_seconds: float, out=sys.stdout) -> None:
+    print(f"\nWall time: {wall_seconds:.2f}s", file=out)
+    header = f"{'stage':<28}{'count':>8}{'err':>6}{'rps':>9}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    print(header, file=out)
+    print("-" * len(header), file=out)
+    for stage, row in report.items():
+        print(
+            f"{stage:<28}{row['count']:>8}{row['errors']:>6}{row['rps']:>9.1f}"
+            f"{row['mean_ms']:>10.1f}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}",
+            file=out,
+        )
+    print("(latencies in ms)", file=out)
+
+
+def compare_to_baseline(report: Dict[str, Dict[str, float]], baseline_path: str, tolerance: float, out=sys.stdout) -> bool:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f).get("stages", {})
+    regressed = False
+    for stage, row in report.items():
+        previous = baseline.get(stage)
+        if not previous or not previous.get("p95_ms"):
+            continue
+        ratio = row["p95_ms"] / previous["p95_ms"]
+        if ratio > 1 + tolerance:
+            regressed = True
+            print(f"❌ REGRESSION {stage}: p95 {previous['p95_ms']:.1f}ms -> {row['p95_ms']:.1f}ms ({ratio:.2f}x)", file=out)
+    if not regressed:
+        print(f"✅ No p95 regression beyond {tolerance:.0%} against {baseline_path}", file=out)
+    return not regressed
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay recorded webhooks against AllChat with local fakes.")
+    parser.add_argument("--payloads", default=os.path.join(PAYLOAD_DIR, "webhooks.ndjson"), help="NDJSON file of recorded webhook payloads")
+    parser.add_argument("--tenant-file", default=os.path.join(PAYLOAD_DIR, "tenant.json"), help="Tenant document to seed")
+    parser.add_argument("--tenant-id", default=DEFAULT_TENANT_ID)
+    parser.add_argument("--rps", type=float, default=20.0, help="Target request rate")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load to generate")
+    parser.add_argument("--users", type=int, default=50, help="Distinct end users to spread the load across")
+    parser.add_argument("--history", type=int, default=0, help="Pre-existing history length per user")
+    parser.add_argument("--llm-median-ms", type=float, default=300.0)
+    parser.add_argument("--llm-p95-ms", type=float, default=800.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Gemini failure probability (forces OpenAI fallback)")
+    parser.add_argument("--fallback-median-ms", type=float, default=500.0)
+    parser.add_argument("--fallback-p95-ms", type=float, default=1200.0)
+    parser.add_argument("--fallback-error-rate", type=float, default=0.0)
+    parser.add_argument("--storage", choices=["firestore", "sqlite"], default="firestore", help="In-memory fake Firestore or a temporary SQLite database")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="Simulated Firestore round trip")
+    parser.add_argument("--platform-latency-ms", type=float, default=30.0, help="Simulated LINE/Graph API latency")
+    parser.add_argument("--platform-error-rate", type=float, default=0.0)
+    parser.add_argument("--reply-token-ttl", type=float, default=None, help="Reject LINE reply tokens older than this many seconds")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", dest="json_path", help="Write the report as JSON")
+    parser.add_argument("--baseline", help="JSON report to compare p95 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 regression ratio with --baseline")
+    parser.add_argument("--verbose", action="store_true", help="Show application logs")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    from benchmarks.fakes import FakeGeminiModel, FakeOpenAIClient, FakePlatformServer, LatencyProfile
+
+    recorder = StageRecorder()
+    platform_server = FakePlatformServer(latency_ms=args.platform_latency_ms, error_rate=args.platform_error_rate, reply_token_ttl_s=args.reply_token_ttl).start()
+    # Must be set before the app modules are imported (they read it at import time).
+    os.environ["LINE_API_BASE_URL"] = platform_server.base_url
+    os.environ["FACEBOOK_GRAPH_BASE_URL"] = platform_server.base_url
+
+    log_sink = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(log_sink):
+        import uvicorn
+        from app.main import app
+
+        storage = build_storage(args, recorder)
+        gemini = FakeGeminiModel(
+            LatencyProfile(args.llm_median_ms, args.llm_p95_ms, args.llm_error_rate, args.seed),
+            on_call=lambda model, seconds, ok: recorder.record("llm.gemini", seconds, ok),
+        )
+        openai_client = FakeOpenAIClient(
+            LatencyProfile(args.fallback_median_ms, args.fallback_p95_ms, args.fallback_error_rate, args.seed),
+            on_call=lambda model, seconds, ok: recorder.record("llm.openai", seconds, ok),
+        )
+        # Routed tiers: the lite model answers faster and the strong model slower than the default.
+        tier_models = {
+            tier: FakeGeminiModel(
+                LatencyProfile(args.llm_median_ms * scale, args.llm_p95_ms * scale, args.llm_error_rate, args.seed),
+                model_name=f"fake-gemini-{tier}",
+                on_call=lambda model, seconds, ok: recorder.record("llm.gemini", seconds, ok),
+            )
+            for tier, scale in (("lite", 0.5), ("strong", 2.0))
+        }
+        install_fakes(storage, gemini, openai_client, recorder, tier_models)
+
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+        server_thread = threading.Thread(target=server.run, name="bench-uvicorn", daemon=True)
+        server_thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        try:
+            wall_seconds = asyncio.run(replay(f"http://127.0.0.1:{port}", load_payloads(args.payloads), args, recorder, platform_server))
+        finally:
+            server.should_exit = True
+            server_thread.join(timeout=10)
+            platform_server.stop()
+
+    report = recorder.summary(wall_seconds)
+    print_report(report, wall_seconds)
+    print(f"Platform API calls: {dict(platform_server.requests)}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "wall_seconds": wall_seconds, "stages": report}, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        return 0 if compare_to_baseline(report, args.baseline, args.tolerance) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
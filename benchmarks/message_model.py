@@ -0,0 +1,156 @@
+# benchmarks/message_model.py
+"""
+Microbenchmark for the history handling inside get_bot_response.
+
+Replays the per-request history work (summary window, recent window converted
+to Gemini Content and OpenAI messages, appending the new turn and slicing the
+new messages back out) on a synthetic conversation, once with the previous
+list/dict pipeline and once with `app.models.conversation`. Each request gets a
+freshly decoded conversation document, as it would from storage, and the same
+chat is replayed many times, as happens when a customer keeps writing.
+
+Reports CPU time and peak allocated memory per request for both pipelines.
+
+Usage:
+    python -m benchmarks.message_model --history 200 --requests 2000
+    python -m benchmarks.message_model --json results.json
+"""
+import argparse
+import datetime
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from google.generativeai.types import content_types
+
+from app.models.conversation import Conversation, gemini_content
+
+RECENT_MESSAGES_TO_KEEP = 4
+SUMMARY = "ลูกค้าสอบถามราคาสินค้าและเวลาเปิดร้าน ต้องการจองคิวช่วงเย็นวันเสาร์"
+
+
+def make_document(history_length: int) -> str:
+    """เอกสาร conversation ในรูป JSON (แต่ละ request ถอดใหม่ เหมือนอ่านจาก storage)"""
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    history = []
+    for i in range(history_length):
+        message: Dict[str, Any] = {
+            'role': 'user' if i % 2 == 0 else 'model',
+            'parts': [{'text': f"ข้อความที่ {i} เกี่ยวกับสินค้าและบริการของร้าน " * 3}],
+            'timestamp': (start + datetime.timedelta(minutes=i)).isoformat(),
+        }
+        if i % 2:
+            message['route'] = 'standard'
+        if i % 37 == 0:
+            message['status'] = 'requires_review'
+        history.append(message)
+    return json.dumps({'history': history, 'summary': SUMMARY, 'summary_checkpoint': history_length - 6}, ensure_ascii=False)
+
+
+def _new_turn(user_input: str):
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    return (
+        {'role': 'user', 'parts': [{'text': user_input}], 'timestamp': now},
+        {'role': 'model', 'parts': [{'text': "ได้เลยค่ะ"}], 'timestamp': now, 'route': 'standard'},
+    )
+
+
+def legacy_request(data: Dict[str, Any], user_input: str):
+    """pipeline เดิม: slice/คัดลอก list และแปลงทุกข้อความใหม่ทุก request"""
+    history_data_from_db = data.get('history', [])
+    stored_history_length = len(history_data_from_db)
+    new_conversation_text = ""
+    for msg in history_data_from_db[data['summary_checkpoint']:]:
+        text_parts = [part['text'] for part in msg['parts'] if 'text' in part]
+        new_conversation_text += f"{msg['role']}: {' '.join(text_parts)}\n"
+    chat_history_for_model = [
+        content_types.to_content({'role': 'user', 'parts': [{'text': f"Summary of previous conversation:\n{data['summary']}"}]}),
+        content_types.to_content({'role': 'model', 'parts': [{'text': "OK, I understand the context."}]}),
+    ]
+    clean_history = [{'role': item['role'], 'parts': item['parts']} for item in history_data_from_db[-RECENT_MESSAGES_TO_KEEP:] if item.get('status') is None]
+    chat_history_for_model.extend([content_types.to_content(item) for item in clean_history])
+    openai_messages = [{"role": "assistant" if item['role'] == 'model' else item['role'], "content": ' '.join([p['text'] for p in item['parts'] if 'text' in p])} for item in clean_history]
+    history_to_save = list(history_data_from_db)
+    history_to_save.extend(_new_turn(user_input))
+    data['history'] = history_to_save
+    return chat_history_for_model, openai_messages, new_conversation_text, history_to_save[stored_history_length:]
+
+
+def model_request(data: Dict[str, Any], user_input: str):
+    """pipeline ใหม่ผ่าน Conversation / Message"""
+    conversation = Conversation(data)
+    new_conversation_text = "".join(msg.summary_line() for msg in conversation.window(data['summary_checkpoint']))
+    chat_history_for_model = [
+        gemini_content('user', (f"Summary of previous conversation:\n{data['summary']}",)),
+        gemini_content('model', ("OK, I understand the context.",)),
+    ]
+    clean_history = list(conversation.recent(RECENT_MESSAGES_TO_KEEP).clean())
+    chat_history_for_model.extend(message.to_gemini() for message in clean_history)
+    openai_messages = [message.to_openai() for message in clean_history]
+    for message in _new_turn(user_input):
+        conversation.append(message)
+    return chat_history_for_model, openai_messages, new_conversation_text, conversation.new_messages()
+
+
+def _check_equivalent(document: str) -> None:
+    legacy = legacy_request(json.loads(document), "ขอราคาหน่อยค่ะ")
+    model = model_request(json.loads(document), "ขอราคาหน่อยค่ะ")
+    assert [type(c).to_dict(c) for c in legacy[0]] == [type(c).to_dict(c) for c in model[0]], "Gemini history differs"
+    assert legacy[1] == model[1], "OpenAI messages differ"
+    assert legacy[2] == model[2], "Summary text differs"
+    assert [m['role'] for m in legacy[3]] == [m['role'] for m in model[3]], "New messages differ"
+
+
+def measure(pipeline: Callable, document: str, requests: int) -> Dict[str, float]:
+    # ถอด JSON นอกช่วงจับเวลา: ทั้งสอง pipeline ได้เอกสารที่ถอดแล้วเหมือนกัน
+    documents = [json.loads(document) for _ in range(requests)]
+    started = time.process_time()
+    for data in documents:
+        pipeline(data, "ขอราคาหน่อยค่ะ")
+    cpu_s = time.process_time() - started
+
+    documents = [json.loads(document) for _ in range(min(requests, 200))]
+    tracemalloc.start()
+    for data in documents:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        pipeline(data, "ขอราคาหน่อยค่ะ")
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {'cpu_us_per_request': round(cpu_s / requests * 1e6, 2), 'peak_kb_per_request': round(peak / 1024, 2)}
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="History pipeline microbenchmark")
+    parser.add_argument("--history", type=int, default=200, help="messages in the stored conversation")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    document = make_document(args.history)
+    _check_equivalent(document)
+    # warm-up (รวมถึง cache ของ Content ที่ instance จริงจะมีอยู่แล้วหลังรับข้อความไม่กี่ข้อความ)
+    measure(legacy_request, document, 50)
+    measure(model_request, document, 50)
+
+    results = {
+        'history': args.history,
+        'requests': args.requests,
+        'legacy': measure(legacy_request, document, args.requests),
+        'model': measure(model_request, document, args.requests),
+    }
+    for name in ('legacy', 'model'):
+        r = results[name]
+        print(f"{name:>7}: {r['cpu_us_per_request']:>9.2f} µs/request  {r['peak_kb_per_request']:>8.2f} KB peak/request")
+    legacy, model = results['legacy'], results['model']
+    print(f"speedup: {legacy['cpu_us_per_request'] / max(model['cpu_us_per_request'], 1e-9):.2f}x CPU, "
+          f"{legacy['peak_kb_per_request'] / max(model['peak_kb_per_request'], 1e-9):.2f}x memory")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())